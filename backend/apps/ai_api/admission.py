@@ -0,0 +1,298 @@
+import itertools
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Callable, Deque, Dict, List, Optional
+
+from django.conf import settings
+
+from llms import telemetry
+
+logger = logging.getLogger('apps.ai_api')
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0  # user-triggered generation/regeneration
+    BATCH = 1        # bulk ingestion and other background work
+
+
+# Initial service-time estimates per operation (seconds) until real runs are observed
+DEFAULT_SERVICE_SECONDS = {
+    "ingest_proposal": 60.0,
+    "generate_overview": 60.0,
+    "generate_backlog": 90.0,
+}
+EWMA_ALPHA = 0.3
+
+
+class AdmissionRejected(Exception):
+    """Raised when a job cannot be admitted; ``retry_after`` is in seconds."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+@dataclass(eq=False)
+class Ticket:
+    ticket_id: int
+    user_id: Optional[int]
+    project_id: Optional[int]
+    operation: str
+    priority: Priority
+    enqueued_at: float = field(default_factory=time.monotonic)
+    started_at: Optional[float] = None
+    granted: threading.Event = field(default_factory=threading.Event)
+    on_update: Optional[Callable[['Ticket', int, float], None]] = None
+
+
+class AdmissionController:
+    """
+    Bounded, fair work queue in front of the shared model.
+
+    At most ``max_concurrency`` jobs run at once. Waiting jobs are ordered by
+    priority class, then round-robin across projects, then across users in a
+    project, so one busy project or user cannot starve the others. Jobs are
+    rejected up front when the queue is full, the user already has too many
+    queued jobs, or the estimated wait (EWMA service time per operation)
+    exceeds ``max_wait_seconds``.
+    """
+
+    def __init__(self, max_concurrency: int = 1, max_queue: int = 16, max_per_user: int = 3,
+                 max_wait_seconds: float = 300.0):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_per_user = max_per_user
+        self.max_wait_seconds = max_wait_seconds
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        # priority -> project_id -> user_id -> deque of tickets
+        self._queues: Dict[Priority, 'OrderedDict[Optional[int], OrderedDict[Optional[int], Deque[Ticket]]]'] = {
+            p: OrderedDict() for p in Priority
+        }
+        self._running: Dict[int, Ticket] = {}
+        self._service_seconds: Dict[str, float] = dict(DEFAULT_SERVICE_SECONDS)
+        self.admitted = 0
+        self.rejected = 0
+
+    # Queue bookkeeping (call with the lock held) ---------------------------
+
+    def _queued(self) -> List[Ticket]:
+        return [t for p in Priority for users in self._queues[p].values() for q in users.values() for t in q]
+
+    def _dispatch_order(self) -> List[Ticket]:
+        """Simulate the round-robin dispatch of every queued ticket, without mutating the queues."""
+        order = []
+        for p in Priority:
+            projects = [
+                [list(q) for q in users.values()] for users in self._queues[p].values()
+            ]
+            while any(any(user_queue for user_queue in users) for users in projects):
+                # One ticket per project per round, rotating through the project's users
+                for users in projects:
+                    for index, user_queue in enumerate(users):
+                        if user_queue:
+                            order.append(user_queue.pop(0))
+                            users.append(users.pop(index))
+                            break
+        return order
+
+    def _estimate(self, operation: str) -> float:
+        return self._service_seconds.get(operation, max(self._service_seconds.values()))
+
+    def _estimated_wait(self, ahead: List[Ticket]) -> float:
+        now = time.monotonic()
+        busy = sum(max(0.0, self._estimate(t.operation) - (now - t.started_at)) for t in self._running.values())
+        queued = sum(self._estimate(t.operation) for t in ahead)
+        if len(self._running) + len(ahead) < self.max_concurrency:
+            return 0.0
+        return (busy + queued) / self.max_concurrency
+
+    def _pop_next(self) -> Optional[Ticket]:
+        for p in Priority:
+            projects = self._queues[p]
+            if not projects:
+                continue
+            project_id, users = next(iter(projects.items()))
+            user_id, user_queue = next(iter(users.items()))
+            ticket = user_queue.popleft()
+            # Rotate: the served user and project go to the back of their rings
+            users.move_to_end(user_id)
+            if not user_queue:
+                del users[user_id]
+            projects.move_to_end(project_id)
+            if not users:
+                del projects[project_id]
+            return ticket
+        return None
+
+    def _remove(self, ticket: Ticket):
+        users = self._queues[ticket.priority].get(ticket.project_id)
+        if not users or ticket.user_id not in users:
+            return
+        try:
+            users[ticket.user_id].remove(ticket)
+        except ValueError:
+            return
+        if not users[ticket.user_id]:
+            del users[ticket.user_id]
+        if not users:
+            del self._queues[ticket.priority][ticket.project_id]
+
+    def _dispatch(self) -> List[tuple]:
+        """Grant free slots and return (ticket, position, eta) updates to publish."""
+        while len(self._running) < self.max_concurrency:
+            ticket = self._pop_next()
+            if ticket is None:
+                break
+            ticket.started_at = time.monotonic()
+            self._running[ticket.ticket_id] = ticket
+            ticket.granted.set()
+        updates = []
+        order = self._dispatch_order()
+        for index, ticket in enumerate(order):
+            if ticket.on_update is not None:
+                updates.append((ticket, index + 1, self._estimated_wait(order[:index])))
+        return updates
+
+    def _publish(self, updates):
+        for ticket, position, eta in updates:
+            try:
+                ticket.on_update(ticket, position, eta)
+            except Exception as e:
+                logger.warning(f"[Admission] Queue position update failed: {e}")
+
+    # Public API ------------------------------------------------------------
+
+    def submit(self, user_id: Optional[int], project_id: Optional[int], operation: str,
+               priority: Priority = Priority.INTERACTIVE,
+               on_update: Optional[Callable[[Ticket, int, float], None]] = None) -> Ticket:
+        """Queue a job or raise AdmissionRejected. The ticket is granted when ``ticket.granted`` is set."""
+        with self._lock:
+            queued = self._queued()
+            if len(queued) >= self.max_queue:
+                self.rejected += 1
+                raise AdmissionRejected("LLM queue is full", self._retry_after(queued))
+            if user_id is not None and sum(1 for t in queued if t.user_id == user_id) >= self.max_per_user:
+                self.rejected += 1
+                raise AdmissionRejected("Too many queued LLM jobs for this user", self._retry_after(queued))
+
+            # Work that would be dispatched before this ticket: same or higher priority
+            ahead = [t for t in queued if t.priority <= priority]
+            eta = self._estimated_wait(ahead)
+            if eta > self.max_wait_seconds:
+                self.rejected += 1
+                raise AdmissionRejected(f"Estimated wait {eta:.0f}s exceeds {self.max_wait_seconds:.0f}s", math.ceil(eta))
+
+            ticket = Ticket(next(self._ids), user_id, project_id, operation, Priority(priority), on_update=on_update)
+            self._queues[ticket.priority].setdefault(project_id, OrderedDict()).setdefault(user_id, deque()).append(ticket)
+            self.admitted += 1
+            updates = self._dispatch()
+        self._publish(updates)
+        return ticket
+
+    def wait(self, ticket: Ticket, timeout: Optional[float] = None):
+        """Block until the ticket is granted; on timeout it is withdrawn and AdmissionRejected is raised."""
+        if ticket.granted.wait(timeout):
+            telemetry.registry.record_queue_wait("admission", ticket.operation, ticket.started_at - ticket.enqueued_at)
+            return
+        with self._lock:
+            if ticket.granted.is_set():
+                granted = True
+            else:
+                granted = False
+                self._remove(ticket)
+                updates = self._dispatch()
+        if granted:
+            telemetry.registry.record_queue_wait("admission", ticket.operation, ticket.started_at - ticket.enqueued_at)
+            return
+        self._publish(updates)
+        raise AdmissionRejected("Timed out waiting for the LLM", math.ceil(self._estimate(ticket.operation)))
+
+    def release(self, ticket: Ticket, succeeded: bool = True):
+        """Free the ticket's slot, fold its duration into the EWMA and dispatch the next job."""
+        with self._lock:
+            if self._running.pop(ticket.ticket_id, None) is None:
+                return
+            if succeeded and ticket.started_at is not None:
+                duration = time.monotonic() - ticket.started_at
+                previous = self._estimate(ticket.operation)
+                self._service_seconds[ticket.operation] = EWMA_ALPHA * duration + (1 - EWMA_ALPHA) * previous
+            updates = self._dispatch()
+        self._publish(updates)
+
+    @contextmanager
+    def slot(self, user_id, project_id, operation: str, priority: Priority = Priority.INTERACTIVE,
+             timeout: Optional[float] = None, on_update=None):
+        """Context manager: submit, wait for a slot, run the body, release."""
+        ticket = self.submit(user_id, project_id, operation, priority, on_update)
+        with self.granted(ticket, timeout):
+            yield ticket
+
+    @contextmanager
+    def granted(self, ticket: Ticket, timeout: Optional[float] = None):
+        """Context manager for a submitted ticket: wait for its slot, run the body, release."""
+        self.wait(ticket, self.max_wait_seconds * 2 if timeout is None else timeout)
+        succeeded = False
+        try:
+            yield ticket
+            succeeded = True
+        finally:
+            self.release(ticket, succeeded)
+
+    def position(self, ticket: Ticket) -> Optional[tuple]:
+        """(position, estimated wait) of a queued ticket, or None once it is granted or withdrawn."""
+        with self._lock:
+            order = self._dispatch_order()
+            for index, queued in enumerate(order):
+                if queued is ticket:
+                    return index + 1, self._estimated_wait(order[:index])
+        return None
+
+    def _retry_after(self, queued: List[Ticket]) -> int:
+        return max(1, math.ceil(self._estimated_wait(queued)))
+
+    def snapshot(self, user_id: Optional[int] = None) -> Dict:
+        """Queue state; ``user_id`` limits the per-ticket list to that user's jobs."""
+        with self._lock:
+            order = self._dispatch_order()
+            queued = []
+            for index, ticket in enumerate(order):
+                if user_id is not None and ticket.user_id != user_id:
+                    continue
+                queued.append({
+                    'ticket_id': ticket.ticket_id,
+                    'project_id': ticket.project_id,
+                    'operation': ticket.operation,
+                    'priority': ticket.priority.name.lower(),
+                    'position': index + 1,
+                    'estimated_wait_seconds': round(self._estimated_wait(order[:index]), 1),
+                    'waited_seconds': round(time.monotonic() - ticket.enqueued_at, 1),
+                })
+            return {
+                'running': len(self._running),
+                'queued': len(order),
+                'max_concurrency': self.max_concurrency,
+                'max_queue': self.max_queue,
+                'max_wait_seconds': self.max_wait_seconds,
+                'estimated_wait_seconds': round(self._estimated_wait(order), 1),
+                'service_seconds': {op: round(s, 1) for op, s in self._service_seconds.items()},
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'jobs': queued,
+            }
+
+
+# Global instance in front of the shared cached model
+llm_admission = AdmissionController(
+    max_concurrency=getattr(settings, 'LLM_MAX_CONCURRENCY', 1),
+    max_queue=getattr(settings, 'LLM_MAX_QUEUE', 16),
+    max_per_user=getattr(settings, 'LLM_MAX_QUEUED_PER_USER', 3),
+    max_wait_seconds=getattr(settings, 'LLM_MAX_WAIT_SECONDS', 300),
+)
@@ -1,34 +1,20 @@
 import json
 import logging
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model
-from rest_framework.authtoken.models import Token
+
+from core.websocket.outbox import OutboxMixin
 
 User = get_user_model()
 logger = logging.getLogger('apps.ai_api')
 
-class ProjectUpdatesConsumer(AsyncWebsocketConsumer):
+class ProjectUpdatesConsumer(OutboxMixin, AsyncWebsocketConsumer):
     async def connect(self):
         logger.info("Project Updates WebSocket: Starting connection...")
         
-        # Extract token from query string
-        query_string = self.scope.get('query_string', b'').decode()
-        token = None
-        
-        for param in query_string.split('&'):
-            if param.startswith('token='):
-                token = param.split('=')[1]
-                break
-        
-        if not token:
-            logger.warning("Project Updates WebSocket: No token provided")
-            await self.close()
-            return
-        
-        # Authenticate user using DRF token
-        user = await self.authenticate_token(token)
-        if not user:
+        # TokenAuthMiddleware has already resolved the token in the query string
+        user = self.scope['user']
+        if not user.is_authenticated:
             logger.warning("Project Updates WebSocket: Authentication failed")
             await self.close()
             return
@@ -61,15 +47,6 @@ class ProjectUpdatesConsumer(AsyncWebsocketConsumer):
             'user_id': self.user_id
         }))
     
-    @database_sync_to_async
-    def authenticate_token(self, token):
-        try:
-            # Use DRF Token authentication
-            token_obj = Token.objects.get(key=token)
-            return token_obj.user
-        except Token.DoesNotExist:
-            return None
-    
     async def disconnect(self, close_code):
         if hasattr(self, 'group_name'):
             await self.channel_layer.group_discard(
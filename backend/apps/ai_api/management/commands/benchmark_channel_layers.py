@@ -0,0 +1,179 @@
+import asyncio
+import json
+import time
+
+from channels.exceptions import ChannelFull
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+
+# Backends that work across processes; each gets separate sender and receiver instances
+CROSS_PROCESS = {'postgres', 'redis'}
+RECEIVE_TIMEOUT = 5  # seconds without a message before the rest count as lost
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 3)
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the configured channel layer backends: point-to-point and group fan-out '
+        'throughput, latency and messages lost to capacity limits'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--backends',
+            nargs='+',
+            choices=sorted(settings.CHANNEL_LAYER_BACKENDS),
+            default=sorted(settings.CHANNEL_LAYER_BACKENDS),
+            help='Backends from CHANNEL_LAYER_BACKENDS to compare (default: all; unavailable ones are skipped)'
+        )
+        parser.add_argument(
+            '--messages',
+            type=int,
+            default=1000,
+            help='Point-to-point messages per run (default: 1000)'
+        )
+        parser.add_argument(
+            '--group-size',
+            type=int,
+            default=50,
+            help='Channels in the fan-out group (default: 50)'
+        )
+        parser.add_argument(
+            '--group-messages',
+            type=int,
+            default=100,
+            help='Messages sent to the group (default: 100)'
+        )
+        parser.add_argument(
+            '--payload-bytes',
+            nargs='+',
+            type=int,
+            default=[200, 16000],
+            help='Message body sizes; over 8000 bytes exercises the large-payload path (default: 200 16000)'
+        )
+        parser.add_argument(
+            '--output',
+            type=str,
+            help='Write the JSON report to this path'
+        )
+
+    def handle(self, *args, **options):
+        if options['messages'] < 1 or options['group_size'] < 1 or options['group_messages'] < 1:
+            raise CommandError('--messages, --group-size and --group-messages must be at least 1')
+
+        results = []
+        for backend in options['backends']:
+            for size in options['payload_bytes']:
+                self.stdout.write(f"{backend}, {size} byte messages...")
+                try:
+                    result = asyncio.run(self.run_backend(backend, size, options))
+                except Exception as e:
+                    self.stdout.write(self.style.WARNING(f"  skipped: {e}"))
+                    result = {'backend': backend, 'payload_bytes': size, 'error': str(e)}
+                else:
+                    self.print_result(result)
+                results.append(result)
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump({'settings': {k: options[k] for k in ('backends', 'messages', 'group_size', 'group_messages', 'payload_bytes')},
+                           'results': results}, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+
+    def make_layer(self, backend):
+        config = settings.CHANNEL_LAYER_BACKENDS[backend]
+        layer_config = dict(config.get('CONFIG', {}))
+        if backend in CROSS_PROCESS:
+            layer_config['prefix'] = 'benchmark'  # keeps the benchmark off the live groups
+        return import_string(config['BACKEND'])(**layer_config)
+
+    async def run_backend(self, backend, size, options):
+        sender = self.make_layer(backend)
+        receiver = self.make_layer(backend) if backend in CROSS_PROCESS else sender
+        try:
+            body = 'x' * size
+            return {
+                'backend': backend,
+                'payload_bytes': size,
+                'point_to_point': await self.point_to_point(sender, receiver, body, options['messages']),
+                'group': await self.fan_out(sender, receiver, body, options['group_size'], options['group_messages']),
+            }
+        finally:
+            await sender.flush()
+            for layer in {id(sender): sender, id(receiver): receiver}.values():
+                close = getattr(layer, 'close_pools', None) or getattr(layer, 'close', None)
+                if close:
+                    await close()
+
+    async def point_to_point(self, sender, receiver, body, count):
+        channel = await receiver.new_channel()
+        latencies = []
+        consumer = asyncio.create_task(self.consume(receiver, channel, count, latencies))
+        full = 0
+        started = time.perf_counter()
+        for seq in range(count):
+            message = {'type': 'bench.message', 'seq': seq, 'sent': time.perf_counter(), 'body': body}
+            while True:
+                try:
+                    await sender.send(channel, message)
+                    break
+                except ChannelFull:
+                    # Backpressure: let the receiver drain, then retry
+                    full += 1
+                    await asyncio.sleep(0.001)
+        received = await consumer
+        return self.summarize(count, received, time.perf_counter() - started, latencies, channel_full=full)
+
+    async def fan_out(self, sender, receiver, body, group_size, count):
+        channels = [await receiver.new_channel() for _ in range(group_size)]
+        for channel in channels:
+            await sender.group_add('benchmark', channel)
+        latencies = []
+        consumers = [asyncio.create_task(self.consume(receiver, channel, count, latencies)) for channel in channels]
+        started = time.perf_counter()
+        for seq in range(count):
+            await sender.group_send('benchmark', {'type': 'bench.message', 'seq': seq, 'sent': time.perf_counter(), 'body': body})
+        received = sum(await asyncio.gather(*consumers))
+        elapsed = time.perf_counter() - started
+        for channel in channels:
+            await sender.group_discard('benchmark', channel)
+        return self.summarize(count * group_size, received, elapsed, latencies)
+
+    async def consume(self, layer, channel, count, latencies):
+        received = 0
+        while received < count:
+            try:
+                message = await asyncio.wait_for(layer.receive(channel), RECEIVE_TIMEOUT)
+            except asyncio.TimeoutError:
+                break
+            latencies.append((time.perf_counter() - message['sent']) * 1000)
+            received += 1
+        return received
+
+    def summarize(self, expected, received, elapsed, latencies, **extra):
+        return {
+            'expected': expected,
+            'received': received,
+            'lost': expected - received,
+            'seconds': round(elapsed, 3),
+            'messages_per_second': round(received / elapsed, 1) if elapsed else None,
+            'latency_ms_p50': _percentile(latencies, 0.5),
+            'latency_ms_p99': _percentile(latencies, 0.99),
+            **extra,
+        }
+
+    def print_result(self, result):
+        for name in ('point_to_point', 'group'):
+            r = result[name]
+            self.stdout.write(
+                f"  {name}: {r['messages_per_second']} msg/s, p50 {r['latency_ms_p50']} ms, "
+                f"p99 {r['latency_ms_p99']} ms, lost {r['lost']}/{r['expected']}"
+                + (f", ChannelFull {r['channel_full']}" if r.get('channel_full') else "")
+            )
@@ -0,0 +1,298 @@
+import csv
+import gc
+import glob
+import json
+import os
+import time
+
+import torch
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from llms import llm_cache, telemetry, token_budget
+from llms.backlog_llm import run_backlog_pipeline, target_epic_count, is_placeholder_epic
+from llms.fake_llm import FakeLLM, synthetic_recordings
+from llms.llm_cache import override_llm
+from llms.model_registry import MODELS
+from llms.project_llm import run_pipeline_from_text
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+CSV_FIELDS = [
+    'model', 'dtype', 'max_new_tokens', 'temperature', 'proposals', 'wall_seconds', 'project_seconds',
+    'backlog_seconds', 'generated_tokens', 'tokens_per_second', 'decode_tokens_per_second', 'calls',
+    'first_try_pass_rate', 'success_rate', 'project_completeness', 'backlog_completeness',
+    'peak_gpu_mb', 'peak_rss_mb', 'error',
+]
+
+
+class _ConfiguredPipeline:
+    """The model's pipeline with one benchmark cell's generation settings applied."""
+
+    def __init__(self, pipeline, max_new_tokens, temperature):
+        self._pipeline = pipeline
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+
+    @property
+    def tokenizer(self):
+        return getattr(self._pipeline, 'tokenizer', None)
+
+    def __call__(self, prompts, **kwargs):
+        # Caps the per-section limits the pipelines ask for
+        kwargs['max_new_tokens'] = min(kwargs.get('max_new_tokens') or self.max_new_tokens, self.max_new_tokens)
+        if self.temperature > 0:
+            kwargs.update(do_sample=True, temperature=self.temperature)
+        else:
+            kwargs['do_sample'] = False
+        return self._pipeline(prompts, **kwargs)
+
+
+class _ConfiguredLLM:
+    def __init__(self, llm, max_new_tokens, temperature):
+        self._llm = llm
+        self.pipeline = _ConfiguredPipeline(llm.pipeline, max_new_tokens, temperature)
+
+    def invoke(self, prompt):
+        # Through the configured pipeline, so the cell's settings apply to unstreamed calls too
+        out = self.pipeline(prompt)
+        if isinstance(out, list) and out and isinstance(out[0], dict):
+            return out[0].get("generated_text") or ""
+        return out if isinstance(out, str) else ""
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare models, weight formats and generation settings on a fixed proposal corpus: '
+        'throughput, wall time, peak memory, first-try validation pass rate and parse completeness'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--models',
+            nargs='+',
+            choices=sorted(MODELS),
+            default=sorted(MODELS),
+            help='Model registry names to benchmark (default: all)'
+        )
+        parser.add_argument(
+            '--dtypes',
+            nargs='+',
+            choices=['auto', llm_cache.QUANTIZED_DTYPE, *sorted(llm_cache.DTYPES)],
+            default=['auto'],
+            help='Weight formats to load each model in (default: auto, i.e. 4-bit on GPU when available)'
+        )
+        parser.add_argument(
+            '--max-new-tokens',
+            nargs='+',
+            type=int,
+            default=[256, 512],
+            help='Caps on the per-section generation limits (default: 256 512)'
+        )
+        parser.add_argument(
+            '--temperatures',
+            nargs='+',
+            type=float,
+            default=[0.4],
+            help='Sampling temperatures; 0 means greedy decoding (default: 0.4)'
+        )
+        parser.add_argument(
+            '--corpus',
+            nargs='+',
+            help='Proposal text files or directories of .txt files (default: data/datasets/project_proposal*.txt)'
+        )
+        parser.add_argument(
+            '--skip-backlog',
+            action='store_true',
+            help='Only run the project pipeline'
+        )
+        parser.add_argument(
+            '--fake',
+            action='store_true',
+            help='Replay the synthetic corpus with FakeLLM instead of loading models (checks the harness on CPU)'
+        )
+        parser.add_argument(
+            '--output',
+            type=str,
+            help='Write the JSON report to this path'
+        )
+        parser.add_argument(
+            '--csv',
+            type=str,
+            help='Write one CSV row per matrix cell to this path'
+        )
+
+    def handle(self, *args, **options):
+        if any(n < 1 for n in options['max_new_tokens']):
+            raise CommandError('--max-new-tokens values must be at least 1')
+        corpus = self.load_corpus(options['corpus'])
+        if not corpus:
+            raise CommandError('No proposals found in the corpus')
+
+        report = {
+            'settings': {k: options[k] for k in ('models', 'dtypes', 'max_new_tokens', 'temperatures', 'skip_backlog', 'fake')},
+            'corpus': [{'name': name, 'words': len(text.split())} for name, text in corpus],
+            'device': 'cuda' if torch.cuda.is_available() else 'cpu',
+            'results': [],
+        }
+        for model in options['models']:
+            for dtype in options['dtypes']:
+                report['results'] += self.benchmark_model(model, dtype, corpus, options)
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2, default=str)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+        if options['csv']:
+            with open(options['csv'], 'w', encoding='utf-8', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=CSV_FIELDS, extrasaction='ignore')
+                writer.writeheader()
+                writer.writerows(report['results'])
+            self.stdout.write(self.style.SUCCESS(f"CSV written to {options['csv']}"))
+
+    def load_corpus(self, paths):
+        if not paths:
+            paths = sorted(glob.glob(os.path.join(settings.BASE_DIR, 'data', 'datasets', 'project_proposal*.txt')))
+        files = []
+        for path in paths:
+            if os.path.isdir(path):
+                files += sorted(glob.glob(os.path.join(path, '*.txt')))
+            else:
+                files.append(path)
+        corpus = []
+        for path in files:
+            with open(path, 'r', encoding='utf-8') as f:
+                text = f.read().strip()
+            if text:
+                corpus.append((os.path.basename(path), text))
+        return corpus
+
+    def load_model(self, model, dtype, options):
+        if options['fake']:
+            return FakeLLM(synthetic_recordings('small'))
+        spec = MODELS[model]
+        return llm_cache._create_llm_pipeline(spec.model_id, dtype=None if dtype == 'auto' else dtype)
+
+    def benchmark_model(self, model, dtype, corpus, options):
+        """One row per (max_new_tokens, temperature) cell for a model loaded once in ``dtype``."""
+        self.stdout.write(f"Loading {model} ({dtype})...")
+        cells = [(n, t) for n in options['max_new_tokens'] for t in options['temperatures']]
+        base = {'model': model, 'dtype': dtype, 'proposals': len(corpus)}
+        started = time.perf_counter()
+        try:
+            llm = self.load_model(model, dtype, options)
+        except Exception as e:
+            self.stdout.write(self.style.WARNING(f"  {model} ({dtype}) could not be loaded: {e}"))
+            return [{**base, 'max_new_tokens': n, 'temperature': t, 'error': str(e)} for n, t in cells]
+        load_seconds = round(time.perf_counter() - started, 3)
+
+        rows = []
+        try:
+            for max_new_tokens, temperature in cells:
+                row = {**base, 'max_new_tokens': max_new_tokens, 'temperature': temperature, 'load_seconds': load_seconds}
+                row.update(self.run_cell(_ConfiguredLLM(llm, max_new_tokens, temperature), corpus, options))
+                rows.append(row)
+                self.print_row(row)
+        finally:
+            del llm
+            gc.collect()
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        return rows
+
+    def run_cell(self, llm, corpus, options):
+        telemetry.reset_metrics()
+        if torch.cuda.is_available():
+            torch.cuda.reset_peak_memory_stats()
+
+        project_scores, backlog_scores = [], []
+        # Every cell runs with the static limits: learned budgets would drift
+        # across cells and are keyed by route, not by the benchmarked model
+        budgets_enabled, token_budget.budgets.enabled = token_budget.budgets.enabled, False
+        try:
+            with override_llm(llm):
+                started = time.perf_counter()
+                projects = [run_pipeline_from_text(text) for _, text in corpus]
+                project_seconds = time.perf_counter() - started
+                for project in projects:
+                    project_scores.append(self.project_completeness(project))
+                if not options['skip_backlog']:
+                    for (_, text), project in zip(corpus, projects):
+                        backlog = run_backlog_pipeline(
+                            text, {"project_title": project.title or "", "project_summary": project.summary or ""}, pad=False
+                        )
+                        backlog_scores.append(self.backlog_completeness(backlog, text))
+                wall_seconds = time.perf_counter() - started
+        finally:
+            token_budget.budgets.enabled = budgets_enabled
+
+        result = {
+            'wall_seconds': round(wall_seconds, 3),
+            'project_seconds': round(project_seconds, 3),
+            'backlog_seconds': None if options['skip_backlog'] else round(wall_seconds - project_seconds, 3),
+            'project_completeness': round(sum(project_scores) / len(project_scores), 4),
+            'backlog_completeness': round(sum(backlog_scores) / len(backlog_scores), 4) if backlog_scores else None,
+            **self.peak_memory(),
+        }
+        result.update(self.summarize(telemetry.get_metrics()['pipelines'], wall_seconds))
+        return result
+
+    def summarize(self, pipelines, wall_seconds):
+        sections = [s for pipeline in pipelines.values() for s in pipeline.values()]
+        calls = sum(s['calls'] for s in sections)
+        generated = sum(s['generated_tokens']['sum'] for s in sections)
+        rate_count = sum(s['decode_tokens_per_second']['count'] for s in sections)
+        rate_sum = sum(s['decode_tokens_per_second']['sum'] for s in sections)
+        return {
+            'calls': calls,
+            'attempts': sum(s['attempts'] for s in sections),
+            'generated_tokens': int(generated),
+            'tokens_per_second': round(generated / wall_seconds, 2) if wall_seconds else None,
+            'decode_tokens_per_second': round(rate_sum / rate_count, 2) if rate_count else None,
+            'first_try_pass_rate': round(sum(s['first_try_successes'] for s in sections) / calls, 4) if calls else None,
+            'success_rate': round(sum(s['successes'] for s in sections) / calls, 4) if calls else None,
+            'sections': {
+                f"{pipeline}.{section}": {
+                    'calls': s['calls'],
+                    'first_try_successes': s['first_try_successes'],
+                    'validation_failures': s['validation_failures'],
+                    'generated_tokens_mean': s['generated_tokens']['mean'],
+                }
+                for pipeline, by_section in pipelines.items() for section, s in by_section.items()
+            },
+        }
+
+    def project_completeness(self, project):
+        """Share of the five project sections that parsed into something usable."""
+        parts = [bool(project.summary), bool(project.features), bool(project.roles), bool(project.goals), bool(project.timeline)]
+        return sum(parts) / len(parts)
+
+    def backlog_completeness(self, backlog, proposal_text):
+        """
+        Generated epics that reach at least one task, relative to the epics
+        asked for. Score the unpadded backlog: generic and placeholder epics
+        do not count.
+        """
+        with_tasks = sum(
+            1 for e in backlog.epics
+            if not is_placeholder_epic(e) and any(us.tasks for se in e.sub_epics for us in se.user_stories)
+        )
+        return min(1.0, with_tasks / target_epic_count(proposal_text))
+
+    def peak_memory(self):
+        gpu = round(torch.cuda.max_memory_allocated() / 2 ** 20, 1) if torch.cuda.is_available() else None
+        # ru_maxrss is the process high-water mark (KiB on Linux), not per cell
+        rss = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1) if resource else None
+        return {'peak_gpu_mb': gpu, 'peak_rss_mb': rss}
+
+    def print_row(self, row):
+        self.stdout.write(
+            f"  max_new_tokens={row['max_new_tokens']} temperature={row['temperature']}: "
+            f"{row['wall_seconds']:.2f} s, {row['tokens_per_second']} tok/s, "
+            f"first-try pass {row['first_try_pass_rate']:.0%}, "
+            f"completeness {row['project_completeness']:.0%}"
+            + (f" / backlog {row['backlog_completeness']:.0%}" if row['backlog_completeness'] is not None else "")
+        )
@@ -0,0 +1,216 @@
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from llms import telemetry
+from llms.fake_llm import FakeLLM, BENCHMARK_SIZES, synthetic_proposal, synthetic_recordings
+from llms.llm_cache import override_llm
+from llms.project_llm import run_pipeline_from_text, parse_project_outputs
+from llms.backlog_llm import run_backlog_pipeline, parse_backlog
+
+
+class _Rollback(Exception):
+    """Raised to roll back the benchmark fixtures after the view runs."""
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the LLM generation pipelines, parsers and persistence with a deterministic fake model (CPU only)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            nargs='+',
+            choices=sorted(BENCHMARK_SIZES),
+            default=['small', 'medium', 'huge'],
+            help='Proposal/backlog sizes to benchmark (default: all)'
+        )
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=3,
+            help='Runs per measurement (default: 3)'
+        )
+        parser.add_argument(
+            '--ttft',
+            type=float,
+            default=0.0,
+            help='Synthetic time to first token in seconds (default: 0)'
+        )
+        parser.add_argument(
+            '--seconds-per-token',
+            type=float,
+            default=0.0,
+            help='Synthetic decode time per generated token in seconds (default: 0)'
+        )
+        parser.add_argument(
+            '--recordings',
+            type=str,
+            help='Directory of recorded outputs (RecordingLLM format) to replay instead of the synthetic corpus'
+        )
+        parser.add_argument(
+            '--backlog-mode',
+            choices=['auto', 'single', 'hierarchical', 'both'],
+            default='both',
+            help='Backlog generation mode(s) to time (default: both single-pass and hierarchical)'
+        )
+        parser.add_argument(
+            '--skip-db',
+            action='store_true',
+            help='Skip the view/persistence measurements'
+        )
+        parser.add_argument(
+            '--output',
+            type=str,
+            help='Write the JSON report to this path'
+        )
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('--iterations must be at least 1')
+
+        report = {'settings': {k: options[k] for k in ('iterations', 'ttft', 'seconds_per_token', 'recordings', 'backlog_mode')}, 'sizes': {}}
+        for size in options['sizes']:
+            self.stdout.write(f"Benchmarking '{size}'...")
+            report['sizes'][size] = self.benchmark_size(size, options)
+            self.print_size(size, report['sizes'][size])
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2, default=str)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+
+    def make_llm(self, size, options):
+        kwargs = {
+            'ttft_seconds': options['ttft'],
+            'seconds_per_token': options['seconds_per_token'],
+        }
+        if options['recordings']:
+            return FakeLLM.from_directory(options['recordings'], **kwargs)
+        return FakeLLM(synthetic_recordings(size), **kwargs)
+
+    def benchmark_size(self, size, options):
+        iterations = options['iterations']
+        proposal_text = synthetic_proposal(size)
+        recordings = synthetic_recordings(size)
+        result = {'proposal_words': len(proposal_text.split())}
+
+        telemetry.reset_metrics()
+        with override_llm(self.make_llm(size, options)):
+            result['project_pipeline'] = self.time_runs(iterations, lambda: run_pipeline_from_text(proposal_text))
+            for mode, hierarchical in self.backlog_modes(options['backlog_mode']):
+                result[f'backlog_pipeline_{mode}'] = self.time_runs(
+                    iterations,
+                    lambda: run_backlog_pipeline(proposal_text, {"project_title": "Benchmark"}, hierarchical=hierarchical)
+                )
+                backlog = run_backlog_pipeline(proposal_text, {"project_title": "Benchmark"}, hierarchical=hierarchical)
+                result[f'backlog_pipeline_{mode}']['shape'] = self.backlog_shape(backlog)
+            if not options['skip_db']:
+                result['views'] = self.benchmark_views(proposal_text, iterations)
+        result['telemetry'] = telemetry.get_metrics()['pipelines']
+
+        # Parsers alone, on the replayed completions
+        result['parse_project'] = self.time_runs(iterations * 10, lambda: parse_project_outputs(dict(recordings)))
+        result['parse_backlog'] = self.time_runs(iterations * 10, lambda: parse_backlog(recordings['backlog']))
+        result['backlog_shape'] = self.backlog_shape(parse_backlog(recordings['backlog']))
+        return result
+
+    def backlog_modes(self, mode):
+        if mode == 'both':
+            return [('single', False), ('hierarchical', True)]
+        return [(mode, {'auto': None, 'single': False, 'hierarchical': True}[mode])]
+
+    def backlog_shape(self, backlog):
+        return {
+            'epics': len(backlog.epics),
+            'tasks': sum(len(us.tasks) for e in backlog.epics for se in e.sub_epics for us in se.user_stories),
+        }
+
+    def time_runs(self, iterations, fn):
+        durations = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            fn()
+            durations.append(time.perf_counter() - started)
+        return {
+            'runs': iterations,
+            'mean_seconds': round(statistics.mean(durations), 6),
+            'min_seconds': round(min(durations), 6),
+            'max_seconds': round(max(durations), 6),
+        }
+
+    def benchmark_views(self, proposal_text, iterations):
+        """Run ingest_proposal and generate_backlog through the view layer inside a rolled-back transaction."""
+        from apps.ai_api.models import Project, Proposal, ProjectMember
+        from apps.ai_api.views import ProjectViewSet
+        from apps.ai_api.singleflight import llm_jobs
+
+        factory = APIRequestFactory()
+        ingest_view = ProjectViewSet.as_view({'put': 'ingest_proposal'})
+        backlog_view = ProjectViewSet.as_view({'put': 'generate_backlog'})
+        results = {'ingest_proposal': [], 'generate_backlog': []}
+
+        # Repeated identical requests would otherwise be served from the single-flight linger window
+        linger_seconds, llm_jobs.linger_seconds = llm_jobs.linger_seconds, 0
+        try:
+            # Jobs run on the request thread: a worker could not see the uncommitted fixtures
+            with override_settings(LLM_JOBS_IN_BACKGROUND=False), transaction.atomic():
+                user = get_user_model().objects.create_user(
+                    email='benchmark-pipelines@example.com', name='Benchmark', password=None
+                )
+                project = Project.objects.create(title='Benchmark Project', created_by=user)
+                ProjectMember.objects.create(project=project, user=user, role='Owner')
+                proposal = Proposal.objects.create(
+                    project=project, file='proposals/benchmark.pdf', parsed_text=proposal_text, uploaded_by=user
+                )
+
+                for _ in range(iterations):
+                    for name, view, path, kwargs in (
+                        ('ingest_proposal', ingest_view, f'/api/ai/projects/{project.id}/ingest-proposal/{proposal.id}/',
+                         {'pk': project.id, 'proposal_id': proposal.id}),
+                        ('generate_backlog', backlog_view, f'/api/ai/projects/{project.id}/generate-backlog/',
+                         {'pk': project.id}),
+                    ):
+                        request = factory.put(path, {}, format='json')
+                        force_authenticate(request, user=user)
+                        started = time.perf_counter()
+                        with CaptureQueriesContext(connection) as queries:
+                            response = view(request, **kwargs)
+                        results[name].append({
+                            'status': response.status_code,
+                            'seconds': time.perf_counter() - started,
+                            'queries': len(queries.captured_queries),
+                        })
+                raise _Rollback()
+        except _Rollback:
+            pass
+        finally:
+            llm_jobs.linger_seconds = linger_seconds
+
+        return {
+            name: {
+                'status_codes': sorted({r['status'] for r in runs}),
+                'mean_seconds': round(statistics.mean(r['seconds'] for r in runs), 6),
+                'queries': max(r['queries'] for r in runs),
+            }
+            for name, runs in results.items()
+        }
+
+    def print_size(self, size, result):
+        self.stdout.write(f"  proposal words: {result['proposal_words']}")
+        for key in ('project_pipeline', 'parse_project', 'parse_backlog'):
+            self.stdout.write(f"  {key}: {result[key]['mean_seconds'] * 1000:.2f} ms mean over {result[key]['runs']} runs")
+        for key in sorted(k for k in result if k.startswith('backlog_pipeline_')):
+            self.stdout.write(
+                f"  {key}: {result[key]['mean_seconds'] * 1000:.2f} ms mean over {result[key]['runs']} runs, "
+                f"shape {result[key]['shape']}"
+            )
+        for name, view in result.get('views', {}).items():
+            self.stdout.write(f"  view {name}: {view['mean_seconds'] * 1000:.2f} ms, {view['queries']} queries, status {view['status_codes']}")
+        self.stdout.write(f"  backlog shape: {result['backlog_shape']}")
+        self.stdout.write(self.style.SUCCESS(f"Finished '{size}'"))
@@ -0,0 +1,378 @@
+import csv
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pdfplumber
+from django.contrib.auth import get_user_model
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from apps.ai_api.models import Project, ProjectMember, Proposal
+from apps.ai_api.persistence import persist_overviews, persist_backlogs, load_token_stats, save_token_stats
+from llms import telemetry, incremental
+from llms.project_llm import run_pipeline_batch, model_to_dict
+from llms.backlog_llm import run_backlog_batch
+
+# Checkpoint stages, in order
+EXTRACTED = 'extracted'
+OVERVIEW = 'overview'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class Command(BaseCommand):
+    help = 'Bulk-ingest proposal PDFs: extract text, generate overviews and backlogs with batched inference'
+
+    def add_arguments(self, parser):
+        source = parser.add_mutually_exclusive_group(required=True)
+        source.add_argument(
+            '--directory',
+            type=str,
+            help='Directory of PDFs; each PDF becomes a new project named after the file'
+        )
+        source.add_argument(
+            '--manifest',
+            type=str,
+            help='JSON list or CSV with columns pdf, project_id (optional) and title (optional)'
+        )
+        parser.add_argument(
+            '--owner',
+            type=str,
+            required=True,
+            help='Email of the user who owns created projects and uploads the proposals'
+        )
+        parser.add_argument(
+            '--checkpoint',
+            type=str,
+            help='Checkpoint file (default: .ingest_checkpoint.json next to the directory/manifest)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=4,
+            help='Prompts per batched model call (default: 4)'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=8,
+            help='Proposals generated and persisted per checkpoint step (default: 8)'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Threads used for PDF text extraction (default: 4)'
+        )
+        parser.add_argument(
+            '--skip-backlog',
+            action='store_true',
+            help='Only extract and generate project overviews'
+        )
+        parser.add_argument(
+            '--retry-failed',
+            action='store_true',
+            help='Retry entries that failed in a previous run'
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1 or options['chunk_size'] < 1:
+            raise CommandError('--batch-size and --chunk-size must be at least 1')
+        try:
+            self.owner = get_user_model().objects.get(email=options['owner'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"No user with email {options['owner']}")
+
+        entries = self.load_entries(options)
+        base = options['directory'] or os.path.dirname(os.path.abspath(options['manifest']))
+        self.checkpoint_path = options['checkpoint'] or os.path.join(base, '.ingest_checkpoint.json')
+        self.checkpoint = self.load_checkpoint()
+        self.reconcile_checkpoint()
+        if options['retry_failed']:
+            for key, state in list(self.checkpoint['items'].items()):
+                if state['stage'] != FAILED:
+                    continue
+                if not state.get('proposal_id'):
+                    # Extraction itself failed: forget the entry so extract() reads the PDF again
+                    del self.checkpoint['items'][key]
+                    continue
+                state['stage'] = state.get('failed_stage') or EXTRACTED
+                state.pop('error', None)
+
+        final_stage = OVERVIEW if options['skip_backlog'] else DONE
+        finished_before = {key for key, state in self.checkpoint['items'].items() if state['stage'] == final_stage}
+
+        telemetry.reset_metrics()
+        timings = {}
+        started = time.perf_counter()
+
+        stage_started = time.perf_counter()
+        self.extract(entries, options['workers'])
+        timings['extract'] = time.perf_counter() - stage_started
+
+        stage_started = time.perf_counter()
+        self.generate_overviews(options['chunk_size'], options['batch_size'])
+        timings['overview'] = time.perf_counter() - stage_started
+
+        if not options['skip_backlog']:
+            stage_started = time.perf_counter()
+            self.generate_backlogs(options['chunk_size'], options['batch_size'])
+            timings['backlog'] = time.perf_counter() - stage_started
+
+        timings['total'] = time.perf_counter() - started
+        self.print_report(entries, timings, final_stage, finished_before)
+
+    # Input -------------------------------------------------------------------
+
+    def load_entries(self, options):
+        if options['directory']:
+            directory = options['directory']
+            if not os.path.isdir(directory):
+                raise CommandError(f"Not a directory: {directory}")
+            return [
+                {'pdf': os.path.join(directory, name), 'project_id': None, 'title': None}
+                for name in sorted(os.listdir(directory)) if name.lower().endswith('.pdf')
+            ]
+
+        path = options['manifest']
+        base = os.path.dirname(os.path.abspath(path))
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                rows = json.load(f) if path.lower().endswith('.json') else list(csv.DictReader(f))
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Could not read manifest {path}: {e}")
+
+        entries = []
+        for row in rows:
+            if not row.get('pdf'):
+                raise CommandError(f"Manifest row without a pdf: {row}")
+            pdf = row['pdf'] if os.path.isabs(row['pdf']) else os.path.join(base, row['pdf'])
+            entries.append({
+                'pdf': pdf,
+                'project_id': int(row['project_id']) if row.get('project_id') else None,
+                'title': row.get('title') or None,
+            })
+        return entries
+
+    # Checkpoint --------------------------------------------------------------
+
+    def load_checkpoint(self):
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+                checkpoint = json.load(f)
+            self.stdout.write(f"Resuming from {self.checkpoint_path} ({len(checkpoint['items'])} entries)")
+            return checkpoint
+        return {'version': 1, 'items': {}}
+
+    def reconcile_checkpoint(self):
+        """
+        Forget entries whose proposal is not in the database. The checkpoint is
+        written just before each transaction commits, so a run that died in
+        between left entries for rows that were rolled back; they are extracted
+        again instead of being skipped.
+        """
+        recorded = {key: state for key, state in self.checkpoint['items'].items() if state.get('proposal_id')}
+        existing = set(
+            Proposal.objects.filter(id__in=[state['proposal_id'] for state in recorded.values()]).values_list('id', flat=True)
+        )
+        lost = [key for key, state in recorded.items() if state['proposal_id'] not in existing]
+        for key in lost:
+            del self.checkpoint['items'][key]
+        if lost:
+            self.stdout.write(f"{len(lost)} checkpoint entries have no proposal in the database; extracting them again")
+            self.save_checkpoint()
+
+    def save_checkpoint(self):
+        # Write-then-rename so an interrupted run never leaves a truncated checkpoint
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.checkpoint, f, indent=2)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def items_at(self, stage):
+        return [(key, state) for key, state in self.checkpoint['items'].items() if state['stage'] == stage]
+
+    def fail(self, items, stage, error):
+        for _, state in items:
+            state.update({'stage': FAILED, 'failed_stage': stage, 'error': str(error)[:500]})
+        self.stderr.write(self.style.ERROR(f"{len(items)} entries failed during {stage}: {error}"))
+
+    # Stage 1: extraction -----------------------------------------------------
+
+    def extract(self, entries, workers):
+        pending, seen = [], {}
+        for entry in entries:
+            with open(entry['pdf'], 'rb') as f:
+                key = hashlib.sha1(f.read()).hexdigest()
+            if key in seen:
+                # Identical files would become identical projects
+                self.stdout.write(self.style.WARNING(f"Skipping {entry['pdf']}: same content as {seen[key]}"))
+                continue
+            seen[key] = entry['pdf']
+            if key not in self.checkpoint['items']:
+                pending.append((key, entry))
+        if not pending:
+            return
+
+        self.stdout.write(f"Extracting {len(pending)} PDFs...")
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            extracted = list(pool.map(lambda item: (item[0], item[1], self.read_pages(item[1]['pdf'])), pending))
+
+        ok = []
+        for key, entry, pages in extracted:
+            if isinstance(pages, Exception):
+                self.checkpoint['items'][key] = {'pdf': entry['pdf'], 'stage': EXTRACTED}
+                self.fail([(key, self.checkpoint['items'][key])], EXTRACTED, pages)
+            else:
+                ok.append((key, entry, pages))
+
+        with transaction.atomic():
+            new_projects = [
+                Project(title=entry['title'] or os.path.splitext(os.path.basename(entry['pdf']))[0][:255], created_by=self.owner)
+                for _, entry, _ in ok if entry['project_id'] is None
+            ]
+            Project.objects.bulk_create(new_projects)
+            ProjectMember.objects.bulk_create([
+                ProjectMember(project=project, user=self.owner, user_name=self.owner.name, user_email=self.owner.email, role='Owner')
+                for project in new_projects
+            ])
+
+            created = iter(new_projects)
+            proposals = []
+            for key, entry, pages in ok:
+                project_id = entry['project_id'] or next(created).id
+                with open(entry['pdf'], 'rb') as f:
+                    name = default_storage.save(f"proposals/{os.path.basename(entry['pdf'])}", File(f))
+                proposals.append(Proposal(
+                    project_id=project_id,
+                    file=name,
+                    parsed_text="\n".join(pages),
+                    page_texts=pages,
+                    page_hashes=incremental.page_hashes(pages),
+                    uploaded_by=self.owner,
+                ))
+            Proposal.objects.bulk_create(proposals)
+
+            for (key, entry, pages), proposal in zip(ok, proposals):
+                self.checkpoint['items'][key] = {
+                    'pdf': entry['pdf'],
+                    'stage': EXTRACTED,
+                    'project_id': proposal.project_id,
+                    'proposal_id': proposal.id,
+                    'title_override': bool(entry['title']),
+                    'pages': len(pages),
+                }
+            # Last step before commit: a crash after this is undone by reconcile_checkpoint
+            self.save_checkpoint()
+
+    def read_pages(self, path):
+        try:
+            with pdfplumber.open(path) as pdf:
+                return [page.extract_text() or "" for page in pdf.pages]
+        except Exception as e:
+            return e
+
+    # Stage 2: project overviews ----------------------------------------------
+
+    def generate_overviews(self, chunk_size, batch_size):
+        pending = self.items_at(EXTRACTED)
+        load_token_stats()
+        for start in range(0, len(pending), chunk_size):
+            chunk = pending[start:start + chunk_size]
+            self.stdout.write(f"Generating overviews {start + 1}-{start + len(chunk)} of {len(pending)}...")
+            try:
+                proposals = Proposal.objects.in_bulk([state['proposal_id'] for _, state in chunk])
+                projects = Project.objects.in_bulk([state['project_id'] for _, state in chunk])
+                results = run_pipeline_batch(
+                    [proposals[state['proposal_id']].page_texts or [proposals[state['proposal_id']].parsed_text] for _, state in chunk],
+                    batch_size=batch_size,
+                )
+
+                with transaction.atomic():
+                    overview_items = []
+                    for (_, state), (project_model, section_outputs) in zip(chunk, results):
+                        project = projects[state['project_id']]
+                        output = model_to_dict(project_model)
+                        if not state.get('title_override'):
+                            project.title = (output.get("title") or project.title)[:255]
+                        project.summary = output.get("summary") or project.summary
+                        proposals[state['proposal_id']].section_outputs = section_outputs
+                        overview_items.append((project, output))
+                    Project.objects.bulk_update([project for project, _ in overview_items], ['title', 'summary'])
+                    Proposal.objects.bulk_update(list(proposals.values()), ['section_outputs'])
+                    persist_overviews(overview_items)
+                    save_token_stats()
+                    for _, state in chunk:
+                        state['stage'] = OVERVIEW
+                    self.save_checkpoint()
+            except Exception as e:
+                self.fail(chunk, EXTRACTED, e)
+                self.save_checkpoint()
+
+    # Stage 3: backlogs -------------------------------------------------------
+
+    def generate_backlogs(self, chunk_size, batch_size):
+        pending = self.items_at(OVERVIEW)
+        load_token_stats()
+        for start in range(0, len(pending), chunk_size):
+            chunk = pending[start:start + chunk_size]
+            self.stdout.write(f"Generating backlogs {start + 1}-{start + len(chunk)} of {len(pending)}...")
+            try:
+                proposals = Proposal.objects.in_bulk([state['proposal_id'] for _, state in chunk])
+                projects = Project.objects.in_bulk([state['project_id'] for _, state in chunk])
+                backlogs = run_backlog_batch(
+                    [
+                        (proposals[state['proposal_id']].parsed_text, {"project_title": projects[state['project_id']].title or ""})
+                        for _, state in chunk
+                    ],
+                    batch_size=batch_size,
+                )
+                with transaction.atomic():
+                    task_counts = persist_backlogs([
+                        (projects[state['project_id']], backlog) for (_, state), backlog in zip(chunk, backlogs)
+                    ])
+                    save_token_stats()
+                    for (_, state), backlog, tasks in zip(chunk, backlogs, task_counts):
+                        state.update({'stage': DONE, 'epics': len(backlog.epics), 'tasks': tasks})
+                    self.save_checkpoint()
+            except Exception as e:
+                self.fail(chunk, OVERVIEW, e)
+                self.save_checkpoint()
+
+    # Report ------------------------------------------------------------------
+
+    def print_report(self, entries, timings, final_stage, finished_before):
+        items = self.checkpoint['items']
+        completed = [s for s in items.values() if s['stage'] == final_stage]
+        failed = [s for s in items.values() if s['stage'] == FAILED]
+        # Throughput only counts proposals finished by this run
+        processed = [s for key, s in items.items() if s['stage'] == final_stage and key not in finished_before]
+        pages = sum(s.get('pages', 0) for s in processed)
+        generated_tokens = sum(
+            section['generated_tokens']['sum']
+            for sections in telemetry.get_metrics()['pipelines'].values()
+            for section in sections.values()
+        )
+        total = timings['total'] or 1e-9
+
+        self.stdout.write("")
+        self.stdout.write(self.style.SUCCESS("Batch ingestion report"))
+        self.stdout.write(
+            f"  entries: {len(entries)}  completed: {len(completed)} ({len(processed)} this run)  failed: {len(failed)}"
+        )
+        for stage in ('extract', 'overview', 'backlog'):
+            if stage in timings:
+                self.stdout.write(f"  {stage}: {timings[stage]:.1f}s")
+        self.stdout.write(f"  total: {timings['total']:.1f}s")
+        self.stdout.write(f"  throughput: {len(processed) / total * 60:.2f} proposals/min, {pages / total:.2f} pages/s")
+        self.stdout.write(f"  generated tokens: {int(generated_tokens)} ({generated_tokens / total:.1f} tokens/s)")
+        if final_stage == DONE:
+            self.stdout.write(f"  backlog tasks: {sum(s.get('tasks', 0) for s in completed)}")
+        for state in failed:
+            self.stdout.write(self.style.WARNING(f"  failed: {state['pdf']} ({state.get('failed_stage')}): {state.get('error')}"))
+        self.stdout.write(f"  checkpoint: {self.checkpoint_path}")
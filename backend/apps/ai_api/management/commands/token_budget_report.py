@@ -0,0 +1,70 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from apps.ai_api.models import SectionTokenStats
+from apps.ai_api.persistence import TOKEN_STATS_FIELDS
+from llms import token_budget
+
+
+class Command(BaseCommand):
+    help = (
+        'Report the recorded generation lengths per pipeline section and model, '
+        'and the max_new_tokens budget learned from them'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--pipeline',
+            choices=['project', 'backlog'],
+            help='Only report one pipeline'
+        )
+        parser.add_argument(
+            '--json',
+            action='store_true',
+            help='Print the report as JSON'
+        )
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help='Delete the recorded stats (after reporting them), so budgets start again from the static limits'
+        )
+
+    def handle(self, *args, **options):
+        stats = SectionTokenStats.objects.order_by('pipeline', 'section', 'model')
+        if options['pipeline']:
+            stats = stats.filter(pipeline=options['pipeline'])
+        rows = list(stats.values('pipeline', 'section', 'model', *TOKEN_STATS_FIELDS[:-1]))
+        report = token_budget.budgets.report(rows)
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        elif not report:
+            self.stdout.write(self.style.WARNING('No generation stats recorded yet.'))
+        else:
+            self.print_table(report)
+
+        if options['reset']:
+            deleted, _ = stats.delete()
+            self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} stats rows.'))
+
+    def print_table(self, report):
+        self.stdout.write(
+            f"{'pipeline.section':<26} {'model':<12} {'attempts':>8} {'samples':>7} {'success':>8} "
+            f"{'trunc':>6} {'p50':>5} {'p95':>5} {'max':>5} {'static':>6} {'budget':>6}"
+        )
+        for row in report:
+            learned = row['samples'] >= token_budget.budgets.min_samples
+            self.stdout.write(
+                f"{row['pipeline'] + '.' + row['section']:<26} {row['model'] or '-':<12} {row['attempts']:>8} "
+                f"{row['samples']:>7} {self.percent(row['success_rate']):>8} {self.percent(row['truncation_rate']):>6} "
+                f"{self.value(row['p50']):>5} {self.value(row['p95']):>5} {self.value(row['max']):>5} "
+                f"{self.value(row['default_tokens']):>6} {self.value(row['budget']):>6}"
+                + ('' if learned else '  (static until enough samples)')
+            )
+
+    def percent(self, value):
+        return '-' if value is None else f'{value:.0%}'
+
+    def value(self, value):
+        return '-' if value is None else str(value)
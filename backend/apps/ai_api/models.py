@@ -37,6 +37,11 @@ class Proposal(models.Model):
     parsed_text = models.TextField(blank=True, null=True)
     uploaded_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    # Per-page text and content hashes, used to detect which pages a revision changed
+    page_texts = models.JSONField(default=list, blank=True)
+    page_hashes = models.JSONField(default=list, blank=True)
+    # Raw LLM output per section keyed by the hash of its prompt: {section: {"input_hash", "raw"}}
+    section_outputs = models.JSONField(default=dict, blank=True)
 
 
 # LLM Enrichment: Project-level structures
@@ -147,6 +152,27 @@ class StoryTask(models.Model):
             self.user_story.check_and_update_completion()
 
 
+# Observed generation lengths per section and model, behind llms.token_budget
+class SectionTokenStats(models.Model):
+    pipeline = models.CharField(max_length=50)
+    section = models.CharField(max_length=50)
+    model = models.CharField(max_length=100, blank=True)
+    # Recent history, oldest first: generated tokens of valid answers and per-attempt truncation flags
+    lengths = models.JSONField(default=list, blank=True)
+    truncated = models.JSONField(default=list, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    successes = models.PositiveIntegerField(default=0)
+    truncations = models.PositiveIntegerField(default=0)
+    max_tokens = models.PositiveIntegerField(default=0)      # limit used by the latest attempt
+    default_tokens = models.PositiveIntegerField(default=0)  # static limit the learned budget replaces
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['pipeline', 'section', 'model'], name='unique_section_token_stats'),
+        ]
+
+
 class ProjectMember(models.Model):
     project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='members')
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='project_memberships')
@@ -0,0 +1,174 @@
+"""
+Bulk persistence of LLM output.
+
+The overview (features, roles, goals, timeline) and backlog (epic tree) of
+one or many projects are written with one bulk insert per table level
+instead of one INSERT per row. Limits match what the ingest and backlog
+endpoints have always stored. The learned generation budgets of
+``llms.token_budget`` are kept in ``SectionTokenStats``; every worker merges
+what it recorded into the shared rows rather than writing its own view.
+"""
+import threading
+from typing import Dict, Iterable, List, Tuple
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from llms import token_budget
+from .models import (
+    Project, ProjectFeature, ProjectRole, ProjectGoal, TimelineWeek, TimelineItem,
+    Epic, SubEpic, UserStory, StoryTask, SectionTokenStats,
+)
+
+MAX_FEATURES = 10
+MAX_ROLES = 20
+MAX_GOALS = 20
+MAX_WEEKS = 12
+MAX_WEEK_ITEMS = 20
+MAX_EPICS = 20
+MAX_SUB_EPICS = 20
+MAX_USER_STORIES = 20
+MAX_TASKS = 50
+
+
+@transaction.atomic
+def persist_overviews(items: Iterable[Tuple[Project, Dict]]):
+    """Replace the features, roles, goals and timeline of each project with ``output`` (model_to_dict format)."""
+    items = list(items)
+    project_ids = [project.id for project, _ in items]
+    ProjectFeature.objects.filter(project_id__in=project_ids).delete()
+    ProjectRole.objects.filter(project_id__in=project_ids).delete()
+    ProjectGoal.objects.filter(project_id__in=project_ids).delete()
+    TimelineWeek.objects.filter(project_id__in=project_ids).delete()
+
+    features, roles, goals, weeks, week_goals = [], [], [], [], []
+    for project, output in items:
+        features += [ProjectFeature(project=project, title=str(feat)[:512]) for feat in output.get("features", [])[:MAX_FEATURES]]
+        roles += [ProjectRole(project=project, role=str(role)[:255]) for role in output.get("roles", [])[:MAX_ROLES]]
+        goals += [
+            ProjectGoal(project=project, title=str(g.get("title", ""))[:512], role=(g.get("role") or "")[:255])
+            for g in output.get("goals", [])[:MAX_GOALS]
+        ]
+        for week in output.get("timeline", [])[:MAX_WEEKS]:
+            weeks.append(TimelineWeek(project=project, week_number=int(week.get("week_number", 0) or 0)))
+            week_goals.append(week.get("goals", [])[:MAX_WEEK_ITEMS])
+
+    ProjectFeature.objects.bulk_create(features)
+    ProjectRole.objects.bulk_create(roles)
+    ProjectGoal.objects.bulk_create(goals)
+    TimelineWeek.objects.bulk_create(weeks)
+    TimelineItem.objects.bulk_create([
+        TimelineItem(week=week, title=str(item)[:512])
+        for week, titles in zip(weeks, week_goals) for item in titles
+    ])
+
+
+def persist_overview(project: Project, output: Dict):
+    persist_overviews([(project, output)])
+
+
+@transaction.atomic
+def persist_backlogs(items: Iterable[Tuple[Project, object]]) -> List[int]:
+    """
+    Replace the AI-generated epics of each project with ``backlog_model``'s
+    epic tree. Returns the number of tasks created per project.
+    """
+    items = list(items)
+    Epic.objects.filter(project_id__in=[project.id for project, _ in items], ai=True).delete()
+
+    epics, epic_sources = [], []
+    for project, backlog_model in items:
+        for epic in backlog_model.epics[:MAX_EPICS]:
+            epics.append(Epic(project=project, title=str(epic.title)[:512], description=getattr(epic, "description", "")))
+            epic_sources.append(epic)
+    Epic.objects.bulk_create(epics)
+
+    sub_epics, sub_sources = [], []
+    for e, epic in zip(epics, epic_sources):
+        for sub in epic.sub_epics[:MAX_SUB_EPICS]:
+            sub_epics.append(SubEpic(epic=e, title=str(sub.title)[:512]))
+            sub_sources.append(sub)
+    SubEpic.objects.bulk_create(sub_epics)
+
+    stories, story_sources = [], []
+    for se, sub in zip(sub_epics, sub_sources):
+        for us in sub.user_stories[:MAX_USER_STORIES]:
+            stories.append(UserStory(sub_epic=se, title=str(us.title)[:512]))
+            story_sources.append(us)
+    UserStory.objects.bulk_create(stories)
+
+    tasks = [
+        StoryTask(user_story=u, title=str(t.title)[:512])
+        for u, us in zip(stories, story_sources) for t in us.tasks[:MAX_TASKS]
+    ]
+    StoryTask.objects.bulk_create(tasks)
+
+    counts = {project.id: 0 for project, _ in items}
+    for task in tasks:
+        counts[task.user_story.sub_epic.epic.project_id] += 1
+    return [counts[project.id] for project, _ in items]
+
+
+def persist_backlog(project: Project, backlog_model) -> int:
+    return persist_backlogs([(project, backlog_model)])[0]
+
+
+TOKEN_STATS_FIELDS = [
+    'lengths', 'truncated', 'attempts', 'successes', 'truncations', 'max_tokens', 'default_tokens', 'updated_at',
+]
+_token_stats_loaded = False
+_token_stats_lock = threading.Lock()
+
+
+def load_token_stats(force: bool = False):
+    """Seed ``token_budget.budgets`` from the database, once per process."""
+    global _token_stats_loaded
+    with _token_stats_lock:
+        if _token_stats_loaded and not force:
+            return
+        token_budget.budgets.load(SectionTokenStats.objects.values(
+            'pipeline', 'section', 'model', *TOKEN_STATS_FIELDS[:-1],
+        ))
+        _token_stats_loaded = True
+
+
+def save_token_stats() -> int:
+    """
+    Merge the attempts recorded since the last save into the stored histories;
+    returns the number of rows written. Rows are locked while new samples are
+    appended and counters incremented, so concurrent workers add up instead of
+    overwriting each other.
+    """
+    deltas = token_budget.budgets.take_deltas()
+    if not deltas:
+        return 0
+    try:
+        with transaction.atomic():
+            SectionTokenStats.objects.bulk_create([
+                SectionTokenStats(pipeline=d['pipeline'], section=d['section'], model=d['model']) for d in deltas
+            ], ignore_conflicts=True)
+            keys = Q()
+            for d in deltas:
+                keys |= Q(pipeline=d['pipeline'], section=d['section'], model=d['model'])
+            stored = {
+                (row.pipeline, row.section, row.model): row
+                for row in SectionTokenStats.objects.select_for_update().filter(keys)
+            }
+            window = token_budget.budgets.window
+            now = timezone.now()
+            for d in deltas:
+                row = stored[(d['pipeline'], d['section'], d['model'])]
+                row.lengths = (list(row.lengths) + d['lengths'])[-window:]
+                row.truncated = (list(row.truncated) + d['truncated'])[-window:]
+                row.attempts += d['attempts']
+                row.successes += d['successes']
+                row.truncations += d['truncations']
+                row.max_tokens = d['max_tokens'] or row.max_tokens
+                row.default_tokens = d['default_tokens'] or row.default_tokens
+                row.updated_at = now
+            SectionTokenStats.objects.bulk_update(list(stored.values()), TOKEN_STATS_FIELDS)
+    except Exception:
+        token_budget.budgets.requeue(deltas)
+        raise
+    return len(deltas)
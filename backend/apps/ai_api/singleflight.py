@@ -0,0 +1,204 @@
+import hashlib
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+from llms import telemetry
+
+logger = logging.getLogger('apps.ai_api')
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+IDEMPOTENCY_TTL_SECONDS = 60 * 60  # replay window for client retries
+RESULT_LINGER_SECONDS = 10  # duplicates arriving right after completion share the result
+FLIGHT_RETAIN_SECONDS = 60 * 60  # background flights stay pollable by id
+
+
+@dataclass
+class _Flight:
+    done: threading.Event = field(default_factory=threading.Event)
+    result: Any = None
+    error: Optional[BaseException] = None
+    waiters: int = 0
+    finished_at: Optional[float] = None
+    flight_id: Optional[str] = None  # set for background flights, see SingleFlight.start
+    info: Dict[str, Any] = field(default_factory=dict)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller runs the
+    function, duplicates block until it finishes and receive the same result
+    (or the same exception). Results linger for ``linger_seconds`` so a
+    double-tap that is dispatched just after the first request completes is
+    also served without re-running the job, unless ``cacheable(result)`` is
+    false. Process-local.
+
+    ``start`` is the non-blocking form: the function runs on a worker thread
+    and callers get the flight, which can be waited on or looked up by its
+    ``flight_id`` until ``retain_seconds`` after it finished.
+    """
+
+    def __init__(self, linger_seconds: float = RESULT_LINGER_SECONDS, max_workers: int = 32,
+                 retain_seconds: float = FLIGHT_RETAIN_SECONDS):
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._by_id: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.linger_seconds = linger_seconds
+        self.max_workers = max_workers
+        self.retain_seconds = retain_seconds
+
+    def do(self, key: Hashable, fn: Callable[[], Any],
+           cacheable: Optional[Callable[[Any], bool]] = None) -> Tuple[Any, bool]:
+        """Run ``fn`` once per key. Returns (result, shared) where ``shared`` is True for duplicates."""
+        flight, leader = self._join(key)
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+        self._run(key, flight, fn, cacheable)
+        if flight.error is not None:
+            raise flight.error
+        return flight.result, False
+
+    def start(self, key: Hashable, fn: Callable[[], Any], prepare: Optional[Callable[[], Any]] = None,
+              cacheable: Optional[Callable[[Any], bool]] = None, background: bool = True,
+              info: Optional[Dict[str, Any]] = None) -> Tuple[_Flight, bool]:
+        """
+        Like ``do`` without waiting: returns (flight, shared) once ``fn`` is
+        scheduled. ``prepare`` runs first on the caller's thread; if it
+        raises, the flight fails with that error and it is re-raised here.
+        With ``background=False`` the function runs before this returns.
+        """
+        flight, leader = self._join(key)
+        if not leader:
+            return flight, True
+
+        flight.flight_id = uuid.uuid4().hex
+        if info is not None:
+            flight.info = info
+        if prepare is not None:
+            try:
+                prepare()
+            except BaseException as e:
+                self._finish(key, flight, error=e)
+                raise
+        with self._lock:
+            self._by_id[flight.flight_id] = flight
+            if background and self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='singleflight')
+        if background:
+            self._executor.submit(self._run, key, flight, fn, cacheable)
+        else:
+            self._run(key, flight, fn, cacheable)
+        return flight, False
+
+    def get(self, flight_id: str) -> Optional[_Flight]:
+        """A flight from ``start`` by its id, while running and ``retain_seconds`` after."""
+        with self._lock:
+            self._expire()
+            return self._by_id.get(flight_id)
+
+    def _join(self, key) -> Tuple[_Flight, bool]:
+        """Attach to the flight for ``key``, or create it; returns (flight, leader)."""
+        with self._lock:
+            self._expire()
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.waiters += 1
+                leader = False
+            else:
+                flight = self._flights[key] = _Flight()
+                leader = True
+        if not leader:
+            logger.info(f"[SingleFlight] Attaching to in-flight job {key}")
+        telemetry.registry.record_cache("singleflight", not leader)
+        return flight, leader
+
+    def _run(self, key, flight: _Flight, fn, cacheable):
+        try:
+            result = fn()
+        except BaseException as e:
+            if flight.flight_id is not None:
+                logger.error(f"[SingleFlight] Background job {key} failed: {e}")
+            self._finish(key, flight, error=e)
+            return
+        self._finish(key, flight, result=result, keep=cacheable is None or cacheable(result))
+
+    def _finish(self, key, flight: _Flight, result=None, error=None, keep=True):
+        flight.result, flight.error = result, error
+        flight.finished_at = time.monotonic()
+        if error is not None or not keep:
+            # Failures are not cached: current waiters share them, the next caller retries
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+        flight.done.set()
+
+    def in_flight(self, key: Hashable) -> bool:
+        with self._lock:
+            flight = self._flights.get(key)
+            return flight is not None and not flight.done.is_set()
+
+    def forget(self, key: Hashable):
+        with self._lock:
+            self._flights.pop(key, None)
+
+    def _expire(self):
+        now = time.monotonic()
+        expired = [
+            key for key, flight in self._flights.items()
+            if flight.finished_at is not None and now - flight.finished_at >= self.linger_seconds
+        ]
+        for key in expired:
+            del self._flights[key]
+        retired = [
+            flight_id for flight_id, flight in self._by_id.items()
+            if flight.finished_at is not None and now - flight.finished_at >= self.retain_seconds
+        ]
+        for flight_id in retired:
+            del self._by_id[flight_id]
+
+
+# Global instance for the LLM endpoints: one worker per job the admission queue can hold
+llm_jobs = SingleFlight(
+    max_workers=getattr(settings, 'LLM_MAX_QUEUE', 16) + getattr(settings, 'LLM_MAX_CONCURRENCY', 1),
+)
+
+
+def proposal_version(proposal) -> str:
+    """Short content hash identifying the proposal text a job was run against."""
+    text = proposal.parsed_text or ""
+    return f"{proposal.id}:{hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]}"
+
+
+def idempotency_cache_key(user_id, project_id, operation: str, key: str) -> str:
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return f"ai_api:idempotency:{user_id}:{project_id}:{operation}:{digest}"
+
+
+def get_idempotent_response(cache_key: str) -> Optional[Dict]:
+    """Return the stored {'status', 'data'} for a replayed idempotency key, if any."""
+    stored = cache.get(cache_key)
+    telemetry.registry.record_cache("idempotency", stored is not None)
+    return stored
+
+
+def is_cacheable_response(result) -> bool:
+    """For ``(data, status_code)`` job results: server errors are retried, not shared."""
+    return result[1] < 500
+
+
+def store_idempotent_response(cache_key: str, status_code: int, data):
+    # Server errors are not stored so that a retry can succeed
+    if status_code >= 500:
+        return
+    cache.set(cache_key, {'status': status_code, 'data': data}, IDEMPOTENCY_TTL_SECONDS)
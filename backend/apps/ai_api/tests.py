@@ -1,16 +1,20 @@
-from django.test import TestCase, TransactionTestCase
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.db import connection
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
 from django.contrib.contenttypes.models import ContentType
+from channels.db import database_sync_to_async
 from channels.testing import WebsocketCommunicator
 from channels.layers import get_channel_layer
 from rest_framework.test import APITestCase
 from rest_framework import status
+from unittest import skipUnless
 from unittest.mock import patch, MagicMock
 import json
 from datetime import datetime
 
 from .models import Project, ProjectInvitation, Notification, ProjectMember
-from .consumers import NotificationConsumer
+from .consumers import ProjectUpdatesConsumer
 from core.services.notification_service import NotificationService
 
 User = get_user_model()
@@ -221,10 +225,10 @@ class NotificationServiceTests(TestCase):
         
         # Verify the payload structure
         mock_async_to_sync.assert_called_once()
-        call_args = mock_async_to_sync.call_args[0][0]
+        group_name, group_send_call = mock_async_to_sync.return_value.call_args[0]
         
         # Check the group_send call
-        group_send_call = call_args
+        self.assertEqual(group_name, f'user_{self.user.user_id}_notifications')
         self.assertEqual(group_send_call['type'], 'notification_message')
         
         payload = group_send_call['notification']
@@ -380,7 +384,7 @@ class ProjectInvitationNotificationTests(APITestCase):
         
         response = self.client.post('/api/ai/invitations/', {
             'project': self.project.id,
-            'invitee': self.invitee.id,
+            'invitee': self.invitee.pk,
             'message': 'Join our project!'
         })
         
@@ -406,7 +410,7 @@ class ProjectInvitationNotificationTests(APITestCase):
         
         self.client.post('/api/ai/invitations/', {
             'project': self.project.id,
-            'invitee': self.invitee.id,
+            'invitee': self.invitee.pk,
             'message': 'Join our project!'
         })
         
@@ -419,7 +423,7 @@ class ProjectInvitationNotificationTests(APITestCase):
         
         self.client.post('/api/ai/invitations/', {
             'project': self.project.id,
-            'invitee': self.invitee.id,
+            'invitee': self.invitee.pk,
             'message': 'Join our project!'
         })
         
@@ -432,7 +436,7 @@ class ProjectInvitationNotificationTests(APITestCase):
         
         self.client.post('/api/ai/invitations/', {
             'project': self.project.id,
-            'invitee': self.invitee.id,
+            'invitee': self.invitee.pk,
             'message': 'Join our project!'
         })
         
@@ -445,7 +449,7 @@ class ProjectInvitationNotificationTests(APITestCase):
         
         self.client.post('/api/ai/invitations/', {
             'project': self.project.id,
-            'invitee': self.invitee.id,
+            'invitee': self.invitee.pk,
             'message': 'Join our project!'
         })
         
@@ -458,13 +462,12 @@ class ProjectInvitationNotificationTests(APITestCase):
         
         self.client.post('/api/ai/invitations/', {
             'project': self.project.id,
-            'invitee': self.invitee.id,
+            'invitee': self.invitee.pk,
             'message': 'Join our project!'
         })
         
         notification = Notification.objects.filter(recipient=self.invitee).first()
-        expected_url = f'/projects/{self.project.id}/invitations'
-        self.assertEqual(notification.action_url, expected_url)
+        self.assertEqual(notification.action_url, '/project-invitation')
     
     def test_notification_linked_to_invitation_via_generic_fk(self):
         """Test notification linked to invitation via generic FK"""
@@ -472,7 +475,7 @@ class ProjectInvitationNotificationTests(APITestCase):
         
         response = self.client.post('/api/ai/invitations/', {
             'project': self.project.id,
-            'invitee': self.invitee.id,
+            'invitee': self.invitee.pk,
             'message': 'Join our project!'
         })
         
@@ -502,7 +505,8 @@ class NotificationWebSocketTests(TransactionTestCase):
     
     async def test_websocket_connection_requires_authentication(self):
         """Test WebSocket connection requires authentication"""
-        communicator = WebsocketCommunicator(NotificationConsumer.as_asgi(), "/ws/notifications/")
+        communicator = WebsocketCommunicator(ProjectUpdatesConsumer.as_asgi(), "/ws/project-updates/")
+        communicator.scope["user"] = AnonymousUser()
         connected, subprotocol = await communicator.connect()
         
         # Should be rejected due to no authentication
@@ -510,11 +514,12 @@ class NotificationWebSocketTests(TransactionTestCase):
     
     async def test_authenticated_user_joins_correct_channel_group(self):
         """Test authenticated user joins correct channel group"""
-        communicator = WebsocketCommunicator(NotificationConsumer.as_asgi(), "/ws/notifications/")
+        communicator = WebsocketCommunicator(ProjectUpdatesConsumer.as_asgi(), "/ws/project-updates/")
         communicator.scope["user"] = self.user
         
         connected, subprotocol = await communicator.connect()
         self.assertTrue(connected)
+        self.assertEqual((await communicator.receive_json_from())['type'], 'connected')
         
         # Test that user is in the correct group
         channel_layer = get_channel_layer()
@@ -541,14 +546,15 @@ class NotificationWebSocketTests(TransactionTestCase):
     
     async def test_notification_delivery_through_websocket(self):
         """Test notification delivery through WebSocket"""
-        communicator = WebsocketCommunicator(NotificationConsumer.as_asgi(), "/ws/notifications/")
+        communicator = WebsocketCommunicator(ProjectUpdatesConsumer.as_asgi(), "/ws/project-updates/")
         communicator.scope["user"] = self.user
         
         connected, subprotocol = await communicator.connect()
         self.assertTrue(connected)
+        self.assertEqual((await communicator.receive_json_from())['type'], 'connected')
         
         # Create a notification
-        notification = Notification.objects.create(
+        notification = await database_sync_to_async(Notification.objects.create)(
             recipient=self.user,
             notification_type='project_invitation',
             title='Test Notification',
@@ -586,11 +592,12 @@ class NotificationWebSocketTests(TransactionTestCase):
     
     async def test_websocket_message_format_matches_expected_structure(self):
         """Test WebSocket message format matches expected structure"""
-        communicator = WebsocketCommunicator(NotificationConsumer.as_asgi(), "/ws/notifications/")
+        communicator = WebsocketCommunicator(ProjectUpdatesConsumer.as_asgi(), "/ws/project-updates/")
         communicator.scope["user"] = self.user
         
         connected, subprotocol = await communicator.connect()
         self.assertTrue(connected)
+        self.assertEqual((await communicator.receive_json_from())['type'], 'connected')
         
         # Send test message with expected structure
         channel_layer = get_channel_layer()
@@ -629,10 +636,10 @@ class NotificationWebSocketTests(TransactionTestCase):
     async def test_multiple_users_receive_only_their_notifications(self):
         """Test multiple users receive only their own notifications"""
         # Connect two users
-        communicator1 = WebsocketCommunicator(NotificationConsumer.as_asgi(), "/ws/notifications/")
+        communicator1 = WebsocketCommunicator(ProjectUpdatesConsumer.as_asgi(), "/ws/project-updates/")
         communicator1.scope["user"] = self.user
         
-        communicator2 = WebsocketCommunicator(NotificationConsumer.as_asgi(), "/ws/notifications/")
+        communicator2 = WebsocketCommunicator(ProjectUpdatesConsumer.as_asgi(), "/ws/project-updates/")
         communicator2.scope["user"] = self.other_user
         
         connected1, _ = await communicator1.connect()
@@ -640,6 +647,8 @@ class NotificationWebSocketTests(TransactionTestCase):
         
         self.assertTrue(connected1)
         self.assertTrue(connected2)
+        self.assertEqual((await communicator1.receive_json_from())['type'], 'connected')
+        self.assertEqual((await communicator2.receive_json_from())['type'], 'connected')
         
         # Send notification to user1 only
         channel_layer = get_channel_layer()
@@ -662,22 +671,19 @@ class NotificationWebSocketTests(TransactionTestCase):
         self.assertEqual(response1['notification']['title'], 'User1 Notification')
         
         # User2 should not receive anything (with timeout)
-        try:
-            await communicator2.receive_json_from(timeout=0.1)
-            self.fail("User2 should not have received a notification")
-        except:
-            pass  # Expected - no message for user2
+        self.assertTrue(await communicator2.receive_nothing(timeout=0.1))
         
         await communicator1.disconnect()
         await communicator2.disconnect()
     
     async def test_disconnect_cleanup(self):
         """Test disconnect cleanup removes user from channel group"""
-        communicator = WebsocketCommunicator(NotificationConsumer.as_asgi(), "/ws/notifications/")
+        communicator = WebsocketCommunicator(ProjectUpdatesConsumer.as_asgi(), "/ws/project-updates/")
         communicator.scope["user"] = self.user
         
         connected, subprotocol = await communicator.connect()
         self.assertTrue(connected)
+        self.assertEqual((await communicator.receive_json_from())['type'], 'connected')
         
         # Disconnect
         await communicator.disconnect()
@@ -698,3 +704,619 @@ class NotificationWebSocketTests(TransactionTestCase):
                 'is_read': False
             }
         })
+
+
+class SingleFlightTests(TestCase):
+    """Test coalescing of duplicate LLM jobs"""
+
+    def test_concurrent_duplicates_share_one_run(self):
+        import threading
+        from .singleflight import SingleFlight
+
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        runs = []
+
+        def job():
+            runs.append(1)
+            started.set()
+            release.wait(5)
+            return {'backlog': 'result'}
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(flight.do(('p', 'backlog'), job)))
+        leader.start()
+        started.wait(5)
+        follower = threading.Thread(target=lambda: results.append(flight.do(('p', 'backlog'), job)))
+        follower.start()
+        while not flight._flights[('p', 'backlog')].waiters:
+            pass
+        release.set()
+        leader.join(5)
+        follower.join(5)
+
+        self.assertEqual(len(runs), 1)
+        self.assertEqual(sorted(shared for _, shared in results), [False, True])
+        self.assertTrue(all(result == {'backlog': 'result'} for result, _ in results))
+
+    def test_failures_are_not_cached(self):
+        from .singleflight import SingleFlight
+
+        flight = SingleFlight()
+
+        def failing():
+            raise RuntimeError('model crashed')
+
+        with self.assertRaises(RuntimeError):
+            flight.do('key', failing)
+        self.assertEqual(flight.do('key', lambda: 'ok'), ('ok', False))
+
+    def test_results_linger_for_late_duplicates(self):
+        from .singleflight import SingleFlight
+
+        flight = SingleFlight(linger_seconds=60)
+        flight.do('key', lambda: 'first')
+        self.assertEqual(flight.do('key', lambda: 'second'), ('first', True))
+        flight.linger_seconds = 0
+        self.assertEqual(flight.do('key', lambda: 'third'), ('third', False))
+
+    def test_server_errors_do_not_linger(self):
+        from .singleflight import SingleFlight, is_cacheable_response
+
+        flight = SingleFlight(linger_seconds=60)
+        failed = ({'error': 'Analysis failed'}, 500)
+        self.assertEqual(flight.do('key', lambda: failed, cacheable=is_cacheable_response), (failed, False))
+        ok = ({'message': 'done'}, 200)
+        self.assertEqual(flight.do('key', lambda: ok, cacheable=is_cacheable_response), (ok, False))
+        self.assertEqual(flight.do('key', lambda: failed, cacheable=is_cacheable_response), (ok, True))
+
+
+@override_settings(LLM_JOBS_IN_BACKGROUND=False)
+class IdempotentLLMEndpointTests(APITestCase):
+    """Test Idempotency-Key replay on the LLM endpoints"""
+
+    def setUp(self):
+        from django.core.cache import cache
+        from .models import Proposal
+        from .singleflight import llm_jobs
+        from llms.fake_llm import synthetic_proposal
+
+        cache.clear()
+        llm_jobs.linger_seconds = 0
+        self.user = User.objects.create_user(email='owner@example.com', name='Owner', password='testpass123')
+        self.project = Project.objects.create(title='Crew', created_by=self.user)
+        ProjectMember.objects.create(project=self.project, user=self.user, role='Owner')
+        Proposal.objects.create(
+            project=self.project, file='proposals/p.pdf', parsed_text=synthetic_proposal('small'), uploaded_by=self.user
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def tearDown(self):
+        from .singleflight import llm_jobs, RESULT_LINGER_SECONDS
+        llm_jobs.linger_seconds = RESULT_LINGER_SECONDS
+
+    def test_retry_with_same_key_replays_response(self):
+        from llms.fake_llm import FakeLLM, synthetic_recordings
+        from llms.llm_cache import override_llm
+
+        fake = FakeLLM(synthetic_recordings('small'))
+        url = f'/api/ai/projects/{self.project.id}/generate-backlog/'
+        with override_llm(fake):
+            first = self.client.put(url, HTTP_IDEMPOTENCY_KEY='abc')
+            calls = len(fake.calls)
+            retry = self.client.put(url, HTTP_IDEMPOTENCY_KEY='abc')
+            fresh = self.client.put(url, HTTP_IDEMPOTENCY_KEY='def')
+
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual(retry.status_code, status.HTTP_200_OK)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(len(fake.calls), calls * 2)
+        self.assertEqual(fresh.status_code, status.HTTP_200_OK)
+
+
+class AdmissionControllerTests(TestCase):
+    """Test the bounded, fair LLM work queue"""
+
+    def make_controller(self, **kwargs):
+        from .admission import AdmissionController
+        options = {'max_concurrency': 1, 'max_queue': 10, 'max_per_user': 5, 'max_wait_seconds': 1000}
+        options.update(kwargs)
+        return AdmissionController(**options)
+
+    def test_round_robin_across_projects_and_priorities(self):
+        from .admission import Priority
+
+        controller = self.make_controller()
+        running = controller.submit(1, 1, 'generate_backlog')
+        self.assertTrue(running.granted.is_set())
+
+        a1 = controller.submit(1, 1, 'generate_backlog')
+        a2 = controller.submit(2, 1, 'generate_backlog')
+        batch = controller.submit(3, 3, 'ingest_proposal', Priority.BATCH)
+        b1 = controller.submit(4, 2, 'generate_backlog')
+
+        order = [job['ticket_id'] for job in controller.snapshot()['jobs']]
+        self.assertEqual(order, [a1.ticket_id, b1.ticket_id, a2.ticket_id, batch.ticket_id])
+
+        granted = []
+        for ticket in (running, a1, b1, a2):
+            controller.release(ticket)
+            granted.append(next(t for t in (a1, a2, b1, batch) if t.granted.is_set() and t not in granted))
+        self.assertEqual(granted, [a1, b1, a2, batch])
+
+    def test_rejects_when_estimated_wait_is_too_long(self):
+        from .admission import AdmissionRejected
+
+        controller = self.make_controller(max_wait_seconds=100)
+        controller.submit(1, 1, 'generate_backlog')  # running, ~90s estimate
+        controller.submit(2, 2, 'generate_backlog')  # waits ~90s
+        with self.assertRaises(AdmissionRejected) as ctx:
+            controller.submit(3, 3, 'generate_backlog')  # would wait ~180s
+        self.assertGreaterEqual(ctx.exception.retry_after, 100)
+        self.assertEqual(controller.snapshot()['rejected'], 1)
+
+    def test_per_user_queue_limit(self):
+        from .admission import AdmissionRejected
+
+        controller = self.make_controller(max_per_user=1)
+        controller.submit(1, 1, 'generate_overview')
+        controller.submit(1, 2, 'generate_overview')
+        with self.assertRaises(AdmissionRejected):
+            controller.submit(1, 3, 'generate_overview')
+
+    def test_release_updates_service_time_estimate(self):
+        controller = self.make_controller()
+        ticket = controller.submit(1, 1, 'generate_overview')
+        ticket.started_at -= 10
+        controller.release(ticket)
+        self.assertAlmostEqual(controller.snapshot()['service_seconds']['generate_overview'], 45.0, delta=0.5)
+
+    def test_wait_timeout_withdraws_ticket_and_publishes_positions(self):
+        from .admission import AdmissionRejected
+
+        controller = self.make_controller()
+        controller.submit(1, 1, 'generate_backlog')
+        updates = []
+        first = controller.submit(2, 2, 'generate_backlog', on_update=lambda t, pos, eta: updates.append(('first', pos)))
+        controller.submit(3, 3, 'generate_backlog', on_update=lambda t, pos, eta: updates.append(('second', pos)))
+        self.assertIn(('second', 2), updates)
+
+        with self.assertRaises(AdmissionRejected):
+            controller.wait(first, timeout=0.01)
+        self.assertEqual(updates[-1], ('second', 1))
+        self.assertEqual(controller.snapshot()['queued'], 1)
+
+
+@override_settings(LLM_JOBS_IN_BACKGROUND=True)
+class BackgroundLLMJobTests(TransactionTestCase):
+    """Test LLM jobs queued from real requests and run on worker threads"""
+
+    def setUp(self):
+        import threading
+        from rest_framework.test import APIClient
+        from .admission import AdmissionController
+        from .models import Proposal
+        from .singleflight import llm_jobs
+
+        llm_jobs.linger_seconds = 0
+        self.controller = AdmissionController(max_concurrency=1, max_queue=3, max_per_user=5, max_wait_seconds=10000)
+        self.release = threading.Event()
+        self.ran = []
+        self.clients = {}
+        self.projects = {}
+        for name in ('a', 'b'):
+            user = User.objects.create_user(email=f'{name}@example.com', name=name.upper(), password='testpass123')
+            project = Project.objects.create(title=f'Project {name}', created_by=user)
+            ProjectMember.objects.create(project=project, user=user, role='Owner')
+            proposal = Proposal.objects.create(
+                project=project, file='proposals/p.pdf', parsed_text='Crew roster app', uploaded_by=user
+            )
+            client = APIClient()
+            client.force_authenticate(user=user)
+            self.clients[name], self.projects[name] = client, (project, proposal)
+
+    def tearDown(self):
+        from .singleflight import llm_jobs, RESULT_LINGER_SECONDS
+        self.release.set()
+        llm_jobs.linger_seconds = RESULT_LINGER_SECONDS
+
+    def blocking_job(self, operation):
+        def job(view, project, proposal, *args):
+            self.ran.append((project.title, operation))
+            self.release.wait(10)
+            return {'operation': operation}, status.HTTP_200_OK
+        return job
+
+    def start(self, name, operation):
+        project, proposal = self.projects[name]
+        path = {
+            'generate_overview': f'/api/ai/projects/{project.id}/generate-overview/',
+            'generate_backlog': f'/api/ai/projects/{project.id}/generate-backlog/',
+            'ingest_proposal': f'/api/ai/projects/{project.id}/ingest-proposal/{proposal.id}/',
+        }[operation]
+        return self.clients[name].put(path, HTTP_PREFER='respond-async')
+
+    def poll(self, name, response, timeout=10):
+        import time
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.clients[name].get(response['Location']).json()
+            if job['status'] not in ('queued', 'running') or time.monotonic() > deadline:
+                return job
+            time.sleep(0.01)
+
+    def test_queued_jobs_return_at_once_and_run_fairly(self):
+        from .views import ProjectViewSet
+
+        with patch('apps.ai_api.views.llm_admission', self.controller), \
+                patch.object(ProjectViewSet, '_generate_overview_job', self.blocking_job('generate_overview')), \
+                patch.object(ProjectViewSet, '_generate_backlog_job', self.blocking_job('generate_backlog')), \
+                patch.object(ProjectViewSet, '_ingest_proposal_job', self.blocking_job('ingest_proposal')):
+            a_overview = self.start('a', 'generate_overview')
+            a_backlog = self.start('a', 'generate_backlog')
+            a_ingest = self.start('a', 'ingest_proposal')
+            b_overview = self.start('b', 'generate_overview')
+            rejected = self.start('b', 'generate_backlog')
+
+            # Every request returned while the first job still holds the model
+            self.assertEqual(
+                [r.status_code for r in (a_overview, a_backlog, a_ingest, b_overview)], [status.HTTP_202_ACCEPTED] * 4
+            )
+            self.assertEqual(rejected.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertGreaterEqual(int(rejected['Retry-After']), 1)
+            queued = self.clients['b'].get(b_overview['Location']).json()
+            self.assertEqual((queued['status'], queued['position']), ('queued', 2))
+
+            self.release.set()
+            jobs = [self.poll('a', a_overview), self.poll('a', a_backlog),
+                    self.poll('a', a_ingest), self.poll('b', b_overview)]
+
+        self.assertEqual([job['status'] for job in jobs], ['completed'] * 4)
+        self.assertEqual(jobs[1]['result'], {'operation': 'generate_backlog'})
+        # Project b's job goes ahead of project a's third
+        self.assertEqual(self.ran, [
+            ('Project a', 'generate_overview'), ('Project a', 'generate_backlog'),
+            ('Project b', 'generate_overview'), ('Project a', 'ingest_proposal'),
+        ])
+        self.assertEqual(self.clients['b'].get(a_overview['Location']).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_waiting_request_does_not_block_admission(self):
+        import threading
+        from .views import ProjectViewSet
+
+        responses = {}
+        with patch('apps.ai_api.views.llm_admission', self.controller), \
+                patch.object(ProjectViewSet, '_generate_overview_job', self.blocking_job('generate_overview')), \
+                patch.object(ProjectViewSet, '_generate_backlog_job', self.blocking_job('generate_backlog')):
+            project, _ = self.projects['a']
+            waiting = threading.Thread(target=lambda: responses.setdefault(
+                'sync', self.clients['a'].put(f'/api/ai/projects/{project.id}/generate-overview/')
+            ))
+            waiting.start()
+            while not self.ran:
+                pass
+            responses['async'] = self.start('b', 'generate_backlog')
+            self.release.set()
+            waiting.join(10)
+
+        self.assertEqual(responses['async'].status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(responses['sync'].status_code, status.HTTP_200_OK)
+        self.assertEqual(responses['sync'].json(), {'operation': 'generate_overview'})
+        self.assertEqual(self.poll('b', responses['async'])['status'], 'completed')
+
+
+@override_settings(LLM_JOBS_IN_BACKGROUND=False)
+class IncrementalIngestTests(APITestCase):
+    """Test that re-ingesting a revised proposal only regenerates affected sections"""
+
+    PAGES = [
+        "Crew Operations Platform. Overview and purpose of the project.",
+        "Key feature list: the system will track crew rosters and certifications.",
+        "The team includes a backend developer, a designer and a QA engineer.",
+        "Goals and objectives: reduce paperwork and measure success by adoption.",
+        "Delivery plan: week 1 setup, week 2 build, week 3 test, week 4 launch.",
+    ]
+
+    def setUp(self):
+        from .singleflight import llm_jobs
+        llm_jobs.linger_seconds = 0
+        self.user = User.objects.create_user(email='owner@example.com', name='Owner', password='testpass123')
+        self.project = Project.objects.create(title='Crew', created_by=self.user)
+        ProjectMember.objects.create(project=self.project, user=self.user, role='Owner')
+        self.client.force_authenticate(user=self.user)
+
+    def tearDown(self):
+        from .singleflight import llm_jobs, RESULT_LINGER_SECONDS
+        llm_jobs.linger_seconds = RESULT_LINGER_SECONDS
+
+    def upload(self, pages):
+        from .models import Proposal
+        from llms import incremental
+        return Proposal.objects.create(
+            project=self.project, file='proposals/p.pdf', parsed_text="\n".join(pages),
+            page_texts=pages, page_hashes=incremental.page_hashes(pages), uploaded_by=self.user,
+        )
+
+    def test_revision_reuses_unchanged_sections(self):
+        from llms.fake_llm import FakeLLM, synthetic_recordings
+        from llms.llm_cache import override_llm
+
+        fake = FakeLLM(synthetic_recordings('small'))
+        first = self.upload(self.PAGES)
+        revised_pages = list(self.PAGES)
+        revised_pages[4] = revised_pages[4] + " Week 5 handover."
+        with override_llm(fake):
+            self.client.put(f'/api/ai/projects/{self.project.id}/ingest-proposal/{first.id}/')
+            revised = self.upload(revised_pages)
+            calls = len(fake.calls)
+            response = self.client.put(f'/api/ai/projects/{self.project.id}/ingest-proposal/{revised.id}/')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        report = response.json()['incremental']
+        self.assertEqual(report['changed_pages'], [4])
+        self.assertEqual(report['regenerated_sections'], ['timeline'])
+        self.assertEqual([c['section'] for c in fake.calls[calls:]], ['timeline'])
+        revised.refresh_from_db()
+        self.assertEqual(set(revised.section_outputs), {'summary', 'features', 'roles', 'goals', 'timeline'})
+
+
+class IngestProposalsCommandTests(TestCase):
+    """Test the bulk ingestion command's checkpointing"""
+
+    def setUp(self):
+        import tempfile
+        self.user = User.objects.create_user(email='owner@example.com', name='Owner', password='testpass123')
+        self.directory = tempfile.mkdtemp()
+        self.media = tempfile.mkdtemp()
+        for name, content in (('alpha.pdf', b'alpha'), ('copy-of-alpha.pdf', b'alpha'), ('beta.pdf', b'beta')):
+            with open(f'{self.directory}/{name}', 'wb') as f:
+                f.write(content)
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.directory, ignore_errors=True)
+        shutil.rmtree(self.media, ignore_errors=True)
+
+    def ingest(self, read_pages=None, **options):
+        from io import StringIO
+        from django.core.management import call_command
+        from llms.fake_llm import FakeLLM, synthetic_recordings
+        from llms.llm_cache import override_llm
+        from .management.commands.ingest_proposals import Command
+
+        pages = ['Crew roster app. Overview and purpose of the project.', 'Key feature list: certifications.']
+        with override_settings(MEDIA_ROOT=self.media), override_llm(FakeLLM(synthetic_recordings('small'))), \
+                patch.object(Command, 'read_pages', read_pages or (lambda command, path: pages)):
+            call_command('ingest_proposals', directory=self.directory, owner=self.user.email, skip_backlog=True,
+                         stdout=StringIO(), stderr=StringIO(), **options)
+        with open(f'{self.directory}/.ingest_checkpoint.json') as f:
+            return json.load(f)['items']
+
+    def test_identical_files_become_one_project(self):
+        items = self.ingest()
+
+        self.assertEqual(len(items), 2)
+        self.assertEqual(sorted(state['stage'] for state in items.values()), ['overview', 'overview'])
+        self.assertEqual(Project.objects.filter(created_by=self.user).count(), 2)
+
+    def test_entries_without_committed_rows_are_extracted_again(self):
+        from .models import Proposal
+
+        items = self.ingest()
+        # As if the run died after writing the checkpoint but before the commit
+        lost = next(state for state in items.values() if state['pdf'].endswith('beta.pdf'))
+        Proposal.objects.filter(id=lost['proposal_id']).delete()
+        Project.objects.filter(id=lost['project_id']).delete()
+
+        items = self.ingest()
+
+        self.assertEqual(len(items), 2)
+        self.assertEqual(Project.objects.filter(created_by=self.user).count(), 2)
+        self.assertEqual(Proposal.objects.filter(uploaded_by=self.user).count(), 2)
+        self.assertTrue(all(state['stage'] == 'overview' for state in items.values()))
+
+    def test_retry_failed_extracts_again(self):
+        def corrupt_beta(command, path):
+            if path.endswith('beta.pdf'):
+                return ValueError('No /Root object! - Is this really a PDF?')
+            return ['Crew roster app. Overview and purpose of the project.']
+
+        items = self.ingest(read_pages=corrupt_beta)
+        beta = next(state for state in items.values() if state['pdf'].endswith('beta.pdf'))
+        self.assertEqual((beta['stage'], beta['failed_stage']), ('failed', 'extracted'))
+
+        items = self.ingest(retry_failed=True)
+
+        self.assertEqual(sorted(state['stage'] for state in items.values()), ['overview', 'overview'])
+        self.assertEqual(Project.objects.filter(created_by=self.user).count(), 2)
+
+
+class BenchmarkModelsTests(SimpleTestCase):
+    """Test the model benchmark's scoring and generation settings"""
+
+    def test_padded_epics_do_not_count_towards_completeness(self):
+        from llms.backlog_llm import pad_backlog, target_epic_count
+        from llms.models import BacklogModel, EpicModel, SubEpicModel, UserStoryModel, TaskModel
+        from .management.commands.benchmark_models import Command
+
+        story = UserStoryModel(title='As a crew lead, I can see certifications', tasks=[TaskModel(title='Build list')])
+        epic = EpicModel(title='Epic 1: Certifications', sub_epics=[SubEpicModel(title='Tracking', user_stories=[story])])
+        backlog = pad_backlog(BacklogModel(epics=[epic]))
+        proposal = 'Crew certification tracking'
+
+        self.assertEqual(len(backlog.epics), 4)
+        self.assertEqual(Command().backlog_completeness(backlog, proposal), 1 / target_epic_count(proposal))
+
+    def test_invoke_applies_the_cell_settings(self):
+        from llms.fake_llm import FakeLLM
+        from llms.project_llm import build_section_prompt
+        from .management.commands.benchmark_models import _ConfiguredLLM
+
+        fake = FakeLLM({'summary': 'summary: ' + 'word ' * 200})
+        prompt = build_section_prompt('summary', ['Crew roster app'], {})
+        capped = _ConfiguredLLM(fake, max_new_tokens=16, temperature=0).invoke(prompt)
+
+        self.assertLess(len(capped.split()), len(fake.invoke(prompt).split()))
+
+    def test_cells_run_with_static_token_limits(self):
+        from llms import token_budget
+        from llms.fake_llm import FakeLLM, synthetic_proposal, synthetic_recordings
+        from .management.commands.benchmark_models import Command
+
+        budgets = token_budget.budgets
+        self.assertTrue(budgets.enabled)
+        with patch.object(budgets, '_budget', side_effect=AssertionError("learned budget used")):
+            result = Command().run_cell(
+                FakeLLM(synthetic_recordings('small')), [('small', synthetic_proposal('small'))], {'skip_backlog': True},
+            )
+        self.assertEqual(result['project_completeness'], 1.0)
+        self.assertTrue(budgets.enabled)
+
+
+class BulkPersistenceTests(TestCase):
+    """Test that LLM output for many projects is written with bulk inserts"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='owner@example.com', name='Owner', password='testpass123')
+        self.projects = [Project.objects.create(title=f'Project {i}', created_by=self.user) for i in range(2)]
+
+    def test_overviews_replace_previous_output(self):
+        from .persistence import persist_overviews
+        output = {
+            "features": ["Rosters", "Certifications"],
+            "roles": ["Backend Developer"],
+            "goals": [{"title": "Reduce paperwork", "role": "Backend Developer"}],
+            "timeline": [{"week_number": 1, "goals": ["Setup", "Design"]}, {"week_number": 2, "goals": ["Build"]}],
+        }
+        persist_overviews([(project, output) for project in self.projects])
+        persist_overviews([(self.projects[0], output)])
+
+        for project in self.projects:
+            self.assertEqual(project.features.count(), 2)
+            self.assertEqual(project.timeline_weeks.count(), 2)
+            self.assertEqual(
+                sorted(project.timeline_weeks.values_list('week_number', 'items__title')),
+                [(1, 'Design'), (1, 'Setup'), (2, 'Build')],
+            )
+
+    def test_backlogs_return_task_counts_per_project(self):
+        from .persistence import persist_backlogs
+        from llms.backlog_llm import parse_backlog
+        from llms.fake_llm import synthetic_backlog
+        small = parse_backlog(synthetic_backlog(4, 1, 1, 2))
+        large = parse_backlog(synthetic_backlog(6, 2, 2, 3))
+
+        # Savepoint, delete lookup, one INSERT per level, release
+        with self.assertNumQueries(7):
+            counts = persist_backlogs([(self.projects[0], small), (self.projects[1], large)])
+
+        self.assertEqual(counts, [8, 72])
+        self.assertEqual(self.projects[0].epics.count(), 4)
+        self.assertEqual(self.projects[1].epics.count(), 6)
+
+
+class TokenStatsPersistenceTests(TestCase):
+    def setUp(self):
+        from llms import token_budget
+        self.budgets = token_budget.budgets
+        self.budgets.reset()
+        self.addCleanup(self.budgets.reset)
+
+    def test_learned_budgets_survive_a_restart(self):
+        from .models import SectionTokenStats
+        from .persistence import load_token_stats, save_token_stats
+        for _ in range(self.budgets.min_samples):
+            self.budgets.record("project", "summary", "qwen-0.5b", 50, 256, "ok")
+        learned = self.budgets.limit("project", "summary", "qwen-0.5b", 256)
+        self.assertLess(learned, 256)
+
+        self.assertEqual(save_token_stats(), 1)
+        self.assertEqual(save_token_stats(), 0)  # nothing changed since
+        self.budgets.record("project", "summary", "qwen-0.5b", 256, 256, "invalid")
+        self.assertEqual(save_token_stats(), 1)  # upserted, not duplicated
+        stats = SectionTokenStats.objects.get()
+        self.assertEqual((stats.attempts, stats.successes, stats.truncations), (21, 20, 1))
+
+        self.budgets.reset()
+        load_token_stats(force=True)
+        self.assertGreaterEqual(self.budgets.limit("project", "summary", "qwen-0.5b", 256), learned)
+
+    def test_workers_merge_instead_of_overwriting(self):
+        from .models import SectionTokenStats
+        from .persistence import save_token_stats
+        # Two processes that started before any stats were stored
+        self.budgets.record("backlog", "backlog", "m", 100, 768, "ok")
+        self.budgets.record("backlog", "backlog", "m", 700, 768, "invalid")
+        self.assertEqual(save_token_stats(), 1)
+        self.budgets.reset()
+        self.budgets.record("backlog", "backlog", "m", 200, 768, "ok")
+        self.assertEqual(save_token_stats(), 1)
+
+        stats = SectionTokenStats.objects.get()
+        self.assertEqual((stats.attempts, stats.successes, stats.truncations), (3, 2, 1))
+        self.assertEqual(stats.lengths, [100, 200])
+        self.assertEqual(stats.truncated, [False, True, False])
+
+    def test_failed_save_keeps_the_deltas(self):
+        from unittest import mock
+        from .models import SectionTokenStats
+        from .persistence import save_token_stats
+        self.budgets.record("project", "goals", "m", 120, 256, "ok")
+        with mock.patch.object(SectionTokenStats.objects, 'bulk_update', side_effect=RuntimeError("db down")):
+            with self.assertRaises(RuntimeError):
+                save_token_stats()
+        self.assertEqual(save_token_stats(), 1)
+        self.assertEqual(SectionTokenStats.objects.get().lengths, [120])
+
+
+class PostgresChannelLayerTests(SimpleTestCase):
+    def test_channel_names_carry_their_process(self):
+        from core.channel_layers.postgres import channel_owner
+        self.assertEqual(channel_owner("specific..ab12cd!xYzAbC"), "ab12cd")
+        self.assertIsNone(channel_owner("background-tasks"))
+
+    def test_notifications_stay_under_the_notify_limit(self):
+        from core.channel_layers.postgres import NOTIFY_PAYLOAD_LIMIT, build_notifications
+        channels = [f"specific..ab12cd!{i:024d}" for i in range(400)]
+        payloads = build_notifications(channels, json.dumps({"type": "x", "body": "y" * 1000}), None, 1.5)
+        self.assertGreater(len(payloads), 1)
+        self.assertTrue(all(len(p.encode()) < NOTIFY_PAYLOAD_LIMIT for p in payloads))
+        decoded = [json.loads(p) for p in payloads]
+        self.assertEqual([c for d in decoded for c in d["c"]], channels)
+        self.assertEqual(decoded[0]["m"]["body"], "y" * 1000)
+
+        # Messages stored in the payload table are referenced by id
+        self.assertEqual(json.loads(build_notifications(channels[:1], None, 42, 1.5)[0]), {"c": channels[:1], "t": 1.5, "r": 42})
+
+    async def test_local_sends_skip_the_database_and_respect_capacity(self):
+        from channels.exceptions import ChannelFull
+        from core.channel_layers import PostgresChannelLayer
+        layer = PostgresChannelLayer(capacity=2)
+        channel = f"specific..{layer.process_id}!abc"
+        await layer.send(channel, {"type": "a"})
+        await layer.send(channel, {"type": "b"})
+        with self.assertRaises(ChannelFull):
+            await layer.send(channel, {"type": "c"})
+        self.assertEqual(layer.channels[channel].qsize(), 2)
+        with self.assertRaises(NotImplementedError):
+            await layer.send("background-tasks", {"type": "a"})
+
+    @skipUnless(connection.vendor == 'postgresql', 'needs PostgreSQL LISTEN/NOTIFY')
+    async def test_group_send_reaches_other_processes(self):
+        from core.channel_layers import PostgresChannelLayer
+        sender, receiver = PostgresChannelLayer(prefix='test_channels'), PostgresChannelLayer(prefix='test_channels')
+        try:
+            channels = [await receiver.new_channel() for _ in range(3)]
+            for channel in channels:
+                await sender.group_add('crew', channel)
+            await sender.group_send('crew', {"type": "small"})
+            await sender.group_send('crew', {"type": "large", "body": "y" * 20000})
+            for channel in channels:
+                self.assertEqual((await receiver.receive(channel))["type"], "small")
+                self.assertEqual(len((await receiver.receive(channel))["body"]), 20000)
+        finally:
+            await sender.flush()
+            await sender.close()
+            await receiver.close()
@@ -3,9 +3,12 @@ import logging
 from rest_framework.viewsets import ModelViewSet
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
 from rest_framework.parsers import MultiPartParser
 from rest_framework import status
 from django.shortcuts import get_object_or_404
+from django.conf import settings
+from django.db import close_old_connections
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.exceptions import PermissionDenied
 
@@ -38,6 +41,37 @@ def get_notification_action_url(recipient, project_id, tab=None):
         result_url = base_url
     
     return result_url
+
+def llm_job_status(flight):
+    """Status payload of a background LLM job (a flight from ``llm_jobs.start``)."""
+    info = flight.info
+    data = {
+        'job_id': flight.flight_id,
+        'project_id': info.get('project_id'),
+        'operation': info.get('operation'),
+    }
+    if not flight.done.is_set():
+        ticket = info.get('ticket')
+        queued = llm_admission.position(ticket) if ticket is not None else None
+        if queued is None:
+            data['status'] = 'running'
+        else:
+            data['status'] = 'queued'
+            data['position'], wait = queued
+            data['estimated_wait_seconds'] = round(wait, 1)
+    elif isinstance(flight.error, AdmissionRejected):
+        data.update(status='rejected', error=flight.error.reason, retry_after=flight.error.retry_after)
+    elif flight.error is not None:
+        data.update(status='failed', error=str(flight.error))
+    else:
+        result, status_code = flight.result
+        data.update(
+            status='completed' if status_code < 400 else 'failed',
+            result=result,
+            result_status=status_code,
+        )
+    return data
+
 from .serializers import (
     ProjectSerializer, ProposalSerializer,
     ProjectFeatureSerializer, ProjectRoleSerializer, ProjectGoalSerializer,
@@ -48,11 +82,20 @@ from .serializers import (
 )
 
 # Real LLM pipelines
-from llms.project_llm import run_pipeline_from_text, model_to_dict
+from llms.project_llm import run_pipeline_from_text, run_incremental_pipeline, model_to_dict
 from llms.backlog_llm import run_backlog_pipeline
-from llms.llm_cache import clear_cache_and_free_memory, get_memory_usage, start_auto_cleanup
+from llms.llm_cache import get_memory_usage, start_auto_cleanup
+from llms import telemetry, incremental
+from llms.model_registry import models as llm_models
 from apps.ai_api.tasks import task_manager, TaskCancelledException
+from apps.ai_api.persistence import persist_overview, persist_backlog, load_token_stats, save_token_stats
+from apps.ai_api.admission import llm_admission, AdmissionRejected, Priority
+from apps.ai_api.singleflight import (
+    llm_jobs, proposal_version, IDEMPOTENCY_HEADER, idempotency_cache_key,
+    get_idempotent_response, store_idempotent_response, is_cacheable_response,
+)
 from core.services.broadcast_service import BroadcastService
+from core.websocket.outbox import outbox_metrics
 from core.services.notification_service import NotificationService
 
 import pdfplumber
@@ -83,56 +126,153 @@ class ProjectViewSet(ModelViewSet):
         if not proposal.parsed_text:
             return Response({"error": "Proposal has no parsed text"}, status=status.HTTP_400_BAD_REQUEST)
 
+        title_override = request.data.get("title")
+        return self._run_llm_job(
+            request, project, "ingest_proposal", f"{proposal_version(proposal)}:{title_override or ''}",
+            lambda: self._ingest_proposal_job(project, proposal, title_override),
+        )
+
+    def _run_llm_job(self, request, project, operation, version, job):
+        """
+        Run an LLM job at most once per (project, operation, proposal version).
+        Concurrent duplicates attach to the in-flight job and get its result;
+        requests carrying an Idempotency-Key replay the stored response.
+
+        Admission is decided on the request thread: when the queue is
+        saturated the response is a 429 with Retry-After. Admitted jobs wait
+        for their slot and run on a worker thread. Clients sending
+        ``Prefer: respond-async`` get a 202 with the job's status URL at once
+        (see ``llm_job``); other requests wait for the result.
+        ``job`` returns a (data, status_code) tuple.
+        """
+        cache_key = None
+        idempotency_key = request.headers.get(IDEMPOTENCY_HEADER)
+        if idempotency_key:
+            cache_key = idempotency_cache_key(request.user.pk, project.id, operation, idempotency_key)
+            stored = get_idempotent_response(cache_key)
+            if stored is not None:
+                response = Response(stored['data'], status=stored['status'])
+                response['Idempotent-Replayed'] = 'true'
+                return response
+
+        user = request.user
+        priority = Priority.BATCH if request.query_params.get("priority") == "batch" else Priority.INTERACTIVE
+        respond_async = 'respond-async' in request.headers.get('Prefer', '')
+        background = getattr(settings, 'LLM_JOBS_IN_BACKGROUND', True)
+        info = {'user_id': user.pk, 'project_id': project.id, 'operation': operation}
+
+        def report_position(ticket, position, estimated_wait):
+            BroadcastService.broadcast_llm_queue_position(project, operation, position, estimated_wait, user)
+
+        def admit():
+            info['ticket'] = llm_admission.submit(user.pk, project.id, operation, priority, on_update=report_position)
+
+        def admitted_job():
+            if background:
+                # Outside the request cycle, so connection housekeeping is up to us
+                close_old_connections()
+            try:
+                with llm_admission.granted(info['ticket']):
+                    load_token_stats()
+                    try:
+                        return job()
+                    finally:
+                        # Keep the learned generation budgets across restarts
+                        try:
+                            save_token_stats()
+                        except Exception as e:
+                            logger.warning(f"Could not save token budget stats: {e}")
+            finally:
+                if background:
+                    close_old_connections()
+
         try:
+            flight, shared = llm_jobs.start(
+                (project.id, operation, version), admitted_job, prepare=admit,
+                cacheable=is_cacheable_response, background=background, info=info,
+            )
+        except AdmissionRejected as e:
+            return self._llm_job_rejected(project, operation, e)
+
+        if respond_async and not (flight.done.is_set() and isinstance(flight.error, AdmissionRejected)):
+            data = llm_job_status(flight)
+            data['status_url'] = reverse('ai-projects-llm-job', kwargs={'job_id': flight.flight_id}, request=request)
+            if cache_key:
+                store_idempotent_response(cache_key, status.HTTP_202_ACCEPTED, data)
+            response = Response(data, status=status.HTTP_202_ACCEPTED)
+            response['Location'] = data['status_url']
+            response['Preference-Applied'] = 'respond-async'
+        else:
+            flight.done.wait()
+            if isinstance(flight.error, AdmissionRejected):
+                return self._llm_job_rejected(project, operation, flight.error)
+            if flight.error is not None:
+                raise flight.error
+            data, status_code = flight.result
+            if cache_key:
+                store_idempotent_response(cache_key, status_code, data)
+            response = Response(data, status=status_code)
+        if shared:
+            response['X-Coalesced'] = 'true'
+        return response
+
+    def _llm_job_rejected(self, project, operation, error):
+        logger.warning(f"LLM job {operation} for project {project.id} rejected: {error.reason}")
+        response = Response({
+            "error": error.reason,
+            "retry_after": error.retry_after,
+        }, status=status.HTTP_429_TOO_MANY_REQUESTS)
+        response['Retry-After'] = str(error.retry_after)
+        return response
+
+    def _ingest_proposal_job(self, project, proposal, title_override):
+        try:
+            # Reuse section outputs from the previous revision where the relevant pages are unchanged
+            pages = proposal.page_texts or [proposal.parsed_text]
+            previous = (
+                Proposal.objects.filter(project=project, uploaded_at__lte=proposal.uploaded_at)
+                .exclude(id=proposal.id)
+                .exclude(section_outputs={})
+                .only("id", "page_hashes", "section_outputs")
+                .order_by("-uploaded_at")
+                .first()
+            )
+            cached_outputs = dict(previous.section_outputs) if previous else {}
+            cached_outputs.update(proposal.section_outputs or {})
+
             # Run real LLM pipeline
-            project_model = run_pipeline_from_text(proposal.parsed_text)
+            project_model, section_outputs, report = run_incremental_pipeline(pages, cached_outputs=cached_outputs)
             output = model_to_dict(project_model)
+            if section_outputs:
+                proposal.section_outputs = section_outputs
+                proposal.save(update_fields=["section_outputs"])
+            report["changed_pages"] = (
+                incremental.changed_pages(previous.page_hashes, proposal.page_hashes)
+                if previous and previous.page_hashes and proposal.page_hashes else None
+            )
 
             # Optionally persist minimal fields on our local Project
-            title_override = request.data.get("title")
             if title_override:
                 output["title"] = title_override
             project.title = output.get("title") or project.title
             project.summary = output.get("summary") or project.summary
             project.save(update_fields=["title", "summary"])
 
-            # Persist features
-            ProjectFeature.objects.filter(project=project).delete()
-            for feat in output.get("features", [])[:10]:
-                ProjectFeature.objects.create(project=project, title=str(feat)[:512])
-
-            # Persist roles
-            ProjectRole.objects.filter(project=project).delete()
-            for role in output.get("roles", [])[:20]:
-                ProjectRole.objects.create(project=project, role=str(role)[:255])
-
-            # Persist goals
-            ProjectGoal.objects.filter(project=project).delete()
-            for g in output.get("goals", [])[:20]:
-                ProjectGoal.objects.create(
-                    project=project,
-                    title=str(g.get("title", ""))[:512],
-                    role=(g.get("role") or "")[:255]
-                )
-
-            # Persist timeline
-            TimelineWeek.objects.filter(project=project).delete()
-            for week in output.get("timeline", [])[:12]:
-                tw = TimelineWeek.objects.create(project=project, week_number=int(week.get("week_number", 0) or 0))
-                for item in week.get("goals", [])[:20]:
-                    TimelineItem.objects.create(week=tw, title=str(item)[:512])
+            # Persist features, roles, goals and timeline
+            persist_overview(project, output)
 
-            return Response({
+            return {
                 "message": "Project enriched with LLM output",
                 "project_id": project.id,
-                "llm": output
-            })
+                "llm": output,
+                "incremental": report,
+            }, status.HTTP_200_OK
             
         except Exception as e:
             logger.error(f"Analysis failed: {str(e)}")
-            return Response({
+            return {
                 "error": f"Analysis failed: {str(e)}"
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            }, status.HTTP_500_INTERNAL_SERVER_ERROR
 
     @action(detail=True, methods=["get"], url_path="current-proposal")
     def current_proposal(self, request, pk=None):
@@ -151,11 +291,21 @@ class ProjectViewSet(ModelViewSet):
         if not proposal or not proposal.parsed_text:
             return Response({"error": "No parsed proposal found for project"}, status=status.HTTP_400_BAD_REQUEST)
 
+        return self._run_llm_job(
+            request, project, "generate_backlog", proposal_version(proposal),
+            lambda: self._generate_backlog_job(project, proposal),
+        )
+
+    def _generate_backlog_job(self, project, proposal):
         try:
             context = {
                 "project_title": project.title or "",
             }
-            backlog_model = run_backlog_pipeline(proposal.parsed_text, context)
+
+            def report_progress(phase, completed, total):
+                BroadcastService.broadcast_backlog_progress(project, phase, completed, total, self.request.user)
+
+            backlog_model = run_backlog_pipeline(proposal.parsed_text, context, progress_callback=report_progress)
 
             # Convert backlog model to dict
             backlog_dict = {
@@ -182,19 +332,7 @@ class ProjectViewSet(ModelViewSet):
             }
 
             # Persist backlog structures
-            Epic.objects.filter(project=project, ai=True).delete()
-            for epic in backlog_model.epics[:20]:
-                e = Epic.objects.create(
-                    project=project,
-                    title=str(epic.title)[:512],
-                    description=getattr(epic, "description", "")
-                )
-                for sub in epic.sub_epics[:20]:
-                    se = SubEpic.objects.create(epic=e, title=str(sub.title)[:512])
-                    for us in sub.user_stories[:20]:
-                        u = UserStory.objects.create(sub_epic=se, title=str(us.title)[:512])
-                        for t in us.tasks[:50]:
-                            StoryTask.objects.create(user_story=u, title=str(t.title)[:512])
+            persist_backlog(project, backlog_model)
 
             # Broadcast backlog regeneration
             BroadcastService.broadcast_backlog_regenerated(project, self.request.user)
@@ -215,16 +353,16 @@ class ProjectViewSet(ModelViewSet):
             except Exception as e:
                 logger.error(f"Error creating backlog regeneration notifications: {e}")
             
-            return Response({
+            return {
                 "message": "Backlog generated successfully",
                 "backlog": backlog_dict
-            })
+            }, status.HTTP_200_OK
             
         except Exception as e:
             logger.error(f"Backlog generation failed: {str(e)}")
-            return Response({
+            return {
                 "error": f"Backlog generation failed: {str(e)}"
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            }, status.HTTP_500_INTERNAL_SERVER_ERROR
 
 
     @action(detail=True, methods=["put"], url_path="generate-overview")
@@ -235,6 +373,12 @@ class ProjectViewSet(ModelViewSet):
         if not proposal or not proposal.parsed_text:
             return Response({"error": "No parsed proposal found for project"}, status=status.HTTP_400_BAD_REQUEST)
 
+        return self._run_llm_job(
+            request, project, "generate_overview", proposal_version(proposal),
+            lambda: self._generate_overview_job(project, proposal),
+        )
+
+    def _generate_overview_job(self, project, proposal):
         # Generate project overview using LLM
         project_model = run_pipeline_from_text(proposal.parsed_text)
         output = model_to_dict(project_model)
@@ -319,10 +463,10 @@ class ProjectViewSet(ModelViewSet):
         except Exception as e:
             print(f"Error creating overview regeneration notifications: {e}")
         
-        return Response({
+        return {
             "message": "Project overview generated successfully",
             "overview": output,
-        }, status=status.HTTP_200_OK)
+        }, status.HTTP_200_OK
 
     @action(detail=True, methods=["get"], url_path="backlog")
     def backlog(self, request, pk=None):
@@ -460,7 +604,7 @@ class ProjectViewSet(ModelViewSet):
         """
         try:
             memory_before = get_memory_usage()
-            clear_cache_and_free_memory()
+            llm_models.unload_all()
             memory_after = get_memory_usage()
             
             return Response({
@@ -483,6 +627,58 @@ class ProjectViewSet(ModelViewSet):
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @action(detail=False, methods=["get"], url_path="llm-metrics")
+    def llm_metrics(self, request):
+        """
+        Get aggregated LLM inference telemetry (tokens, TTFT, decode rate, retries, cache hits),
+        per section and per serving model, plus the loaded models and their routes.
+        Pass ?reset=true to clear the counters after reading them.
+        """
+        try:
+            metrics = telemetry.get_metrics()
+            metrics['model_registry'] = llm_models.snapshot()
+            if request.query_params.get('reset', '').lower() == 'true':
+                telemetry.reset_metrics()
+            return Response(metrics)
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    @action(detail=False, methods=["get"], url_path="llm-queue")
+    def llm_queue(self, request):
+        """
+        LLM admission queue state, including the requesting user's queued jobs
+        with their position and estimated wait.
+        """
+        return Response(llm_admission.snapshot(user_id=request.user.pk), status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=["get"], url_path=r"llm-jobs/(?P<job_id>[0-9a-f]+)")
+    def llm_job(self, request, job_id=None):
+        """
+        Status of an LLM job started with ``Prefer: respond-async``: queued (with its
+        position and estimated wait), running, completed or failed. Finished jobs carry
+        the endpoint's response as ``result`` and ``result_status``. Visible to the user
+        who started the job and to members of its project, for an hour after it ends.
+        """
+        flight = llm_jobs.get(job_id)
+        if flight is None or not (
+            flight.info.get('user_id') == request.user.pk
+            or ProjectMember.objects.filter(project_id=flight.info.get('project_id'), user=request.user).exists()
+        ):
+            return Response({"error": "LLM job not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(llm_job_status(flight), status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=["get"], url_path="socket-metrics")
+    def socket_metrics(self, request):
+        """
+        WebSocket send queues of this process per consumer: open connections, queue
+        depths, frames sent, coalesced and dropped, and slow-consumer evictions.
+        Pass ?reset=true to clear the counters after reading them.
+        """
+        metrics = outbox_metrics.snapshot()
+        if request.query_params.get('reset', '').lower() == 'true':
+            outbox_metrics.reset()
+        return Response(metrics, status=status.HTTP_200_OK)
+
     @action(detail=False, methods=["post"], url_path="start-auto-cleanup")
     def start_auto_cleanup(self, request):
         """
@@ -567,7 +763,8 @@ class ProposalViewSet(ModelViewSet):
 
         try:
             with pdfplumber.open(file) as pdf:
-                text = "\n".join(page.extract_text() or "" for page in pdf.pages)
+                pages = [page.extract_text() or "" for page in pdf.pages]
+                text = "\n".join(pages)
         except Exception as e:
             return Response({"error": f"PDF parsing failed: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -575,6 +772,8 @@ class ProposalViewSet(ModelViewSet):
             project=project,
             file=file,
             parsed_text=text,
+            page_texts=pages,
+            page_hashes=incremental.page_hashes(pages),
             uploaded_by=request.user if request.user.is_authenticated else None
         )
 
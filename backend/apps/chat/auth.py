@@ -1,10 +1,75 @@
+import hashlib
+import logging
 from urllib.parse import parse_qs
+from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from rest_framework.authtoken.models import Token
 from channels.db import database_sync_to_async
 
+from .permissions import is_room_member
+
 User = get_user_model()
+logger = logging.getLogger('apps.chat')
+
+# Reconnect storms (e.g. after a deploy) resolve the same tokens and memberships
+# over and over, so both are cached. Entries are dropped by the signal handlers in
+# signals.py when tokens, users or memberships change; the TTLs bound staleness
+# where that cannot reach (a per-process cache with several workers).
+TOKEN_CACHE_PREFIX = 'ws_auth:token:'
+MEMBERSHIP_CACHE_PREFIX = 'ws_auth:member:'
+UNKNOWN_TOKEN_TTL = 30  # seconds an unknown token is remembered as such
+
+
+def _token_cache_key(token_key):
+    # Hashed so raw tokens never end up in cache keys
+    return TOKEN_CACHE_PREFIX + hashlib.sha256(token_key.encode()).hexdigest()
+
+
+def _membership_cache_key(room_id, user_id):
+    return f'{MEMBERSHIP_CACHE_PREFIX}{room_id}:{user_id}'
+
+
+def get_user_for_token(token_key):
+    """The active user owning a DRF token, else AnonymousUser. Cached for WS_AUTH_CACHE_TTL seconds."""
+    key = _token_cache_key(token_key)
+    user = cache.get(key)
+    if user is False:
+        return AnonymousUser()
+    if user is not None:
+        return user
+
+    token = Token.objects.select_related('user').filter(key=token_key).first()
+    if token is None or not token.user.is_active:
+        cache.set(key, False, UNKNOWN_TOKEN_TTL)
+        return AnonymousUser()
+    cache.set(key, token.user, getattr(settings, 'WS_AUTH_CACHE_TTL', 300))
+    return token.user
+
+
+def is_room_member_cached(user, room_id):
+    """``is_room_member`` for WebSocket consumers, cached for WS_MEMBERSHIP_CACHE_TTL seconds."""
+    if not user or not user.is_authenticated:
+        return False
+    key = _membership_cache_key(room_id, user.pk)
+    member = cache.get(key)
+    if member is None:
+        member = is_room_member(user, room_id)
+        cache.set(key, member, getattr(settings, 'WS_MEMBERSHIP_CACHE_TTL', 60))
+    return member
+
+
+def invalidate_token(token_key):
+    cache.delete(_token_cache_key(token_key))
+
+
+def invalidate_user_tokens(user_id):
+    cache.delete_many([_token_cache_key(key) for key in Token.objects.filter(user_id=user_id).values_list('key', flat=True)])
+
+
+def invalidate_membership(room_id, user_id):
+    cache.delete(_membership_cache_key(room_id, user_id))
 
 
 class TokenAuthMiddleware:
@@ -23,41 +88,29 @@ class TokenAuthMiddleware:
                 query = parse_qs(query_string.decode())
             except Exception:
                 query = {}
-            
+
             token_key_list = query.get("token") or query.get("auth_token")
             if token_key_list:
-                token_key = token_key_list[0]
-                print(f"WebSocket auth: Attempting to authenticate with token: {token_key[:10]}...")
                 try:
                     # Validate DRF token
-                    scope_user = await self.get_user_by_token(token_key)
+                    scope_user = await self.get_user_by_token(token_key_list[0])
                     if scope_user.is_authenticated:
-                        print(f"WebSocket auth: Successfully authenticated user {scope_user.user_id}")
+                        logger.debug(f"WebSocket auth: Authenticated user {scope_user.user_id}")
                     else:
-                        print(f"WebSocket auth: Token validation failed - user not authenticated")
+                        logger.info("WebSocket auth: Unknown token or inactive user")
                 except Exception as e:
-                    print(f"WebSocket token authentication error: {e}")
+                    logger.error(f"WebSocket token authentication error: {e}")
                     scope_user = AnonymousUser()
             else:
-                print(f"WebSocket auth: No token found in query string: {query_string.decode()}")
+                logger.debug("WebSocket auth: No token in query string")
 
         scope["user"] = scope_user
         return await self.inner(scope, receive, send)
-    
+
     @database_sync_to_async
     def get_user_by_token(self, token_key):
-        try:
-            print(f"WebSocket auth: Looking up token: {token_key[:10]}...")
-            token_obj = Token.objects.get(key=token_key)
-            print(f"WebSocket auth: Found token for user: {token_obj.user.email}")
-            return token_obj.user
-        except Token.DoesNotExist:
-            print(f"WebSocket auth: Token not found in database")
-            return AnonymousUser()
-        except Exception as e:
-            print(f"WebSocket auth: Error looking up token: {e}")
-            return AnonymousUser()
+        return get_user_for_token(token_key)
 
 
 def TokenAuthMiddlewareStack(inner):
-    return TokenAuthMiddleware(inner)
\ No newline at end of file
+    return TokenAuthMiddleware(inner)
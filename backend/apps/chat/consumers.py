@@ -1,21 +1,30 @@
 import json
 import logging
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.db import transaction
 from django.db.models import Count
+
+from core.websocket.outbox import OutboxMixin
+from .history import recent_messages, room_history
 from .models import Room, RoomMembership, Message
+from .auth import is_room_member_cached
+from .presence import presence, presence_group_name
 from .serializers import MessageSerializer, RoomSerializer, RoomMembershipSerializer
 
 User = get_user_model()
 logger = logging.getLogger('apps.chat')
 
 
-class ChatConsumer(AsyncWebsocketConsumer):
+class ChatConsumer(OutboxMixin, AsyncWebsocketConsumer):
     async def connect(self):
         self.room_id = self.scope['url_route']['kwargs']['room_id']
         self.room_group_name = f'chat_{self.room_id}'
+        # Presence deltas (online members, typing) have their own group so multiplexed clients can opt out of them
+        self.presence_group_name = presence_group_name(self.room_id)
         
         # Check if user is authenticated
         if not self.scope['user'].is_authenticated:
@@ -29,41 +38,43 @@ class ChatConsumer(AsyncWebsocketConsumer):
             await self.close()
             return
         
-        # Join room group
+        # Join room and presence groups
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
-        
-        await self.accept()
-        
-        # Send user joined message
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'user_joined',
-                'user': self.scope['user'].name,
-                'user_id': self.scope['user'].user_id,
-            }
+        await self.channel_layer.group_add(
+            self.presence_group_name,
+            self.channel_name
         )
 
+        # Keep the room's recent messages in memory while sockets here are in it
+        self.in_history = True
+        if room_history.join(self.room_id):
+            events = await self.load_recent_messages(room_history.size)
+            room_history.seed(self.room_id, events, complete=len(events) < room_history.size)
+
+        await self.accept()
+        await self.resume()
+
+        # Joining is announced in the next batched presence delta, not per connect
+        presence.connect(self.room_id, self.scope['user'].user_id, self.scope['user'].name)
+        presence.ensure_running()
+        await self.send_presence()
+
     async def disconnect(self, close_code):
-        # Leave room group
+        # Leave room and presence groups
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
-        
-        # Send user left message only if user is authenticated
-        if self.scope['user'].is_authenticated:
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'user_left',
-                    'user': self.scope['user'].name,
-                    'user_id': self.scope['user'].user_id,
-                }
-            )
+        await self.channel_layer.group_discard(
+            self.presence_group_name,
+            self.channel_name
+        )
+        if getattr(self, 'in_history', False):
+            room_history.leave(self.room_id)
+            presence.disconnect(self.room_id, self.scope['user'].user_id)
 
     async def receive(self, text_data):
         try:
@@ -72,9 +83,13 @@ class ChatConsumer(AsyncWebsocketConsumer):
             
             # WebSocket only handles real-time events, not data operations
             if message_type == 'typing':
-                await self.handle_typing(text_data_json)
+                presence.typing(self.room_id, self.scope['user'].user_id)
             elif message_type == 'stop_typing':
-                await self.handle_stop_typing(text_data_json)
+                presence.stop_typing(self.room_id, self.scope['user'].user_id)
+            elif message_type == 'heartbeat':
+                presence.heartbeat(self.room_id, self.scope['user'].user_id)
+            elif message_type == 'who_is_online':
+                await self.send_presence()
             else:
                 await self.send(text_data=json.dumps({
                     'type': 'error',
@@ -90,49 +105,71 @@ class ChatConsumer(AsyncWebsocketConsumer):
     # WebSocket only handles real-time events, not data operations
     # All data operations (messages, rooms, users) are handled via REST API
 
-    async def handle_typing(self, data):
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'typing',
-                'user': self.scope['user'].username,
-                'user_id': self.scope['user'].user_id,
-            }
-        )
+    async def resume(self):
+        """
+        Replay the messages a reconnecting client missed since the
+        ``last_message_id`` in its query string, from memory when the room's
+        buffer covers it, else with one keyset query. Live events queued
+        meanwhile are delivered afterwards, skipping replayed ones.
+        """
+        self.replayed = set()
+        try:
+            last_message_id = int(parse_qs(self.scope.get('query_string', b'').decode())['last_message_id'][0])
+        except (KeyError, ValueError):
+            return
 
-    async def handle_stop_typing(self, data):
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'stop_typing',
-                'user': self.scope['user'].username,
-                'user_id': self.scope['user'].user_id,
-            }
-        )
+        limit = getattr(settings, 'CHAT_RESUME_LIMIT', 500)
+        events = room_history.since(self.room_id, last_message_id)
+        source = 'memory'
+        if events is None:
+            events = await self.load_missed_messages(last_message_id, limit + 1)
+            source = 'database'
+        complete = len(events) <= limit
+        events = events[:limit]
 
-    # WebSocket event handlers
-    async def chat_message(self, event):
+        for event in events:
+            self.replayed.add(event['message']['message_id'])
+            await self.send_chat_message(event)
+        if events:
+            last_message_id = events[-1]['message']['message_id']
+        logger.info(f"Chat WebSocket: Replayed {len(events)} messages from {source} for user {self.scope['user'].user_id} in room {self.room_id}")
         await self.send(text_data=json.dumps({
-            'type': 'chat_message',
-            'message': event['message'],
-            'user': event['user'],
-            'user_id': event['user_id'],
+            'type': 'resume',
+            'replayed': len(events),
+            'source': source,
+            # When incomplete, fetch the rest with GET messages/?after_id=<last_message_id>
+            'complete': complete,
+            'last_message_id': last_message_id,
         }))
 
-    async def typing(self, event):
+    async def send_presence(self):
+        # A newer snapshot supersedes one still queued
         await self.send(text_data=json.dumps({
-            'type': 'typing',
-            'user': event['user'],
-            'user_id': event['user_id'],
-        }))
+            'type': 'presence',
+            'room_id': int(self.room_id),
+            'online': presence.who_is_online(self.room_id),
+        }), coalesce='presence')
+
+    # WebSocket event handlers
+    async def chat_message(self, event):
+        room_history.add(self.room_id, event)
+        message_id = event['message'].get('message_id')
+        if message_id in self.replayed:
+            self.replayed.discard(message_id)
+            return
+        await self.send_chat_message(event)
 
-    async def stop_typing(self, event):
+    async def send_chat_message(self, event):
         await self.send(text_data=json.dumps({
-            'type': 'stop_typing',
+            'type': 'chat_message',
+            'message': event['message'],
             'user': event['user'],
             'user_id': event['user_id'],
         }))
 
+    async def presence_delta(self, event):
+        await self.send(text_data=json.dumps(presence.apply(event)))
+
     async def user_joined(self, event):
         await self.send(text_data=json.dumps({
             'type': 'user_joined',
@@ -149,6 +186,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
     async def message_deleted(self, event):
         """Handle message deleted notification"""
+        room_history.discard(self.room_id, event['message_id'])
         await self.send(text_data=json.dumps({
             'type': 'message_deleted',
             'message_id': event['message_id'],
@@ -160,17 +198,15 @@ class ChatConsumer(AsyncWebsocketConsumer):
     @database_sync_to_async
     def is_authenticated_and_member(self):
         """Check if user is authenticated and is a member of the room"""
-        if not self.scope['user'].is_authenticated:
-            return False
-        
-        try:
-            room = Room.objects.get(room_id=self.room_id)
-            return RoomMembership.objects.filter(
-                room=room, 
-                user=self.scope['user']
-            ).exists()
-        except Room.DoesNotExist:
-            return False
+        return is_room_member_cached(self.scope['user'], self.room_id)
+
+    @database_sync_to_async
+    def load_recent_messages(self, limit):
+        return recent_messages(self.room_id, limit=limit, newest=True)
+
+    @database_sync_to_async
+    def load_missed_messages(self, last_message_id, limit):
+        return recent_messages(self.room_id, after_id=last_message_id, limit=limit)
 
     @database_sync_to_async
     def create_message(self, content, message_type='text', reply_to_id=None):
@@ -185,6 +221,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
                     message_type=message_type,
                     reply_to_id=reply_to_id
                 )
+                room.record_message(message)
                 # Serialize the message for sending
                 serializer = MessageSerializer(message)
                 return serializer.data
@@ -199,7 +236,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
     # WebSocket consumers only handle real-time events like typing indicators
 
 
-class ChatNotificationConsumer(AsyncWebsocketConsumer):
+class ChatNotificationConsumer(OutboxMixin, AsyncWebsocketConsumer):
     """Consumer for global chat notifications (new messages, mentions, etc.)"""
     
     async def connect(self):
@@ -292,8 +329,9 @@ class ChatNotificationConsumer(AsyncWebsocketConsumer):
         unread_count = event.get('unread_count', 0)
         room_id = event.get('room_id')
         logger.info(f"📊 ChatNotificationConsumer: Sending unread_count_updated WebSocket message: user_id={self.user_id}, unread_count={unread_count}, room_id={room_id}")
+        # Totals supersede each other: a client that is behind only gets the latest
         await self.send(text_data=json.dumps({
             'type': 'unread_count_updated',
             'unread_count': unread_count,
             'room_id': room_id,
-        }))
\ No newline at end of file
+        }), coalesce='unread_count')
\ No newline at end of file
@@ -0,0 +1,142 @@
+"""
+Realtime delivery of a new chat message, after the HTTP response.
+
+``MessageViewSet.create`` only inserts the message and schedules
+``deliver_message`` with ``transaction.on_commit``. The delivery runs on a
+background thread, so the request does not wait for the channel layer:
+
+- one query for the room's members and one for all their unread totals,
+- every event built up front: ``chat_message`` to the room, plus
+  ``new_message_notification`` and ``unread_count_updated`` to each member's
+  chat notifications (only ``unread_count_updated`` for the sender),
+- one coroutine sending all groups concurrently with ``asyncio.gather``.
+  Events for the same group keep their order.
+
+A single worker thread delivers messages in the order they were committed.
+The sends must run on the server's event loop: the in-memory layer's queues
+belong to it, and a loop made up by ``async_to_sync`` on the worker thread
+would leave consumers waiting. ``schedule_delivery`` captures that loop on
+the request thread and the worker submits to it with
+``run_coroutine_threadsafe``, waiting for each batch so the order holds.
+Without a server loop (WSGI, management commands) ``async_to_sync`` is used.
+Set ``CHAT_DELIVERY_ASYNC = False`` to deliver inline in the commit hook.
+"""
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from asgiref.sync import SyncToAsync, async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Count, F, Q
+
+from .models import RoomMembership
+
+logger = logging.getLogger('apps.chat')
+
+_executor = None
+SEND_TIMEOUT = 30  # seconds the worker waits for one message's sends on the server loop
+
+
+def schedule_delivery(room_id, sender_id, sender_name, message_data: Dict):
+    """Deliver a committed message; call from ``transaction.on_commit``."""
+    if not getattr(settings, 'CHAT_DELIVERY_ASYNC', True):
+        deliver_message(room_id, sender_id, sender_name, message_data)
+        return
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='chat-delivery')
+    _executor.submit(_deliver_in_background, server_loop(), room_id, sender_id, sender_name, message_data)
+
+
+def server_loop() -> Optional[asyncio.AbstractEventLoop]:
+    """The event loop serving the current request, from async code or a ``sync_to_async`` thread."""
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    # Set by asgiref for the threads that run sync views under ASGI
+    if getattr(SyncToAsync.threadlocal, 'main_event_loop_pid', None) != os.getpid():
+        return None
+    loop = getattr(SyncToAsync.threadlocal, 'main_event_loop', None)
+    return loop if loop is not None and loop.is_running() else None
+
+
+def _deliver_in_background(loop, *args):
+    # Outside the request cycle, so connection housekeeping is up to us
+    close_old_connections()
+    try:
+        deliver_message(*args, loop=loop)
+    except Exception:
+        logger.exception(f"Chat delivery: Failed for room {args[0]}")
+    finally:
+        close_old_connections()
+
+
+def deliver_message(room_id, sender_id, sender_name, message_data: Dict,
+                    loop: Optional[asyncio.AbstractEventLoop] = None):
+    """Query and send a message's events; with ``loop``, the sends run there (call from another thread)."""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    member_ids = list(RoomMembership.objects.filter(room_id=room_id).values_list('user_id', flat=True))
+    totals = unread_totals(member_ids)
+    batches = build_events(room_id, sender_id, sender_name, message_data, totals)
+    if loop is not None and not loop.is_closed():
+        asyncio.run_coroutine_threadsafe(send_all(channel_layer, batches), loop).result(SEND_TIMEOUT)
+    else:
+        async_to_sync(send_all)(channel_layer, batches)
+
+
+def unread_totals(user_ids: Iterable[int]) -> Dict[int, int]:
+    """Unread messages across all rooms for each user, in one query."""
+    rows = (
+        RoomMembership.objects.filter(user_id__in=list(user_ids))
+        .values('user_id')
+        .annotate(unread=Count('room__messages', filter=(
+            Q(room__messages__is_deleted=False, room__messages__created_at__gt=F('joined_at'))
+            & ~Q(room__messages__sender_id=F('user_id'))
+        )))
+    )
+    totals = {user_id: 0 for user_id in user_ids}
+    for row in rows:
+        totals[row['user_id']] += row['unread']
+    return totals
+
+
+def build_events(room_id, sender_id, sender_name, message_data, totals) -> List[Tuple[str, List[Dict]]]:
+    """(group, events) pairs: the room's event, then each member's notifications."""
+    room_id = int(room_id)
+    batches = [(f'chat_{room_id}', [{
+        'type': 'chat_message',
+        'room_id': room_id,
+        'message': message_data,
+        'user': sender_name,
+        'user_id': sender_id,
+    }])]
+    for user_id, unread in totals.items():
+        events = []
+        if user_id != sender_id:
+            events.append({
+                'type': 'new_message_notification',
+                'room_id': room_id,
+                'message': message_data,
+                'sender': sender_name,
+            })
+        events.append({'type': 'unread_count_updated', 'unread_count': unread, 'room_id': room_id})
+        batches.append((f'user_{user_id}_chat_notifications', events))
+    return batches
+
+
+async def send_all(channel_layer, batches):
+    async def send_group(group, events):
+        for event in events:
+            await channel_layer.group_send(group, event)
+
+    results = await asyncio.gather(*(send_group(group, events) for group, events in batches), return_exceptions=True)
+    for (group, _), result in zip(batches, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Chat delivery: Failed to send to {group}: {result}")
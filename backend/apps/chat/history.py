@@ -0,0 +1,130 @@
+"""
+Recent chat messages per room, kept in memory so a reconnecting
+``ChatConsumer`` can replay what it missed without querying the database.
+
+A process keeps a room's buffer only while one of its sockets is in the
+room. Those sockets receive every ``chat_message`` event of the room group
+and add it here, and the first one seeds the buffer from the database. The
+buffer therefore holds every message with an id above its ``floor``. Resumes
+from before the floor fall back to one keyset query.
+"""
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from django.conf import settings
+
+from .models import Message
+from .serializers import MessageSerializer
+
+
+def message_event(message: Message) -> Dict:
+    """The ``chat_message`` event ``MessageViewSet.create`` sends for ``message``."""
+    return {
+        'type': 'chat_message',
+        'room_id': message.room_id,
+        'message': MessageSerializer(message).data,
+        'user': message.sender.name,
+        'user_id': message.sender_id,
+    }
+
+
+def recent_messages(room_id, after_id=None, limit=None, newest=False) -> List[Dict]:
+    """
+    ``chat_message`` events for the room's messages, oldest first: those
+    after ``after_id`` (keyset on message_id), or the newest ``limit``
+    when ``newest`` is set.
+    """
+    messages = Message.objects.filter(room_id=room_id, is_deleted=False).select_related('sender')
+    if after_id is not None:
+        messages = messages.filter(message_id__gt=after_id)
+    messages = messages.order_by('-message_id' if newest else 'message_id')
+    if limit is not None:
+        messages = messages[:limit]
+    events = [message_event(message) for message in messages]
+    return events[::-1] if newest else events
+
+
+class RoomBuffer:
+    __slots__ = ('messages', 'floor', 'seeded', 'sockets')
+
+    def __init__(self):
+        self.messages = OrderedDict()  # message_id -> event, ascending
+        self.floor = 0  # every message with a greater id is in ``messages`` (once seeded)
+        self.seeded = False
+        self.sockets = 0
+
+
+class RoomHistory:
+    """
+    Bounded per-room ring buffers of ``chat_message`` events. Only used
+    from the event loop, so it needs no locking.
+    """
+
+    def __init__(self, size: Optional[int] = None):
+        self.size = size or getattr(settings, 'CHAT_HISTORY_SIZE', 200)
+        self._rooms: Dict[int, RoomBuffer] = {}
+
+    def join(self, room_id) -> bool:
+        """Count a socket in the room; True if the buffer is new and should be seeded."""
+        buffer = self._rooms.get(int(room_id))
+        if buffer is None:
+            buffer = self._rooms[int(room_id)] = RoomBuffer()
+        buffer.sockets += 1
+        return buffer.sockets == 1
+
+    def leave(self, room_id):
+        """Forget the room once no socket in this process receives its events."""
+        buffer = self._rooms.get(int(room_id))
+        if buffer is not None:
+            buffer.sockets -= 1
+            if buffer.sockets <= 0:
+                del self._rooms[int(room_id)]
+
+    def seed(self, room_id, events: List[Dict], complete: bool):
+        """
+        Fill a new buffer with the room's newest messages (oldest first).
+        ``complete`` means they are all of the room's messages.
+        """
+        buffer = self._rooms.get(int(room_id))
+        if buffer is None:
+            return
+        if events and not complete:
+            buffer.floor = max(buffer.floor, events[0]['message']['message_id'] - 1)
+        for event in events:
+            self._insert(buffer, event)
+        buffer.seeded = True
+
+    def add(self, room_id, event: Dict):
+        buffer = self._rooms.get(int(room_id))
+        if buffer is not None:
+            self._insert(buffer, event)
+
+    def discard(self, room_id, message_id):
+        """Drop a deleted message so it is not replayed."""
+        buffer = self._rooms.get(int(room_id))
+        if buffer is not None:
+            buffer.messages.pop(message_id, None)
+
+    def since(self, room_id, last_message_id) -> Optional[List[Dict]]:
+        """Events after ``last_message_id``, or None if the buffer cannot tell."""
+        buffer = self._rooms.get(int(room_id))
+        if buffer is None or not buffer.seeded or last_message_id < buffer.floor:
+            return None
+        return [event for message_id, event in buffer.messages.items() if message_id > last_message_id]
+
+    def _insert(self, buffer: RoomBuffer, event: Dict):
+        message_id = event['message']['message_id']
+        if message_id <= buffer.floor or message_id in buffer.messages:
+            return
+        newest = next(reversed(buffer.messages), 0) if buffer.messages else 0
+        buffer.messages[message_id] = event
+        if message_id < newest:
+            # Events can arrive out of id order when messages are posted concurrently
+            for later in [key for key in buffer.messages if key > message_id]:
+                buffer.messages.move_to_end(later)
+        while len(buffer.messages) > self.size:
+            evicted, _ = buffer.messages.popitem(last=False)
+            buffer.floor = max(buffer.floor, evicted)
+
+
+room_history = RoomHistory()
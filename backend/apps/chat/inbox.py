@@ -0,0 +1,123 @@
+"""
+The chat sidebar in a constant number of queries: every room of a user
+with member count, last message and unread count, most recently active
+first, paged by a keyset cursor on (last activity, room id).
+
+One query returns the page of memberships: order and cursor read the
+room's denormalized last_activity_at (indexed with room_id), counts come
+from correlated subqueries. A second fetches the page's last messages by id.
+"""
+import base64
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from django.db.models import Count, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Message, RoomMembership
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+PREVIEW_LENGTH = 120
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(last_activity_at: datetime, room_id: int) -> str:
+    raw = f"{last_activity_at.isoformat()}|{room_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        timestamp, room_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(timestamp), int(room_id)
+    except (ValueError, UnicodeError) as e:
+        raise InvalidCursor(str(e))
+
+
+def _count(queryset):
+    """Scalar COUNT(*) subquery over a queryset correlated with OuterRef."""
+    return Coalesce(
+        Subquery(queryset.order_by().values('room').annotate(n=Count('pk')).values('n'), output_field=IntegerField()),
+        0,
+    )
+
+
+def inbox_queryset(user):
+    """The user's memberships annotated for the inbox, most recently active room first."""
+    room_messages = Message.objects.filter(room=OuterRef('room'), is_deleted=False)
+    return (
+        RoomMembership.objects.filter(user=user)
+        .select_related('room')
+        .annotate(
+            members_count=_count(RoomMembership.objects.filter(room=OuterRef('room'))),
+            unread_count=_count(
+                room_messages.filter(created_at__gt=OuterRef('joined_at')).exclude(sender=OuterRef('user'))
+            ),
+            # Direct rooms have no name; the client shows the other member instead
+            other_member_name=Subquery(
+                RoomMembership.objects.filter(room=OuterRef('room')).exclude(user=OuterRef('user'))
+                .order_by('membership_id').values('user__name')[:1]
+            ),
+        )
+        .order_by('-room__last_activity_at', '-room_id')
+    )
+
+
+def inbox_page(user, cursor: Optional[str] = None, limit: int = DEFAULT_LIMIT) -> Dict:
+    """One page of the inbox: ``results`` and the ``next_cursor`` (None on the last page)."""
+    queryset = inbox_queryset(user)
+    if cursor:
+        last_activity_at, room_id = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(room__last_activity_at__lt=last_activity_at)
+            | Q(room__last_activity_at=last_activity_at, room_id__lt=room_id)
+        )
+    memberships = list(queryset[:limit + 1])
+    has_more = len(memberships) > limit
+    memberships = memberships[:limit]
+
+    message_ids = [m.room.last_message_id for m in memberships if m.room.last_message_id]
+    last_messages = Message.objects.select_related('sender').in_bulk(message_ids) if message_ids else {}
+
+    results = [_entry(membership, last_messages.get(membership.room.last_message_id)) for membership in memberships]
+    next_cursor = None
+    if has_more:
+        last = memberships[-1]
+        next_cursor = encode_cursor(last.room.last_activity_at, last.room_id)
+    return {'results': results, 'next_cursor': next_cursor, 'has_more': has_more}
+
+
+def _entry(membership, last_message: Optional[Message]) -> Dict:
+    room = membership.room
+    display_name = room.name
+    if not display_name and room.is_private and membership.members_count == 2:
+        display_name = membership.other_member_name
+    return {
+        'room_id': room.room_id,
+        'name': room.name,
+        'display_name': display_name or f"Room {room.room_id}",
+        'is_private': room.is_private,
+        'is_admin': membership.is_admin,
+        'members_count': membership.members_count,
+        'unread_count': membership.unread_count,
+        'last_activity_at': room.last_activity_at,
+        'last_message': _preview(last_message) if last_message else None,
+    }
+
+
+def _preview(message: Message) -> Dict:
+    content = message.content or ''
+    return {
+        'message_id': message.message_id,
+        'sender_id': message.sender_id,
+        'sender_username': message.sender.name,
+        'message_type': message.message_type,
+        'content': content[:PREVIEW_LENGTH],
+        'truncated': len(content) > PREVIEW_LENGTH,
+        'created_at': message.created_at,
+    }
@@ -0,0 +1,188 @@
+import json
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from apps.chat import search as chat_search
+from apps.chat.models import Message, Room, RoomMembership
+
+BENCHMARK_EMAIL = 'search-benchmark@example.invalid'
+
+# Synthetic chat vocabulary; words are drawn with a Zipf-like skew so common
+# terms match many messages and rare ones few, as in real chat history
+WORDS = (
+    'the a to and is it you we that this for on are with be have can do just not so what '
+    'deploy build release branch merge review ticket sprint standup meeting lunch coffee '
+    'bug fix test failing green staging production rollback hotfix migration database '
+    'design mockup figma client invoice deadline estimate backlog priority blocker '
+    'tomorrow today friday weekend morning thanks great sounds good ok sure later '
+    'kubernetes terraform grafana postgres redis celery websocket latency throughput'
+).split()
+DEFAULT_QUERIES = ['deploy', 'rollback production', '"merge review"', 'grafana latency', 'xylophone']
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 2)
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark chat message search: seed synthetic messages, then time ranked full-text '
+        'pages against the LIKE scan they replace'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--messages',
+            type=int,
+            default=1_000_000,
+            help='Messages in the benchmark rooms; missing ones are seeded, existing ones reused (default: 1000000)'
+        )
+        parser.add_argument(
+            '--rooms',
+            type=int,
+            default=200,
+            help='Rooms the messages are spread over (default: 200)'
+        )
+        parser.add_argument(
+            '--queries',
+            nargs='+',
+            default=DEFAULT_QUERIES,
+            help='Search queries to time'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Timed runs per query (default: 5)'
+        )
+        parser.add_argument(
+            '--skip-like',
+            action='store_true',
+            help='Do not time the LIKE scan baseline (slow on millions of messages)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Messages per bulk insert while seeding (default: 5000)'
+        )
+        parser.add_argument(
+            '--cleanup',
+            action='store_true',
+            help='Delete the benchmark user, rooms and messages, then exit'
+        )
+        parser.add_argument(
+            '--output',
+            type=str,
+            help='Write the JSON report to this path'
+        )
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        if options['cleanup']:
+            deleted, _ = User.objects.filter(email=BENCHMARK_EMAIL).delete()
+            self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} benchmark rows"))
+            return
+        if options['messages'] < 1 or options['rooms'] < 1 or options['repeat'] < 1:
+            raise CommandError('--messages, --rooms and --repeat must be at least 1')
+
+        user = User.objects.filter(email=BENCHMARK_EMAIL).first() or User.objects.create_user(BENCHMARK_EMAIL, 'Search Benchmark')
+        rooms = self.ensure_rooms(user, options['rooms'])
+        self.seed(user, rooms, options['messages'], options['batch_size'])
+
+        backend = chat_search.search_backend()
+        self.stdout.write(f"Search backend: {backend}")
+        results = []
+        for query in options['queries']:
+            result = {'query': query, 'search': self.time_search(user, query, options['repeat'])}
+            if not options['skip_like'] and backend != 'like':
+                result['like_scan'] = self.time_like(user, query, options['repeat'])
+            self.print_result(result)
+            results.append(result)
+        self.stdout.write("Benchmark data kept for the next run; remove it with --cleanup")
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump({'backend': backend,
+                           'settings': {k: options[k] for k in ('messages', 'rooms', 'repeat')},
+                           'results': results}, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+
+    def ensure_rooms(self, user, count):
+        rooms = list(Room.objects.filter(created_by=user).order_by('room_id'))
+        for i in range(len(rooms), count):
+            room = Room.objects.create(name=f'Search benchmark {i}', created_by=user)
+            RoomMembership.objects.create(room=room, user=user)
+            rooms.append(room)
+        return rooms
+
+    def seed(self, user, rooms, total, batch_size):
+        existing = Message.objects.filter(sender=user).count()
+        missing = total - existing
+        if missing <= 0:
+            self.stdout.write(f"Reusing {existing} benchmark messages")
+            return
+        self.stdout.write(f"Seeding {missing} messages over {len(rooms)} rooms...")
+        rng = random.Random(existing)
+        weights = [1 / (rank + 1) for rank in range(len(WORDS))]
+        started = time.perf_counter()
+        while missing > 0:
+            size = min(batch_size, missing)
+            batch = [
+                Message(
+                    room=rng.choice(rooms),
+                    sender=user,
+                    content=' '.join(rng.choices(WORDS, weights, k=rng.randint(4, 30))),
+                )
+                for _ in range(size)
+            ]
+            with transaction.atomic():
+                Message.objects.bulk_create(batch)
+            missing -= size
+        # bulk_create skips record_message; keep the inbox columns right for these rooms
+        for room in rooms:
+            room.refresh_last_message()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"  seeded in {elapsed:.1f}s (index maintenance included)")
+
+    def time_search(self, user, query, repeat):
+        first, second, hits = [], [], 0
+        for _ in range(repeat):
+            started = time.perf_counter()
+            page = chat_search.search_messages(user, query)
+            first.append((time.perf_counter() - started) * 1000)
+            hits = len(page['results'])
+            if page['next_cursor']:
+                started = time.perf_counter()
+                chat_search.search_messages(user, query, cursor=page['next_cursor'])
+                second.append((time.perf_counter() - started) * 1000)
+        return {
+            'first_page_hits': hits,
+            'first_page_ms_p50': _percentile(first, 0.5),
+            'first_page_ms_max': round(max(first), 2),
+            'next_page_ms_p50': _percentile(second, 0.5) if second else None,
+        }
+
+    def time_like(self, user, query, repeat):
+        # What search costs without the index: a scan of every message in the user's rooms
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            chat_search._like_hits(user, query, None, None, chat_search.DEFAULT_LIMIT)
+            timings.append((time.perf_counter() - started) * 1000)
+        return {'ms_p50': _percentile(timings, 0.5), 'ms_max': round(max(timings), 2)}
+
+    def print_result(self, result):
+        search = result['search']
+        line = (
+            f"  {result['query']!r}: first page {search['first_page_ms_p50']} ms p50 "
+            f"({search['first_page_hits']} hits), next page {search['next_page_ms_p50']} ms p50"
+        )
+        if 'like_scan' in result:
+            line += f"; LIKE scan {result['like_scan']['ms_p50']} ms p50"
+        self.stdout.write(line)
@@ -0,0 +1,67 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:40
+
+from collections import defaultdict
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_direct_pairs(apps, schema_editor):
+    """
+    Key existing direct rooms (private, unnamed, exactly two members) by their
+    user pair. Where earlier races created several rooms for one pair, only the
+    oldest is keyed; the others stay reachable through their memberships.
+    """
+    Room = apps.get_model('chat', 'Room')
+    RoomMembership = apps.get_model('chat', 'RoomMembership')
+
+    candidates = list(
+        Room.objects.filter(is_private=True)
+        .filter(models.Q(name__isnull=True) | models.Q(name=''))
+        .annotate(members=models.Count('memberships'))
+        .filter(members=2)
+        .order_by('created_at', 'room_id')
+        .values_list('room_id', flat=True)
+    )
+    members = defaultdict(list)
+    for room_id, user_id in RoomMembership.objects.filter(room_id__in=candidates).values_list('room_id', 'user_id'):
+        members[room_id].append(user_id)
+
+    keyed = set()
+    for room_id in candidates:
+        pair = tuple(sorted(members[room_id]))
+        if len(pair) != 2 or pair[0] == pair[1] or pair in keyed:
+            continue
+        keyed.add(pair)
+        Room.objects.filter(room_id=room_id).update(dm_user_low_id=pair[0], dm_user_high_id=pair[1])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_message_room_created_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='dm_user_high',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='dm_user_low',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(backfill_direct_pairs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='room',
+            constraint=models.UniqueConstraint(fields=('dm_user_low', 'dm_user_high'), name='unique_direct_room_pair'),
+        ),
+        migrations.AddConstraint(
+            model_name='room',
+            constraint=models.CheckConstraint(condition=models.Q(('dm_user_low__lt', models.F('dm_user_high'))), name='direct_room_pair_ordered'),
+        ),
+    ]
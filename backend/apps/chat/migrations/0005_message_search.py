@@ -0,0 +1,87 @@
+from django.db import migrations
+
+# Full-text index over chat_message.content, read by apps/chat/search.py. Nothing
+# here is part of the model: the database maintains it on write.
+
+POSTGRES_FORWARD = [
+    # Generated columns rewrite the table once; after that every write keeps it current
+    """
+    ALTER TABLE chat_message
+    ADD COLUMN search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('english'::regconfig, content)) STORED
+    """,
+    "CREATE INDEX chat_message_search_idx ON chat_message USING GIN (search_vector)",
+]
+POSTGRES_REVERSE = [
+    "DROP INDEX IF EXISTS chat_message_search_idx",
+    "ALTER TABLE chat_message DROP COLUMN IF EXISTS search_vector",
+]
+
+# External-content FTS5 table. Django rebuilds SQLite tables for some schema changes,
+# which drops triggers: a later chat_message migration on SQLite must recreate them.
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE chat_message_fts USING fts5(
+        content, content='chat_message', content_rowid='message_id', tokenize='porter unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER chat_message_fts_insert AFTER INSERT ON chat_message BEGIN
+        INSERT INTO chat_message_fts(rowid, content) VALUES (new.message_id, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER chat_message_fts_delete AFTER DELETE ON chat_message BEGIN
+        INSERT INTO chat_message_fts(chat_message_fts, rowid, content) VALUES ('delete', old.message_id, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER chat_message_fts_update AFTER UPDATE OF content ON chat_message BEGIN
+        INSERT INTO chat_message_fts(chat_message_fts, rowid, content) VALUES ('delete', old.message_id, old.content);
+        INSERT INTO chat_message_fts(rowid, content) VALUES (new.message_id, new.content);
+    END
+    """,
+    "INSERT INTO chat_message_fts(chat_message_fts) VALUES ('rebuild')",
+]
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS chat_message_fts_insert",
+    "DROP TRIGGER IF EXISTS chat_message_fts_delete",
+    "DROP TRIGGER IF EXISTS chat_message_fts_update",
+    "DROP TABLE IF EXISTS chat_message_fts",
+]
+
+
+def _sqlite_has_fts5(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA compile_options")
+        return any(option == 'ENABLE_FTS5' for option, in cursor.fetchall())
+
+
+def _statements(connection, forward):
+    if connection.vendor == 'postgresql':
+        return POSTGRES_FORWARD if forward else POSTGRES_REVERSE
+    if connection.vendor == 'sqlite' and _sqlite_has_fts5(connection):
+        return SQLITE_FORWARD if forward else SQLITE_REVERSE
+    # Other databases search with LIKE
+    return []
+
+
+def create_search_index(apps, schema_editor):
+    for sql in _statements(schema_editor.connection, forward=True):
+        schema_editor.execute(sql, params=None)
+
+
+def drop_search_index(apps, schema_editor):
+    for sql in _statements(schema_editor.connection, forward=False):
+        schema_editor.execute(sql, params=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_direct_room_pair'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
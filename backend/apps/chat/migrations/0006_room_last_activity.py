@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:42
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def backfill_last_activity(apps, schema_editor):
+    """Point every room at its latest visible message, or its creation time without one."""
+    Room = apps.get_model('chat', 'Room')
+    Message = apps.get_model('chat', 'Message')
+
+    latest = (
+        Message.objects.filter(room=models.OuterRef('pk'), is_deleted=False)
+        .order_by('-created_at', '-message_id')
+    )
+    Room.objects.update(
+        last_message_id=models.Subquery(latest.values('message_id')[:1]),
+        last_activity_at=Coalesce(
+            models.Subquery(latest.values('created_at')[:1]), models.F('created_at')
+        ),
+    )
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_message_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='last_activity_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='last_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chat.message'),
+        ),
+        migrations.RunPython(backfill_last_activity, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='room',
+            index=models.Index(fields=['last_activity_at', 'room_id'], name='chat_room_activity_idx'),
+        ),
+    ]
@@ -1,5 +1,6 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
+from django.utils import timezone
 
 
 class Room(models.Model):
@@ -16,14 +17,73 @@ class Room(models.Model):
         related_name='rooms_created'
     )
     created_at = models.DateTimeField(auto_now_add=True)
+    # Direct (1:1) rooms only: the two users, lower id first, so a pair has one room
+    dm_user_low = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+    dm_user_high = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+    # Latest visible message and its time (room creation until there is one), kept by
+    # record_message/refresh_last_message so the inbox sorts and pages on an index
+    last_message = models.ForeignKey(
+        'Message',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+    last_activity_at = models.DateTimeField(default=timezone.now)
 
     class Meta:
         db_table = 'chat_room'
         ordering = ['-created_at']
+        indexes = [
+            # Inbox order and keyset cursor (apps/chat/inbox.py)
+            models.Index(fields=['last_activity_at', 'room_id'], name='chat_room_activity_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['dm_user_low', 'dm_user_high'], name='unique_direct_room_pair'),
+            models.CheckConstraint(
+                condition=models.Q(dm_user_low__lt=models.F('dm_user_high')),
+                name='direct_room_pair_ordered'
+            ),
+        ]
 
     def __str__(self):
         return self.name or f"Room {self.room_id}"
 
+    @staticmethod
+    def direct_pair(user_id, other_user_id):
+        """The (dm_user_low, dm_user_high) ids for a direct room between two users."""
+        return tuple(sorted((int(user_id), int(other_user_id))))
+
+    def record_message(self, message):
+        """Make a newly posted message the room's last one, unless a later one got there first."""
+        Room.objects.filter(room_id=self.room_id, last_activity_at__lte=message.created_at).update(
+            last_message=message, last_activity_at=message.created_at
+        )
+
+    def refresh_last_message(self):
+        """Recompute the last message from scratch, e.g. after it was deleted."""
+        with transaction.atomic():
+            room = Room.objects.select_for_update().get(room_id=self.room_id)
+            latest = (
+                room.messages.filter(is_deleted=False).order_by('-created_at', '-message_id')
+                .only('message_id', 'created_at').first()
+            )
+            room.last_message = latest
+            room.last_activity_at = latest.created_at if latest else room.created_at
+            room.save(update_fields=['last_message', 'last_activity_at'])
+
 
 class RoomMembership(models.Model):
     """Membership linking users to rooms with roles."""
@@ -59,4 +119,8 @@ class Message(models.Model):
     class Meta:
         db_table = 'chat_message'
         ordering = ['created_at']
+        indexes = [
+            # Latest message and unread counts per room (inbox)
+            models.Index(fields=['room', 'created_at'], name='chat_message_room_created_idx'),
+        ]
 
@@ -2,6 +2,13 @@ from rest_framework.permissions import BasePermission, SAFE_METHODS
 from .models import RoomMembership, Room, Message
 
 
+def is_room_member(user, room_id):
+    """Whether ``user`` belongs to the room; shared by the REST permissions and the WebSocket consumers."""
+    if not user or not user.is_authenticated:
+        return False
+    return RoomMembership.objects.filter(room_id=room_id, user=user).exists()
+
+
 class IsAuthenticatedAndRoomMember(BasePermission):
     message = 'You must be a member of the room to perform this action.'
 
@@ -14,7 +21,7 @@ class IsAuthenticatedAndRoomMember(BasePermission):
         if hasattr(view, 'kwargs'):
             room_id = view.kwargs.get('room_pk') or view.kwargs.get('pk')
         if room_id is not None:
-            return RoomMembership.objects.filter(room_id=room_id, user=request.user).exists()
+            return is_room_member(request.user, room_id)
         return True
 
     def has_object_permission(self, request, view, obj):
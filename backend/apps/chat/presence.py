@@ -0,0 +1,265 @@
+"""
+Room presence: who is online in each chat room and who is typing.
+
+Sockets report connects, disconnects, heartbeats and typing frames here
+instead of broadcasting each one. Every ``PRESENCE_TICK`` seconds the
+changes per room are sent as one ``presence_delta`` event to the room's
+presence group:
+
+    {"type": "presence_delta", "room_id": 12,
+     "joined": [{"user_id": 3, "user": "Ana"}], "left": [5],
+     "typing": [{"user_id": 3, "user": "Ana"}], "stopped_typing": []}
+
+Typing is debounced per user and room. Repeated ``typing`` frames only
+extend a ``TYPING_TIMEOUT`` window, and the user stops typing when it
+lapses or on ``stop_typing``. A user who connects and leaves within one
+tick produces no event at all.
+
+Each worker tracks its own sockets. Sockets that send heartbeats go
+offline after ``PRESENCE_TTL`` seconds without one. Sockets that never
+do stay online until they disconnect (the ASGI server's ping timeout
+closes dead ones). Workers learn about each other's users from the
+deltas, which carry the sending worker's id (``worker``). Remote users are
+tracked per worker, so a user connected to several workers only goes
+offline, and only reaches clients in ``left``, once the last of them lets
+go. Workers also repeat their online users (``present``) every half TTL,
+so ``who_is_online`` on any worker covers the whole room and drops users
+of a worker that went away.
+"""
+import asyncio
+import logging
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+logger = logging.getLogger('apps.chat')
+
+
+def presence_group_name(room_id) -> str:
+    return f'chat_{room_id}_presence'
+
+
+class LocalUser:
+    __slots__ = ('name', 'sockets', 'seen', 'heartbeats', 'expired')
+
+    def __init__(self, name, now):
+        self.name = name
+        self.sockets = 0
+        self.seen = now
+        self.heartbeats = False  # the TTL applies once the client sends heartbeats
+        self.expired = False
+
+
+class RoomPresence:
+    __slots__ = ('local', 'online', 'remote', 'typing', 'joined', 'left', 'started', 'stopped',
+                 'refreshed_at')
+
+    def __init__(self, now):
+        self.local: Dict[int, LocalUser] = {}
+        self.online: Dict[int, Dict] = {}  # user_id -> {'user_id', 'user'}, this worker's and others'
+        self.remote: Dict[int, Dict[str, float]] = {}  # other workers' users -> {worker: when it lapses}
+        self.typing: Dict[int, float] = {}  # local typers -> end of their typing window
+        # Changes since the last tick
+        self.joined: Dict[int, str] = {}
+        self.left = set()
+        self.started: Dict[int, str] = {}
+        self.stopped = set()
+        self.refreshed_at = now
+
+    def is_idle(self):
+        return not (self.local or self.online or self.remote or self.joined or self.left or self.started or self.stopped)
+
+
+class PresenceTracker:
+    """Per-process presence state. Only used from the event loop, so it needs no locking."""
+
+    def __init__(self, tick: Optional[float] = None, ttl: Optional[float] = None,
+                 typing_timeout: Optional[float] = None, clock=time.monotonic, worker_id: Optional[str] = None):
+        self.tick = tick or getattr(settings, 'PRESENCE_TICK', 1.0)
+        self.ttl = ttl or getattr(settings, 'PRESENCE_TTL', 60)
+        self.typing_timeout = typing_timeout or getattr(settings, 'TYPING_TIMEOUT', 6)
+        self.clock = clock
+        self.worker_id = worker_id or uuid.uuid4().hex[:12]
+        self._rooms: Dict[int, RoomPresence] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def connect(self, room_id, user_id, name):
+        room = self._rooms.get(int(room_id))
+        if room is None:
+            room = self._rooms[int(room_id)] = RoomPresence(self.clock())
+        user = room.local.get(user_id)
+        if user is None:
+            user = room.local[user_id] = LocalUser(name, self.clock())
+        user.sockets += 1
+        if user.sockets == 1 or user.expired:
+            self._mark_online(room, user_id, user)
+
+    def disconnect(self, room_id, user_id):
+        room = self._rooms.get(int(room_id))
+        user = room.local.get(user_id) if room else None
+        if user is None:
+            return
+        user.sockets -= 1
+        if user.sockets <= 0:
+            del room.local[user_id]
+            if not user.expired:
+                self._mark_offline(room, user_id)
+
+    def heartbeat(self, room_id, user_id):
+        room = self._rooms.get(int(room_id))
+        user = room.local.get(user_id) if room else None
+        if user is None:
+            return
+        user.seen = self.clock()
+        user.heartbeats = True
+        if user.expired:
+            self._mark_online(room, user_id, user)
+
+    def typing(self, room_id, user_id):
+        room = self._rooms.get(int(room_id))
+        user = room.local.get(user_id) if room else None
+        if user is None or user.expired:
+            return
+        if user_id not in room.typing:
+            if user_id in room.stopped:
+                room.stopped.discard(user_id)
+            else:
+                room.started[user_id] = user.name
+        room.typing[user_id] = self.clock() + self.typing_timeout
+
+    def stop_typing(self, room_id, user_id):
+        room = self._rooms.get(int(room_id))
+        if room is not None:
+            self._stop_typing(room, user_id)
+
+    def who_is_online(self, room_id) -> List[Dict]:
+        room = self._rooms.get(int(room_id))
+        return list(room.online.values()) if room else []
+
+    def is_online(self, room_id, user_id) -> bool:
+        room = self._rooms.get(int(room_id))
+        return room is not None and user_id in room.online
+
+    def apply(self, delta: Dict) -> Dict:
+        """
+        Take in a delta from the presence group and return it as clients
+        should see it: ``left`` only lists users no worker has online any
+        more. Idempotent, as every local socket applies it.
+        """
+        room = self._rooms.get(int(delta['room_id']))
+        if room is None:
+            return delta
+        worker = delta.get('worker', '')
+        if worker != self.worker_id:
+            expires = self.clock() + self.ttl
+            for entry in delta.get('joined', []) + delta.get('present', []):
+                user_id = entry['user_id']
+                room.remote.setdefault(user_id, {})[worker] = expires
+                if user_id not in room.local:
+                    room.online[user_id] = {'user_id': user_id, 'user': entry['user']}
+            for user_id in delta.get('left', []):
+                workers = room.remote.get(user_id)
+                if workers is not None:
+                    workers.pop(worker, None)
+                    if not workers:
+                        del room.remote[user_id]
+                if user_id not in room.local and user_id not in room.remote:
+                    room.online.pop(user_id, None)
+        left = [user_id for user_id in delta.get('left', []) if user_id not in room.online]
+        if len(left) == len(delta.get('left', [])):
+            return delta
+        return {**delta, 'left': left}
+
+    def collect(self) -> Dict[int, Dict]:
+        """Apply timeouts and take each room's changes since the last tick as a delta."""
+        now = self.clock()
+        deltas = {}
+        for room_id, room in list(self._rooms.items()):
+            for user_id, until in list(room.typing.items()):
+                if until <= now:
+                    self._stop_typing(room, user_id)
+            for user_id, user in room.local.items():
+                if user.heartbeats and not user.expired and user.seen + self.ttl <= now:
+                    user.expired = True
+                    self._mark_offline(room, user_id)
+            for user_id, workers in list(room.remote.items()):
+                for worker, expires in list(workers.items()):
+                    if expires <= now:
+                        del workers[worker]
+                if not workers:
+                    del room.remote[user_id]
+                    if user_id not in room.local:
+                        room.online.pop(user_id, None)
+
+            present = None
+            if room.local and now - room.refreshed_at >= self.ttl / 2:
+                present = [{'user_id': user_id, 'user': user.name}
+                           for user_id, user in room.local.items() if not user.expired]
+                room.refreshed_at = now
+
+            if room.joined or room.left or room.started or room.stopped or present:
+                delta = {
+                    'type': 'presence_delta',
+                    'room_id': room_id,
+                    'worker': self.worker_id,
+                    'joined': [{'user_id': user_id, 'user': name} for user_id, name in room.joined.items()],
+                    'left': sorted(room.left),
+                    'typing': [{'user_id': user_id, 'user': name} for user_id, name in room.started.items()],
+                    'stopped_typing': sorted(room.stopped),
+                }
+                if present:
+                    delta['present'] = present
+                deltas[room_id] = delta
+                room.joined, room.left, room.started, room.stopped = {}, set(), {}, set()
+
+            if room.is_idle():
+                del self._rooms[room_id]
+        return deltas
+
+    def ensure_running(self):
+        """Start the tick loop on the running event loop, if it is not running there already."""
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        channel_layer = get_channel_layer()
+        while self._rooms:
+            await asyncio.sleep(self.tick)
+            for room_id, delta in self.collect().items():
+                try:
+                    await channel_layer.group_send(presence_group_name(room_id), delta)
+                except Exception as e:
+                    logger.warning(f"Presence: Failed to send delta for room {room_id}: {e}")
+
+    def _mark_online(self, room, user_id, user):
+        user.expired = False
+        # Announced even when another worker has the user, so it counts this one too
+        if user_id in room.left:
+            room.left.discard(user_id)
+        else:
+            room.joined[user_id] = user.name
+        room.online[user_id] = {'user_id': user_id, 'user': user.name}
+
+    def _mark_offline(self, room, user_id):
+        self._stop_typing(room, user_id)
+        if user_id not in room.remote:
+            room.online.pop(user_id, None)
+        if user_id in room.joined:
+            del room.joined[user_id]
+        else:
+            room.left.add(user_id)
+
+    def _stop_typing(self, room, user_id):
+        if room.typing.pop(user_id, None) is None:
+            return
+        if user_id in room.started:
+            del room.started[user_id]
+        else:
+            room.stopped.add(user_id)
+
+
+presence = PresenceTracker()
@@ -0,0 +1,206 @@
+"""
+Full-text search over chat messages, limited to the rooms the user belongs to.
+
+Results are ranked best match first, each with a highlighted snippet, and
+paged by a keyset cursor on (rank, message id). The index depends on the
+database; migration 0005 creates it:
+
+- PostgreSQL: a stored ``search_vector`` tsvector column generated from
+  ``content`` with a GIN index, kept current by the database on every
+  write. Queries use ``websearch_to_tsquery`` (quotes, ``or`` and ``-word``
+  work as in web search engines), ranked by ``ts_rank_cd``; ``ts_headline``
+  runs on the returned page only.
+- SQLite (development): an external-content FTS5 table, ``chat_message_fts``,
+  kept in sync by triggers, ranked by bm25.
+- Anything else, or SQLite without the FTS5 table: a ``LIKE`` scan, newest
+  first.
+
+Snippets are HTML-escaped with matches wrapped in ``<mark>``.
+"""
+import base64
+import html
+import re
+from typing import Dict, List, Optional, Tuple
+
+from django.db import connection
+
+from .inbox import InvalidCursor
+from .models import Message
+
+SEARCH_CONFIG = 'english'  # text search configuration of the PostgreSQL index (migration 0005)
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+MAX_QUERY_LENGTH = 200
+SNIPPET_WORDS = 24
+
+# Highlight markers: private-use characters that cannot clash with escaping
+_START, _STOP = '\ue000', '\ue001'
+_TERM_RE = re.compile(r'\w+')
+
+
+def encode_cursor(rank: float, message_id: int) -> str:
+    raw = f"{rank!r}|{message_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[float, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        rank, message_id = raw.rsplit('|', 1)
+        return float(rank), int(message_id)
+    except (ValueError, UnicodeError) as e:
+        raise InvalidCursor(str(e))
+
+
+def search_terms(query: str) -> List[str]:
+    return _TERM_RE.findall(query.lower())
+
+
+def search_messages(user, query: str, room_id: Optional[int] = None, cursor: Optional[str] = None,
+                    limit: int = DEFAULT_LIMIT) -> Dict:
+    """One page of matches: ``results`` and the ``next_cursor`` (None on the last page)."""
+    after = decode_cursor(cursor) if cursor else None
+    query = query[:MAX_QUERY_LENGTH]
+    if not search_terms(query):
+        return {'results': [], 'next_cursor': None, 'has_more': False}
+
+    backend = search_backend()
+    if backend == 'postgresql':
+        hits = _postgres_hits(user.pk, query, room_id, after, limit + 1)
+    elif backend == 'fts5':
+        hits = _fts5_hits(user.pk, query, room_id, after, limit + 1)
+    else:
+        hits = _like_hits(user, query, room_id, after, limit + 1)
+    has_more = len(hits) > limit
+    hits = hits[:limit]
+
+    messages = Message.objects.select_related('sender', 'room').in_bulk([message_id for message_id, _, _ in hits])
+    results = [
+        _entry(messages[message_id], rank, snippet)
+        for message_id, rank, snippet in hits if message_id in messages
+    ]
+    next_cursor = encode_cursor(hits[-1][1], hits[-1][0]) if has_more else None
+    return {'results': results, 'next_cursor': next_cursor, 'has_more': has_more}
+
+
+def search_backend() -> str:
+    """'postgresql', 'fts5' or 'like', by database and what migration 0005 could set up."""
+    if connection.vendor == 'postgresql':
+        return 'postgresql'
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as c:
+            c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chat_message_fts'")
+            if c.fetchone():
+                return 'fts5'
+    return 'like'
+
+
+def _after_clause(after) -> Tuple[str, list]:
+    if after is None:
+        return '', []
+    rank, message_id = after
+    return 'AND (rank < %s OR (rank = %s AND message_id < %s))', [rank, rank, message_id]
+
+
+def _room_clause(room_id) -> Tuple[str, list]:
+    if room_id is None:
+        return '', []
+    return 'AND m.room_id = %s', [room_id]
+
+
+def _postgres_hits(user_id, query, room_id, after, limit):
+    room_sql, room_params = _room_clause(room_id)
+    after_sql, after_params = _after_clause(after)
+    # The inner query pages on the index; headlines are only built for the page
+    sql = f"""
+        SELECT message_id, rank,
+               ts_headline(%s::regconfig, content, query, %s) AS snippet
+        FROM (
+            SELECT message_id, content, query, rank FROM (
+                SELECT m.message_id, m.content, query,
+                       ts_rank_cd(m.search_vector, query)::float8 AS rank
+                FROM chat_message m, websearch_to_tsquery(%s::regconfig, %s) query
+                WHERE m.search_vector @@ query
+                  AND NOT m.is_deleted
+                  AND m.room_id IN (SELECT room_id FROM chat_room_membership WHERE user_id = %s)
+                  {room_sql}
+            ) matches
+            WHERE TRUE {after_sql}
+            ORDER BY rank DESC, message_id DESC
+            LIMIT %s
+        ) page
+        ORDER BY rank DESC, message_id DESC
+    """
+    options = f'StartSel="{_START}", StopSel="{_STOP}", MaxWords={SNIPPET_WORDS}, MinWords=8, MaxFragments=2'
+    params = [SEARCH_CONFIG, options, SEARCH_CONFIG, query, user_id, *room_params, *after_params, limit]
+    with connection.cursor() as c:
+        c.execute(sql, params)
+        return [(message_id, rank, _highlight_html(snippet)) for message_id, rank, snippet in c.fetchall()]
+
+
+def _fts5_hits(user_id, query, room_id, after, limit):
+    room_sql, room_params = _room_clause(room_id)
+    after_sql, after_params = _after_clause(after)
+    # Quoted terms: user input never reaches the FTS5 query syntax
+    match = ' '.join(f'"{term}"' for term in search_terms(query))
+    sql = f"""
+        SELECT message_id, rank, snippet FROM (
+            SELECT m.message_id AS message_id, -bm25(chat_message_fts) AS rank,
+                   snippet(chat_message_fts, 0, %s, %s, '…', %s) AS snippet
+            FROM chat_message_fts JOIN chat_message m ON m.message_id = chat_message_fts.rowid
+            WHERE chat_message_fts MATCH %s
+              AND NOT m.is_deleted
+              AND m.room_id IN (SELECT room_id FROM chat_room_membership WHERE user_id = %s)
+              {room_sql}
+        )
+        WHERE 1 {after_sql}
+        ORDER BY rank DESC, message_id DESC
+        LIMIT %s
+    """
+    params = [_START, _STOP, SNIPPET_WORDS, match, user_id, *room_params, *after_params, limit]
+    with connection.cursor() as c:
+        c.execute(sql, params)
+        return [(message_id, rank, _highlight_html(snippet)) for message_id, rank, snippet in c.fetchall()]
+
+
+def _like_hits(user, query, room_id, after, limit):
+    # Unranked: every hit has rank 0, so the cursor pages newest first by id
+    terms = search_terms(query)
+    queryset = Message.objects.filter(room__memberships__user=user, is_deleted=False)
+    if room_id is not None:
+        queryset = queryset.filter(room_id=room_id)
+    for term in terms:
+        queryset = queryset.filter(content__icontains=term)
+    if after is not None:
+        queryset = queryset.filter(message_id__lt=after[1])
+    rows = queryset.order_by('-message_id').values_list('message_id', 'content')[:limit]
+    return [(message_id, 0.0, _highlight_html(_snippet(content, terms))) for message_id, content in rows]
+
+
+def _snippet(content: str, terms: List[str]) -> str:
+    """A window of words around the first match, with matches marked (LIKE fallback)."""
+    pattern = re.compile('|'.join(re.escape(term) for term in terms), re.IGNORECASE)
+    words = content.split()
+    first = next((i for i, word in enumerate(words) if pattern.search(word)), 0)
+    start = max(first - SNIPPET_WORDS // 3, 0)
+    window = ' '.join(words[start:start + SNIPPET_WORDS])
+    marked = pattern.sub(lambda m: f'{_START}{m.group(0)}{_STOP}', window)
+    return ('…' if start else '') + marked + ('…' if start + SNIPPET_WORDS < len(words) else '')
+
+
+def _highlight_html(snippet: Optional[str]) -> str:
+    return html.escape(snippet or '').replace(_START, '<mark>').replace(_STOP, '</mark>')
+
+
+def _entry(message: Message, rank: float, snippet: str) -> Dict:
+    return {
+        'message_id': message.message_id,
+        'room_id': message.room_id,
+        'room_name': message.room.name,
+        'sender_id': message.sender_id,
+        'sender_username': message.sender.name,
+        'message_type': message.message_type,
+        'created_at': message.created_at,
+        'snippet': snippet,
+        'rank': rank,
+    }
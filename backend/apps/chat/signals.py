@@ -0,0 +1,31 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .auth import invalidate_membership, invalidate_token, invalidate_user_tokens
+from .models import RoomMembership
+
+User = get_user_model()
+
+
+# Keep the WebSocket auth cache in step with logout, token rotation and account changes
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def token_changed(sender, instance, **kwargs):
+    invalidate_token(instance.key)
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, update_fields=None, **kwargs):
+    # Logins only touch last_login, which cached sockets do not use
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    invalidate_user_tokens(instance.pk)
+
+
+# Membership changes (invites, leaving, room deletion cascades) take effect for sockets at once
+@receiver(post_save, sender=RoomMembership)
+@receiver(post_delete, sender=RoomMembership)
+def membership_changed(sender, instance, **kwargs):
+    invalidate_membership(instance.room_id, instance.user_id)
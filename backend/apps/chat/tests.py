@@ -1,8 +1,28 @@
-from django.test import TestCase
+import asyncio
+import json
+
+from django.db import IntegrityError, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from unittest.mock import patch
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from channels.generic.websocket import AsyncWebsocketConsumer
+from channels.testing import WebsocketCommunicator
 from rest_framework.test import APIClient
 from rest_framework.authtoken.models import Token
-from chat.models import Room, RoomMembership, Message
+from .auth import get_user_for_token, is_room_member_cached
+from .consumers import ChatConsumer
+from .delivery import unread_totals
+from .inbox import inbox_page
+from .search import search_backend, search_messages
+from .history import RoomHistory, message_event, room_history
+from .presence import PresenceTracker, presence
+from .models import Room, RoomMembership, Message
+from .views import send_room_notification
+from core.websocket.multiplex import MultiplexConsumer, resolve_topic
+from core.websocket.outbox import EVICTED_CLOSE_CODE, OutboxMixin, outbox_metrics
 
 
 User = get_user_model()
@@ -53,14 +73,14 @@ class ChatApiTests(TestCase):
 
         # Owner invites member
         resp = self.client_owner.post(f'{self.base}/rooms/{room_id}/invite/', {
-            'user_id': self.user_member.pk,
+            'email': self.user_member.email,
         }, format='json')
         self.assertEqual(resp.status_code, 200, resp.content)
         self.assertTrue(RoomMembership.objects.filter(room=room, user=self.user_member).exists())
 
         # Non-admin cannot invite
         resp = self.client_member.post(f'{self.base}/rooms/{room_id}/invite/', {
-            'user_id': self.user_other.pk,
+            'email': self.user_other.email,
         }, format='json')
         self.assertIn(resp.status_code, (403, 404))
 
@@ -79,13 +99,13 @@ class ChatApiTests(TestCase):
     def test_direct_room_endpoint(self):
         # Owner creates/gets direct room with member
         resp = self.client_owner.post(f'{self.base}/rooms/direct/', {
-            'user_id': self.user_member.pk,
+            'email': self.user_member.email,
         }, format='json')
         self.assertEqual(resp.status_code, 201, resp.content)
         room_id = resp.data['room_id']
         # Calling again returns same room (200 OK implied by serializer response)
         resp2 = self.client_owner.post(f'{self.base}/rooms/direct/', {
-            'user_id': self.user_member.pk,
+            'email': self.user_member.email,
         }, format='json')
         # Endpoint returns existing room with 200 when found, 201 when created
         self.assertIn(resp2.status_code, (200, 201), resp2.content)
@@ -158,3 +178,727 @@ class ChatApiTests(TestCase):
         self.assertEqual(resp.status_code, 400)
 
 # Create your tests here.
+
+
+class MultiplexConsumerTests(TransactionTestCase):
+    """One socket subscribing to several topics"""
+
+    def setUp(self):
+        cache.clear()  # flushed tables bypass the invalidation signals
+        self.user = User.objects.create_user(email='stream@example.com', name='Stream', password='pass123')
+        self.other = User.objects.create_user(email='other@example.com', name='Other', password='pass123')
+        self.room = Room.objects.create(name='Design', created_by=self.user)
+        RoomMembership.objects.create(room=self.room, user=self.user, is_admin=True)
+        self.other_room = Room.objects.create(name='Private', created_by=self.other)
+        RoomMembership.objects.create(room=self.other_room, user=self.other, is_admin=True)
+
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(MultiplexConsumer.as_asgi(), "/ws/stream/")
+        communicator.scope["user"] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual((await communicator.receive_json_from())['type'], 'connected')
+        return communicator
+
+    async def subscribe(self, communicator, topic):
+        await communicator.send_json_to({'action': 'subscribe', 'topic': topic})
+        return await communicator.receive_json_from()
+
+    def test_resolve_topic(self):
+        self.assertEqual(resolve_topic('notifications', 7)['group'], 'user_7_notifications')
+        self.assertEqual(resolve_topic('chat.12', 7), {'group': 'chat_12', 'room_id': 12})
+        self.assertEqual(resolve_topic('presence.12', 7)['group'], 'chat_12_presence')
+        for topic in ('chat', 'notifications.3', 'unknown', 'chat.x', None, 5):
+            self.assertIsNone(resolve_topic(topic, 7))
+
+    async def test_requires_authentication(self):
+        from django.contrib.auth.models import AnonymousUser
+        communicator = WebsocketCommunicator(MultiplexConsumer.as_asgi(), "/ws/stream/")
+        communicator.scope["user"] = AnonymousUser()
+        connected, _ = await communicator.connect()
+        self.assertFalse(connected)
+
+    async def test_streams_are_tagged_by_topic(self):
+        communicator = await self.connect(self.user)
+        for topic in ('notifications', 'chat_notifications', f'chat.{self.room.room_id}'):
+            self.assertEqual(await self.subscribe(communicator, topic), {'type': 'subscribed', 'topic': topic})
+
+        layer = get_channel_layer()
+        await layer.group_send(f'user_{self.user.user_id}_notifications', {
+            'type': 'notification_message', 'notification': {'id': 1, 'type': 'test'}})
+        event = await communicator.receive_json_from()
+        self.assertEqual((event['topic'], event['type']), ('notifications', 'notification'))
+
+        await layer.group_send(f'user_{self.user.user_id}_chat_notifications', {
+            'type': 'new_message_notification', 'room_id': self.room.room_id, 'message': {}, 'sender': 'Other'})
+        event = await communicator.receive_json_from()
+        self.assertEqual((event['topic'], event['type']), ('chat_notifications', 'new_message'))
+
+        await sync_to_async(send_room_notification)(self.room.room_id, 'chat_message', {
+            'message': {'content': 'hi'}, 'user': 'Other', 'user_id': self.other.user_id})
+        event = await communicator.receive_json_from()
+        self.assertEqual(event['topic'], f'chat.{self.room.room_id}')
+        self.assertEqual(event['message'], {'content': 'hi'})
+
+        # Project updates were not subscribed to
+        await layer.group_send(f'user_{self.user.user_id}_updates', {'type': 'project_event', 'data': {}})
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+    async def test_room_topics_require_membership(self):
+        communicator = await self.connect(self.user)
+        for topic in (f'chat.{self.other_room.room_id}', f'presence.{self.other_room.room_id}'):
+            response = await self.subscribe(communicator, topic)
+            self.assertEqual((response['type'], response['topic']), ('error', topic))
+        self.assertEqual((await self.subscribe(communicator, 'bogus'))['type'], 'error')
+        for action in ('subscribe', 'unsubscribe'):
+            for topic in (['chat.1'], {'room': 1}, None):
+                await communicator.send_json_to({'action': action, 'topic': topic})
+                self.assertEqual((await communicator.receive_json_from())['type'], 'error')
+
+        await communicator.send_json_to({'action': 'typing', 'room_id': self.other_room.room_id})
+        self.assertEqual((await communicator.receive_json_from())['type'], 'error')
+        await communicator.disconnect()
+
+    async def test_presence_deltas_are_batched(self):
+        communicator = await self.connect(self.user)
+        presence_topic = f'presence.{self.room.room_id}'
+        with patch.object(presence, 'tick', 0.05):
+            await self.subscribe(communicator, f'chat.{self.room.room_id}')
+            await self.subscribe(communicator, presence_topic)
+            delta = await communicator.receive_json_from()
+            self.assertEqual((delta['topic'], delta['type']), (presence_topic, 'presence_delta'))
+            self.assertEqual(delta['joined'], [{'user_id': self.user.user_id, 'user': 'Stream'}])
+
+            # Repeated typing frames become one delta
+            for _ in range(3):
+                await communicator.send_json_to({'action': 'typing', 'room_id': self.room.room_id})
+            delta = await communicator.receive_json_from()
+            self.assertEqual(delta['typing'], [{'user_id': self.user.user_id, 'user': 'Stream'}])
+            self.assertTrue(await communicator.receive_nothing(0.15))
+
+            await communicator.send_json_to({'action': 'who_is_online', 'room_id': self.room.room_id})
+            response = await communicator.receive_json_from()
+            self.assertEqual((response['type'], response['online']),
+                             ('presence', [{'user_id': self.user.user_id, 'user': 'Stream'}]))
+
+            await communicator.send_json_to({'action': 'unsubscribe', 'topic': presence_topic})
+            self.assertEqual(await communicator.receive_json_from(), {'type': 'unsubscribed', 'topic': presence_topic})
+            await communicator.send_json_to({'action': 'stop_typing', 'room_id': self.room.room_id})
+            self.assertTrue(await communicator.receive_nothing(0.15))
+        await communicator.disconnect()
+
+
+class PresenceTrackerTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 100.0
+        self.tracker = PresenceTracker(tick=1, ttl=60, typing_timeout=5, clock=lambda: self.now)
+
+    def test_joins_and_typing_are_coalesced_per_tick(self):
+        self.tracker.connect(1, 10, 'Ana')
+        self.tracker.connect(1, 10, 'Ana')  # second tab
+        self.tracker.connect(1, 11, 'Ben')
+        self.tracker.disconnect(1, 11)  # in and out within the tick
+        for _ in range(5):
+            self.tracker.typing(1, 10)
+        delta = self.tracker.collect()[1]
+        self.assertEqual(delta['joined'], [{'user_id': 10, 'user': 'Ana'}])
+        self.assertEqual((delta['left'], delta['typing']), ([], [{'user_id': 10, 'user': 'Ana'}]))
+        self.assertEqual(self.tracker.collect(), {})
+
+        self.now += 6  # typing window lapsed
+        self.assertEqual(self.tracker.collect()[1]['stopped_typing'], [10])
+
+        self.tracker.disconnect(1, 10)
+        self.assertEqual(self.tracker.collect(), {})  # Ana still has a tab open
+        self.tracker.disconnect(1, 10)
+        self.assertEqual(self.tracker.collect()[1]['left'], [10])
+        self.assertEqual(self.tracker.who_is_online(1), [])
+
+    def test_heartbeat_ttl_and_remote_deltas(self):
+        self.tracker.connect(1, 10, 'Ana')
+        self.tracker.heartbeat(1, 10)
+        self.tracker.apply({'room_id': 1, 'joined': [{'user_id': 20, 'user': 'Remote'}], 'left': []})
+        self.tracker.collect()
+        self.assertEqual({u['user_id'] for u in self.tracker.who_is_online(1)}, {10, 20})
+
+        self.now += 30
+        self.assertEqual(self.tracker.collect()[1]['present'], [{'user_id': 10, 'user': 'Ana'}])
+        self.now += 31  # no heartbeat from Ana, no refresh from the remote worker
+        self.assertEqual(self.tracker.collect()[1]['left'], [10])
+        self.assertEqual(self.tracker.who_is_online(1), [])
+
+        self.tracker.heartbeat(1, 10)  # the socket was alive after all
+        self.assertEqual(self.tracker.collect()[1]['joined'], [{'user_id': 10, 'user': 'Ana'}])
+
+    def test_user_stays_online_while_any_worker_has_them(self):
+        self.tracker.connect(1, 11, 'Ben')
+        joined = {'room_id': 1, 'joined': [{'user_id': 10, 'user': 'Ana'}], 'left': []}
+        self.tracker.apply({**joined, 'worker': 'a'})
+        self.tracker.apply({**joined, 'worker': 'b'})
+        self.tracker.collect()
+        # Already online elsewhere, but the other workers still need to hear about this one
+        self.tracker.connect(1, 10, 'Ana')
+        own = self.tracker.collect()[1]
+        self.assertEqual((own['worker'], own['joined']), (self.tracker.worker_id, [{'user_id': 10, 'user': 'Ana'}]))
+        self.assertEqual(self.tracker.apply(own), own)
+
+        # Ana closes her tab on worker A: still online through B and here
+        left = {'room_id': 1, 'joined': [], 'left': [10], 'worker': 'a'}
+        self.assertEqual(self.tracker.apply(left)['left'], [])
+        self.assertEqual(self.tracker.apply(left)['left'], [])  # every socket applies it
+        # ... and here: worker B still has her
+        self.tracker.disconnect(1, 10)
+        own = self.tracker.collect()[1]
+        self.assertEqual(own['left'], [10])  # the other workers must drop this worker's entry
+        self.assertEqual(self.tracker.apply(own)['left'], [])
+        self.assertIn({'user_id': 10, 'user': 'Ana'}, self.tracker.who_is_online(1))
+
+        self.assertEqual(self.tracker.apply({**left, 'worker': 'b'})['left'], [10])
+        self.assertEqual(self.tracker.who_is_online(1), [{'user_id': 11, 'user': 'Ben'}])
+
+
+def _event(message_id):
+    return {'type': 'chat_message', 'message': {'message_id': message_id}, 'user': 'Owner', 'user_id': 1}
+
+
+class RoomHistoryTests(SimpleTestCase):
+    def test_replays_from_memory_only_above_floor(self):
+        history = RoomHistory(size=3)
+        self.assertTrue(history.join(1))
+        self.assertFalse(history.join(1))
+        self.assertIsNone(history.since(1, 0))  # not seeded yet
+
+        history.seed(1, [_event(10), _event(12)], complete=False)
+        history.add(1, _event(12))  # duplicate delivery
+        history.add(1, _event(15))
+        self.assertEqual([e['message']['message_id'] for e in history.since(1, 10)], [12, 15])
+        self.assertIsNone(history.since(1, 8))  # older than the buffer
+
+        history.add(1, _event(14))  # out of order; evicts 10
+        self.assertEqual([e['message']['message_id'] for e in history.since(1, 10)], [12, 14, 15])
+        self.assertIsNone(history.since(1, 9))
+
+        history.discard(1, 14)
+        self.assertEqual([e['message']['message_id'] for e in history.since(1, 12)], [15])
+
+        history.leave(1)
+        history.leave(1)
+        self.assertIsNone(history.since(1, 12))
+
+    def test_complete_seed_covers_whole_room(self):
+        history = RoomHistory(size=5)
+        history.join(2)
+        history.seed(2, [_event(4)], complete=True)
+        self.assertEqual(len(history.since(2, 0)), 1)
+
+
+class ChatResumeTests(TransactionTestCase):
+    """Reconnecting ChatConsumer sockets replay what they missed"""
+
+    def setUp(self):
+        cache.clear()  # flushed tables bypass the invalidation signals
+        self.user = User.objects.create_user(email='resume@example.com', name='Resume', password='pass123')
+        self.room = Room.objects.create(name='Design', created_by=self.user)
+        RoomMembership.objects.create(room=self.room, user=self.user, is_admin=True)
+        self.messages = [
+            Message.objects.create(room=self.room, sender=self.user, content=f'message {i}') for i in range(5)
+        ]
+
+    async def connect(self, query=''):
+        communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), f"/ws/chat/{self.room.room_id}/{query}")
+        communicator.scope["user"] = self.user
+        communicator.scope["url_route"] = {'kwargs': {'room_id': str(self.room.room_id)}}
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def receive_until(self, communicator, event_type):
+        events = []
+        while True:
+            event = await communicator.receive_json_from()
+            events.append(event)
+            if event['type'] == event_type:
+                return events
+
+    async def test_resume_from_database_then_memory(self):
+        last_seen = self.messages[1].message_id
+        first = await self.connect(f'?last_message_id={last_seen}')
+        events = await self.receive_until(first, 'resume')
+        self.assertEqual([e['message']['message_id'] for e in events[:-1]],
+                         [m.message_id for m in self.messages[2:]])
+        # The room's buffer was seeded on first join, so the replay came from it
+        self.assertEqual(events[-1]['source'], 'memory')
+        self.assertTrue(events[-1]['complete'])
+
+        # A second socket resuming while the first keeps the buffer alive
+        second = await self.connect(f'?last_message_id={self.messages[3].message_id}')
+        events = await self.receive_until(second, 'resume')
+        self.assertEqual(events[0]['message']['message_id'], self.messages[4].message_id)
+        self.assertEqual((events[-1]['source'], events[-1]['replayed']), ('memory', 1))
+        await second.disconnect()
+        await first.disconnect()
+        self.assertIsNone(room_history.since(self.room.room_id, 0))
+
+    async def test_resume_falls_back_to_keyset_query(self):
+        with self.settings(CHAT_RESUME_LIMIT=2):
+            original_size = room_history.size
+            room_history.size = 2  # seed only the newest two messages
+            try:
+                communicator = await self.connect(f'?last_message_id={self.messages[0].message_id}')
+                events = await self.receive_until(communicator, 'resume')
+            finally:
+                room_history.size = original_size
+        resume = events[-1]
+        self.assertEqual((resume['source'], resume['replayed'], resume['complete']), ('database', 2, False))
+        self.assertEqual(resume['last_message_id'], self.messages[2].message_id)
+
+        # A replayed message delivered live as well is not sent twice
+        event = await sync_to_async(message_event)(self.messages[2])
+        await get_channel_layer().group_send(f'chat_{self.room.room_id}', event)
+        snapshot = await communicator.receive_json_from()
+        self.assertEqual(snapshot['type'], 'presence')
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+
+class WebSocketAuthCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='ws@example.com', name='Socket', password='pass123')
+        self.token = Token.objects.create(user=self.user)
+        self.room = Room.objects.create(name='Design', created_by=self.user)
+
+    def test_token_lookups_are_cached_until_logout(self):
+        self.assertEqual(get_user_for_token(self.token.key), self.user)
+        self.assertFalse(get_user_for_token('unknown').is_authenticated)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_user_for_token(self.token.key), self.user)
+            self.assertFalse(get_user_for_token('unknown').is_authenticated)
+
+        key = self.token.key
+        self.token.delete()  # logout
+        self.assertFalse(get_user_for_token(key).is_authenticated)
+
+    def test_deactivated_user_is_dropped(self):
+        get_user_for_token(self.token.key)
+        self.user.is_active = False
+        self.user.save()
+        self.assertFalse(get_user_for_token(self.token.key).is_authenticated)
+
+    def test_membership_is_cached_and_invalidated(self):
+        self.assertFalse(is_room_member_cached(self.user, self.room.room_id))
+        membership = RoomMembership.objects.create(room=self.room, user=self.user)
+        with self.assertNumQueries(1):
+            self.assertTrue(is_room_member_cached(self.user, self.room.room_id))
+            self.assertTrue(is_room_member_cached(self.user, self.room.room_id))
+        membership.delete()
+        self.assertFalse(is_room_member_cached(self.user, self.room.room_id))
+
+
+class InboxTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='inbox@example.com', name='Inbox', password='pass123')
+        self.friend = User.objects.create_user(email='friend@example.com', name='Friend', password='pass123')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.user).key}')
+
+        self.quiet = self.make_room('Quiet')
+        self.direct = self.make_room(None, is_private=True)
+        self.busy = self.make_room('Busy')
+        self.post(self.direct, self.user, 'hello')
+        self.post(self.busy, self.friend, 'x' * 200)
+        Message.objects.create(room=self.busy, sender=self.friend, content='second', is_deleted=True)
+
+    def make_room(self, name, is_private=False):
+        room = Room.objects.create(name=name, is_private=is_private, created_by=self.user)
+        RoomMembership.objects.create(room=room, user=self.user, is_admin=True)
+        RoomMembership.objects.create(room=room, user=self.friend)
+        return room
+
+    def post(self, room, sender, content):
+        message = Message.objects.create(room=room, sender=sender, content=content)
+        room.record_message(message)
+        return message
+
+    def test_rooms_sorted_by_activity_with_counts(self):
+        resp = self.client.get('/api/chat/rooms/inbox/')
+        self.assertEqual(resp.status_code, 200, resp.content)
+        rooms = resp.data['results']
+        self.assertEqual([r['room_id'] for r in rooms], [self.busy.room_id, self.direct.room_id, self.quiet.room_id])
+
+        busy, direct, quiet = rooms
+        self.assertEqual((busy['members_count'], busy['unread_count']), (2, 1))  # deleted message not counted
+        self.assertTrue(busy['last_message']['truncated'])
+        self.assertEqual(direct['display_name'], 'Friend')
+        self.assertEqual(direct['unread_count'], 0)  # own message
+        self.assertIsNone(quiet['last_message'])
+        self.assertIsNone(resp.data['next_cursor'])
+
+    def test_constant_queries_and_keyset_pages(self):
+        for i in range(5):
+            room = self.make_room(f'Extra {i}')
+            self.post(room, self.friend, f'extra {i}')
+        with self.assertNumQueries(2):
+            page = inbox_page(self.user, limit=4)
+
+        seen = [r['room_id'] for r in page['results']]
+        while page['next_cursor']:
+            page = inbox_page(self.user, cursor=page['next_cursor'], limit=4)
+            seen += [r['room_id'] for r in page['results']]
+        self.assertEqual(len(seen), 8)
+        self.assertEqual(len(set(seen)), 8)
+
+        resp = self.client.get('/api/chat/rooms/inbox/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(resp.status_code, 400)
+
+    def test_posting_and_deleting_move_the_room(self):
+        resp = self.client.post(f'/api/chat/rooms/{self.quiet.room_id}/messages/', {'content': 'wake up'})
+        self.assertEqual(resp.status_code, 201, resp.content)
+        rooms = inbox_page(self.user)['results']
+        self.assertEqual([r['room_id'] for r in rooms], [self.quiet.room_id, self.busy.room_id, self.direct.room_id])
+        self.assertEqual(rooms[0]['last_message']['content'], 'wake up')
+
+        resp = self.client.delete(f"/api/chat/rooms/{self.quiet.room_id}/messages/{resp.data['message_id']}/")
+        self.assertEqual(resp.status_code, 204)
+        self.quiet.refresh_from_db()
+        self.assertIsNone(self.quiet.last_message_id)
+        self.assertEqual(self.quiet.last_activity_at, self.quiet.created_at)
+        rooms = inbox_page(self.user)['results']
+        self.assertEqual([r['room_id'] for r in rooms], [self.busy.room_id, self.direct.room_id, self.quiet.room_id])
+        self.assertIsNone(rooms[2]['last_message'])
+
+
+class DirectRoomTests(TestCase):
+    def setUp(self):
+        self.ana = User.objects.create_user(email='ana@example.com', name='Ana', password='pass123')
+        self.ben = User.objects.create_user(email='ben@example.com', name='Ben', password='pass123')
+        self.client_ana = APIClient()
+        self.client_ana.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.ana).key}')
+        self.client_ben = APIClient()
+        self.client_ben.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.ben).key}')
+
+    def test_one_room_per_pair_in_either_direction(self):
+        # A private group room with the same two members is not their direct room
+        group = Room.objects.create(name='Pair', is_private=True, created_by=self.ana)
+        RoomMembership.objects.create(room=group, user=self.ana, is_admin=True)
+        RoomMembership.objects.create(room=group, user=self.ben)
+
+        first = self.client_ana.post('/api/chat/rooms/direct/', {'email': 'ben@example.com'}, format='json')
+        self.assertEqual(first.status_code, 201, first.content)
+        self.assertNotEqual(first.data['room_id'], group.room_id)
+
+        again = self.client_ana.post('/api/chat/rooms/direct/', {'email': 'ben@example.com'}, format='json')
+        reverse = self.client_ben.post('/api/chat/rooms/direct/', {'email': 'ana@example.com'}, format='json')
+        self.assertEqual((again.status_code, reverse.status_code), (200, 200))
+        self.assertEqual({again.data['room_id'], reverse.data['room_id']}, {first.data['room_id']})
+
+        room = Room.objects.get(room_id=first.data['room_id'])
+        self.assertEqual((room.dm_user_low_id, room.dm_user_high_id), Room.direct_pair(self.ben.pk, self.ana.pk))
+        self.assertEqual(room.memberships.count(), 2)
+
+    def test_removed_member_is_restored(self):
+        first = self.client_ana.post('/api/chat/rooms/direct/', {'email': 'ben@example.com'}, format='json')
+        room_id = first.data['room_id']
+        resp = self.client_ana.post(f'/api/chat/rooms/{room_id}/remove_member/', {'user_id': self.ben.pk}, format='json')
+        self.assertEqual(resp.status_code, 200)
+
+        again = self.client_ben.post('/api/chat/rooms/direct/', {'email': 'ana@example.com'}, format='json')
+        self.assertEqual((again.status_code, again.data['room_id']), (200, room_id))
+        self.assertTrue(RoomMembership.objects.filter(room_id=room_id, user=self.ben).exists())
+        self.assertEqual(self.client_ben.get(f'/api/chat/rooms/{room_id}/messages/').status_code, 200)
+
+    def test_pair_is_unique(self):
+        low, high = Room.direct_pair(self.ana.pk, self.ben.pk)
+        Room.objects.create(is_private=True, created_by=self.ana, dm_user_low_id=low, dm_user_high_id=high)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Room.objects.create(is_private=True, created_by=self.ben, dm_user_low_id=low, dm_user_high_id=high)
+
+
+class MessageSearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='search@example.com', name='Search', password='pass123')
+        self.stranger = User.objects.create_user(email='stranger@example.com', name='Stranger', password='pass123')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.user).key}')
+
+        self.room = Room.objects.create(name='Team', created_by=self.user)
+        RoomMembership.objects.create(room=self.room, user=self.user)
+        self.other_room = Room.objects.create(name='Other', created_by=self.stranger)
+        RoomMembership.objects.create(room=self.other_room, user=self.stranger)
+
+        self.passing = Message.objects.create(room=self.room, sender=self.user, content='the deploy went out <fine>')
+        self.focused = Message.objects.create(room=self.room, sender=self.user, content='deploy deploy: deploy checklist')
+        Message.objects.create(room=self.room, sender=self.user, content='deploy rolled back', is_deleted=True)
+        Message.objects.create(room=self.other_room, sender=self.stranger, content='secret deploy plans')
+
+    def test_search_is_scoped_ranked_and_highlighted(self):
+        resp = self.client.get('/api/chat/messages/search/', {'q': 'deploy'})
+        self.assertEqual(resp.status_code, 200, resp.content)
+        ids = [r['message_id'] for r in resp.data['results']]
+        self.assertEqual(set(ids), {self.passing.message_id, self.focused.message_id})  # not deleted, not other rooms
+        if search_backend() != 'like':
+            self.assertEqual(ids[0], self.focused.message_id)
+
+        passing = next(r for r in resp.data['results'] if r['message_id'] == self.passing.message_id)
+        self.assertIn('<mark>deploy</mark>', passing['snippet'])
+        self.assertIn('&lt;fine&gt;', passing['snippet'])
+        self.assertEqual(passing['room_name'], 'Team')
+
+        self.assertEqual(self.client.get('/api/chat/messages/search/').status_code, 400)
+        self.assertEqual(self.client.get('/api/chat/messages/search/', {'q': 'x', 'cursor': '%%'}).status_code, 400)
+        other = self.client.get('/api/chat/messages/search/', {'q': 'deploy', 'room': self.other_room.room_id})
+        self.assertEqual(other.data['results'], [])
+
+    def test_keyset_pages(self):
+        for i in range(5):
+            Message.objects.create(room=self.room, sender=self.user, content=f'deploy number {i}')
+        page = search_messages(self.user, 'deploy', limit=3)
+        seen = [r['message_id'] for r in page['results']]
+        while page['next_cursor']:
+            page = search_messages(self.user, 'deploy', cursor=page['next_cursor'], limit=3)
+            seen += [r['message_id'] for r in page['results']]
+        self.assertEqual(len(seen), 7)
+        self.assertEqual(len(set(seen)), 7)
+
+
+class RecordingLayer:
+    def __init__(self):
+        self.sent = []
+
+    async def group_send(self, group, event):
+        self.sent.append((group, event))
+
+
+@override_settings(CHAT_DELIVERY_ASYNC=False)
+class MessageDeliveryTests(TestCase):
+    def setUp(self):
+        self.sender = User.objects.create_user(email='sender@example.com', name='Sender', password='pass123')
+        self.reader = User.objects.create_user(email='reader@example.com', name='Reader', password='pass123')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.sender).key}')
+
+        self.room = Room.objects.create(name='Delivery', created_by=self.sender)
+        RoomMembership.objects.create(room=self.room, user=self.sender)
+        RoomMembership.objects.create(room=self.room, user=self.reader)
+        other = Room.objects.create(name='Elsewhere', created_by=self.reader)
+        RoomMembership.objects.create(room=other, user=self.reader)
+        RoomMembership.objects.create(room=other, user=self.sender)
+        Message.objects.create(room=other, sender=self.reader, content='earlier')
+        self.url = f'/api/chat/rooms/{self.room.room_id}/messages/'
+
+    def test_events_are_sent_after_commit(self):
+        layer = RecordingLayer()
+        with patch('apps.chat.delivery.get_channel_layer', return_value=layer):
+            with self.captureOnCommitCallbacks() as callbacks:
+                resp = self.client.post(self.url, {'content': 'hi'}, format='json')
+            self.assertEqual(resp.status_code, 201, resp.content)
+            self.assertEqual(layer.sent, [])  # nothing before the commit
+            with self.assertNumQueries(2):
+                for callback in callbacks:
+                    callback()
+
+        room_group = f'chat_{self.room.room_id}'
+        self.assertEqual(layer.sent[0][0], room_group)
+        self.assertEqual(layer.sent[0][1]['message']['message_id'], resp.data['message_id'])
+        by_group = {}
+        for group, event in layer.sent:
+            by_group.setdefault(group, []).append(event)
+        reader = by_group[f'user_{self.reader.pk}_chat_notifications']
+        self.assertEqual([e['type'] for e in reader], ['new_message_notification', 'unread_count_updated'])
+        self.assertEqual(reader[1]['unread_count'], 1)  # the new message; 'earlier' is the reader's own
+        sender = by_group[f'user_{self.sender.pk}_chat_notifications']
+        self.assertEqual([(e['type'], e['unread_count']) for e in sender], [('unread_count_updated', 1)])
+
+    def test_unread_totals_match_per_room_counts(self):
+        Message.objects.create(room=self.room, sender=self.reader, content='one')
+        Message.objects.create(room=self.room, sender=self.reader, content='gone', is_deleted=True)
+        with self.assertNumQueries(1):
+            totals = unread_totals([self.sender.pk, self.reader.pk])
+        self.assertEqual(totals, {self.sender.pk: 2, self.reader.pk: 0})
+
+
+class BackgroundDeliveryTests(TransactionTestCase):
+    """Deliveries from the worker thread reach an in-memory layer's consumers"""
+
+    def setUp(self):
+        cache.clear()  # flushed tables bypass the invalidation signals
+        self.sender = User.objects.create_user(email='bg@example.com', name='Background', password='pass123')
+        self.room = Room.objects.create(name='Background', created_by=self.sender)
+        RoomMembership.objects.create(room=self.room, user=self.sender)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.sender).key}')
+
+    async def test_sends_run_on_the_server_loop(self):
+        layer = get_channel_layer()
+        channel = await layer.new_channel()
+        await layer.group_add(f'chat_{self.room.room_id}', channel)
+        # A consumer already waiting on its channel, as connected sockets are
+        received = asyncio.ensure_future(layer.receive(channel))
+        await asyncio.sleep(0)
+        # A sync view under ASGI: the commit hook runs on a sync_to_async thread
+        resp = await sync_to_async(self.client.post)(
+            f'/api/chat/rooms/{self.room.room_id}/messages/', {'content': 'hello'}, format='json')
+        self.assertEqual(resp.status_code, 201, resp.content)
+        # Woken by the send itself: a put from a foreign loop is only noticed when the timeout fires
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        event = await asyncio.wait_for(received, 5)
+        self.assertLess(loop.time() - started, 4)
+        self.assertEqual((event['type'], event['message']['message_id']), ('chat_message', resp.data['message_id']))
+        await layer.group_discard(f'chat_{self.room.room_id}', channel)
+
+
+class GatedSocket(AsyncWebsocketConsumer):
+    """A client link that only takes frames while ``gate`` is set."""
+    instances = []
+
+    async def connect(self):
+        self.gate = asyncio.Event()
+        self.gate.set()
+        self.received = []
+        GatedSocket.instances.append(self)
+        await self.accept()
+
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        await self.gate.wait()
+        await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        self.received.append(text_data)
+
+
+class QueuedSocket(OutboxMixin, GatedSocket):
+    pass
+
+
+class FloodSocket(OutboxMixin, AsyncWebsocketConsumer):
+    """Queues frames, one per loop iteration, once the client says "go"."""
+
+    async def receive(self, text_data=None, bytes_data=None):
+        for i in range(1000):
+            await self.send(text_data=f'frame {i}')
+            await asyncio.sleep(0)  # events arrive over time, letting the writer run
+
+
+class OutboxTests(SimpleTestCase):
+    def setUp(self):
+        outbox_metrics.reset()
+        GatedSocket.instances.clear()
+
+    async def connect(self):
+        communicator = WebsocketCommunicator(QueuedSocket.as_asgi(), '/ws/test/')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator, GatedSocket.instances[-1]
+
+    async def test_superseded_frames_are_coalesced(self):
+        communicator, socket = await self.connect()
+        socket.gate.clear()
+        await socket.send(text_data='first')  # taken by the writer, stuck on the slow link
+        await asyncio.sleep(0)
+        for count in (1, 2, 3):
+            await socket.send(text_data=f'unread {count}', coalesce='unread_count')
+        self.assertEqual(outbox_metrics.snapshot()['QueuedSocket']['queue_depth'], 1)
+
+        socket.gate.set()
+        self.assertEqual(await communicator.receive_from(), 'first')
+        self.assertEqual(await communicator.receive_from(), 'unread 3')
+        self.assertTrue(await communicator.receive_nothing())
+        metrics = outbox_metrics.snapshot()['QueuedSocket']
+        self.assertEqual((metrics['sent'], metrics['coalesced'], metrics['dropped']), (2, 2, 0))
+        await communicator.disconnect()
+
+    @override_settings(WS_SEND_QUEUE_SIZE=3)
+    async def test_full_queue_evicts(self):
+        communicator, socket = await self.connect()
+        socket.gate.clear()
+        await socket.send(text_data='frame 0')  # taken by the writer, stuck on the slow link
+        await asyncio.sleep(0)
+        for i in range(1, 6):
+            await socket.send(text_data=f'frame {i}')
+        output = await communicator.receive_output()
+        self.assertEqual((output['type'], output['code']), ('websocket.close', EVICTED_CLOSE_CODE))
+        metrics = outbox_metrics.snapshot()['QueuedSocket']
+        self.assertEqual(metrics['evictions'], {'queue_full': 1})
+        self.assertEqual(metrics['dropped'], 4)  # frames 1-3 queued when evicted, then frame 5
+        await communicator.disconnect()
+
+    @override_settings(WS_SEND_TIMEOUT=0.05)
+    async def test_stuck_send_evicts(self):
+        communicator, socket = await self.connect()
+        socket.gate.clear()
+        await socket.send(text_data='never delivered')
+        output = await communicator.receive_output()
+        self.assertEqual(output['code'], EVICTED_CLOSE_CODE)
+        self.assertEqual(outbox_metrics.snapshot()['QueuedSocket']['evictions'], {'send_timeout': 1})
+        await communicator.disconnect()
+
+    @override_settings(WS_PING_INTERVAL=0.05, WS_PING_TIMEOUT=0.2)
+    async def test_pings_and_timeout_for_clients_that_answer(self):
+        communicator, socket = await self.connect()
+        self.assertEqual(await communicator.receive_json_from(), {'type': 'ping'})
+        await communicator.send_json_to({'type': 'pong'})
+        await communicator.send_to(text_data='hello')
+        self.assertEqual(await communicator.receive_json_from(), {'type': 'ping'})
+        self.assertEqual(socket.received, ['hello'])  # pongs are not passed on
+
+        # Silent from here on: pings go unanswered until the timeout
+        while (output := await communicator.receive_output(1))['type'] == 'websocket.send':
+            pass
+        self.assertEqual(output['code'], EVICTED_CLOSE_CODE)
+        self.assertEqual(outbox_metrics.snapshot()['QueuedSocket']['evictions'], {'ping_timeout': 1})
+        await communicator.disconnect()
+
+    @override_settings(WS_SEND_WINDOW=2, WS_SEND_TIMEOUT=0.2)
+    async def test_ack_window_holds_frames_back(self):
+        communicator, socket = await self.connect()
+        await communicator.send_json_to({'type': 'ack', 'count': 0})
+        await asyncio.sleep(0.01)
+        for i in range(4):
+            await socket.send(text_data=f'frame {i}')
+        self.assertEqual([await communicator.receive_from() for _ in range(2)], ['frame 0', 'frame 1'])
+        self.assertTrue(await communicator.receive_nothing(0.05))
+        self.assertEqual(outbox_metrics.snapshot()['QueuedSocket']['queue_depth'], 2)
+
+        await communicator.send_json_to({'type': 'ack', 'count': 1})
+        self.assertEqual(await communicator.receive_from(), 'frame 2')
+        self.assertTrue(await communicator.receive_nothing(0.05))
+        self.assertEqual(socket.received, [])  # acks are not passed on
+
+        # No more acks: the full window evicts
+        output = await communicator.receive_output(1)
+        self.assertEqual(output['code'], EVICTED_CLOSE_CODE)
+        self.assertEqual(outbox_metrics.snapshot()['QueuedSocket']['evictions'], {'send_timeout': 1})
+        await communicator.disconnect()
+
+
+class OutboxDaphneTests(SimpleTestCase):
+    """The outbox behind a real Daphne server, where sends never block"""
+
+    def read_until_closed(self, ws):
+        from websockets.exceptions import ConnectionClosed
+        frames = []
+        try:
+            while True:
+                frames.append(ws.recv(timeout=5))
+        except ConnectionClosed:
+            return frames
+
+    def test_client_that_stops_acking_is_evicted(self):
+        from daphne.testing import DaphneProcess
+        from websockets.sync.client import connect
+
+        with self.settings(WS_SEND_WINDOW=8, WS_SEND_QUEUE_SIZE=32):
+            server = DaphneProcess('127.0.0.1', FloodSocket.as_asgi)
+            server.daemon = True
+            server.start()  # forked, so it keeps these settings
+        self.addCleanup(server.terminate)
+        self.assertTrue(server.ready.wait(10))
+
+        with connect(f'ws://127.0.0.1:{server.port.value}/') as ws:
+            ws.send(json.dumps({'type': 'ack', 'count': 0}))
+            ws.send('go')
+            frames = self.read_until_closed(ws)
+        self.assertEqual(frames, [f'frame {i}' for i in range(8)])
+        self.assertEqual(ws.close_code, EVICTED_CLOSE_CODE)
@@ -13,6 +13,7 @@ urlpatterns = [
     # Manual nested routes for messages under rooms - MUST come BEFORE router.urls
     # Otherwise the router's 'rooms/<pk>/' route matches first
     path('rooms/<int:room_pk>/messages/', MessageViewSet.as_view({'get': 'list', 'post': 'create'}), name='room-messages-list-create'),
+    path('messages/search/', MessageViewSet.as_view({'get': 'search'}), name='message-search'),
     path('rooms/<int:room_pk>/messages/<int:pk>/', MessageViewSet.as_view({'delete': 'destroy'}), name='room-message-detail'),
     # Router URLs come after nested routes
     path('', include(router.urls)),
@@ -2,8 +2,11 @@
 """
 Hybrid Chat System: REST API for data operations + WebSocket for real-time updates
 """
-from django.db import transaction
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from rest_framework import viewsets, mixins, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
@@ -11,6 +14,9 @@ from rest_framework.permissions import IsAuthenticated
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 
+from . import inbox as chat_inbox
+from . import search as chat_search
+from .delivery import schedule_delivery
 from .models import Room, RoomMembership, Message
 from .serializers import RoomSerializer, RoomMembershipSerializer, MessageSerializer
 from .permissions import IsAuthenticatedAndRoomMember, IsRoomAdmin
@@ -27,6 +33,8 @@ def send_room_notification(room_id, notification_type, data):
             room_group_name,
             {
                 'type': notification_type,
+                # Lets multiplexed sockets tell which room an event belongs to
+                'room_id': int(room_id),
                 **data
             }
         )
@@ -238,6 +246,23 @@ class RoomViewSet(viewsets.ModelViewSet):
             'latest_message_at': latest_message.created_at.isoformat() if latest_message else None
         })
 
+    @action(detail=False, methods=['get'])
+    def inbox(self, request):
+        """
+        All of the user's rooms with member count, last message and unread count,
+        most recently active first. Constant queries per page; pass the returned
+        next_cursor as ?cursor= for the next page (?limit=, default 50, max 200).
+        """
+        try:
+            limit = min(max(int(request.query_params.get('limit', chat_inbox.DEFAULT_LIMIT)), 1), chat_inbox.MAX_LIMIT)
+        except ValueError:
+            return Response({'detail': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            page = chat_inbox.inbox_page(request.user, request.query_params.get('cursor'), limit)
+        except chat_inbox.InvalidCursor:
+            return Response({'detail': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(page)
+
     @action(detail=False, methods=['get'], url_path='unread-count')
     def unread_count(self, request):
         """Get total unread messages count across all user's rooms"""
@@ -281,15 +306,28 @@ class RoomViewSet(viewsets.ModelViewSet):
         if int(other_user.pk) == int(request.user.pk):
             return Response({'detail': 'email must be different from current user'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Find existing private room for exactly these two users
-        existing = (
-            Room.objects.filter(is_private=True)
-            .filter(memberships__user=request.user)
-            .filter(memberships__user_id=other_user.pk)
-            .distinct()
-            .first()
-        )
+        # Direct rooms are keyed by the ordered user pair: one index probe, and the
+        # unique constraint makes concurrent requests for the same pair share a room
+        low, high = Room.direct_pair(request.user.pk, other_user.pk)
+        existing = Room.objects.filter(dm_user_low_id=low, dm_user_high_id=high).first()
+        if existing is None:
+            try:
+                # Create new private room and add both users
+                with transaction.atomic():
+                    room = Room.objects.create(
+                        created_by=request.user, is_private=True, name=None,
+                        dm_user_low_id=low, dm_user_high_id=high
+                    )
+                    RoomMembership.objects.create(room=room, user=request.user, is_admin=True)
+                    RoomMembership.objects.get_or_create(room=room, user=other_user)
+            except IntegrityError:
+                # A concurrent request created the room first
+                existing = Room.objects.get(dm_user_low_id=low, dm_user_high_id=high)
+
         if existing:
+            # Either user may have been removed since; the pair's room is theirs again
+            RoomMembership.objects.get_or_create(room=existing, user=request.user)
+            RoomMembership.objects.get_or_create(room=existing, user=other_user)
             serializer = self.get_serializer(existing)
             # Notify the other user they have an active direct chat
             send_user_notification(other_user.pk, 'direct_room_created', {
@@ -298,23 +336,17 @@ class RoomViewSet(viewsets.ModelViewSet):
             })
             return Response(serializer.data)
 
-        # Create new private room and add both users
-        with transaction.atomic():
-            room = Room.objects.create(created_by=request.user, is_private=True, name=None)
-            RoomMembership.objects.create(room=room, user=request.user, is_admin=True)
-            RoomMembership.objects.get_or_create(room=room, user=other_user)
-            
-            # Send real-time notification
-            send_room_notification(room.room_id, 'direct_room_created', {
-                'room': RoomSerializer(room).data,
-                'created_by': request.user.name,
-            })
-            # Notify the other user directly as well
-            send_user_notification(other_user.pk, 'direct_room_created', {
-                'room': RoomSerializer(room).data,
-                'created_by': request.user.name,
-            })
-        
+        # Send real-time notification
+        send_room_notification(room.room_id, 'direct_room_created', {
+            'room': RoomSerializer(room).data,
+            'created_by': request.user.name,
+        })
+        # Notify the other user directly as well
+        send_user_notification(other_user.pk, 'direct_room_created', {
+            'room': RoomSerializer(room).data,
+            'created_by': request.user.name,
+        })
+
         serializer = self.get_serializer(room)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
@@ -412,89 +444,25 @@ class MessageViewSet(mixins.ListModelMixin,
         serializer = self.get_serializer(data=message_data, context={'room_id': room_id})
         serializer.is_valid(raise_exception=True)
         
-        # Create message
-        message = Message.objects.create(
-            room_id=room_id,
-            sender=request.user,
-            content=serializer.validated_data['content'],
-            message_type=serializer.validated_data.get('message_type', 'text'),
-            reply_to_id=serializer.validated_data.get('reply_to_id')
-        )
-        
-        # Send real-time notification to room
-        message_data = self.get_serializer(message).data
-        # Align WebSocket event name with consumer handler
-        send_room_notification(room_id, 'chat_message', {
-            'message': message_data,
-            'user': request.user.name,
-            'user_id': request.user.pk,
-        })
-        
-        # IMPORTANT: When sender sends a message in a room they're viewing, mark it as read
-        # Update sender's joined_at to current message time so their own message doesn't count as unread
-        # This ensures the badge count is accurate immediately after sending
-        sender_membership = RoomMembership.objects.filter(room_id=room_id, user=request.user).first()
-        if sender_membership:
-            from django.utils import timezone
-            from datetime import timedelta
-            # Set joined_at to be slightly after the message timestamp to mark it as read
-            message_time = message.created_at
-            sender_membership.joined_at = max(timezone.now(), message_time) + timedelta(seconds=1)
-            sender_membership.save(update_fields=['joined_at'])
-            sender_membership.refresh_from_db()
-            
-            # Calculate and send updated unread count to SENDER for immediate badge update
-            # This ensures badge reflects that the sender has seen their own message
-            sender_memberships = RoomMembership.objects.filter(user=request.user).select_related('room')
-            sender_total_unread = 0
-            for memb in sender_memberships:
-                memb.refresh_from_db()  # Ensure latest joined_at
-                unread = Message.objects.filter(
-                    room=memb.room,
-                    created_at__gt=memb.joined_at,
-                    is_deleted=False
-                ).exclude(sender=request.user).count()
-                sender_total_unread += unread
-            
-            sender_total_unread = max(0, sender_total_unread)
-            
-            # Send unread_count_updated to sender for immediate badge update
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.info(f"📊 Sending unread_count_updated to message SENDER: user_id={request.user.pk}, total_unread={sender_total_unread}, room_id={room_id}")
-            send_user_notification(request.user.pk, 'unread_count_updated', {
-                'unread_count': sender_total_unread,
-                'room_id': room_id,
-            })
-        
-        # Send notifications to room members who aren't currently connected (excluding sender)
-        room = Room.objects.get(room_id=room_id)
-        for membership in room.memberships.exclude(user=request.user):
-            send_user_notification(membership.user.pk, 'new_message_notification', {
-                'room_id': room_id,
-                'message': message_data,
-                'sender': request.user.name,
-            })
-            
-            # Calculate and send updated unread count for real-time badge update
-            memberships = RoomMembership.objects.filter(user=membership.user).select_related('room')
-            total_unread = 0
-            for memb in memberships:
-                memb.refresh_from_db()  # Ensure latest joined_at
-                unread = Message.objects.filter(
-                    room=memb.room,
-                    created_at__gt=memb.joined_at,
-                    is_deleted=False
-                ).exclude(sender=membership.user).count()
-                total_unread += unread
-            
-            total_unread = max(0, total_unread)
-            
-            send_user_notification(membership.user.pk, 'unread_count_updated', {
-                'unread_count': total_unread,
-                'room_id': room_id,
-            })
-        
+        with transaction.atomic():
+            message = Message.objects.create(
+                room_id=room_id,
+                sender=request.user,
+                content=serializer.validated_data['content'],
+                message_type=serializer.validated_data.get('message_type', 'text'),
+                reply_to_id=serializer.validated_data.get('reply_to_id')
+            )
+            message.room.record_message(message)
+            # The sender has read their own message: move their joined_at past it so
+            # it never counts as unread for them
+            RoomMembership.objects.filter(room_id=room_id, user=request.user).update(
+                joined_at=max(timezone.now(), message.created_at) + timedelta(seconds=1)
+            )
+            # Room event, notifications and unread badges go out after the commit,
+            # off the request (see delivery.py)
+            message_data = self.get_serializer(message).data
+            transaction.on_commit(lambda: schedule_delivery(room_id, request.user.pk, request.user.name, message_data))
+
         out = self.get_serializer(message)
         headers = self.get_success_headers(out.data)
         return Response(out.data, status=status.HTTP_201_CREATED, headers=headers)
@@ -528,6 +496,8 @@ class MessageViewSet(mixins.ListModelMixin,
         
         instance.is_deleted = True
         instance.save(update_fields=['is_deleted'])
+        if instance.room.last_message_id == instance.message_id:
+            instance.room.refresh_last_message()
         
         # Send real-time notification with message details for system message display
         send_room_notification(instance.room.room_id, 'message_deleted', {
@@ -538,3 +508,25 @@ class MessageViewSet(mixins.ListModelMixin,
         })
         
         return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def search(self, request, *args, **kwargs):
+        """
+        Full-text search over the messages of the user's rooms, best match first
+        (?q=, optional ?room= to search one room). Each result has an HTML snippet
+        with matches in <mark>. Pass next_cursor as ?cursor= for the next page
+        (?limit=, default 20, max 100).
+        """
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'detail': 'q is required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = min(max(int(request.query_params.get('limit', chat_search.DEFAULT_LIMIT)), 1), chat_search.MAX_LIMIT)
+            room_id = request.query_params.get('room')
+            room_id = int(room_id) if room_id else None
+        except ValueError:
+            return Response({'detail': 'limit and room must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            page = chat_search.search_messages(request.user, query, room_id, request.query_params.get('cursor'), limit)
+        except chat_inbox.InvalidCursor:
+            return Response({'detail': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(page)
@@ -22,9 +22,12 @@ django_asgi_app = get_asgi_application()
 from apps.chat.auth import TokenAuthMiddlewareStack
 import apps.chat.routing
 from apps.ai_api.routing import websocket_urlpatterns as ai_websocket_urlpatterns
+from core.websocket.routing import websocket_urlpatterns as stream_websocket_urlpatterns
 
 # Combine all WebSocket URL patterns
-websocket_urlpatterns = apps.chat.routing.websocket_urlpatterns + ai_websocket_urlpatterns
+websocket_urlpatterns = (
+    apps.chat.routing.websocket_urlpatterns + ai_websocket_urlpatterns + stream_websocket_urlpatterns
+)
 
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
@@ -171,12 +171,69 @@ AUTH_USER_MODEL = 'users.User'
 ASGI_APPLICATION = 'config.asgi.application'
 
 # Channel layers configuration
-CHANNEL_LAYERS = {
-    'default': {
+# CHANNEL_LAYER_BACKEND selects one of these. "memory" only reaches sockets in the
+# sending process; run more than one worker with "postgres" (LISTEN/NOTIFY on the
+# main database, no broker) or "redis".
+CHANNEL_LAYER_BACKENDS = {
+    'memory': {
         'BACKEND': 'channels.layers.InMemoryChannelLayer'
     },
+    'postgres': {
+        'BACKEND': 'core.channel_layers.PostgresChannelLayer',
+        'CONFIG': {
+            'capacity': config("CHANNEL_LAYER_CAPACITY", default=100, cast=int),
+            'expiry': 60,
+        },
+    },
+    'redis': {
+        'BACKEND': 'channels_redis.core.RedisChannelLayer',
+        'CONFIG': {
+            'hosts': [config("REDIS_URL", default="redis://127.0.0.1:6379/0")],
+            'capacity': config("CHANNEL_LAYER_CAPACITY", default=100, cast=int),
+        },
+    },
+}
+CHANNEL_LAYER_BACKEND = config("CHANNEL_LAYER_BACKEND", default="memory")
+CHANNEL_LAYERS = {
+    'default': CHANNEL_LAYER_BACKENDS[CHANNEL_LAYER_BACKEND],
 }
 
+# Chat resume: recent messages kept in memory per open room, and the most a
+# reconnecting socket replays (passing last_message_id) before the client has
+# to page the rest over REST
+CHAT_HISTORY_SIZE = config("CHAT_HISTORY_SIZE", default=200, cast=int)
+CHAT_RESUME_LIMIT = config("CHAT_RESUME_LIMIT", default=500, cast=int)
+
+# Chat presence: seconds between batched presence deltas, before a socket that
+# sends heartbeats goes offline without one, and a typing indicator lasts
+PRESENCE_TICK = config("PRESENCE_TICK", default=1.0, cast=float)
+PRESENCE_TTL = config("PRESENCE_TTL", default=60, cast=int)
+TYPING_TIMEOUT = config("TYPING_TIMEOUT", default=6, cast=int)
+
+# WebSocket auth: seconds a resolved token and a room membership check stay cached.
+# Changes invalidate them at once via signals; with several workers, use a shared
+# cache backend so that also holds across processes.
+WS_AUTH_CACHE_TTL = config("WS_AUTH_CACHE_TTL", default=300, cast=int)
+WS_MEMBERSHIP_CACHE_TTL = config("WS_MEMBERSHIP_CACHE_TTL", default=60, cast=int)
+
+# Chat delivery: room events, notifications and unread badges for a new message are
+# sent from a background thread after commit. False sends them inline instead.
+CHAT_DELIVERY_ASYNC = config("CHAT_DELIVERY_ASYNC", default=True, cast=bool)
+
+# LLM endpoints: admitted jobs run on worker threads (apps/ai_api/singleflight.py),
+# so the request thread only decides admission. False runs them on the request thread.
+LLM_JOBS_IN_BACKGROUND = config("LLM_JOBS_IN_BACKGROUND", default=True, cast=bool)
+
+# WebSocket send queues (core/websocket/outbox.py): frames a connection may have
+# queued, and seconds one send (or a full ack window) may take, before it is
+# evicted as a slow consumer; unacknowledged frames allowed for clients that ack;
+# seconds idle before a ping, and without frames from a client that answers pings
+WS_SEND_QUEUE_SIZE = config("WS_SEND_QUEUE_SIZE", default=256, cast=int)
+WS_SEND_TIMEOUT = config("WS_SEND_TIMEOUT", default=10, cast=int)
+WS_SEND_WINDOW = config("WS_SEND_WINDOW", default=64, cast=int)
+WS_PING_INTERVAL = config("WS_PING_INTERVAL", default=25, cast=int)
+WS_PING_TIMEOUT = config("WS_PING_TIMEOUT", default=60, cast=int)
+
 # CORS settings
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:5173",
@@ -326,6 +383,16 @@ LOGGING = {
             'level': 'INFO',
             'propagate': False,
         },
+        'core.channel_layers': {
+            'handlers': ['websocket_file', 'console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'core.websocket': {
+            'handlers': ['websocket_file', 'console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
         'llms': {
             'handlers': ['file', 'console'],
             'level': 'INFO',
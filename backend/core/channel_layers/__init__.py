@@ -0,0 +1,4 @@
+# Channel layer backends for running several ASGI workers without Redis
+from .postgres import PostgresChannelLayer
+
+__all__ = ['PostgresChannelLayer']
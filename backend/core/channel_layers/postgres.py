@@ -0,0 +1,497 @@
+"""
+Channel layer on PostgreSQL LISTEN/NOTIFY, for several workers on one host
+(or any hosts sharing the database) without a Redis broker.
+
+- Every layer instance (one per worker process) LISTENs on its own
+  notification channel. The process-specific channel names it hands out
+  (``specific.<process>!<id>``) say which process owns them.
+- Group membership lives in an UNLOGGED table shared by all processes.
+  ``group_send`` reads the members once and sends one NOTIFY per owning
+  process listing all of that process's channels, so fan-out costs one
+  notification per worker rather than one per socket.
+- NOTIFY payloads must stay under 8000 bytes. Larger messages are stored
+  once in an UNLOGGED payload table and the notifications carry the row id.
+- Sends to channels owned by the calling process skip the database.
+
+Capacity works as in the other layers: each channel has a bounded queue
+(``capacity`` / ``channel_capacity``). ``send`` to a full local channel
+raises ``ChannelFull``; deliveries from other processes and group sends
+drop messages for a full channel. Database work runs on one thread per
+process in send order, and at most ``max_pending_sends`` operations may
+wait for it. Beyond that, ``send`` raises ``ChannelFull`` and group sends
+are dropped with a warning, instead of the backlog growing without bound.
+
+Messages are JSON encoded. Only process-specific channels (from
+``new_channel``) can be received on, which is all consumers use. The
+tables are created on first use.
+"""
+import asyncio
+import json
+import logging
+import random
+import re
+import string
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+from typing import Dict, List, Optional
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+
+logger = logging.getLogger('core.channel_layers')
+
+# Postgres rejects NOTIFY payloads of 8000 bytes or more
+NOTIFY_PAYLOAD_LIMIT = 7900
+# Bytes of a notification besides the channel list and message
+ENVELOPE_OVERHEAD = 48
+CLEANUP_INTERVAL = 30  # seconds between purges of expired group members and payloads
+
+_PREFIX_RE = re.compile(r"^[a-z][a-z0-9_]{0,30}$")
+
+
+def channel_owner(channel: str) -> Optional[str]:
+    """Process id in a process-specific channel name (``<prefix>.<process>!<id>``), else None."""
+    head, sep, _ = channel.partition("!")
+    return head.rsplit(".", 1)[-1] if sep else None
+
+
+def encode_message(message: Dict) -> str:
+    return json.dumps(message, cls=DjangoJSONEncoder, separators=(",", ":"))
+
+
+def build_notifications(channels: List[str], message_json: Optional[str], ref: Optional[int],
+                        sent_at: float, limit: int = NOTIFY_PAYLOAD_LIMIT) -> List[str]:
+    """
+    Notification payloads delivering one message to ``channels``. The message
+    is inlined (``message_json``) or referenced by payload row (``ref``); the
+    channel list is split so every payload stays within ``limit`` bytes.
+    """
+    body = f'"r":{ref}' if ref is not None else f'"m":{message_json}'
+    fixed = len(body.encode()) + ENVELOPE_OVERHEAD
+    chunks, current, size = [], [], fixed
+    for channel in channels:
+        cost = len(channel) + 3
+        if current and size + cost > limit:
+            chunks.append(current)
+            current, size = [], fixed
+        current.append(channel)
+        size += cost
+    if current:
+        chunks.append(current)
+    return ['{"c":%s,"t":%.6f,%s}' % (json.dumps(chunk, separators=(",", ":")), sent_at, body) for chunk in chunks]
+
+
+class PostgresChannelLayer(BaseChannelLayer):
+    extensions = ["groups", "flush"]
+
+    def __init__(self, expiry=60, group_expiry=86400, capacity=100, channel_capacity=None,
+                 prefix="channels", database="default", max_pending_sends=1000,
+                 payload_limit=NOTIFY_PAYLOAD_LIMIT, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity, **kwargs)
+        if not _PREFIX_RE.match(prefix):
+            raise ValueError(f"Channel layer prefix must be a short lowercase identifier, got {prefix!r}")
+        self.channel_capacity = self.compile_capacities(channel_capacity or {})
+        self.group_expiry = group_expiry
+        self.prefix = prefix
+        self.database = database
+        self.max_pending_sends = max_pending_sends
+        self.payload_limit = payload_limit
+        self.process_id = uuid.uuid4().hex[:12]
+        self.notify_channel = f"{prefix}_{self.process_id}"
+        self.groups_table = f"{prefix}_groups"
+        self.payloads_table = f"{prefix}_payloads"
+        self.channels: Dict[str, asyncio.Queue] = {}
+        self.dropped = 0  # messages lost to full channels or expiry
+
+        # Database work: one connection, used only by this executor's thread
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"channel-layer-{prefix}")
+        self._db = None
+        self._last_cleanup = 0.0
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+
+        # Listening: one connection, read on the event loop that receives
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._listener = None
+        self._listening: Optional[asyncio.Task] = None
+        self._inbox = deque()  # notifications waiting behind a payload fetch
+        self._draining: Optional[asyncio.Task] = None
+        self._last_expiry_check = 0.0
+
+    # Channel layer API ---------------------------------------------------------
+
+    async def send(self, channel, message):
+        """Send a message to a process-specific channel."""
+        assert isinstance(message, dict), "message is not a dict"
+        self.require_valid_channel_name(channel)
+        assert "__asgi_channel__" not in message
+        owner = self._require_owner(channel)
+        if owner == self.process_id and self._is_local_loop():
+            try:
+                self._queue(channel).put_nowait((time.time() + self.expiry, deepcopy(message)))
+            except asyncio.QueueFull:
+                raise ChannelFull(channel)
+            return
+        await self._in_executor(self._publish, {owner: [channel]}, message, time.time())
+
+    async def receive(self, channel):
+        """Wait for the next unexpired message on one of this process's channels."""
+        self.require_valid_channel_name(channel)
+        if self._require_owner(channel) != self.process_id:
+            raise ValueError(f"{channel} belongs to another process")
+        await self._ensure_listener()
+        self._clean_expired()
+
+        queue = self._queue(channel)
+        try:
+            while True:
+                expires_at, message = await queue.get()
+                if expires_at >= time.time():
+                    return message
+                self.dropped += 1
+        finally:
+            if queue.empty() and self.channels.get(channel) is queue:
+                del self.channels[channel]
+
+    async def new_channel(self, prefix="specific."):
+        await self._ensure_listener()
+        return "%s.%s!%s" % (prefix, self.process_id, "".join(random.choices(string.ascii_letters, k=12)))
+
+    # Groups extension ----------------------------------------------------------
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        await self._in_executor(self._add_member, group, channel)
+
+    async def group_discard(self, group, channel):
+        self.require_valid_channel_name(channel)
+        self.require_valid_group_name(group)
+        await self._in_executor(self._discard_members, group, [channel])
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "Message is not a dict"
+        self.require_valid_group_name(group)
+        local_owner = self.process_id if self._is_local_loop() else None
+        try:
+            local = await self._in_executor(self._group_publish, group, message, time.time(), local_owner)
+        except ChannelFull:
+            logger.warning(f"[Channel layer] Dropped message for group {group}: {self.max_pending_sends} database sends pending")
+            return
+        expires_at = time.time() + self.expiry
+        for channel in local:
+            try:
+                self._queue(channel).put_nowait((expires_at, deepcopy(message)))
+            except asyncio.QueueFull:
+                self.dropped += 1
+
+    # Flush extension -----------------------------------------------------------
+
+    async def flush(self):
+        self.channels = {}
+        self._inbox.clear()
+        await self._in_executor(self._truncate)
+
+    async def close(self):
+        self._stop_listener()
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._close_db)
+
+    # Local queues ----------------------------------------------------------------
+
+    def _require_owner(self, channel: str) -> str:
+        owner = channel_owner(channel)
+        if owner is None:
+            raise NotImplementedError("PostgresChannelLayer only supports process-specific channels from new_channel()")
+        return owner
+
+    def _is_local_loop(self) -> bool:
+        """Whether local queues may be used directly from the running event loop."""
+        return self._loop is None or self._loop is asyncio.get_running_loop()
+
+    def _queue(self, channel: str) -> asyncio.Queue:
+        queue = self.channels.get(channel)
+        if queue is None:
+            queue = self.channels[channel] = asyncio.Queue(maxsize=self.get_capacity(channel))
+        return queue
+
+    def _deliver(self, channels: List[str], sent_at: float, message: Dict) -> int:
+        """Queue a message received from another process; returns how many channels took it."""
+        expires_at = sent_at + self.expiry
+        if expires_at < time.time():
+            self.dropped += len(channels)
+            return 0
+        delivered = 0
+        for index, channel in enumerate(channels):
+            try:
+                self._queue(channel).put_nowait((expires_at, message if index == 0 else deepcopy(message)))
+                delivered += 1
+            except asyncio.QueueFull:
+                self.dropped += 1
+        return delivered
+
+    def _clean_expired(self):
+        """
+        Drop expired messages. A channel with expired messages is no longer
+        read, so it also leaves its groups, as in the other layers.
+        """
+        now = time.time()
+        if now - self._last_expiry_check < 1:
+            return
+        self._last_expiry_check = now
+        stale = []
+        for channel, queue in list(self.channels.items()):
+            expired = False
+            while not queue.empty() and queue._queue[0][0] < now:
+                queue.get_nowait()
+                self.dropped += 1
+                expired = True
+            if expired:
+                stale.append(channel)
+                if queue.empty():
+                    self.channels.pop(channel, None)
+        if stale:
+            asyncio.get_running_loop().create_task(self._discard_stale(stale))
+
+    async def _discard_stale(self, channels: List[str]):
+        try:
+            await self._in_executor(self._discard_members, None, channels)
+        except Exception as e:
+            logger.warning(f"[Channel layer] Could not remove expired channels from groups: {e}")
+
+    # Listening -------------------------------------------------------------------
+
+    async def _ensure_listener(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._listening is None:
+            self._stop_listener()
+            self._loop = loop
+            self._listening = loop.create_task(self._listen())
+        try:
+            await asyncio.shield(self._listening)
+        except Exception:
+            self._listening = None  # retried by the next call
+            raise
+
+    async def _listen(self):
+        loop = asyncio.get_running_loop()
+        conn = await loop.run_in_executor(self._executor, self._open_listener)
+        self._listener = conn
+        loop.add_reader(conn.fileno(), self._on_notify)
+        logger.info(f"[Channel layer] Listening on {self.notify_channel}")
+
+    def _open_listener(self):
+        conn = self._connect()
+        with conn.cursor() as cursor:
+            cursor.execute(f'LISTEN "{self.notify_channel}"')
+        return conn
+
+    def _stop_listener(self):
+        conn, self._listener = self._listener, None
+        task, self._listening = self._listening, None
+        if task is not None and not task.done():
+            task.cancel()
+        if conn is not None:
+            try:
+                self._loop.remove_reader(conn.fileno())
+            except Exception:
+                pass  # loop already closed
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def _on_notify(self):
+        try:
+            self._listener.poll()
+        except Exception as e:
+            logger.warning(f"[Channel layer] Lost the LISTEN connection, reconnecting: {e}")
+            self._stop_listener()
+            self._loop.create_task(self._reconnect())
+            return
+        notifies = self._listener.notifies
+        while notifies:
+            payload = notifies.pop(0).payload
+            try:
+                data = json.loads(payload)
+            except ValueError:
+                logger.warning(f"[Channel layer] Ignoring malformed notification: {payload[:100]}")
+                continue
+            if self._inbox or "r" in data:
+                # Keep order behind messages whose payload must be fetched first
+                self._inbox.append(data)
+                if self._draining is None or self._draining.done():
+                    self._draining = self._loop.create_task(self._drain_inbox())
+            else:
+                self._deliver(data["c"], data["t"], data["m"])
+
+    async def _drain_inbox(self):
+        while self._inbox:
+            data = self._inbox[0]
+            if "r" in data:
+                try:
+                    data["m"] = await self._in_executor(self._fetch_payload, data.pop("r"))
+                except Exception as e:
+                    logger.warning(f"[Channel layer] Could not fetch a large message: {e}")
+            self._inbox.popleft()
+            if data.get("m") is not None:
+                self._deliver(data["c"], data["t"], data["m"])
+
+    async def _reconnect(self):
+        delay = 0.5
+        while self._listening is None and self._loop is asyncio.get_running_loop():
+            await asyncio.sleep(delay)
+            try:
+                await self._ensure_listener()
+                return
+            except Exception as e:
+                logger.warning(f"[Channel layer] Reconnect failed: {e}")
+                delay = min(delay * 2, 30)
+
+    # Database work (runs on the executor thread) -----------------------------------
+
+    async def _in_executor(self, fn, *args):
+        with self._pending_lock:
+            if self._pending >= self.max_pending_sends:
+                raise ChannelFull(f"{self.max_pending_sends} database sends pending")
+            self._pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, self._run, fn, *args)
+        finally:
+            with self._pending_lock:
+                self._pending -= 1
+
+    def _connect(self):
+        wrapper = connections[self.database]
+        if wrapper.vendor != 'postgresql':
+            raise ImproperlyConfigured(f"PostgresChannelLayer needs a PostgreSQL database, {self.database!r} is {wrapper.vendor}")
+        conn = wrapper.get_new_connection(wrapper.get_connection_params())
+        conn.autocommit = True
+        return conn
+
+    def _run(self, fn, *args):
+        if self._db is None or self._db.closed:
+            conn = self._connect()
+            try:
+                self._create_tables(conn)
+            except Exception:
+                conn.close()
+                raise
+            self._db = conn
+        driver = connections[self.database].Database
+        try:
+            with self._db.cursor() as cursor:
+                result = fn(cursor, *args)
+                if time.time() - self._last_cleanup > CLEANUP_INTERVAL:
+                    self._last_cleanup = time.time()
+                    self._purge(cursor)
+                return result
+        except (driver.OperationalError, driver.InterfaceError):
+            self._close_db()  # reconnect on the next call
+            raise
+
+    def _close_db(self):
+        conn, self._db = self._db, None
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def _create_tables(self, conn):
+        with conn.cursor() as cursor:
+            # Serialized so workers starting together do not race on CREATE
+            cursor.execute(
+                f"""
+                BEGIN;
+                SELECT pg_advisory_xact_lock(hashtext(%s));
+                CREATE UNLOGGED TABLE IF NOT EXISTS {self.groups_table} (
+                    group_name varchar(100) NOT NULL,
+                    channel varchar(100) NOT NULL,
+                    expires_at timestamptz NOT NULL,
+                    PRIMARY KEY (group_name, channel)
+                );
+                CREATE INDEX IF NOT EXISTS {self.groups_table}_channel ON {self.groups_table} (channel);
+                CREATE UNLOGGED TABLE IF NOT EXISTS {self.payloads_table} (
+                    id bigserial PRIMARY KEY,
+                    data text NOT NULL,
+                    created_at timestamptz NOT NULL DEFAULT now()
+                );
+                COMMIT;
+                """,
+                [self.groups_table],
+            )
+
+    def _purge(self, cursor):
+        cursor.execute(f"DELETE FROM {self.groups_table} WHERE expires_at < now()")
+        cursor.execute(
+            f"DELETE FROM {self.payloads_table} WHERE created_at < now() - make_interval(secs => %s)",
+            [self.expiry],
+        )
+
+    def _truncate(self, cursor):
+        cursor.execute(f"TRUNCATE {self.groups_table}, {self.payloads_table}")
+
+    def _add_member(self, cursor, group, channel):
+        cursor.execute(
+            f"INSERT INTO {self.groups_table} (group_name, channel, expires_at) "
+            f"VALUES (%s, %s, now() + make_interval(secs => %s)) "
+            f"ON CONFLICT (group_name, channel) DO UPDATE SET expires_at = EXCLUDED.expires_at",
+            [group, channel, self.group_expiry],
+        )
+
+    def _discard_members(self, cursor, group, channels):
+        if group is None:
+            cursor.execute(f"DELETE FROM {self.groups_table} WHERE channel = ANY(%s)", [channels])
+        else:
+            cursor.execute(
+                f"DELETE FROM {self.groups_table} WHERE group_name = %s AND channel = ANY(%s)", [group, channels],
+            )
+
+    def _group_publish(self, cursor, group, message, sent_at, local_owner):
+        """NOTIFY the processes owning members of ``group``; returns the members owned by ``local_owner``."""
+        cursor.execute(
+            f"SELECT channel FROM {self.groups_table} WHERE group_name = %s AND expires_at > now()", [group],
+        )
+        routes, local = {}, []
+        for (channel,) in cursor.fetchall():
+            owner = channel_owner(channel)
+            if owner is None:
+                continue
+            if owner == local_owner:
+                local.append(channel)
+            else:
+                routes.setdefault(owner, []).append(channel)
+        if routes:
+            self._publish(cursor, routes, message, sent_at)
+        return local
+
+    def _publish(self, cursor, routes: Dict[str, List[str]], message, sent_at):
+        """One statement sending ``message`` to every owner's channels."""
+        message_json = encode_message(message)
+        longest = max(len(channel) for channels in routes.values() for channel in channels)
+        ref = None
+        if len(message_json.encode()) + ENVELOPE_OVERHEAD + longest + 3 > self.payload_limit:
+            cursor.execute(f"INSERT INTO {self.payloads_table} (data) VALUES (%s) RETURNING id", [message_json])
+            ref = cursor.fetchone()[0]
+            message_json = None
+        targets, payloads = [], []
+        for owner, channels in routes.items():
+            for payload in build_notifications(channels, message_json, ref, sent_at, self.payload_limit):
+                targets.append(f"{self.prefix}_{owner}")
+                payloads.append(payload)
+        cursor.execute(
+            "SELECT pg_notify(target, payload) FROM unnest(%s::text[], %s::text[]) AS t(target, payload)",
+            [targets, payloads],
+        )
+
+    def _fetch_payload(self, cursor, ref):
+        cursor.execute(f"SELECT data FROM {self.payloads_table} WHERE id = %s", [ref])
+        row = cursor.fetchone()
+        return json.loads(row[0]) if row else None
@@ -79,6 +79,28 @@ class BroadcastService:
             {'project_id': project.id, 'title': project.title}, actor
         )
     
+    @staticmethod
+    def broadcast_backlog_progress(project, phase, completed, total, actor):
+        """Broadcast backlog generation progress (e.g. epics expanded so far)"""
+        BroadcastService.broadcast_to_project(
+            project.id, 'backlog_progress', phase,
+            {'project_id': project.id, 'phase': phase, 'completed': completed, 'total': total}, actor
+        )
+    
+    @staticmethod
+    def broadcast_llm_queue_position(project, operation, position, estimated_wait, actor):
+        """Broadcast the queue position of a pending LLM job for the project"""
+        BroadcastService.broadcast_to_project(
+            project.id, 'llm_queue', 'queued',
+            {
+                'project_id': project.id,
+                'operation': operation,
+                'position': position,
+                'estimated_wait_seconds': round(estimated_wait, 1),
+            },
+            actor
+        )
+    
     # Epic-related broadcasts
     @staticmethod
     def broadcast_epic_update(epic, action, actor):
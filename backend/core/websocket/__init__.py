@@ -0,0 +1 @@
+# WebSocket consumers shared across apps
@@ -0,0 +1,278 @@
+"""
+One WebSocket per client for every realtime stream, at ``ws/stream/``.
+
+Instead of a socket per stream (project updates, chat notifications and one
+per open chat room, each authenticating on its own), the client opens one
+socket and subscribes to topics:
+
+    {"action": "subscribe", "topic": "chat.12"}
+    {"action": "unsubscribe", "topic": "chat.12"}
+    {"action": "typing", "room_id": 12}        (or "stop_typing")
+    {"action": "who_is_online", "room_id": 12}
+    {"action": "heartbeat"}
+
+Topics:
+
+- ``project_updates``, ``notifications``, ``chat_notifications``: the
+  user's own streams, as sent to ``ProjectUpdatesConsumer`` and
+  ``ChatNotificationConsumer``.
+- ``chat.<room_id>``: room events (messages, deletions, membership
+  changes). Subscribing also puts the user online in the room.
+- ``presence.<room_id>``: batched ``presence_delta`` events (who came
+  online or left, who is typing) from ``apps.chat.presence``.
+
+Each topic maps to the channel group the existing consumers use, so the
+senders are unchanged. Room topics need room membership, checked with the
+same rule as the chat REST API (through the WebSocket membership cache).
+Every event sent to the client carries its ``topic``; subscribe and
+unsubscribe are answered with ``subscribed`` / ``unsubscribed`` or an
+``error`` naming the topic.
+
+Frames go out through the bounded queue of ``outbox.OutboxMixin``. Its
+``ping`` frames carry no topic; answer them with ``{"action": "pong"}``.
+"""
+import json
+import logging
+import re
+from collections import Counter
+from typing import Dict, Optional
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+
+from apps.chat.auth import is_room_member_cached
+from apps.chat.presence import presence, presence_group_name
+from core.websocket.outbox import OutboxMixin
+
+logger = logging.getLogger('core.websocket')
+
+MAX_TOPICS = 50  # subscriptions per socket
+
+USER_TOPICS = {
+    'project_updates': 'user_{user_id}_updates',
+    'notifications': 'user_{user_id}_notifications',
+    'chat_notifications': 'user_{user_id}_chat_notifications',
+}
+ROOM_TOPICS = {
+    'chat': 'chat_{room_id}',
+    'presence': 'chat_{room_id}_presence',
+}
+_TOPIC_RE = re.compile(r"^(?P<kind>[a-z_]+)(?:\.(?P<room_id>\d+))?$")
+
+# Chat notification events renamed for the client, as ChatNotificationConsumer does
+CHAT_NOTIFICATION_TYPES = {
+    'new_message_notification': 'new_message',
+    'mention_notification': 'mention',
+}
+
+
+def resolve_topic(topic, user_id) -> Optional[Dict]:
+    """
+    Parse a topic name into its channel group, or None if it is not a valid
+    topic. Room topics also return the ``room_id`` to check membership for.
+    """
+    match = _TOPIC_RE.match(topic) if isinstance(topic, str) else None
+    if not match:
+        return None
+    kind, room_id = match['kind'], match['room_id']
+    if room_id is None:
+        template = USER_TOPICS.get(kind)
+        return {'group': template.format(user_id=user_id), 'room_id': None} if template else None
+    template = ROOM_TOPICS.get(kind)
+    return {'group': template.format(room_id=room_id), 'room_id': int(room_id)} if template else None
+
+
+class MultiplexConsumer(OutboxMixin, AsyncWebsocketConsumer):
+    async def connect(self):
+        user = self.scope['user']
+        if not user.is_authenticated:
+            logger.warning("Stream WebSocket: User not authenticated")
+            await self.close()
+            return
+
+        self.user_id = user.user_id
+        self.topics = {}  # topic -> channel group
+        self.groups = Counter()  # channel group -> topics needing it
+        self.rooms = set()  # rooms this socket is online in (chat.<room_id> subscriptions)
+        await self.accept()
+        await self.send_event({'type': 'connected', 'user_id': self.user_id})
+
+    async def disconnect(self, close_code):
+        for group in getattr(self, 'groups', {}):
+            await self.channel_layer.group_discard(group, self.channel_name)
+        for room_id in getattr(self, 'rooms', ()):
+            presence.disconnect(room_id, self.user_id)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            data = json.loads(text_data or '')
+        except json.JSONDecodeError:
+            await self.send_error('Invalid JSON format')
+            return
+        if not isinstance(data, dict):
+            await self.send_error('Expected a JSON object')
+            return
+
+        action = data.get('action')
+        if action in ('subscribe', 'unsubscribe') and not isinstance(data.get('topic'), str):
+            # Lists and objects would fail as dict keys below
+            await self.send_error('Expected a topic name')
+            return
+        if action == 'subscribe':
+            await self.subscribe(data.get('topic'))
+        elif action == 'unsubscribe':
+            await self.unsubscribe(data.get('topic'))
+        elif action in ('typing', 'stop_typing'):
+            await self.report_typing(action, data.get('room_id'))
+        elif action == 'heartbeat':
+            for room_id in self.rooms:
+                presence.heartbeat(room_id, self.user_id)
+        elif action == 'who_is_online':
+            await self.send_presence(data.get('room_id'))
+        else:
+            await self.send_error(f'Unknown action: {action}')
+
+    async def subscribe(self, topic):
+        if topic in self.topics:
+            await self.send_event({'type': 'subscribed', 'topic': topic})
+            return
+        if len(self.topics) >= MAX_TOPICS:
+            await self.send_error(f'At most {MAX_TOPICS} subscriptions per connection', topic)
+            return
+
+        resolved = resolve_topic(topic, self.user_id)
+        if resolved is None:
+            await self.send_error('Unknown topic', topic)
+            return
+        if resolved['room_id'] is not None and not await self.is_member(resolved['room_id']):
+            logger.warning(f"Stream WebSocket: User {self.user_id} not a member of room {resolved['room_id']}")
+            await self.send_error('You must be a member of the room to subscribe', topic)
+            return
+
+        self.topics[topic] = resolved['group']
+        for group in self.topic_groups(topic):
+            await self.add_group(group)
+        if topic.startswith('chat.'):
+            self.rooms.add(resolved['room_id'])
+            presence.connect(resolved['room_id'], self.user_id, self.scope['user'].name)
+            presence.ensure_running()
+        await self.send_event({'type': 'subscribed', 'topic': topic})
+
+    async def unsubscribe(self, topic):
+        if topic in self.topics:
+            for group in self.topic_groups(topic):
+                await self.discard_group(group)
+            del self.topics[topic]
+            if topic.startswith('chat.'):
+                room_id = int(topic.split('.', 1)[1])
+                self.rooms.discard(room_id)
+                presence.disconnect(room_id, self.user_id)
+        await self.send_event({'type': 'unsubscribed', 'topic': topic})
+
+    def topic_groups(self, topic):
+        # Chat topics also join the presence group, so this worker's presence view stays current
+        if topic.startswith('chat.'):
+            return [self.topics[topic], presence_group_name(topic.split('.', 1)[1])]
+        return [self.topics[topic]]
+
+    async def add_group(self, group):
+        self.groups[group] += 1
+        if self.groups[group] == 1:
+            await self.channel_layer.group_add(group, self.channel_name)
+
+    async def discard_group(self, group):
+        self.groups[group] -= 1
+        if self.groups[group] <= 0:
+            del self.groups[group]
+            await self.channel_layer.group_discard(group, self.channel_name)
+
+    async def report_typing(self, action, room_id):
+        # Subscribing to the room's chat topic already checked membership
+        if f'chat.{room_id}' not in self.topics:
+            await self.send_error('Subscribe to the room before sending typing events', f'chat.{room_id}')
+            return
+        if action == 'typing':
+            presence.typing(room_id, self.user_id)
+        else:
+            presence.stop_typing(room_id, self.user_id)
+
+    async def send_presence(self, room_id):
+        topic = f'presence.{room_id}'
+        if f'chat.{room_id}' not in self.topics and topic not in self.topics:
+            await self.send_error('Subscribe to the room before asking who is online', topic)
+            return
+        await self.send_event({
+            'type': 'presence',
+            'topic': topic,
+            'room_id': int(room_id),
+            'online': presence.who_is_online(room_id),
+        }, coalesce=topic)
+
+    @database_sync_to_async
+    def is_member(self, room_id):
+        return is_room_member_cached(self.scope['user'], room_id)
+
+    async def send_event(self, payload, coalesce=None):
+        await self.send(text_data=json.dumps(payload), coalesce=coalesce)
+
+    async def send_error(self, message, topic=None):
+        payload = {'type': 'error', 'message': message}
+        if topic is not None:
+            payload['topic'] = topic
+        await self.send_event(payload)
+
+    async def forward(self, topic, payload, coalesce=None):
+        # Events can still arrive between unsubscribe and the group discard completing
+        if topic in self.topics:
+            await self.send_event({'topic': topic, **payload}, coalesce)
+
+    async def forward_room_event(self, kind, event):
+        room_id = event.get('room_id')
+        if room_id is None:
+            logger.debug(f"Stream WebSocket: Dropping {event['type']} without room_id")
+            return
+        await self.forward(f'{kind}.{room_id}', event)
+
+    # Project updates and notifications (ProjectUpdatesConsumer's groups)
+    async def project_event(self, event):
+        await self.forward('project_updates', event['data'])
+
+    async def notification_message(self, event):
+        await self.forward('notifications', {
+            'type': 'notification',
+            'action': 'notification_created',
+            'notification': event['notification']
+        })
+
+    # Chat notifications (ChatNotificationConsumer's group)
+    async def chat_notification(self, event):
+        payload = dict(event, type=CHAT_NOTIFICATION_TYPES.get(event['type'], event['type']))
+        # Unread totals supersede each other, as on ChatNotificationConsumer
+        coalesce = 'unread_count' if event['type'] == 'unread_count_updated' else None
+        await self.forward('chat_notifications', payload, coalesce)
+
+    new_message_notification = chat_notification
+    mention_notification = chat_notification
+    room_invitation = chat_notification
+    unread_count_updated = chat_notification
+
+    async def direct_room_created(self, event):
+        # Sent both to the room group (with room_id) and to the users' chat notifications
+        if 'room_id' in event:
+            await self.forward_room_event('chat', event)
+        else:
+            await self.chat_notification(event)
+
+    # Room events (ChatConsumer's groups)
+    async def room_event(self, event):
+        await self.forward_room_event('chat', event)
+
+    chat_message = room_event
+    message_deleted = room_event
+    user_joined = room_event
+    user_left = room_event
+    room_created = room_event
+
+    # Presence deltas (the rooms' presence groups)
+    async def presence_delta(self, event):
+        await self.forward_room_event('presence', presence.apply(event))
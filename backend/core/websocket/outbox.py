@@ -0,0 +1,307 @@
+"""
+Bounded outgoing queues for WebSocket consumers.
+
+``AsyncWebsocketConsumer.send`` hands every frame straight to the ASGI
+server, which buffers whatever a slow client cannot take yet, without a
+bound. While a handler waits on such a send, the channel layer drops events
+over its per-channel capacity. ``OutboxMixin`` puts a bounded queue in front
+of the socket instead, drained by one writer task per connection, so
+handlers return at once:
+
+- ``send(..., coalesce=key)`` replaces a still-queued frame with the same
+  key instead of adding one (e.g. only the latest unread count is sent).
+- A connection whose queue reaches ``WS_SEND_QUEUE_SIZE`` frames, or whose
+  send takes over ``WS_SEND_TIMEOUT`` seconds, is evicted: closed with code
+  4008 and its queue dropped. Clients reconnect (chat sockets resume from
+  ``last_message_id``).
+- After ``WS_PING_INTERVAL`` seconds without a frame sent, the server sends
+  ``{"type": "ping"}``. Clients that answer ``{"type": "pong"}`` opt in to
+  liveness checks and are evicted after ``WS_PING_TIMEOUT`` seconds without
+  any frame from them. Pongs never reach ``receive``.
+- Clients that send ``{"type": "ack", "count": n}`` (n: frames received so
+  far, pings included) opt in to flow control: at most ``WS_SEND_WINDOW``
+  frames are unacknowledged, the rest wait in the queue, and a window that
+  stays full for ``WS_SEND_TIMEOUT`` seconds evicts (``send_timeout``). Acks
+  never reach ``receive`` either.
+
+The limits are only as good as the backpressure the writer sees. Daphne's
+``websocket.send`` returns once the frame is handed to Twisted, which
+buffers without a bound, so for clients that do not ack, a slow reader
+never fills the queue and never hits the send timeout there. Acks measure
+what the client actually read.
+
+``outbox_metrics.snapshot()`` reports queue depths, coalesced and dropped
+frames and evictions per consumer class.
+
+Mix in before the consumer base class:
+``class ChatConsumer(OutboxMixin, AsyncWebsocketConsumer)``.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+import weakref
+from collections import Counter, deque
+from typing import Dict, Optional
+
+from django.conf import settings
+
+logger = logging.getLogger('core.websocket')
+
+EVICTED_CLOSE_CODE = 4008
+PING_FRAME = json.dumps({'type': 'ping'})
+
+
+class ConsumerMetrics:
+    __slots__ = ('connections', 'queued', 'sent', 'coalesced', 'dropped', 'max_depth', 'evictions')
+
+    def __init__(self):
+        self.connections = 0
+        self.queued = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.evictions = Counter()
+
+
+class OutboxMetrics:
+    """Per-process counters by consumer class; locked, as the metrics endpoint reads them from a thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._consumers: Dict[str, ConsumerMetrics] = {}
+        self._open = weakref.WeakSet()  # connected consumers, for current queue depths
+
+    def _metrics(self, consumer) -> ConsumerMetrics:
+        name = type(consumer).__name__
+        metrics = self._consumers.get(name)
+        if metrics is None:
+            metrics = self._consumers[name] = ConsumerMetrics()
+        return metrics
+
+    def connected(self, consumer):
+        with self._lock:
+            self._metrics(consumer).connections += 1
+            self._open.add(consumer)
+
+    def disconnected(self, consumer, dropped):
+        with self._lock:
+            self._metrics(consumer).dropped += dropped
+            self._open.discard(consumer)
+
+    def queued(self, consumer, depth, coalesced):
+        with self._lock:
+            metrics = self._metrics(consumer)
+            if coalesced:
+                metrics.coalesced += 1
+            else:
+                metrics.queued += 1
+                metrics.max_depth = max(metrics.max_depth, depth)
+
+    def sent(self, consumer):
+        with self._lock:
+            self._metrics(consumer).sent += 1
+
+    def dropped(self, consumer, count=1):
+        with self._lock:
+            self._metrics(consumer).dropped += count
+
+    def evicted(self, consumer, reason, dropped):
+        with self._lock:
+            metrics = self._metrics(consumer)
+            metrics.evictions[reason] += 1
+            metrics.dropped += dropped
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            depths = {}
+            for consumer in list(self._open):
+                depths.setdefault(type(consumer).__name__, []).append(len(consumer._outbox))
+            return {
+                name: {
+                    'open': len(depths.get(name, [])),
+                    'connections': m.connections,
+                    'queue_depth': sum(depths.get(name, [])),
+                    'queue_depth_max_open': max(depths.get(name, [0])),
+                    'queue_depth_max_seen': m.max_depth,
+                    'queued': m.queued,
+                    'sent': m.sent,
+                    'coalesced': m.coalesced,
+                    'dropped': m.dropped,
+                    'evictions': dict(m.evictions),
+                }
+                for name, m in self._consumers.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._consumers.clear()
+
+
+outbox_metrics = OutboxMetrics()
+
+
+class Frame:
+    __slots__ = ('text_data', 'bytes_data', 'close', 'key')
+
+    def __init__(self, text_data, bytes_data, close, key):
+        self.text_data = text_data
+        self.bytes_data = bytes_data
+        self.close = close
+        self.key = key
+
+
+def _ack_count(text) -> Optional[int]:
+    """The ``count`` of an ack frame, or None for anything else."""
+    if len(text) > 64 or 'ack' not in text:
+        return None
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(data, dict) or data.get('type') != 'ack':
+        return None
+    count = data.get('count')
+    return count if isinstance(count, int) and not isinstance(count, bool) and count >= 0 else None
+
+
+def _is_pong(text) -> bool:
+    # Pongs are tiny; skip parsing anything else
+    if len(text) > 64 or 'pong' not in text:
+        return False
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        return False
+    return isinstance(data, dict) and 'pong' in (data.get('type'), data.get('action'))
+
+
+class OutboxMixin:
+    _outbox = ()
+    _writer: Optional[asyncio.Task] = None
+    _heartbeat: Optional[asyncio.Task] = None
+    _evicted = False
+
+    async def accept(self, *args, **kwargs):
+        await super().accept(*args, **kwargs)
+        self._outbox = deque()
+        self._coalescing: Dict[str, Frame] = {}
+        self.queue_size = getattr(settings, 'WS_SEND_QUEUE_SIZE', 256)
+        self.send_timeout = getattr(settings, 'WS_SEND_TIMEOUT', 10)
+        self.ping_interval = getattr(settings, 'WS_PING_INTERVAL', 25)
+        self.ping_timeout = getattr(settings, 'WS_PING_TIMEOUT', 60)
+        self.send_window = getattr(settings, 'WS_SEND_WINDOW', 64)
+        self._last_sent = self._last_received = time.monotonic()
+        self._answers_pings = False
+        # Flow control, once the client acks: frames sent and acknowledged so far
+        self._sends_acks = False
+        self._sent_count = self._acked_count = 0
+        self._acked = asyncio.Event()
+        outbox_metrics.connected(self)
+        self._heartbeat = asyncio.ensure_future(self._run_heartbeat())
+
+    async def send(self, text_data=None, bytes_data=None, close=False, coalesce=None):
+        """Queue a frame; with ``coalesce``, it replaces a queued frame with the same key."""
+        if self._evicted:
+            outbox_metrics.dropped(self)
+            return
+        if not isinstance(self._outbox, deque):
+            # Not accepted yet: nothing to queue behind
+            await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
+            return
+
+        queued = self._coalescing.get(coalesce) if coalesce is not None else None
+        if queued is not None:
+            queued.text_data, queued.bytes_data, queued.close = text_data, bytes_data, close
+            outbox_metrics.queued(self, len(self._outbox), coalesced=True)
+            return
+        if len(self._outbox) >= self.queue_size:
+            await self.evict('queue_full')
+            return
+
+        frame = Frame(text_data, bytes_data, close, coalesce)
+        self._outbox.append(frame)
+        if coalesce is not None:
+            self._coalescing[coalesce] = frame
+        outbox_metrics.queued(self, len(self._outbox), coalesced=False)
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.ensure_future(self._drain())
+
+    async def _drain(self):
+        while self._outbox:
+            if self._sends_acks and self._sent_count - self._acked_count >= self.send_window:
+                # Window full: frames stay queued (and count against the queue) until acked
+                self._acked.clear()
+                try:
+                    await asyncio.wait_for(self._acked.wait(), self.send_timeout)
+                except asyncio.TimeoutError:
+                    await self.evict('send_timeout')
+                    return
+                continue
+            frame = self._outbox.popleft()
+            if frame.key is not None and self._coalescing.get(frame.key) is frame:
+                del self._coalescing[frame.key]
+            try:
+                await asyncio.wait_for(
+                    super().send(text_data=frame.text_data, bytes_data=frame.bytes_data, close=frame.close),
+                    self.send_timeout
+                )
+            except asyncio.TimeoutError:
+                outbox_metrics.dropped(self)  # the frame that was stuck
+                await self.evict('send_timeout')
+                return
+            self._last_sent = time.monotonic()
+            self._sent_count += 1
+            outbox_metrics.sent(self)
+
+    async def _run_heartbeat(self):
+        while not self._evicted:
+            await asyncio.sleep(min(self.ping_interval, self.ping_timeout) / 2)
+            now = time.monotonic()
+            if self._answers_pings and now - self._last_received > self.ping_timeout:
+                await self.evict('ping_timeout')
+                return
+            if now - self._last_sent >= self.ping_interval:
+                await self.send(text_data=PING_FRAME, coalesce='ping')
+
+    async def evict(self, reason):
+        """Drop the queue and close the connection; the client is expected to reconnect."""
+        if self._evicted:
+            return
+        self._evicted = True
+        dropped = len(self._outbox)
+        self._outbox.clear()
+        self._coalescing.clear()
+        outbox_metrics.evicted(self, reason, dropped)
+        logger.warning(
+            f"WebSocket outbox: Evicting {type(self).__name__} {self.channel_name} ({reason}, {dropped} frames dropped)"
+        )
+        if self._writer is not None and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        await self.close(code=EVICTED_CLOSE_CODE)
+
+    async def websocket_receive(self, message):
+        self._last_received = time.monotonic()
+        text = message.get('text')
+        if text is not None and _is_pong(text):
+            self._answers_pings = True
+            return
+        count = _ack_count(text) if text is not None else None
+        if count is not None:
+            if isinstance(self._outbox, deque):
+                self._sends_acks = True
+                self._acked_count = max(self._acked_count, min(count, self._sent_count))
+                self._acked.set()
+            return
+        await super().websocket_receive(message)
+
+    async def websocket_disconnect(self, message):
+        for task in (self._writer, self._heartbeat):
+            if task is not None and task is not asyncio.current_task():
+                task.cancel()
+        if isinstance(self._outbox, deque):
+            outbox_metrics.disconnected(self, dropped=len(self._outbox))
+            self._outbox.clear()
+        await super().websocket_disconnect(message)
@@ -0,0 +1,6 @@
+from django.urls import re_path
+from . import multiplex
+
+websocket_urlpatterns = [
+    re_path(r'ws/stream/$', multiplex.MultiplexConsumer.as_asgi()),
+]
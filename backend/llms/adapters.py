@@ -0,0 +1,240 @@
+"""
+LoRA adapters served on a shared base model.
+
+``fine_tune/train_lora.py`` writes one adapter per base model
+(``{name}_project_manager_lora``). Instead of loading a fine-tuned copy of the
+base model, the adapter weights are attached to the base model the model
+registry already holds. Many adapters can be resident at once, up to
+``LLM_MAX_ADAPTERS`` per base model; the least recently used adapter is
+deleted when a new one is loaded.
+
+The active adapter is global state on the model, so ``set_adapter`` and the
+generation that uses it run under the base model's lock. Prompts for
+different adapters can still share one forward pass through
+``AdapterManager.generate_mixed`` (peft's per-row ``adapter_names``).
+
+A model registry route names an adapter as ``"<model>+<adapter>"``, e.g.
+``{"summary": "qwen-0.5b+qwen-project-manager"}``.
+"""
+import logging
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence
+
+from django.conf import settings
+
+try:
+    from peft import PeftModel
+except Exception:  # peft not installed: adapters cannot be served
+    PeftModel = None
+
+logger = logging.getLogger('llms')
+
+FINE_TUNE_DIR = os.path.join(os.path.dirname(__file__), "fine_tune")
+DEFAULT_MAX_ADAPTERS = 8
+BASE = "__base__"  # peft's name for "no adapter" in mixed batches
+
+
+@dataclass(frozen=True)
+class AdapterSpec:
+    name: str
+    model: str  # model registry name of the base model the adapter was trained on
+    path: str
+
+
+def _trained_adapter(train_name: str, model: str) -> AdapterSpec:
+    return AdapterSpec(
+        f"{train_name}-project-manager", model,
+        os.path.join(FINE_TUNE_DIR, f"{train_name}_project_manager_lora"),
+    )
+
+
+# Adapters produced by fine_tune/train_lora.py for models in the registry
+ADAPTERS: Dict[str, AdapterSpec] = {
+    spec.name: spec for spec in (
+        _trained_adapter("tinyllama", "tinyllama"),
+        _trained_adapter("qwen", "qwen-0.5b"),
+    )
+}
+# Extra adapters, e.g. per customer: {"acme": {"model": "qwen-0.5b", "path": "..."}}
+ADAPTERS.update({
+    name: AdapterSpec(name, config["model"], config["path"])
+    for name, config in getattr(settings, 'LLM_ADAPTERS', {}).items()
+})
+
+
+class PeftHost:
+    """Attaches adapters to a loaded HuggingFacePipeline's model with peft."""
+
+    def __init__(self, llm):
+        self.pipeline = llm.pipeline
+        self.peft_model = None
+
+    def load(self, spec: AdapterSpec):
+        if PeftModel is None:
+            raise RuntimeError("peft is not installed")
+        if self.peft_model is None:
+            self.peft_model = PeftModel.from_pretrained(self.pipeline.model, spec.path, adapter_name=spec.name)
+            self.pipeline.model = self.peft_model
+        else:
+            self.peft_model.load_adapter(spec.path, adapter_name=spec.name)
+
+    def delete(self, name: str):
+        self.peft_model.delete_adapter(name)
+
+    def activate(self, name: Optional[str]):
+        if self.peft_model is None:
+            return
+        if name is None:
+            self.peft_model.base_model.disable_adapter_layers()
+        else:
+            self.peft_model.base_model.enable_adapter_layers()
+            self.peft_model.set_adapter(name)
+
+    def generate_mixed(self, prompts: Sequence[str], adapter_names: List[str], max_new_tokens: int) -> List[str]:
+        tokenizer = self.pipeline.tokenizer
+        inputs = tokenizer(list(prompts), return_tensors="pt", padding=True).to(self.peft_model.device)
+        self.peft_model.base_model.enable_adapter_layers()
+        output = self.peft_model.generate(**inputs, adapter_names=adapter_names, max_new_tokens=max_new_tokens)
+        # Left padding: every prompt ends at the same column
+        new_tokens = output[:, inputs["input_ids"].shape[1]:]
+        return tokenizer.batch_decode(new_tokens, skip_special_tokens=True)
+
+
+class AdapterManager:
+    """The resident adapters of one base model, with LRU eviction."""
+
+    def __init__(self, llm, max_adapters: int = DEFAULT_MAX_ADAPTERS,
+                 host_factory: Callable[[object], object] = PeftHost, adapters: Dict[str, AdapterSpec] = None):
+        self.llm = llm
+        self.max_adapters = max_adapters
+        self.adapters = ADAPTERS if adapters is None else adapters
+        self._host = host_factory(llm)
+        self._resident: 'OrderedDict[str, None]' = OrderedDict()
+        self._lock = threading.RLock()
+        self.loads = 0
+        self.evictions = 0
+
+    def _ensure(self, name: Optional[str], pinned: Sequence[str] = ()):
+        """Make adapter ``name`` resident (call with the lock held)."""
+        if name is None:
+            return
+        if name in self._resident:
+            self._resident.move_to_end(name)
+            return
+        spec = self.adapters.get(name)
+        if spec is None:
+            raise KeyError(f"Unknown adapter: {name}")
+        for victim in list(self._resident):
+            if len(self._resident) < self.max_adapters:
+                break
+            if victim in pinned:
+                continue
+            logger.info(f"[Adapters] Evicting adapter {victim}")
+            self._host.delete(victim)
+            del self._resident[victim]
+            self.evictions += 1
+        logger.info(f"[Adapters] Loading adapter {name} from {spec.path}")
+        self._host.load(spec)
+        self._resident[name] = None
+        self.loads += 1
+
+    def run(self, name: Optional[str], fn: Callable[[], object]):
+        """Call ``fn`` with adapter ``name`` active (None: the plain base model)."""
+        with self._lock:
+            self._ensure(name)
+            self._host.activate(name)
+            return fn()
+
+    def generate_mixed(self, prompts: Sequence[str], adapter_names: Sequence[Optional[str]],
+                       max_new_tokens: int) -> List[str]:
+        """One forward pass where each prompt uses its own adapter."""
+        with self._lock:
+            wanted = [name for name in adapter_names if name is not None]
+            for name in wanted:
+                self._ensure(name, pinned=wanted)
+            return self._host.generate_mixed(prompts, [name or BASE for name in adapter_names], max_new_tokens)
+
+    def bind(self, name: Optional[str]) -> 'AdapterLLM':
+        return AdapterLLM(self, name)
+
+    def resident(self) -> List[str]:
+        with self._lock:
+            return list(self._resident)
+
+
+class _AdapterPipeline:
+    """Callable like the HF pipeline; runs it with the bound adapter active."""
+
+    def __init__(self, manager: AdapterManager, name: Optional[str]):
+        self._manager = manager
+        self._name = name
+        self._pipeline = manager.llm.pipeline
+
+    @property
+    def tokenizer(self):
+        return getattr(self._pipeline, 'tokenizer', None)
+
+    def __call__(self, prompts, **kwargs):
+        return self._manager.run(self._name, lambda: self._pipeline(prompts, **kwargs))
+
+
+class AdapterLLM:
+    """A base model LLM bound to one adapter; drop-in for the pipelines' ``llm``."""
+
+    def __init__(self, manager: AdapterManager, name: Optional[str]):
+        self.adapter = name
+        self.pipeline = _AdapterPipeline(manager, name)
+        self._manager = manager
+
+    def invoke(self, prompt: str):
+        return self._manager.run(self.adapter, lambda: self._manager.llm.invoke(prompt))
+
+
+# Base model name -> AdapterManager for the currently loaded instance
+_managers: Dict[str, AdapterManager] = {}
+_managers_lock = threading.Lock()
+
+
+def bind(model_name: str, llm, adapter: str) -> AdapterLLM:
+    """``llm`` (the loaded ``model_name``) with ``adapter`` active for every call."""
+    spec = ADAPTERS.get(adapter)
+    if spec is None:
+        raise KeyError(f"Unknown adapter: {adapter}")
+    if spec.model != model_name:
+        raise ValueError(f"Adapter {adapter} was trained on {spec.model}, not {model_name}")
+    with _managers_lock:
+        manager = _managers.get(model_name)
+        if manager is None or manager.llm is not llm:
+            manager = _managers[model_name] = AdapterManager(
+                llm, max_adapters=getattr(settings, 'LLM_MAX_ADAPTERS', DEFAULT_MAX_ADAPTERS),
+            )
+    return manager.bind(adapter)
+
+
+def bind_base(model_name: str, llm):
+    """
+    ``llm`` without an adapter. Once adapters are attached to the model, plain
+    calls also go through its manager so they never run with one active.
+    """
+    with _managers_lock:
+        manager = _managers.get(model_name)
+    if manager is None or manager.llm is not llm:
+        return llm
+    return manager.bind(None)
+
+
+def forget(model_name: str):
+    """Drop the adapters of an unloaded base model."""
+    with _managers_lock:
+        _managers.pop(model_name, None)
+
+
+def snapshot() -> Dict:
+    with _managers_lock:
+        return {
+            name: {'resident': manager.resident(), 'loads': manager.loads, 'evictions': manager.evictions}
+            for name, manager in _managers.items()
+        }
@@ -1,18 +1,43 @@
 import os
 import re
+import time
 import logging
-from typing import Dict, Optional
+from typing import Callable, Dict, List, Optional, Tuple
 from apps.ai_api.tasks import CancellationToken, TaskCancelledException
 from llms.models import BacklogModel, EpicModel, SubEpicModel, UserStoryModel, TaskModel
-from llms.llm_cache import get_cached_backlog_llm
+from llms import telemetry, incremental, stream_parser, token_budget
+from llms.model_registry import models
 
 logger = logging.getLogger('llms')
 
 # Cache prompt templates in memory to avoid disk I/O on every call
 _PROMPT_CACHE = {}
 
+# Hierarchical (two-phase) generation: list the epics first, then expand each
+# epic in its own prompt so the backlog is not capped by a single 768-token answer
+HIERARCHICAL_MIN_WORDS = 1200  # proposals this long use the two-phase mode by default
+MIN_EPICS = 4
+MAX_EPICS = 12
+WORDS_PER_EXTRA_EPIC = 800
+BACKLOG_MAX_TOKENS = 768
+EPIC_LIST_MAX_TOKENS = 384
+EPIC_EXPAND_MAX_TOKENS = 768
+EPIC_EXPAND_BATCH_SIZE = 4
+
+# Continuation of a near-miss backlog: tokens budgeted per missing epic
+# (1 sub-epic, 1 story, 2 tasks is ~60 tokens)
+CONTINUATION_TOKENS_PER_EPIC = 96
+
+_EPIC_LINE_RE = re.compile(r"^\s*Epic\s*\d*\s*:\s*(.+)$", re.IGNORECASE)
+_EPIC_NUMBER_RE = re.compile(r"^\s*Epic\s+(\d+)", re.IGNORECASE)
+_CHILD_LABEL_RE = re.compile(r"^\s*(-(?:Sub-Epic|User Story|Task))\s+\d+((?:\.\d+)*)\s*:", re.IGNORECASE)
+
+# progress_callback(phase, completed, total)
+ProgressCallback = Callable[[str, int, int], None]
+
 def build_prompt(section: str, proposal_text: str, context: Dict = None) -> str:
     # Check cache first
+    telemetry.registry.record_cache("prompt_template", section in _PROMPT_CACHE)
     if section not in _PROMPT_CACHE:
         root_dir = os.path.dirname(__file__)
         prompt_path = os.path.join(root_dir, "prompts", f"{section}_prompt.txt")
@@ -55,99 +80,318 @@ def validate_backlog_format(response: str) -> bool:
     # Require minimum of 4 epics and at least one task for a valid backlog
     return has_epic and has_task and epic_count >= 4 and task_count > 0
 
-def generate_section(llm, section: str, prompt: str, max_retries: int = 3, max_tokens: int = 768, cancellation_token: Optional[CancellationToken] = None) -> str:
+def validate_epic_list(response: str) -> bool:
+    """Validate the first hierarchical phase: at least MIN_EPICS "Epic X:" lines."""
+    return len(extract_epic_titles(response or "")) >= MIN_EPICS
+
+def validate_epic_expansion(response: str) -> bool:
+    """Validate one expanded epic: at least one Sub-Epic and one Task entry."""
+    if not response or not isinstance(response, str):
+        return False
+    lines = [line.strip().lower() for line in response.splitlines()]
+    has_sub_epic = any(line.startswith("-sub-epic") and ":" in line for line in lines)
+    has_task = any(line.startswith("-task") and ":" in line for line in lines)
+    return has_sub_epic and has_task
+
+def generate_section(llm, section: str, prompt: str, max_retries: int = 3, max_tokens: int = BACKLOG_MAX_TOKENS,
+                     cancellation_token: Optional[CancellationToken] = None,
+                     validator: Callable[[str], bool] = validate_backlog_format,
+                     prefetched: Optional[Tuple[Optional[str], telemetry.CompletionStats]] = None,
+                     repair: Optional[Callable[[str], Optional[str]]] = None,
+                     text_sink: Optional[Callable[[], Callable[[str], None]]] = None) -> str:
+    """
+    Generate and validate one completion, retrying up to ``max_retries`` times.
+    ``prefetched`` is a (text, stats) result from a batched call that is used as
+    the first attempt instead of calling the model again. ``repair`` is given
+    an invalid response and may return a valid one (e.g. by continuing it)
+    before a full regeneration is attempted. ``text_sink`` is called once per
+    model call for a function that receives the text as it is generated.
+    """
+    call = telemetry.SectionCall("backlog", section, max_tokens)
     for _ in range(max_retries):
         try:
             # Check for cancellation before each attempt
             if cancellation_token:
                 cancellation_token.check_cancelled()
 
-            text = None
-            # Prefer direct pipeline call with per-call override if available
-            if hasattr(llm, "pipeline"):
-                try:
-                    out = llm.pipeline(prompt, max_new_tokens=max_tokens)
-                    if isinstance(out, list) and out and isinstance(out[0], dict) and "generated_text" in out[0]:
-                        text = out[0]["generated_text"]
-                    elif isinstance(out, str):
-                        text = out
-                except Exception:
-                    # Fall back to invoke if pipeline call fails
-                    pass
-
-            if not text:
-                # Fallback to the wrapper invoke
-                text = llm.invoke(prompt)
+            if prefetched is not None:
+                (text, stats), prefetched = prefetched, None
+            else:
+                on_text = text_sink() if text_sink is not None else None
+                text, stats = telemetry.timed_completion(llm, prompt, max_tokens, on_text=on_text)
 
             response = (text or "").strip()
             if not response:
+                call.attempt(stats, "empty")
                 continue
-            if not validate_backlog_format(response):
+            if not validator(response):
+                call.attempt(stats, "invalid")
                 lines = response.splitlines()
                 epic_count = sum(1 for line in lines if line.strip().lower().startswith("epic") and ":" in line)
                 task_count = sum(1 for line in lines if line.strip().lower().startswith("-task") and ":" in line)
-                logger.warning(f"Backlog validation failed, retrying... (attempt {_ + 1}/{max_retries})")
-                logger.warning(f"Epic count: {epic_count} (need >=4), Task count: {task_count}")
+                logger.warning(
+                    f"Backlog validation ({getattr(validator, '__name__', 'validator')}) failed for {section}, "
+                    f"retrying... (attempt {_ + 1}/{max_retries})"
+                )
+                logger.warning(f"Epic count: {epic_count}, Task count: {task_count}")
                 logger.debug(f"Response preview: {response[:200]}...")
+                if repair is not None:
+                    repaired = repair(response)
+                    if repaired:
+                        call.finish(success=True)
+                        return repaired
                 continue
+            call.attempt(stats, "ok")
+            call.finish(success=True)
             return response
         except TaskCancelledException:
+            call.finish(success=False, cancelled=True)
             raise  # Re-raise cancellation exceptions
         except Exception:
+            call.error()
             continue
+    call.finish(success=False)
     return ""
 
+def salvage_backlog_prefix(raw_text: str) -> str:
+    """
+    Keep the structurally complete prefix of a backlog completion: well-formed
+    Epic/Sub-Epic/User Story/Task lines, ending with the last epic that has at
+    least one task (a truncated trailing epic is dropped).
+    """
+    kept = []
+    last_complete = 0
+    epic_has_task = False
+    for line in raw_text.splitlines():
+        stripped = line.strip()
+        label, sep, content = stripped.partition(":")
+        if not sep or not content.strip():
+            continue
+        lowered = label.lower()
+        if lowered.startswith("epic"):
+            if kept and epic_has_task:
+                last_complete = len(kept)
+            epic_has_task = False
+        elif lowered.startswith("-task"):
+            if not kept:
+                continue
+            epic_has_task = True
+        elif not (lowered.startswith("-sub-epic") or lowered.startswith("-user story")) or not kept:
+            continue
+        kept.append(line.rstrip())
+    if kept and epic_has_task:
+        last_complete = len(kept)
+    return "\n".join(kept[:last_complete])
+
+def continue_backlog(llm, response: str, proposal_text: str, context: Dict,
+                     cancellation_token: Optional[CancellationToken] = None) -> Optional[str]:
+    """
+    Repair a near-miss backlog (e.g. 3 epics instead of 4): keep the valid
+    prefix and ask the model for just the missing epics, instead of paying for
+    another full-length regeneration. Returns the repaired backlog or None.
+    """
+    prefix = salvage_backlog_prefix(response)
+    epic_count = sum(1 for line in prefix.splitlines() if line.strip().lower().startswith("epic"))
+    if not epic_count:
+        return None
+    if validate_backlog_format(prefix):
+        return prefix
+
+    next_epic = epic_count + 1
+    remaining = max(1, MIN_EPICS - epic_count)
+    continuation_context = dict(context or {})
+    continuation_context.update({
+        "backlog_so_far": prefix,
+        "next_epic": next_epic,
+        "remaining_epics": remaining,
+    })
+    prompt = build_prompt("backlog_continue", proposal_text, continuation_context)
+    if not prompt:
+        return None
+
+    max_tokens = remaining * CONTINUATION_TOKENS_PER_EPIC
+    call = telemetry.SectionCall("backlog", "backlog_continue", max_tokens)
+    try:
+        if cancellation_token:
+            cancellation_token.check_cancelled()
+        text, stats = telemetry.timed_completion(llm, prompt, max_tokens)
+    except TaskCancelledException:
+        call.finish(success=False, cancelled=True)
+        raise
+    except Exception as e:
+        logger.warning(f"Backlog continuation failed: {e}")
+        call.error()
+        call.finish(success=False)
+        return None
+
+    # Drop anything the model restated before the first new epic
+    new_lines = []
+    for line in (text or "").splitlines():
+        match = _EPIC_NUMBER_RE.match(line)
+        if not new_lines and not (match and int(match.group(1)) >= next_epic):
+            continue
+        new_lines.append(line)
+
+    repaired = salvage_backlog_prefix(prefix + "\n" + "\n".join(new_lines))
+    if validate_backlog_format(repaired):
+        call.attempt(stats, "ok")
+        call.finish(success=True)
+        logger.info(f"Backlog repaired by continuation from Epic {next_epic} ({stats.generated_tokens} tokens)")
+        return repaired
+    call.attempt(stats, "invalid" if text else "empty")
+    call.finish(success=False)
+    return None
+
 def parse_backlog(raw_text: str) -> BacklogModel:
-    backlog = BacklogModel()
-    current_epic = None
-    current_sub_epic = None
-    current_user_story = None
+    return stream_parser.parse_backlog(raw_text)
+
+def target_epic_count(proposal_text: str) -> int:
+    """Scale the number of epics with the proposal length (MIN_EPICS..MAX_EPICS)."""
+    words = len((proposal_text or "").split())
+    return max(MIN_EPICS, min(MAX_EPICS, MIN_EPICS + words // WORDS_PER_EXTRA_EPIC))
 
+def extract_epic_titles(raw_text: str) -> List[str]:
+    """Return the de-duplicated epic titles (without the "Epic X:" label) in order."""
+    titles = []
+    seen = set()
     for line in raw_text.splitlines():
-        line = line.strip()
-
-        if line.startswith("Epic"):
-            label, content = line.split(":", 1)
-            title = f"{label.strip()}: {content.strip()}"
-            task_hint = ""
-            if "*(covers:" in title:
-                title_part, task_hint = title.split("*(covers:", 1)
-                title = title_part.strip()
-                task_hint = task_hint.rstrip(")*").strip()
-                title = f"{title} *(covers: {task_hint})*"
-            current_epic = EpicModel(
-                title=title,
-                description=f"Derived from task: {task_hint}" if task_hint else "",
-                ai=True
-            )
-            backlog.epics.append(current_epic)
-
-        elif line.startswith("-Sub-Epic") and current_epic:
-            label, content = line.split(":", 1)
-            title = f"{label.strip()}: {content.strip()}"
-            current_sub_epic = SubEpicModel(title=title, ai=True)
-            current_epic.sub_epics.append(current_sub_epic)
-
-        elif line.startswith("-User Story") and current_sub_epic:
-            label, content = line.split(":", 1)
-            title = f"{label.strip()}: {content.strip()}"
-            current_user_story = UserStoryModel(title=title, ai=True)
-            current_sub_epic.user_stories.append(current_user_story)
-
-        elif line.startswith("-Task") and current_user_story:
-            label, content = line.split(":", 1)
-            title = f"{label.strip()}: {content.strip()}"
-            task = TaskModel(
-                title=title,
-                description="",
-                status="pending",
-                ai=True
+        match = _EPIC_LINE_RE.match(line)
+        if not match:
+            continue
+        title = match.group(1).strip()
+        if title and title.lower() not in seen:
+            seen.add(title.lower())
+            titles.append(title)
+    return titles[:MAX_EPICS]
+
+def _renumber_epic_children(raw_text: str, epic_number: int) -> List[str]:
+    """Keep the Sub-Epic/User Story/Task lines of an expansion, renumbered under ``epic_number``."""
+    lines = []
+    for line in raw_text.splitlines():
+        match = _CHILD_LABEL_RE.match(line)
+        if not match:
+            continue
+        label, suffix = match.group(1), match.group(2)
+        lines.append(f"{label} {epic_number}{suffix}:{line[match.end():]}")
+    return lines
+
+# User story of the stand-in structure given to padded and unexpanded epics
+PLACEHOLDER_STORY = "As a developer, I need to implement"
+
+def _placeholder_epic_children(epic_number: int, title: str) -> List[str]:
+    """Minimal sub-epic/story/tasks for an epic whose expansion failed."""
+    name = title.split("*(covers:", 1)[0].strip()
+    return [
+        f"-Sub-Epic {epic_number}.1: {name} Implementation",
+        f"-User Story {epic_number}.1.1: {PLACEHOLDER_STORY} {name.lower()} functionality",
+        f"-Task {epic_number}.1.1.1: Design {name.lower()} components",
+        f"-Task {epic_number}.1.1.2: Implement {name.lower()} functionality",
+    ]
+
+def _report_progress(progress_callback: Optional[ProgressCallback], phase: str, completed: int, total: int):
+    if progress_callback is None:
+        return
+    try:
+        progress_callback(phase, completed, total)
+    except Exception as e:
+        # Progress reporting must never break generation
+        logger.warning(f"Backlog progress callback failed: {e}")
+
+def expand_epics(llm, epic_titles: List[str], proposal_text: str, context: Dict,
+                 batch_size: int = EPIC_EXPAND_BATCH_SIZE,
+                 cancellation_token: Optional[CancellationToken] = None,
+                 progress_callback: Optional[ProgressCallback] = None) -> List[str]:
+    """
+    Expand every epic into sub-epics, user stories and tasks. Prompts are
+    submitted ``batch_size`` at a time as one batched pipeline call; invalid
+    answers are retried individually. Returns one raw expansion per epic
+    ("" when the epic could not be expanded).
+    """
+    prompts = []
+    for index, title in enumerate(epic_titles):
+        epic_context = dict(context or {})
+        epic_context.update({
+            "epic_number": index + 1,
+            "epic_title": title,
+            "other_epics": "\n".join(f"- {t}" for j, t in enumerate(epic_titles) if j != index) or "- (none)",
+            "max_sub_epics": 2,
+            "max_user_stories": 2,
+            "max_tasks": 4,
+        })
+        prompts.append(build_prompt("backlog_epic", proposal_text, epic_context))
+
+    expansions = [""] * len(prompts)
+    completed = 0
+    max_tokens = token_budget.limit("backlog", "backlog_epic", telemetry.current_model(), EPIC_EXPAND_MAX_TOKENS)
+    for start in range(0, len(prompts), max(1, batch_size)):
+        if cancellation_token:
+            cancellation_token.check_cancelled()
+        indexes = list(range(start, min(start + batch_size, len(prompts))))
+        batch = telemetry.timed_batch_completion(llm, [prompts[i] for i in indexes], max_tokens)
+        for offset, i in enumerate(indexes):
+            expansions[i] = generate_section(
+                llm, "backlog_epic", prompts[i], max_retries=2, max_tokens=max_tokens,
+                cancellation_token=cancellation_token, validator=validate_epic_expansion,
+                prefetched=batch[offset] if batch else None,
             )
-            current_user_story.tasks.append(task)
+            completed += 1
+            _report_progress(progress_callback, "expanding", completed, len(prompts))
+    return expansions
+
+def run_hierarchical_backlog(llm, proposal_text: str, context: Dict,
+                             cancellation_token: Optional[CancellationToken] = None,
+                             progress_callback: Optional[ProgressCallback] = None) -> BacklogModel:
+    """
+    Two-phase backlog generation: one short completion lists the epics, then
+    each epic is expanded independently and everything is merged into one
+    BacklogModel. Returns an empty model if the epic list cannot be generated.
+    """
+    epic_context = dict(context or {})
+    epic_context["epic_count"] = target_epic_count(proposal_text)
+    prompt = build_prompt("backlog_epics", proposal_text, epic_context)
+    if not prompt:
+        return BacklogModel()
+
+    _report_progress(progress_callback, "epics", 0, 1)
+    raw_epics = generate_section(
+        llm, "backlog_epics", prompt,
+        max_tokens=token_budget.limit("backlog", "backlog_epics", telemetry.current_model(), EPIC_LIST_MAX_TOKENS),
+        cancellation_token=cancellation_token, validator=validate_epic_list,
+    )
+    epic_titles = extract_epic_titles(raw_epics)
+    if len(epic_titles) < MIN_EPICS:
+        return BacklogModel()
+    _report_progress(progress_callback, "epics", 1, 1)
 
-    return backlog
+    expansions = expand_epics(
+        llm, epic_titles, proposal_text, context,
+        cancellation_token=cancellation_token, progress_callback=progress_callback,
+    )
 
-def run_backlog_pipeline(proposal_text: str, context: Dict, task_id: Optional[str] = None) -> BacklogModel:
+    lines = []
+    for number, (title, expansion) in enumerate(zip(epic_titles, expansions), start=1):
+        lines.append(f"Epic {number}: {title}")
+        children = _renumber_epic_children(expansion, number) if expansion else []
+        if not children:
+            logger.warning(f"Epic {number} could not be expanded, using placeholder structure")
+            children = _placeholder_epic_children(number, title)
+        lines.extend(children)
+
+    logger.debug(f"RAW HIERARCHICAL BACKLOG: {len(epic_titles)} epics, {len(lines)} lines")
+    return parse_backlog("\n".join(lines))
+
+def run_backlog_pipeline(proposal_text: str, context: Dict, task_id: Optional[str] = None,
+                         hierarchical: Optional[bool] = None,
+                         progress_callback: Optional[ProgressCallback] = None,
+                         pad: bool = True) -> BacklogModel:
+    """
+    Generate the backlog for a proposal. ``hierarchical`` selects the two-phase
+    mode (epics first, then one expansion per epic); by default it is used for
+    proposals of at least HIERARCHICAL_MIN_WORDS words. ``progress_callback``
+    is called as ``(phase, completed, total)`` while epics are expanded, or,
+    in single-pass mode, as ("streaming", epics parsed, target) while the
+    backlog is generated. ``pad=False`` returns the backlog as generated, without generic epics.
+    """
     if not proposal_text:
         return BacklogModel()
 
@@ -158,19 +402,79 @@ def run_backlog_pipeline(proposal_text: str, context: Dict, task_id: Optional[st
     if cancellation_token:
         cancellation_token.check_cancelled()
 
-    llm = get_cached_backlog_llm()  # Uses dedicated backlog model cache - separate from project model
-    prompt = build_prompt("backlog", proposal_text, context)
-    if not prompt:
-        return BacklogModel()
+    wait_started = time.perf_counter()
+    model_name, llm = models.get_for_section("backlog", incremental.page_hash(proposal_text))
+    telemetry.registry.record_queue_wait("backlog", "model", time.perf_counter() - wait_started)
 
-    raw_backlog = generate_section(llm, "backlog", prompt, max_tokens=768, cancellation_token=cancellation_token)
-    if not raw_backlog:
+    if hierarchical is None:
+        hierarchical = len(proposal_text.split()) >= HIERARCHICAL_MIN_WORDS
+
+    with telemetry.model_scope(model_name):
+        backlog_model = _generate_backlog(llm, proposal_text, context, hierarchical, cancellation_token, progress_callback)
+    if backlog_model is None:
         return BacklogModel()
+    return pad_backlog(backlog_model) if pad else backlog_model
 
-    logger.debug(f"RAW BACKLOG: {raw_backlog}")
-    
-    backlog_model = parse_backlog(raw_backlog)
-    
+def _generate_backlog(llm, proposal_text: str, context: Dict, hierarchical: bool,
+                      cancellation_token: Optional[CancellationToken],
+                      progress_callback: Optional[ProgressCallback]) -> Optional[BacklogModel]:
+    """Hierarchical and/or single-pass generation; None when no backlog could be produced."""
+    backlog_model = BacklogModel()
+    if hierarchical:
+        backlog_model = run_hierarchical_backlog(
+            llm, proposal_text, context,
+            cancellation_token=cancellation_token, progress_callback=progress_callback,
+        )
+        if not backlog_model.epics:
+            logger.warning("Hierarchical backlog generation failed, falling back to single-pass generation")
+
+    if not backlog_model.epics:
+        prompt = build_prompt("backlog", proposal_text, context)
+        if not prompt:
+            return None
+
+        raw_backlog = generate_section(
+            llm, "backlog", prompt,
+            max_tokens=token_budget.limit("backlog", "backlog", telemetry.current_model(), BACKLOG_MAX_TOKENS),
+            cancellation_token=cancellation_token,
+            repair=lambda response: continue_backlog(llm, response, proposal_text, context, cancellation_token),
+            text_sink=_streaming_progress(proposal_text, progress_callback) if progress_callback else None,
+        )
+        if not raw_backlog:
+            return None
+
+        logger.debug(f"RAW BACKLOG: {raw_backlog}")
+
+        backlog_model = parse_backlog(raw_backlog)
+
+    return backlog_model
+
+def _streaming_progress(proposal_text: str, progress_callback: ProgressCallback) -> Callable[[], Callable[[str], None]]:
+    """
+    Sink factory for single-pass generation: each attempt feeds a fresh
+    ``stream_parser.BacklogParser`` and reports ("streaming", epics, target)
+    whenever a new epic has been parsed.
+    """
+    target = target_epic_count(proposal_text)
+
+    def sink() -> Callable[[str], None]:
+        parser = stream_parser.BacklogParser()
+        _report_progress(progress_callback, "streaming", 0, target)
+
+        def feed(chunk: str):
+            if any(isinstance(item, EpicModel) for item in parser.feed(chunk)):
+                epics = len(parser.backlog.epics)
+                _report_progress(progress_callback, "streaming", epics, max(target, epics))
+        return feed
+    return sink
+
+def is_placeholder_epic(epic: EpicModel) -> bool:
+    """True for generic padding epics and epics left with the stand-in structure."""
+    stories = [us for se in epic.sub_epics for us in se.user_stories]
+    return len(stories) == 1 and PLACEHOLDER_STORY in stories[0].title
+
+def pad_backlog(backlog_model: BacklogModel) -> BacklogModel:
+    """Ensure a minimum of 4 epics by appending generic ones."""
     # Ensure minimum of 4 epics - add generic epics if needed
     if len(backlog_model.epics) < 4:
         logger.warning(f"Only {len(backlog_model.epics)} epics generated, adding generic epics to reach minimum of 4")
@@ -192,7 +496,7 @@ def run_backlog_pipeline(proposal_text: str, context: Dict, task_id: Optional[st
             )
             # Add a basic sub-epic, user story, and tasks
             sub_epic = SubEpicModel(title=f"-Sub-Epic {epic_num}.1: {title} Implementation", ai=True)
-            user_story = UserStoryModel(title=f"-User Story {epic_num}.1.1: As a developer, I need to implement {title.lower()} functionality", ai=True)
+            user_story = UserStoryModel(title=f"-User Story {epic_num}.1.1: {PLACEHOLDER_STORY} {title.lower()} functionality", ai=True)
             
             task1 = TaskModel(title=f"-Task {epic_num}.1.1.1: Design {title.lower()} components", description="", status="pending", ai=True)
             task2 = TaskModel(title=f"-Task {epic_num}.1.1.2: Implement {title.lower()} functionality", description="", status="pending", ai=True)
@@ -202,4 +506,56 @@ def run_backlog_pipeline(proposal_text: str, context: Dict, task_id: Optional[st
             epic.sub_epics = [sub_epic]
             backlog_model.epics.append(epic)
     
-    return backlog_model
\ No newline at end of file
+    return backlog_model
+
+def run_backlog_batch(items: List[Tuple[str, Dict]], batch_size: int = EPIC_EXPAND_BATCH_SIZE,
+                      progress_callback: Optional[ProgressCallback] = None) -> List[BacklogModel]:
+    """
+    Generate backlogs for many (proposal_text, context) pairs. Proposals long
+    enough for the hierarchical mode run one by one (their epic expansions are
+    already batched); the single-pass prompts of the others go through the
+    pipeline ``batch_size`` at a time, with near-miss repair and individual
+    retries. Returns one BacklogModel per item, in input order.
+    """
+    results = [BacklogModel() for _ in items]
+    if not any(text for text, _ in items):
+        return results
+
+    single_pass = []
+    done = 0
+    for i, (text, context) in enumerate(items):
+        if not text:
+            continue
+        if len(text.split()) >= HIERARCHICAL_MIN_WORDS:
+            results[i] = run_backlog_pipeline(text, context, hierarchical=True)
+            done += 1
+            _report_progress(progress_callback, "backlog", done, len(items))
+        else:
+            prompt = build_prompt("backlog", text, context)
+            if prompt:
+                single_pass.append((models.route("backlog", incremental.page_hash(text)), i, prompt))
+    # Proposals routed to the same model are batched together
+    single_pass.sort(key=lambda item: item[0])
+
+    for start in range(0, len(single_pass), max(1, batch_size)):
+        chunk = single_pass[start:start + batch_size]
+        for model_name in sorted({item[0] for item in chunk}):
+            group = [(i, prompt) for name, i, prompt in chunk if name == model_name]
+            wait_started = time.perf_counter()
+            llm = models.get(model_name)
+            telemetry.registry.record_queue_wait("backlog", "model", time.perf_counter() - wait_started)
+            max_tokens = token_budget.limit("backlog", "backlog", model_name, BACKLOG_MAX_TOKENS)
+            batch = telemetry.timed_batch_completion(llm, [prompt for _, prompt in group], max_tokens)
+            with telemetry.model_scope(model_name):
+                for offset, (i, prompt) in enumerate(group):
+                    text, context = items[i]
+                    raw_backlog = generate_section(
+                        llm, "backlog", prompt, max_tokens=max_tokens,
+                        prefetched=batch[offset] if batch else None,
+                        repair=lambda response, llm=llm, text=text, context=context: continue_backlog(llm, response, text, context),
+                    )
+                    if raw_backlog:
+                        results[i] = pad_backlog(parse_backlog(raw_backlog))
+                    done += 1
+                    _report_progress(progress_callback, "backlog", done, len(items))
+    return results
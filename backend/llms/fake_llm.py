@@ -0,0 +1,294 @@
+"""
+Deterministic stand-in for the cached HuggingFace pipeline.
+
+FakeLLM replays recorded completions per prompt section with a synthetic
+latency model (time to first token + per-token decode time), so the
+generation pipelines, parsers and persistence code can be exercised and
+benchmarked on a CPU-only box without downloading a model::
+
+    from llms.fake_llm import FakeLLM, synthetic_recordings
+    from llms.llm_cache import override_llm
+
+    with override_llm(FakeLLM(synthetic_recordings("medium"), seconds_per_token=0.002)):
+        run_pipeline_from_text(proposal_text)
+"""
+import itertools
+import logging
+import os
+import re
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Union
+
+logger = logging.getLogger('llms')
+
+# Phrases that identify which prompt template produced a prompt (first match wins)
+SECTION_MARKERS = [
+    ("summary", 'must* start with "summary: "'),
+    ("features", "List the key features from the proposal"),
+    ("roles", "Generate a list of project roles"),
+    ("goals", "Generate project goals"),
+    ("timeline", "Create a 4-week project timeline"),
+    ("backlog_epics", "planning the epics of a software project backlog"),
+    ("backlog_epic", "expanding one epic of a software project backlog"),
+    ("backlog_continue", "continuing a partially generated software project backlog"),
+    ("backlog", "generating a structured backlog"),
+]
+
+_TOKEN_RE = re.compile(r"\S+\s*")
+
+
+def detect_section(prompt: str) -> str:
+    """Return the section name for a prompt built from llms/prompts, or 'default'."""
+    for section, marker in SECTION_MARKERS:
+        if marker in prompt:
+            return section
+    return "default"
+
+
+class _FakePipeline:
+    """Callable mimicking ``transformers.pipeline('text-generation')`` output shapes."""
+
+    def __init__(self, owner: 'FakeLLM'):
+        self._owner = owner
+        self.tokenizer = None
+
+    def __call__(self, prompt, max_new_tokens: Optional[int] = None, streamer=None, **kwargs):
+        if isinstance(prompt, (list, tuple)):
+            # Batched call: one list of candidates per prompt, like the HF pipeline
+            return [[{"generated_text": text}] for text in self._owner.complete_batch(prompt, max_new_tokens)]
+        return [{"generated_text": self._owner.complete(prompt, max_new_tokens, streamer)}]
+
+
+class FakeLLM:
+    """
+    Replays ``recordings`` ({section: text or [texts]}) for matching prompts.
+
+    A list of texts is replayed in order and then repeats its last entry, which
+    makes retry paths (invalid first answer, valid second answer) reproducible.
+    Latency: ``ttft_seconds + prefill_seconds_per_token * prompt_tokens`` before
+    the first token, then ``seconds_per_token`` per generated token. Output is
+    truncated at ``max_new_tokens`` like a real model hitting its budget.
+    """
+
+    def __init__(
+        self,
+        recordings: Dict[str, Union[str, List[str]]],
+        ttft_seconds: float = 0.0,
+        prefill_seconds_per_token: float = 0.0,
+        seconds_per_token: float = 0.0,
+        tokens_per_word: float = 1.3,
+        router: Optional[Callable[[str], str]] = None,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.recordings = {k: (v if isinstance(v, list) else [v]) for k, v in recordings.items()}
+        self.ttft_seconds = ttft_seconds
+        self.prefill_seconds_per_token = prefill_seconds_per_token
+        self.seconds_per_token = seconds_per_token
+        self.tokens_per_word = tokens_per_word
+        self.router = router or detect_section
+        self.sleep = sleep
+        self.pipeline = _FakePipeline(self)
+        self.calls: List[Dict] = []
+        self._cursors: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_directory(cls, path: str, **kwargs) -> 'FakeLLM':
+        """
+        Load recordings written by RecordingLLM: ``<section>.txt`` or
+        ``<section>.<n>.txt`` files, replayed in ``n`` order.
+        """
+        grouped: Dict[str, List[tuple]] = {}
+        for name in sorted(os.listdir(path)):
+            if not name.endswith(".txt"):
+                continue
+            parts = name[:-4].split(".")
+            order = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 0
+            with open(os.path.join(path, name), "r", encoding="utf-8") as f:
+                grouped.setdefault(parts[0], []).append((order, f.read()))
+        recordings = {section: [text for _, text in sorted(items)] for section, items in grouped.items()}
+        return cls(recordings, **kwargs)
+
+    def count_tokens(self, text: str) -> int:
+        return int(len(text.split()) * self.tokens_per_word)
+
+    def _next_recording(self, section: str) -> str:
+        texts = self.recordings.get(section) or self.recordings.get("default") or [""]
+        with self._lock:
+            index = self._cursors.get(section, 0)
+            self._cursors[section] = index + 1
+        return texts[min(index, len(texts) - 1)]
+
+    def _generate(self, prompt: str, max_new_tokens: Optional[int]):
+        section = self.router(prompt)
+        text = self._next_recording(section)
+        words = _TOKEN_RE.findall(text)
+        if max_new_tokens is not None:
+            words = words[:max(1, int(max_new_tokens / self.tokens_per_word))]
+        prompt_tokens = self.count_tokens(prompt)
+        generated_tokens = max(1, int(len(words) * self.tokens_per_word)) if words else 0
+        self.calls.append({
+            "section": section,
+            "prompt_tokens": prompt_tokens,
+            "generated_tokens": generated_tokens,
+            "max_new_tokens": max_new_tokens,
+        })
+        return "".join(words), prompt_tokens, generated_tokens
+
+    def complete_batch(self, prompts: List[str], max_new_tokens: Optional[int] = None) -> List[str]:
+        """
+        One batched forward pass: prefill scales with the total prompt tokens,
+        decode with the longest completion (sequences are generated in lockstep).
+        """
+        results = [self._generate(p, max_new_tokens) for p in prompts]
+        delay = self.ttft_seconds + self.prefill_seconds_per_token * sum(r[1] for r in results)
+        longest = max((r[2] for r in results), default=0)
+        if self.seconds_per_token and longest > 1:
+            delay += self.seconds_per_token * (longest - 1)
+        if delay:
+            self.sleep(delay)
+        return [r[0] for r in results]
+
+    def complete(self, prompt: str, max_new_tokens: Optional[int] = None, streamer=None) -> str:
+        output, prompt_tokens, generated_tokens = self._generate(prompt, max_new_tokens)
+
+        if streamer is not None:
+            streamer.put([0] * prompt_tokens)
+        delay = self.ttft_seconds + self.prefill_seconds_per_token * prompt_tokens
+        if delay:
+            self.sleep(delay)
+        if streamer is not None and generated_tokens:
+            streamer.put([0])
+        if self.seconds_per_token and generated_tokens > 1:
+            self.sleep(self.seconds_per_token * (generated_tokens - 1))
+        if streamer is not None:
+            if generated_tokens > 1:
+                streamer.put([0] * (generated_tokens - 1))
+            streamer.end()
+        return output
+
+    def invoke(self, prompt: str) -> str:
+        return self.complete(prompt)
+
+
+class RecordingLLM:
+    """
+    Wraps a real pipeline and writes every completion to ``directory`` so the
+    run can later be replayed with ``FakeLLM.from_directory``.
+    """
+
+    def __init__(self, llm, directory: str, router: Optional[Callable[[str], str]] = None):
+        self.llm = llm
+        self.directory = directory
+        self.router = router or detect_section
+        self._counters: Dict[str, int] = {}
+        os.makedirs(directory, exist_ok=True)
+        self.pipeline = self._record_pipeline
+
+    def _save(self, prompt: str, text: str):
+        section = self.router(prompt)
+        index = self._counters.get(section, 0)
+        self._counters[section] = index + 1
+        path = os.path.join(self.directory, f"{section}.{index}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text or "")
+
+    def _record_pipeline(self, prompt, **kwargs):
+        out = self.llm.pipeline(prompt, **kwargs)
+        if isinstance(out, list) and out and isinstance(out[0], dict):
+            self._save(prompt, out[0].get("generated_text", ""))
+        return out
+
+    def invoke(self, prompt: str) -> str:
+        text = self.llm.invoke(prompt)
+        self._save(prompt, text)
+        return text
+
+
+# Synthetic corpus --------------------------------------------------------
+
+# epics, sub-epics per epic, stories per sub-epic, tasks per story, proposal words
+BENCHMARK_SIZES = {
+    "small": {"epics": 4, "sub_epics": 1, "stories": 1, "tasks": 2, "words": 400},
+    "medium": {"epics": 6, "sub_epics": 2, "stories": 2, "tasks": 3, "words": 1500},
+    "huge": {"epics": 12, "sub_epics": 3, "stories": 3, "tasks": 4, "words": 6000},
+}
+
+_DOMAIN_WORDS = [
+    "inventory", "scheduling", "analytics", "onboarding", "billing", "reporting",
+    "notifications", "dashboard", "authentication", "integration", "mobile", "search",
+    "permissions", "workflow", "audit", "export", "payments", "calendar",
+]
+
+
+def synthetic_proposal(size: str = "small") -> str:
+    """Deterministic proposal text of roughly BENCHMARK_SIZES[size]['words'] words."""
+    spec = BENCHMARK_SIZES[size]
+    words = itertools.cycle(_DOMAIN_WORDS)
+    paragraphs = []
+    count = 0
+    page = 1
+    while count < spec["words"]:
+        sentence = " ".join(next(words) for _ in range(11))
+        paragraphs.append(f"Section {page}. The platform covers {sentence}.")
+        count += 15
+        if len(paragraphs) % 20 == 0:
+            page += 1
+    return "Project Proposal: Crew Operations Platform\n" + "\n".join(paragraphs)
+
+
+def _synthetic_epic_line(e: int) -> str:
+    area = _DOMAIN_WORDS[(e - 1) % len(_DOMAIN_WORDS)].title()
+    return f"Epic {e}: {area} Module *(covers: Deliver {area.lower()} capabilities)*"
+
+
+def _synthetic_epic_children(e: int, sub_epics: int, stories: int, tasks: int) -> List[str]:
+    area = _DOMAIN_WORDS[(e - 1) % len(_DOMAIN_WORDS)]
+    lines = []
+    for s in range(1, sub_epics + 1):
+        lines.append(f" -Sub-Epic {e}.{s}: {area.title()} Core Flow {s}")
+        for u in range(1, stories + 1):
+            lines.append(f"  -User Story {e}.{s}.{u}: As a crew manager, I want {area} step {u} so that work is tracked")
+            for t in range(1, tasks + 1):
+                lines.append(f"   -Task {e}.{s}.{u}.{t}: Implement {area} item {t} for story {u}")
+    return lines
+
+
+def synthetic_backlog(epics: int, sub_epics: int = 1, stories: int = 1, tasks: int = 2, start: int = 1) -> str:
+    """Backlog text in the format requested by prompts/backlog_prompt.txt."""
+    lines = []
+    for e in range(start, start + epics):
+        lines.append(_synthetic_epic_line(e))
+        lines.extend(_synthetic_epic_children(e, sub_epics, stories, tasks))
+    return "\n".join(lines)
+
+
+def synthetic_recordings(size: str = "small") -> Dict[str, str]:
+    """Valid completions for every section, scaled to BENCHMARK_SIZES[size]."""
+    spec = BENCHMARK_SIZES[size]
+    features = "\n".join(f"  - {w.title()} Management" for w in _DOMAIN_WORDS[:6])
+    goals = "\n".join(
+        f"- title: Deliver {w} capability\n    role: {role}"
+        for w, role in zip(_DOMAIN_WORDS[:8], itertools.cycle([
+            "Backend Developer", "Frontend Developer", "UI/UX Designer",
+            "Quality Assurance Engineer", "Project Manager",
+        ]))
+    )
+    weeks = "\n".join(
+        f"  - week_number: {n}\n    tasks:\n      - Build {_DOMAIN_WORDS[2 * n - 2]} flow\n      - Test {_DOMAIN_WORDS[2 * n - 1]} flow"
+        for n in range(1, 5)
+    )
+    return {
+        "summary": "summary: Crew Operations Platform centralizes scheduling, analytics and onboarding for field crews. "
+                   "A team of developers, designers and QA engineers delivers it in four sprints, measured by adoption and on-time delivery.",
+        "features": f"features:\n{features}",
+        "roles": "roles:\n  - Project Manager\n  - Frontend Developer\n  - Backend Developer\n"
+                 "  - Quality Assurance Engineer\n  - UI/UX Designer\n  - Data Engineer",
+        "goals": goals,
+        "timeline": f"timeline:\n{weeks}",
+        "backlog": synthetic_backlog(spec["epics"], spec["sub_epics"], spec["stories"], spec["tasks"]),
+        # Hierarchical mode: the epic list, then one expansion (replayed for every epic)
+        "backlog_epics": "\n".join(_synthetic_epic_line(e) for e in range(1, spec["epics"] + 1)),
+        "backlog_epic": "\n".join(_synthetic_epic_children(1, spec["sub_epics"], spec["stories"], spec["tasks"])),
+    }
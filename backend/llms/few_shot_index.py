@@ -0,0 +1,199 @@
+"""
+Few-shot example retrieval for the section prompts.
+
+``few_shots/examples.jsonl`` holds worked examples: a one-line project
+description and a section output in the exact format the parser expects.
+Instead of one static example per prompt, each section prompt gets the
+examples whose projects are most similar to the proposal (BM25 over the
+description and output), at most ``LLM_FEW_SHOT_K`` of them within the
+section's token budget. Budgets are per section, since a goals or timeline
+example is about twice the size of a features one; override them with
+``LLM_FEW_SHOT_TOKEN_BUDGETS``. The most relevant example is always kept,
+and a section without indexed examples falls back to its static format
+example, ``few_shots/<section>.txt``.
+
+The index is built on first use and is small enough to score in pure Python.
+"""
+import json
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from django.conf import settings
+
+from llms import telemetry
+
+logger = logging.getLogger('llms')
+
+FEW_SHOTS_DIR = os.path.join(os.path.dirname(__file__), "few_shots")
+EXAMPLES_PATH = os.path.join(FEW_SHOTS_DIR, "examples.jsonl")
+FEW_SHOT_K = getattr(settings, 'LLM_FEW_SHOT_K', 2)
+FEW_SHOT_TOKEN_BUDGET = getattr(settings, 'LLM_FEW_SHOT_TOKEN_BUDGET', 160)  # sections without their own budget
+# Room for FEW_SHOT_K examples of each section (heuristic token counts of the bundled corpus)
+FEW_SHOT_TOKEN_BUDGETS = {
+    "summary": 170,
+    "features": 130,
+    "roles": 130,
+    "goals": 240,
+    "timeline": 250,
+    **getattr(settings, 'LLM_FEW_SHOT_TOKEN_BUDGETS', {}),
+}
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in into is it its of on or our that the their "
+    "this to was we will with who which while can each all any more most other such than then "
+    "there these they through using use via".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word terms without stopwords and single characters."""
+    return [w for w in _WORD_RE.findall((text or "").lower()) if len(w) > 1 and w not in _STOPWORDS]
+
+
+@dataclass(frozen=True)
+class FewShotExample:
+    section: str
+    context: str  # one-line description of the example project
+    output: str   # the section output, formatted exactly as the prompt asks
+
+    def render(self) -> str:
+        return f"<<<EXAMPLE>>>\nProject: {self.context}\n{self.output}\n<<<END EXAMPLE>>>"
+
+
+class BM25:
+    """Okapi BM25 over pre-tokenized documents."""
+
+    def __init__(self, documents: Sequence[List[str]], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._tf = [Counter(doc) for doc in documents]
+        self._lengths = [len(doc) for doc in documents]
+        self._avg_length = (sum(self._lengths) / len(documents)) if documents else 0.0
+        df = Counter(term for tf in self._tf for term in tf)
+        n = len(documents)
+        self._idf = {term: math.log(1 + (n - count + 0.5) / (count + 0.5)) for term, count in df.items()}
+
+    def scores(self, query: Iterable[str]) -> List[float]:
+        terms = [term for term in set(query) if term in self._idf]
+        result = []
+        for tf, length in zip(self._tf, self._lengths):
+            norm = self.k1 * (1 - self.b + self.b * length / self._avg_length) if self._avg_length else self.k1
+            score = 0.0
+            for term in terms:
+                freq = tf.get(term)
+                if freq:
+                    score += self._idf[term] * freq * (self.k1 + 1) / (freq + norm)
+            result.append(score)
+        return result
+
+
+class FewShotIndex:
+    """One BM25 index per section over the few-shot corpus."""
+
+    def __init__(self, examples: Sequence[FewShotExample]):
+        self._examples: Dict[str, List[FewShotExample]] = {}
+        for example in examples:
+            self._examples.setdefault(example.section, []).append(example)
+        self._indexes = {
+            section: BM25([tokenize(f"{e.context}\n{e.output}") for e in items])
+            for section, items in self._examples.items()
+        }
+
+    @classmethod
+    def from_file(cls, path: str = EXAMPLES_PATH) -> 'FewShotIndex':
+        examples = []
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        examples.append(FewShotExample(entry["section"], entry["context"], entry["output"].strip()))
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"[Few-shot] Could not load examples from {path}: {e}")
+        return cls(examples)
+
+    def sections(self) -> List[str]:
+        return sorted(self._examples)
+
+    def search(self, section: str, query: str, k: Optional[int] = None) -> List[Tuple[FewShotExample, float]]:
+        """The ``section`` examples ranked by relevance to ``query`` (corpus order breaks ties)."""
+        examples = self._examples.get(section, [])
+        if not examples:
+            return []
+        scores = self._indexes[section].scores(tokenize(query))
+        ranked = sorted(range(len(examples)), key=lambda i: -scores[i])
+        return [(examples[i], scores[i]) for i in ranked[:k]]
+
+    def select(self, section: str, query: str, k: int = FEW_SHOT_K,
+               token_budget: Optional[int] = None, llm=None) -> List[FewShotExample]:
+        """
+        Up to ``k`` of the most relevant examples whose rendered text fits in
+        ``token_budget`` tokens (default: the section's budget); an example
+        that does not fit is skipped for the next, shorter one. The most
+        relevant example is kept even when it alone is over the budget.
+        """
+        if token_budget is None:
+            token_budget = section_token_budget(section)
+        ranked = self.search(section, query)
+        selected, used = [], 0
+        for example, _ in ranked:
+            if len(selected) >= k:
+                break
+            cost = telemetry.count_tokens(llm, example.render())
+            if used + cost > token_budget:
+                continue
+            selected.append(example)
+            used += cost
+        if not selected and ranked and k > 0:
+            selected.append(ranked[0][0])
+        return selected
+
+    def render(self, section: str, query: str, k: int = FEW_SHOT_K,
+               token_budget: Optional[int] = None, llm=None) -> str:
+        """The examples block for a section prompt; the static example when the section has none."""
+        examples = self.select(section, query, k, token_budget, llm)
+        if not examples:
+            static = static_example(section)
+            return f"Example format:\n{static}" if static else ""
+        return "Examples from similar projects:\n" + "\n".join(e.render() for e in examples)
+
+
+def section_token_budget(section: str) -> int:
+    return FEW_SHOT_TOKEN_BUDGETS.get(section, FEW_SHOT_TOKEN_BUDGET)
+
+
+@lru_cache(maxsize=None)
+def static_example(section: str) -> str:
+    """The section's static format example from ``few_shots/<section>.txt``, or ""."""
+    try:
+        with open(os.path.join(FEW_SHOTS_DIR, f"{section}.txt"), "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+_index: Optional[FewShotIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> FewShotIndex:
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = FewShotIndex.from_file()
+                logger.info(f"[Few-shot] Indexed examples for sections: {', '.join(_index.sections())}")
+    return _index
+
+
+def examples_for(section: str, proposal_text: str, llm=None) -> str:
+    """Examples block for ``section`` of the proposal, sized by the configured k and the section's token budget."""
+    return get_index().render(section, proposal_text, llm=llm)
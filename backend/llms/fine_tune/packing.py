@@ -0,0 +1,66 @@
+"""
+Sequence packing and padding accounting for the fine-tuning data pipeline.
+
+Plain Python so it can be used from ``datasets.map`` workers and tested
+without the training dependencies.
+"""
+from typing import Dict, List, Optional, Sequence
+
+IGNORE_INDEX = -100  # label value ignored by the causal LM loss
+
+
+def pack_examples(input_ids: Sequence[List[int]], labels: Sequence[List[int]], max_length: int) -> Dict[str, List]:
+    """
+    Pack tokenized examples into sequences of at most ``max_length`` tokens
+    (first-fit decreasing, examples are never split). ``position_ids`` restart
+    at 0 for every example so positional encodings match the unpacked data.
+
+    Rows get no ``attention_mask``: an all-ones mask would let each example
+    attend to the ones packed before it. Train on them with an attention
+    implementation that splits rows where ``position_ids`` restart
+    (flash-attention varlen), as train_lora.py does.
+    """
+    order = sorted(range(len(input_ids)), key=lambda i: len(input_ids[i]), reverse=True)
+    bins: List[List[int]] = []
+    bin_lengths: List[int] = []
+    for i in order:
+        length = min(len(input_ids[i]), max_length)
+        for b, used in enumerate(bin_lengths):
+            if used + length <= max_length:
+                bins[b].append(i)
+                bin_lengths[b] += length
+                break
+        else:
+            bins.append([i])
+            bin_lengths.append(length)
+
+    packed = {"input_ids": [], "labels": [], "position_ids": [], "length": []}
+    for members in bins:
+        ids, labs, positions = [], [], []
+        for i in members:
+            ids += input_ids[i][:max_length]
+            labs += labels[i][:max_length]
+            positions += list(range(min(len(input_ids[i]), max_length)))
+        packed["input_ids"].append(ids)
+        packed["labels"].append(labs)
+        packed["position_ids"].append(positions)
+        packed["length"].append(len(ids))
+    return packed
+
+
+def padding_stats(lengths: Sequence[int], batch_size: int, max_length: Optional[int] = None) -> Dict[str, float]:
+    """
+    Real vs padded tokens when ``lengths`` are batched ``batch_size`` at a
+    time: padded to ``max_length`` when given, else to each batch's longest
+    row (dynamic padding). Pass lengths sorted to model length grouping.
+    """
+    real = sum(lengths)
+    padded = 0
+    for start in range(0, len(lengths), batch_size):
+        batch = lengths[start:start + batch_size]
+        padded += len(batch) * (max_length if max_length is not None else max(batch))
+    return {
+        "real_tokens": real,
+        "padded_tokens": padded,
+        "padding_waste": round(1 - real / padded, 4) if padded else 0.0,
+    }
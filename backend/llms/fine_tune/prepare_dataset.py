@@ -1,6 +1,15 @@
-from datasets import load_dataset
+import argparse
+import hashlib
+import json
+import os
+import time
+
+from datasets import load_dataset, load_from_disk
+from datasets.fingerprint import Hasher
 from transformers import AutoTokenizer
 
+from .packing import IGNORE_INDEX, pack_examples, padding_stats
+
 #Models
 MODELS = {
     "phi": "microsoft/phi-2",
@@ -8,8 +17,10 @@ MODELS = {
     "qwen": "Qwen/Qwen2-0.5B-Instruct"
 }
 
-#Load dataset
-dataset = load_dataset("ai-in-projectmanagement/ProjectManagementLLM_dataset")
+MAX_LENGTH = 512
+OUTPUT_DIR = "datasets"
+# Bump when the tokenization/packing below changes so cached datasets are rebuilt
+PIPELINE_VERSION = 3
 
 #Format prompt-response pairs
 def format_example(entry):
@@ -22,26 +33,134 @@ def format_example(entry):
     )
     return {"prompt": prompt, "response": entry["recommendation"]}
 
-formatted_dataset = dataset["train"].map(format_example)
+#Tokenize as causal LM examples: prompt + response, loss on the response only, no padding
+def tokenize(batch, tokenizer, max_length):
+    input_ids, labels = [], []
+    for prompt, response in zip(batch["prompt"], batch["response"]):
+        prompt_ids = tokenizer(prompt + "\n", add_special_tokens=True)["input_ids"]
+        response_ids = tokenizer(response, add_special_tokens=False)["input_ids"] + [tokenizer.eos_token_id]
+        ids = (prompt_ids + response_ids)[:max_length]
+        input_ids.append(ids)
+        labels.append(([IGNORE_INDEX] * len(prompt_ids) + response_ids)[:max_length])
+    return {"input_ids": input_ids, "labels": labels, "length": [len(ids) for ids in input_ids]}
+
+def pack(batch, max_length):
+    return pack_examples(batch["input_ids"], batch["labels"], max_length)
 
-#Tokenize for each model
-for name, model_id in MODELS.items():
-    print(f"\n Tokenizing for {name.upper()}...")
+#Cache key: same source data + same tokenizer + same settings -> same dataset
+def dataset_fingerprint(formatted, tokenizer, max_length, packing):
+    key = json.dumps({
+        "data": formatted._fingerprint,
+        "tokenizer": Hasher.hash(tokenizer),
+        "max_length": max_length,
+        "packing": packing,
+        "version": PIPELINE_VERSION,
+    }, sort_keys=True)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
 
+def read_meta(path):
+    try:
+        with open(os.path.join(path, "prep_meta.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def prepare(name, model_id, formatted, args, built):
+    save_path = os.path.join(args.output_dir, f"tokenized_project_management_{name}")
     tokenizer = AutoTokenizer.from_pretrained(model_id)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    fingerprint = dataset_fingerprint(formatted, tokenizer, args.max_length, args.packing)
+
+    meta = read_meta(save_path)
+    if meta and meta.get("fingerprint") == fingerprint and not args.force:
+        print(f"{name}: up to date ({save_path})")
+        return meta
 
-    def tokenize(example):
-        return tokenizer(
-            example["prompt"],
-            text_target=example["response"],
-            truncation=True,
-            padding="max_length",
-            max_length=512
+    started = time.perf_counter()
+    if fingerprint in built:
+        # Another model shares this tokenizer: reuse its arrays instead of re-tokenizing
+        print(f"{name}: same tokenizer as {built[fingerprint]['name']}, reusing")
+        dataset = load_from_disk(built[fingerprint]["path"])
+        fixed_waste = built[fingerprint]["padding_waste_fixed"]
+    else:
+        print(f"\n Tokenizing for {name.upper()} with {args.num_proc} processes...")
+        dataset = formatted.map(
+            tokenize,
+            batched=True,
+            num_proc=args.num_proc,
+            remove_columns=formatted.column_names,
+            fn_kwargs={"tokenizer": tokenizer, "max_length": args.max_length},
+            desc=f"Tokenizing ({name})",
         )
+        fixed_waste = padding_stats(dataset["length"], args.batch_size, args.max_length)["padding_waste"]
+        if args.packing:
+            dataset = dataset.map(
+                pack,
+                batched=True,
+                batch_size=1000,
+                num_proc=args.num_proc,
+                remove_columns=dataset.column_names,
+                fn_kwargs={"max_length": args.max_length},
+                desc=f"Packing ({name})",
+            )
+
+    #Save as Arrow: load_from_disk memory-maps it instead of reading it into RAM
+    dataset.save_to_disk(save_path, num_proc=args.num_proc)
+    elapsed = time.perf_counter() - started
 
-    tokenized = formatted_dataset.map(tokenize, batched=True)
+    lengths = dataset["length"]
+    real_tokens = sum(lengths)
+    meta = {
+        "name": name,
+        "model_id": model_id,
+        "path": save_path,
+        "fingerprint": fingerprint,
+        "packing": args.packing,
+        "max_length": args.max_length,
+        "rows": len(lengths),
+        "real_tokens": real_tokens,
+        "seconds": round(elapsed, 2),
+        "tokens_per_second": round(real_tokens / elapsed, 1) if elapsed else None,
+        # Padding to max_length (the previous format) vs what training will see
+        "padding_waste_fixed": fixed_waste,
+        "padding_waste_dynamic": padding_stats(sorted(lengths), args.batch_size)["padding_waste"],
+    }
+    with open(os.path.join(save_path, "prep_meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    built[fingerprint] = meta
+    print(f"Saved tokenized dataset to: {save_path}")
+    return meta
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Tokenize the project management dataset for LoRA fine-tuning "
+                    "(run from backend/ as python -m llms.fine_tune.prepare_dataset)"
+    )
+    parser.add_argument("--models", nargs="+", choices=sorted(MODELS), default=list(MODELS))
+    parser.add_argument("--max-length", type=int, default=MAX_LENGTH)
+    parser.add_argument("--packing", action="store_true",
+                        help="Pack several examples per row; training them needs flash-attn "
+                             "(default: one example per row, padded per batch)")
+    parser.add_argument("--num-proc", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--batch-size", type=int, default=4, help="Training batch size used for the padding report")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--force", action="store_true", help="Rebuild even if the cached dataset is up to date")
+    args = parser.parse_args()
+
+    #Load dataset
+    dataset = load_dataset("ai-in-projectmanagement/ProjectManagementLLM_dataset")
+    formatted_dataset = dataset["train"].map(format_example, num_proc=args.num_proc)
+
+    built = {}
+    report = [prepare(name, MODELS[name], formatted_dataset, args, built) for name in args.models]
+
+    print("\nModel       rows    tokens    tok/s     pad waste (max_length -> dynamic)")
+    for meta in report:
+        print(
+            f"{meta['name']:<10} {meta['rows']:>6} {meta['real_tokens']:>9} {meta['tokens_per_second'] or 0:>9} "
+            f"    {meta['padding_waste_fixed']:.1%} -> {meta['padding_waste_dynamic']:.1%}"
+        )
 
-    #Save to disk
-    save_path = f"datasets/tokenized_project_management_{name}"
-    tokenized.save_to_disk(save_path)
-    print(f"Saved tokenized dataset to: {save_path}")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
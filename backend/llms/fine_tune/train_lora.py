@@ -1,8 +1,15 @@
+import argparse
+import json
+import os
+
 from datasets import load_from_disk
-from transformers import AutoModelForCausalLM, TrainingArguments, Trainer, AutoTokenizer
+from transformers import AutoModelForCausalLM, TrainingArguments, Trainer, AutoTokenizer, DataCollatorForSeq2Seq
+from transformers.utils import is_flash_attn_2_available
 from peft import get_peft_model, LoraConfig, TaskType
 
-# Supported models and their tokenized dataset paths
+from .packing import IGNORE_INDEX
+
+# Supported models and their tokenized dataset paths (written by prepare_dataset.py)
 MODELS = {
     "phi": {
         "model_id": "microsoft/phi-2",
@@ -18,6 +25,9 @@ MODELS = {
     }
 }
 
+# Adapters are saved where llms/adapters.py serves them from
+ADAPTER_DIR = os.path.dirname(os.path.abspath(__file__))
+
 # LoRA configuration
 peft_config = LoraConfig(
     task_type=TaskType.CAUSAL_LM,
@@ -28,42 +38,121 @@ peft_config = LoraConfig(
 )
 
 # Training arguments
-training_args = TrainingArguments(
-    output_dir="./results",
-    per_device_train_batch_size=4,
-    num_train_epochs=3,
-    logging_dir="./logs",
-    save_steps=100,
-    evaluation_strategy="no",
-    fp16=True
-)
+def training_args(name, batch_size):
+    return TrainingArguments(
+        output_dir=f"./results/{name}",
+        per_device_train_batch_size=batch_size,
+        num_train_epochs=3,
+        logging_dir="./logs",
+        save_steps=100,
+        eval_strategy="no",
+        fp16=True,
+        # Batches of similar length need little padding (precomputed "length" column)
+        group_by_length=True,
+        length_column_name="length",
+        remove_unused_columns=False,
+    )
+
+class PaddingCountingCollator(DataCollatorForSeq2Seq):
+    """
+    Pads each batch to its longest row and counts real vs padded tokens.
+    Packed batches leave out the attention mask, so flash-attention splits
+    each row into its examples at the position id restarts.
+    """
+
+    real_tokens = 0
+    padded_tokens = 0
+
+    def __call__(self, features, return_tensors=None):
+        features = [{k: v for k, v in f.items() if k != "length"} for f in features]
+        # Packed rows carry per-example position ids, which the tokenizer does not pad
+        positions = [f.pop("position_ids", None) for f in features]
+        batch = super().__call__(features, return_tensors)
+        if positions[0] is not None:
+            width = batch["input_ids"].shape[1]
+            padded = []
+            for ids in positions:
+                fill = [0] * (width - len(ids))
+                padded.append(fill + list(ids) if self.tokenizer.padding_side == "left" else list(ids) + fill)
+            batch["position_ids"] = batch["input_ids"].new_tensor(padded)
+        self.real_tokens += int(batch["attention_mask"].sum())
+        self.padded_tokens += int(batch["attention_mask"].numel())
+        if positions[0] is not None:
+            del batch["attention_mask"]
+        return batch
 
-# Loop through each model and fine-tune
-for name, config in MODELS.items():
+def train(name, config, batch_size):
     print(f"\nStarting LoRA fine-tuning for {name.upper()}")
 
-    # Load tokenized dataset
+    # Load tokenized dataset (memory-mapped Arrow)
     dataset = load_from_disk(config["dataset_path"])
 
     # Load base model and tokenizer
     tokenizer = AutoTokenizer.from_pretrained(config["model_id"])
-    model = AutoModelForCausalLM.from_pretrained(config["model_id"], dtype="auto")
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    model_kwargs = {}
+    if "position_ids" in dataset.column_names:
+        # Packed rows: only the varlen kernels keep their examples from attending to each other
+        if not is_flash_attn_2_available():
+            raise SystemExit(
+                f"{config['dataset_path']} is packed, which needs flash-attn to train; "
+                f"install it or rebuild the dataset without --packing"
+            )
+        model_kwargs["attn_implementation"] = "flash_attention_2"
+    model = AutoModelForCausalLM.from_pretrained(config["model_id"], dtype="auto", **model_kwargs)
 
     # Apply LoRA adapters
     model = get_peft_model(model, peft_config)
 
+    # Dynamic padding: rows are stored unpadded (or packed) and padded per batch
+    collator = PaddingCountingCollator(tokenizer, padding="longest", label_pad_token_id=IGNORE_INDEX, pad_to_multiple_of=8)
+
     # Initialize Trainer
     trainer = Trainer(
         model=model,
-        args=training_args,
+        args=training_args(name, batch_size),
         train_dataset=dataset,
-        tokenizer=tokenizer
+        data_collator=collator,
+        processing_class=tokenizer
     )
 
     # Train
-    trainer.train()
+    result = trainer.train()
 
-    # Save fine-tuned model
-    save_path = f"LLMs/fine_tune/{name}_project_manager_lora"
+    # Save fine-tuned adapter
+    save_path = os.path.join(ADAPTER_DIR, f"{name}_project_manager_lora")
     trainer.save_model(save_path)
-    print(f"Saved fine-tuned {name.upper()} model to {save_path}")
\ No newline at end of file
+    print(f"Saved fine-tuned {name.upper()} model to {save_path}")
+
+    runtime = result.metrics.get("train_runtime") or 0
+    report = {
+        "model": name,
+        "train_runtime": runtime,
+        "real_tokens": collator.real_tokens,
+        "padded_tokens": collator.padded_tokens,
+        "effective_tokens_per_second": round(collator.real_tokens / runtime, 1) if runtime else None,
+        "padding_waste": round(1 - collator.real_tokens / collator.padded_tokens, 4) if collator.padded_tokens else 0.0,
+    }
+    with open(os.path.join(save_path, "train_report.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(
+        f"{name}: {report['effective_tokens_per_second']} effective tokens/s, "
+        f"{report['padding_waste']:.1%} padding"
+    )
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="LoRA fine-tuning on the prepared datasets (run from backend/ as python -m llms.fine_tune.train_lora)"
+    )
+    parser.add_argument("--models", nargs="+", choices=sorted(MODELS), default=list(MODELS))
+    parser.add_argument("--batch-size", type=int, default=4)
+    args = parser.parse_args()
+
+    # Loop through each model and fine-tune
+    for name in args.models:
+        train(name, MODELS[name], args.batch_size)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Page-level bookkeeping for incremental proposal re-ingestion.
+
+Each project section is generated from the pages relevant to it (plus the
+outputs of the sections it depends on). A section's raw output is cached
+under the hash of its final prompt, so when a revised proposal only changes
+a few pages, sections whose prompt is byte-identical reuse the cached output
+instead of calling the model again.
+"""
+import hashlib
+from typing import Dict, List, Optional
+
+# Proposals up to this many pages are sent whole to every section
+FULL_TEXT_MAX_PAGES = 3
+
+# Words that mark a page as relevant to a section (matched case-insensitively)
+SECTION_KEYWORDS = {
+    "summary": ("overview", "summary", "introduction", "background", "objective", "purpose", "problem"),
+    "features": ("feature", "functionality", "function", "module", "capabilit", "requirement", "user can", "system will"),
+    "roles": ("team", "role", "developer", "designer", "engineer", "manager", "staff", "personnel", "responsib"),
+    "goals": ("goal", "objective", "deliverable", "outcome", "success", "aim", "scope"),
+    "timeline": ("week", "month", "phase", "milestone", "schedule", "timeline", "sprint", "deadline"),
+}
+
+
+def page_hash(text: str) -> str:
+    """Hash of a page, ignoring whitespace-only differences from PDF extraction."""
+    normalized = " ".join((text or "").split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def page_hashes(pages: List[str]) -> List[str]:
+    return [page_hash(page) for page in pages]
+
+
+def changed_pages(old_hashes: List[str], new_hashes: List[str]) -> List[int]:
+    """Indices of pages (0-based) that were added or modified; removed pages count as the last index."""
+    changed = [i for i, h in enumerate(new_hashes) if i >= len(old_hashes) or old_hashes[i] != h]
+    if len(old_hashes) > len(new_hashes) and not changed:
+        changed.append(max(0, len(new_hashes) - 1))
+    return changed
+
+
+def relevant_pages(section: str, pages: List[str]) -> List[int]:
+    """
+    Page indices fed to ``section``. Short proposals are used whole; otherwise
+    the first page plus every page mentioning one of the section's keywords
+    (all pages when nothing beyond the first page matches).
+    """
+    if len(pages) <= FULL_TEXT_MAX_PAGES or section not in SECTION_KEYWORDS:
+        return list(range(len(pages)))
+    keywords = SECTION_KEYWORDS[section]
+    selected = [0] + [
+        i for i, page in enumerate(pages[1:], start=1)
+        if any(keyword in page.lower() for keyword in keywords)
+    ]
+    if len(selected) == 1:
+        return list(range(len(pages)))
+    return selected
+
+
+def section_text(section: str, pages: List[str]) -> str:
+    return "\n".join(pages[i] for i in relevant_pages(section, pages))
+
+
+def prompt_hash(prompt: str, max_tokens: int, model: str = "") -> str:
+    """Cache key of a generation; output from a different model is not reused."""
+    key = f"{model}\n{max_tokens}\n{prompt}" if model else f"{max_tokens}\n{prompt}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def cached_output(cache: Optional[Dict[str, Dict]], section: str, input_hash: str) -> Optional[str]:
+    """Return the cached raw output for ``section`` if it was produced from the same prompt."""
+    entry = (cache or {}).get(section)
+    if entry and entry.get("input_hash") == input_hash and entry.get("raw"):
+        return entry["raw"]
+    return None
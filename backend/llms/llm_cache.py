@@ -3,8 +3,11 @@ import torch
 import time
 import gc
 import logging
+from contextlib import contextmanager
+from typing import Optional
 from transformers import AutoTokenizer, AutoModelForCausalLM, pipeline
 from langchain_huggingface import HuggingFacePipeline
+from llms import telemetry
 try:
     from transformers import BitsAndBytesConfig
 except Exception:
@@ -18,26 +21,46 @@ MODEL_ID = "unsloth/mistral-7b-instruct-v0.3-bnb-4bit"
 _model_instance = None
 _model_lock = threading.Lock()
 
+# Stand-in model (e.g. llms.fake_llm.FakeLLM) returned instead of loading MODEL_ID
+_override_instance = None
+
 # Auto-cleanup variables
 _last_activity_time = None
 _cleanup_thread = None
 _cleanup_interval = 1800  # 30 minutes in seconds
 _cleanup_lock = threading.Lock()
 
-def _create_llm_pipeline() -> HuggingFacePipeline:
-    """Create a new LLM pipeline instance. Internal helper function."""
+# Weight formats accepted by _create_llm_pipeline (None picks per device as below)
+DTYPES = {"float16": torch.float16, "bfloat16": torch.bfloat16, "float32": torch.float32}
+QUANTIZED_DTYPE = "4bit"
+
+def _create_llm_pipeline(model_id: str = MODEL_ID, dtype: Optional[str] = None) -> HuggingFacePipeline:
+    """
+    Create a new LLM pipeline instance. Internal helper function.
+    ``dtype`` forces the weight format: "4bit" (CUDA + bitsandbytes) or a
+    key of DTYPES; by default GPUs try 4-bit and fall back to float16, CPUs use float32.
+    """
+    if dtype is not None and dtype != QUANTIZED_DTYPE and dtype not in DTYPES:
+        raise ValueError(f"Unknown dtype: {dtype}")
+    if dtype == QUANTIZED_DTYPE and not torch.cuda.is_available():
+        raise RuntimeError("4-bit loading needs CUDA and bitsandbytes")
     logger.info("Loading LLM model...")
-    logger.info(f"Model ID: {MODEL_ID}")
+    logger.info(f"Model ID: {model_id}")
     
     logger.info("Loading tokenizer...")
-    tokenizer = AutoTokenizer.from_pretrained(MODEL_ID, trust_remote_code=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_id, trust_remote_code=True)
+    # Batched generation (e.g. hierarchical backlog expansion) needs a pad token
+    # and left padding so every prompt ends right where generation starts
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    tokenizer.padding_side = "left"
     logger.info("Tokenizer loaded")
 
     use_cuda = torch.cuda.is_available()
     quant_cfg = None
     
     # Only try quantization if CUDA is available AND bitsandbytes is properly installed
-    if use_cuda and BitsAndBytesConfig is not None:
+    if use_cuda and BitsAndBytesConfig is not None and dtype in (None, QUANTIZED_DTYPE):
         try:
             # Test if bitsandbytes is actually working
             import bitsandbytes as bnb
@@ -51,6 +74,8 @@ def _create_llm_pipeline() -> HuggingFacePipeline:
         except (ImportError, Exception) as e:
             logger.warning(f"bitsandbytes not available, falling back to standard loading: {e}")
             quant_cfg = None
+    if dtype == QUANTIZED_DTYPE and quant_cfg is None:
+        raise RuntimeError("4-bit loading needs CUDA and bitsandbytes")
 
     if use_cuda:
         logger.info("CUDA available, loading model to GPU...")
@@ -58,7 +83,7 @@ def _create_llm_pipeline() -> HuggingFacePipeline:
             logger.info("Using 4-bit quantization for memory efficiency...")
             # CUDA with 4-bit (requires bitsandbytes, best on Linux)
             model = AutoModelForCausalLM.from_pretrained(
-                MODEL_ID,
+                model_id,
                 device_map="auto",
                 trust_remote_code=True,
                 quantization_config=quant_cfg,
@@ -68,9 +93,9 @@ def _create_llm_pipeline() -> HuggingFacePipeline:
             logger.info("Loading model without quantization...")
             # CUDA without bitsandbytes: load then move explicitly to GPU
             model = AutoModelForCausalLM.from_pretrained(
-                MODEL_ID,
+                model_id,
                 device_map=None,
-                dtype=torch.float16,
+                dtype=DTYPES[dtype or "float16"],
                 trust_remote_code=True,
             ).to("cuda")
             logger.info("Model loaded to GPU")
@@ -91,9 +116,9 @@ def _create_llm_pipeline() -> HuggingFacePipeline:
         logger.info("CUDA not available, loading model to CPU...")
         # CPU fallback (slower). Avoid 4-bit config on CPU.
         model = AutoModelForCausalLM.from_pretrained(
-            MODEL_ID,
+            model_id,
             device_map=None,
-            dtype=torch.float32,
+            dtype=DTYPES[dtype or "float32"],
             trust_remote_code=True,
         )
         logger.info("Model loaded to CPU")
@@ -132,11 +157,16 @@ def get_cached_llm() -> HuggingFacePipeline:
     
     logger.debug("[LLM Cache] get_cached_llm() called")
     
+    if _override_instance is not None:
+        logger.debug("[LLM Cache] Returning override model instance")
+        return _override_instance
+    
     # Update activity time whenever LLM is accessed
     _update_activity_time()
     
     if _model_instance is not None:
         logger.debug("[LLM Cache] Returning existing cached model instance")
+        telemetry.registry.record_cache("model", True)
         return _model_instance
     
     logger.debug("[LLM Cache] No cached model found, creating new instance...")
@@ -145,9 +175,11 @@ def get_cached_llm() -> HuggingFacePipeline:
         # Double-check pattern: another thread might have created it while we waited
         if _model_instance is not None:
             logger.debug("[LLM Cache] Another thread created model while waiting, returning existing instance")
+            telemetry.registry.record_cache("model", True)
             return _model_instance
         
         logger.debug("[LLM Cache] Creating new LLM pipeline...")
+        telemetry.registry.record_cache("model", False)
         _model_instance = _create_llm_pipeline()
         logger.debug("[LLM Cache] LLM model loaded and cached successfully")
         return _model_instance
@@ -160,6 +192,34 @@ def get_cached_backlog_llm() -> HuggingFacePipeline:
     logger.debug("[LLM Cache] get_cached_backlog_llm() called - delegating to get_cached_llm()")
     return get_cached_llm()
 
+def set_llm_override(llm):
+    """
+    Serve ``llm`` from get_cached_llm() instead of the real model.
+    Used by benchmarks and tests to inject a deterministic stand-in.
+    """
+    global _override_instance
+    logger.debug(f"[LLM Cache] Installing LLM override: {type(llm).__name__}")
+    _override_instance = llm
+
+def clear_llm_override():
+    """Remove the override installed by set_llm_override()."""
+    global _override_instance
+    logger.debug("[LLM Cache] Clearing LLM override")
+    _override_instance = None
+
+@contextmanager
+def override_llm(llm):
+    """Context manager form of set_llm_override()."""
+    previous = _override_instance
+    set_llm_override(llm)
+    try:
+        yield llm
+    finally:
+        if previous is None:
+            clear_llm_override()
+        else:
+            set_llm_override(previous)
+
 def clear_cache():
     """
     Clear the cached model instance. Useful for testing or memory management.
@@ -259,7 +319,9 @@ def _auto_cleanup_worker():
                 # If no activity for the cleanup interval, clear the cache
                 if time_since_activity >= _cleanup_interval:
                     logger.debug(f"[LLM Cache] Auto-cleanup triggered: No LLM activity for {time_since_activity:.0f} seconds, clearing cache...")
-                    clear_cache_and_free_memory()
+                    # Also unloads the section models loaded by the model registry
+                    from llms.model_registry import models
+                    models.unload_all()
                     _last_activity_time = None  # Reset activity time
                     logger.debug("[LLM Cache] Auto-cleanup completed")
                     
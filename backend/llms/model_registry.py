@@ -0,0 +1,222 @@
+"""
+Section-to-model routing.
+
+Light sections (summary, features, roles) do not need the 7B model that
+writes the backlog, so each section is routed to a model from ``MODELS``.
+Models load lazily on first use and share one memory budget: loading a model
+that does not fit evicts the least recently used ones. A route may also be a
+weighted split between models (``{"qwen-0.5b": 50, "mistral-7b": 50}``) to
+A/B their latency and quality; calls are tagged with the serving model in
+telemetry, so the ``llm-metrics`` endpoint reports each arm separately.
+A route of the form ``"<model>+<adapter>"`` serves the section from a LoRA
+adapter attached to the shared base model (see ``llms.adapters``).
+
+Routes and the budget can be overridden with the ``LLM_SECTION_MODELS`` and
+``LLM_MEMORY_BUDGET_MB`` settings.
+"""
+import gc
+import hashlib
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Union
+
+from django.conf import settings
+
+from llms import adapters, llm_cache, telemetry
+
+logger = logging.getLogger('llms')
+
+
+@dataclass(frozen=True)
+class ModelSpec:
+    name: str
+    model_id: str
+    memory_mb: int  # resident size estimate (GPU, as loaded by llm_cache)
+
+
+MODELS = {
+    "mistral-7b": ModelSpec("mistral-7b", llm_cache.MODEL_ID, 5000),
+    # Same small models as fine_tune/train_lora.py
+    "tinyllama": ModelSpec("tinyllama", "TinyLlama/TinyLlama-1.1B-Chat-v1.0", 2400),
+    "qwen-0.5b": ModelSpec("qwen-0.5b", "Qwen/Qwen2-0.5B-Instruct", 1200),
+}
+
+# Served through llm_cache's singleton, so its auto-cleanup keeps working
+DEFAULT_MODEL = "mistral-7b"
+
+# Section -> model name, or {model name: weight} for an A/B split
+DEFAULT_ROUTES: Dict[str, Union[str, Dict[str, int]]] = {
+    "summary": "qwen-0.5b",
+    "features": "qwen-0.5b",
+    "roles": "qwen-0.5b",
+    "goals": DEFAULT_MODEL,
+    "timeline": DEFAULT_MODEL,
+    "backlog": DEFAULT_MODEL,
+}
+
+DEFAULT_MEMORY_BUDGET_MB = 8192
+
+
+class ModelRegistry:
+    """Routes sections to models and keeps the loaded models within ``memory_budget_mb``."""
+
+    def __init__(self, models: Dict[str, ModelSpec] = None, routes: Dict = None,
+                 memory_budget_mb: int = DEFAULT_MEMORY_BUDGET_MB,
+                 loader: Optional[Callable[[ModelSpec], object]] = None, default_model: str = DEFAULT_MODEL):
+        self.models = dict(models or MODELS)
+        self.routes = dict(DEFAULT_ROUTES if routes is None else routes)
+        self.memory_budget_mb = memory_budget_mb
+        self.default_model = default_model
+        self._loader = loader
+        self._lock = threading.Lock()
+        # name -> llm, least recently used first (the default model lives in llm_cache)
+        self._loaded: 'OrderedDict[str, object]' = OrderedDict()
+        self._last_used: Dict[str, float] = {}
+        self.loads = 0
+        self.evictions = 0
+
+    # Routing -----------------------------------------------------------------
+
+    def route(self, section: str, key: Optional[str] = None) -> str:
+        """
+        Model name (or ``model+adapter``) for ``section``. For a weighted route,
+        ``key`` (e.g. a task or proposal id) makes the choice sticky; without
+        it the arm is random.
+        """
+        route = self.routes.get(section, self.default_model)
+        if isinstance(route, dict):
+            arms = [(name, weight) for name, weight in route.items() if weight > 0]
+            if not arms:
+                return self.default_model
+            total = sum(weight for _, weight in arms)
+            if key is None:
+                point = random.uniform(0, total)
+            else:
+                digest = hashlib.sha1(f"{section}:{key}".encode("utf-8")).hexdigest()
+                point = int(digest[:8], 16) / 0xFFFFFFFF * total
+            for name, weight in arms:
+                point -= weight
+                if point <= 0:
+                    return name
+            return arms[-1][0]
+        return route if route.partition("+")[0] in self.models else self.default_model
+
+    # Loading -----------------------------------------------------------------
+
+    def _resident(self) -> Dict[str, int]:
+        resident = {name: self.models[name].memory_mb for name in self._loaded}
+        if self._loader is None and llm_cache._model_instance is not None:
+            resident[self.default_model] = self.models[self.default_model].memory_mb
+        return resident
+
+    def _make_room(self, name: str):
+        """Evict least recently used models until ``name`` fits the budget (call with the lock held)."""
+        needed = self.models[name].memory_mb
+        resident = self._resident()
+        candidates = sorted((n for n in resident if n != name), key=lambda n: self._last_used.get(n, 0))
+        while candidates and sum(resident.values()) + needed > self.memory_budget_mb:
+            victim = candidates.pop(0)
+            self._unload(victim)
+            resident.pop(victim)
+        if sum(resident.values()) + needed > self.memory_budget_mb:
+            logger.warning(f"[Model Registry] {name} ({needed} MB) exceeds the {self.memory_budget_mb} MB budget")
+
+    def _unload(self, name: str):
+        logger.info(f"[Model Registry] Unloading {name}")
+        self.evictions += 1
+        adapters.forget(name)
+        if name == self.default_model and self._loader is None:
+            llm_cache.clear_cache_and_free_memory()
+            return
+        # In-flight generations keep their reference; memory is freed once they finish
+        self._loaded.pop(name, None)
+        gc.collect()
+        if self._loader is None:
+            try:
+                import torch
+                if torch.cuda.is_available():
+                    torch.cuda.empty_cache()
+            except ImportError:
+                pass
+
+    def get(self, name: str):
+        """
+        The loaded model ``name``, loading it (and evicting others) if needed.
+        For ``model+adapter`` the base model is returned bound to the adapter.
+        """
+        if llm_cache._override_instance is not None:
+            return llm_cache._override_instance
+        base, _, adapter = name.partition("+")
+        llm = self._get_base(base)
+        if adapter:
+            return adapters.bind(base, llm, adapter)
+        return adapters.bind_base(base, llm)
+
+    def _get_base(self, name: str):
+        if name not in self.models:
+            raise KeyError(f"Unknown model: {name}")
+
+        # Any model in use keeps the idle cleanup (which unloads them all) at bay
+        llm_cache._update_activity_time()
+        self._last_used[name] = time.monotonic()
+        if name == self.default_model and self._loader is None:
+            if llm_cache._model_instance is None:
+                with self._lock:
+                    self._make_room(name)
+                self.loads += 1
+            return llm_cache.get_cached_llm()
+
+        llm = self._loaded.get(name)
+        if llm is not None:
+            telemetry.registry.record_cache("model", True)
+            with self._lock:
+                if name in self._loaded:
+                    self._loaded.move_to_end(name)
+            return llm
+
+        with self._lock:
+            llm = self._loaded.get(name)
+            if llm is not None:
+                return llm
+            telemetry.registry.record_cache("model", False)
+            self._make_room(name)
+            spec = self.models[name]
+            logger.info(f"[Model Registry] Loading {name} ({spec.model_id})")
+            llm = self._loader(spec) if self._loader else llm_cache._create_llm_pipeline(spec.model_id)
+            self._loaded[name] = llm
+            self.loads += 1
+            return llm
+
+    def get_for_section(self, section: str, key: Optional[str] = None):
+        """Returns (model_name, llm) for ``section``."""
+        name = self.route(section, key)
+        return name, self.get(name)
+
+    def unload_all(self):
+        with self._lock:
+            for name in list(self._resident()):
+                self._unload(name)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            resident = self._resident()
+            return {
+                'memory_budget_mb': self.memory_budget_mb,
+                'resident_mb': sum(resident.values()),
+                'loaded': sorted(resident),
+                'routes': self.routes,
+                'loads': self.loads,
+                'evictions': self.evictions,
+                'adapters': adapters.snapshot(),
+            }
+
+
+# Global instance used by the project and backlog pipelines
+models = ModelRegistry(
+    routes={**DEFAULT_ROUTES, **getattr(settings, 'LLM_SECTION_MODELS', {})},
+    memory_budget_mb=getattr(settings, 'LLM_MEMORY_BUDGET_MB', DEFAULT_MEMORY_BUDGET_MB),
+)
@@ -1,15 +1,12 @@
 import os
 import re
+import time
 import logging
-from llms.models import (
-    ProjectModel,
-    TeamMemberModel,
-    TimelineWeekModel,
-    TimelineGoalModel
-)
-from typing import Dict, Optional
+from llms.models import ProjectModel
+from typing import Callable, Dict, List, Optional, Tuple
 from apps.ai_api.tasks import CancellationToken, TaskCancelledException
-from llms.llm_cache import get_cached_llm
+from llms import telemetry, incremental, few_shot_index, stream_parser, token_budget
+from llms.model_registry import models
 
 logger = logging.getLogger('llms')
 
@@ -18,6 +15,7 @@ _PROMPT_CACHE = {}
 
 def build_prompt(section: str, proposal_text: str, context: Dict = None) -> str:
     # Check cache first
+    telemetry.registry.record_cache("prompt_template", section in _PROMPT_CACHE)
     if section not in _PROMPT_CACHE:
         root_dir = os.path.dirname(__file__)
         prompt_path = os.path.join(root_dir, "prompts", f"{section}_prompt.txt")
@@ -55,160 +53,206 @@ def validate_section_format(section: str, response: str) -> bool:
         return "timeline:" in response_lower and "week_number:" in response_lower
     return True
 
-def generate_section(llm, section: str, prompt: str, max_retries: int = 3, max_tokens: int = 512, cancellation_token: Optional[CancellationToken] = None) -> str:
+def generate_section(llm, section: str, prompt: str, max_retries: int = 3, max_tokens: int = 512,
+                     cancellation_token: Optional[CancellationToken] = None,
+                     prefetched: Optional[Tuple[Optional[str], telemetry.CompletionStats]] = None) -> str:
+    """
+    Generate and validate one section, retrying up to ``max_retries`` times.
+    ``prefetched`` is a (text, stats) result from a batched call that is used
+    as the first attempt.
+    """
+    call = telemetry.SectionCall("project", section, max_tokens)
     for _ in range(max_retries):
         try:
             # Check for cancellation before each attempt
             if cancellation_token:
                 cancellation_token.check_cancelled()
 
-            text = None
-            # Prefer direct pipeline call with per-call override if available
-            if hasattr(llm, "pipeline"):
-                try:
-                    out = llm.pipeline(prompt, max_new_tokens=max_tokens)
-                    if isinstance(out, list) and out and isinstance(out[0], dict) and "generated_text" in out[0]:
-                        text = out[0]["generated_text"]
-                    elif isinstance(out, str):
-                        text = out
-                except Exception:
-                    # Fall back to invoke if pipeline call fails
-                    pass
-
-            if not text:
-                # Fallback to the wrapper invoke
-                text = llm.invoke(prompt)
+            if prefetched is not None:
+                (text, stats), prefetched = prefetched, None
+            else:
+                text, stats = telemetry.timed_completion(llm, prompt, max_tokens)
 
             response = (text or "").strip()
             if not response:
+                call.attempt(stats, "empty")
                 continue
             if not validate_section_format(section, response):
+                call.attempt(stats, "invalid")
                 continue
+            call.attempt(stats, "ok")
+            call.finish(success=True)
             return response
         except TaskCancelledException:
+            call.finish(success=False, cancelled=True)
             raise  # Re-raise cancellation exceptions
         except Exception:
+            call.error()
             continue
+    call.finish(success=False)
     return ""
 
+SECTIONS = ["summary", "features", "roles", "goals", "timeline"]
+
+# Section-specific token limits for optimal performance
+SECTION_TOKEN_LIMITS = {
+    "summary": 256,    # Short paragraph
+    "features": 256,   # List of 5-6 items
+    "roles": 256,      # List of 5-8 roles
+    "goals": 384,      # 8 goals with titles/roles
+    "timeline": 384,   # 4 weeks with tasks
+}
+
+def build_section_prompt(section: str, pages: List[str], raw_outputs: Dict[str, str],
+                         project_model: Optional[ProjectModel] = None) -> str:
+    """Prompt for ``section`` from its relevant pages and the earlier sections' outputs."""
+    project_model = project_model or ProjectModel()
+    context = {
+        "project_title": project_model.title or "",
+        "project_summary": project_model.summary or "",
+        "overarching_goals": ", ".join(project_model.features),
+        "additional_roles": "\n".join([r.role for r in project_model.roles]) if project_model.roles else "",
+        "goals": "",
+    }
+
+    if section == "timeline" and "goals" in raw_outputs:
+        goal_titles = []
+        for line in raw_outputs["goals"].splitlines():
+            if line.strip().startswith("- title:"):
+                title = line.strip()[len("- title:"):].strip()
+                goal_titles.append(title)
+        context["goals"] = "\n".join(goal_titles)
+
+    section_text = incremental.section_text(section, pages)
+    # Worked examples from the most similar projects, in place of a static format example
+    context["few_shot_examples"] = few_shot_index.examples_for(section, section_text)
+    return build_prompt(section, section_text, context)
+
 def run_pipeline_from_text(proposal_text: str, task_id: Optional[str] = None) -> ProjectModel:
     if not proposal_text:
         return ProjectModel()
+    project_model, _, _ = run_incremental_pipeline([proposal_text], task_id=task_id)
+    return project_model
+
+def run_incremental_pipeline(pages: List[str], cached_outputs: Optional[Dict[str, Dict]] = None,
+                             task_id: Optional[str] = None) -> Tuple[ProjectModel, Dict[str, Dict], Dict[str, List[str]]]:
+    """
+    Generate every project section from the pages relevant to it. A section
+    whose final prompt hashes to the same value as an entry in
+    ``cached_outputs`` reuses that raw output instead of calling the model.
+    Returns (project_model, section_outputs, report) where section_outputs is
+    the cache to store for this proposal and report lists the regenerated
+    and reused sections. Each section is served by the model it is routed to
+    in the model registry.
+    """
+    report = {"regenerated_sections": [], "reused_sections": []}
+    pages = [page for page in pages if page and page.strip()]
+    if not pages:
+        return ProjectModel(), {}, report
 
     # Create cancellation token if task_id is provided
     cancellation_token = CancellationToken(task_id) if task_id else None
 
-    llm = get_cached_llm()  # Uses singleton cache - model loaded only once per server lifetime
+    # Models are only loaded once a section routed to them needs generating
+    llms = {}
+    route_key = incremental.page_hash(pages[0])  # keeps A/B routing stable per proposal
     project_model = ProjectModel()
     raw_outputs = {}
-    sections = ["summary", "features", "roles", "goals", "timeline"]
-    
-    # Section-specific token limits for optimal performance
-    section_token_limits = {
-        "summary": 256,    # Short paragraph
-        "features": 256,   # List of 5-6 items
-        "roles": 256,      # List of 5-8 roles
-        "goals": 384,      # 8 goals with titles/roles
-        "timeline": 384,   # 4 weeks with tasks
-    }
+    section_outputs = {}
 
-    context = {
-        "proposal_text": proposal_text,
-        "project_title": "",
-        "project_summary": "",
-        "overarching_goals": "",
-        "additional_roles": "",
-        "goals": ""
-    }
-
-    for section in sections:
+    for section in SECTIONS:
         # Check for cancellation before each section
         if cancellation_token:
             cancellation_token.check_cancelled()
-        
-        context["project_title"] = project_model.title or ""
-        context["project_summary"] = project_model.summary or ""
-        context["overarching_goals"] = ", ".join(project_model.features)
-        context["additional_roles"] = "\n".join([r.role for r in project_model.roles]) if project_model.roles else ""
-
-        if section == "timeline" and "goals" in raw_outputs:
-            goal_titles = []
-            for line in raw_outputs["goals"].splitlines():
-                if line.strip().startswith("- title:"):
-                    title = line.strip()[len("- title:"):].strip()
-                    goal_titles.append(title)
-            context["goals"] = "\n".join(goal_titles)
-
-        prompt = build_prompt(section, proposal_text, context)
+
+        prompt = build_section_prompt(section, pages, raw_outputs, project_model)
         if prompt:
-            max_tokens = section_token_limits.get(section, 512)
-            raw_response = generate_section(llm, section, prompt, max_tokens=max_tokens, cancellation_token=cancellation_token)
+            default_tokens = SECTION_TOKEN_LIMITS.get(section, 512)
+            model_name = models.route(section, route_key)
+            # Keyed on the static limit so learned budgets do not invalidate cached outputs
+            input_hash = incremental.prompt_hash(prompt, default_tokens, model_name)
+            raw_response = incremental.cached_output(cached_outputs, section, input_hash)
+            telemetry.registry.record_cache("section_output", raw_response is not None, "project", section)
+            if raw_response:
+                report["reused_sections"].append(section)
+            else:
+                if model_name not in llms:
+                    wait_started = time.perf_counter()
+                    llms[model_name] = models.get(model_name)
+                    telemetry.registry.record_queue_wait("project", "model", time.perf_counter() - wait_started)
+                max_tokens = token_budget.limit("project", section, model_name, default_tokens)
+                with telemetry.model_scope(model_name):
+                    raw_response = generate_section(
+                        llms[model_name], section, prompt, max_tokens=max_tokens, cancellation_token=cancellation_token,
+                    )
+                report["regenerated_sections"].append(section)
             if raw_response:
                 logger.debug(f"RAW {section.upper()}: {raw_response}")
                 raw_outputs[section] = raw_response
+                section_outputs[section] = {"input_hash": input_hash, "raw": raw_response}
 
-    if "summary" in raw_outputs:
-        match = re.search(r"summary:\s*(.*)", raw_outputs["summary"], re.DOTALL | re.IGNORECASE)
-        if match:
-            project_model.summary = match.group(1).strip()
-            first_sentence = re.match(r"^(.*?\.)", project_model.summary)
-            project_model.title = first_sentence.group(1).strip() if first_sentence else "Project from Proposal"
-        else:
-            project_model.summary = raw_outputs["summary"]
-            project_model.title = "Project from Proposal"
-
-    if "features" in raw_outputs:
-        lines = [line.strip()[2:] for line in raw_outputs["features"].splitlines() if line.strip().startswith("- ")]
-        project_model.features = [re.sub(r"^\(Optional:\)\s*", "", line) for line in lines[:5]]
-
-    if "roles" in raw_outputs:
-        roles = [TeamMemberModel(role=line.strip()[2:].strip()) for line in raw_outputs["roles"].splitlines() if line.strip().startswith("- ")]
-        project_model.roles = roles
-
-    if "goals" in raw_outputs:
-        goal_lines = raw_outputs["goals"].splitlines()
-        parsed_goals = []
-        current_goal = {}
-
-        for line in goal_lines:
-            line = line.strip()
-            if line.startswith("- title:"):
-                if current_goal:
-                    parsed_goals.append(current_goal)
-                current_goal = {"title": line[len("- title:"):].strip(), "role": ""}
-            elif line.startswith("role:") and current_goal:
-                current_goal["role"] = line[len("role:"):].strip()
-
-        if current_goal:
-            parsed_goals.append(current_goal)
-
-        project_model.goals = parsed_goals
-
-    if "timeline" in raw_outputs:
-        try:
-            match = re.search(r"timeline:\s*\n([\s\S]*)", raw_outputs["timeline"], re.DOTALL | re.IGNORECASE)
-            if match:
-                timeline_str = match.group(1).strip()
-                weeks = []
-                current_week = None
-                current_goals = []
-                for line in timeline_str.splitlines():
-                    line = line.strip()
-                    week_match = re.match(r"^-?\s*week_number:\s*(\d+)", line, re.IGNORECASE)
-                    goal_match = re.match(r"^-\s*(.*)", line)
-                    if week_match:
-                        if current_week is not None:
-                            weeks.append(TimelineWeekModel(week_number=current_week, goals=current_goals))
-                        current_week = int(week_match.group(1))
-                        current_goals = []
-                    elif goal_match and current_week is not None:
-                        current_goals.append(TimelineGoalModel(title=goal_match.group(1).strip()))
-                if current_week is not None:
-                    weeks.append(TimelineWeekModel(week_number=current_week, goals=current_goals))
-                project_model.timeline = weeks
-        except Exception:
-            pass
+    return parse_project_outputs(raw_outputs, project_model), section_outputs, report
+
+def run_pipeline_batch(documents: List[List[str]], batch_size: int = 4,
+                       progress_callback: Optional[Callable[[str, int, int], None]] = None) -> List[Tuple[ProjectModel, Dict[str, Dict]]]:
+    """
+    Generate the project sections for many proposals (each a list of pages).
+    Sections run in order; within a section the prompts of ``batch_size``
+    proposals go through one batched pipeline call and invalid answers are
+    retried individually; proposals routed to different models are batched
+    separately. ``progress_callback(section, done, total)`` is called after
+    each batch. Returns (project_model, section_outputs) per proposal, in
+    input order.
+    """
+    docs = [[page for page in pages if page and page.strip()] for pages in documents]
+    raw_outputs = [{} for _ in docs]
+    section_outputs = [{} for _ in docs]
+    if not any(docs):
+        return [(ProjectModel(), {}) for _ in docs]
+    route_keys = [incremental.page_hash(pages[0]) if pages else None for pages in docs]
+
+    for section in SECTIONS:
+        default_tokens = SECTION_TOKEN_LIMITS.get(section, 512)
+        pending = []
+        for i, pages in enumerate(docs):
+            prompt = build_section_prompt(section, pages, raw_outputs[i]) if pages else ""
+            if prompt:
+                pending.append((models.route(section, route_keys[i]), i, prompt))
+        pending.sort(key=lambda item: item[0])
+
+        done = 0
+        for start in range(0, len(pending), max(1, batch_size)):
+            chunk = pending[start:start + batch_size]
+            for model_name in sorted({item[0] for item in chunk}):
+                group = [(i, prompt) for name, i, prompt in chunk if name == model_name]
+                wait_started = time.perf_counter()
+                llm = models.get(model_name)
+                telemetry.registry.record_queue_wait("project", "model", time.perf_counter() - wait_started)
+                max_tokens = token_budget.limit("project", section, model_name, default_tokens)
+                batch = telemetry.timed_batch_completion(llm, [prompt for _, prompt in group], max_tokens)
+                with telemetry.model_scope(model_name):
+                    for offset, (i, prompt) in enumerate(group):
+                        response = generate_section(
+                            llm, section, prompt, max_tokens=max_tokens,
+                            prefetched=batch[offset] if batch else None,
+                        )
+                        if response:
+                            raw_outputs[i][section] = response
+                            section_outputs[i][section] = {
+                                "input_hash": incremental.prompt_hash(prompt, default_tokens, model_name), "raw": response,
+                            }
+            done += len(chunk)
+            if progress_callback is not None:
+                progress_callback(section, done, len(pending))
+
+    return [(parse_project_outputs(raw_outputs[i]), section_outputs[i]) for i in range(len(docs))]
 
+def parse_project_outputs(raw_outputs: Dict[str, str], project_model: Optional[ProjectModel] = None) -> ProjectModel:
+    """Build a ProjectModel from the raw per-section completions."""
+    project_model = project_model or ProjectModel()
+    for section in SECTIONS:
+        if section in raw_outputs:
+            stream_parser.parse_section(section, raw_outputs[section], project_model)
     return project_model
 
 def model_to_dict(project_model: ProjectModel) -> dict:
@@ -0,0 +1,264 @@
+"""
+Push-based parsing of model output into ``llms.models`` objects.
+
+Text is fed in chunks as it arrives from the model (or all at once); each
+complete line is classified once with precompiled patterns and drives a small
+state machine, so output is never re-scanned. ``feed`` returns the objects
+completed by that chunk and ``close`` flushes the unterminated last line.
+
+``BacklogParser`` reads the Epic / -Sub-Epic / -User Story / -Task format of
+the backlog prompts; ``SectionParser`` reads one project section (summary,
+features, roles, goals, timeline) into a ``ProjectModel``. Malformed lines
+are skipped rather than raised on.
+
+Single-pass backlog generation feeds a ``BacklogParser`` from the token
+stream (``telemetry.timed_completion(on_text=...)``) to report epics as they
+appear. Project sections are not streamed: they are generated in batches
+and validated as whole strings before ``parse_section`` runs on the result.
+"""
+import re
+from typing import Any, Dict, List, Optional
+
+from llms.models import (
+    BacklogModel,
+    EpicModel,
+    ProjectModel,
+    SubEpicModel,
+    TaskModel,
+    TeamMemberModel,
+    TimelineGoalModel,
+    TimelineWeekModel,
+    UserStoryModel,
+)
+
+MAX_FEATURES = 5
+
+# Backlog line labels, looked up by their first three characters
+_BACKLOG_KINDS = {kind[:3]: kind for kind in ("Epic", "-Sub-Epic", "-User Story", "-Task")}
+# Line boundaries honoured by str.splitlines()
+_LINE_BREAKS = "\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029"
+_SUMMARY_RE = re.compile(r"summary:\s*(.*)", re.IGNORECASE | re.DOTALL)
+_FIRST_SENTENCE_RE = re.compile(r"^(.*?\.)")
+_OPTIONAL_RE = re.compile(r"^\(Optional:\)\s*")
+_TIMELINE_RE = re.compile(r"timeline:\s*$", re.IGNORECASE)
+_WEEK_RE = re.compile(r"^-?\s*week_number:\s*(\d+)", re.IGNORECASE)
+_ITEM_RE = re.compile(r"^-\s*(.*)")
+
+DEFAULT_TITLE = "Project from Proposal"
+
+
+class LineParser:
+    """Splits pushed chunks into lines and hands each complete line to ``_line``."""
+
+    def __init__(self):
+        self._tail = ""
+        self._closed = False
+
+    def feed(self, chunk: str) -> List[Any]:
+        """Consume ``chunk``; returns the objects completed by it."""
+        if self._closed:
+            raise ValueError("feed() after close()")
+        if "\n" not in chunk:
+            self._tail += chunk
+            return []
+        text = self._tail + chunk
+        lines = text.splitlines()
+        self._tail = "" if text[-1] in _LINE_BREAKS else lines.pop()
+        emitted: List[Any] = []
+        for line in lines:
+            self._line(line, emitted)
+        return emitted
+
+    def close(self) -> List[Any]:
+        """Parse the unterminated last line and finish; returns the remaining objects."""
+        emitted: List[Any] = []
+        if not self._closed:
+            self._closed = True
+            for line in self._tail.splitlines():
+                self._line(line, emitted)
+            self._tail = ""
+            self._finish(emitted)
+        return emitted
+
+    def _line(self, line: str, emitted: List[Any]):
+        raise NotImplementedError
+
+    def _finish(self, emitted: List[Any]):
+        pass
+
+
+class BacklogParser(LineParser):
+    """
+    Backlog lines into a ``BacklogModel``. Each Epic, Sub-Epic, User Story and
+    Task is emitted as soon as its line is complete, already attached to its
+    parent. Children that appear before any parent are dropped.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.backlog = BacklogModel()
+        self._epic: Optional[EpicModel] = None
+        self._sub_epic: Optional[SubEpicModel] = None
+        self._story: Optional[UserStoryModel] = None
+
+    def _line(self, line: str, emitted: List[Any]):
+        label, sep, content = line.strip().partition(":")
+        if not sep:
+            return
+        kind = _BACKLOG_KINDS.get(label[:3])
+        if kind is None or not label.startswith(kind):
+            return
+        title = f"{label.strip()}: {content.strip()}"
+
+        if kind == "-Task":
+            if self._story:
+                task = TaskModel(title=title, description="", status="pending", ai=True)
+                self._story.tasks.append(task)
+                emitted.append(task)
+        elif kind == "-User Story":
+            if self._sub_epic:
+                self._story = UserStoryModel(title=title, ai=True)
+                self._sub_epic.user_stories.append(self._story)
+                emitted.append(self._story)
+        elif kind == "-Sub-Epic":
+            if self._epic:
+                self._sub_epic = SubEpicModel(title=title, ai=True)
+                self._story = None
+                self._epic.sub_epics.append(self._sub_epic)
+                emitted.append(self._sub_epic)
+        else:
+            hint = ""
+            if "*(covers:" in title:
+                head, _, hint = title.partition("*(covers:")
+                hint = hint.rstrip(")*").strip()
+                title = f"{head.strip()} *(covers: {hint})*"
+            self._epic = EpicModel(title=title, description=f"Derived from task: {hint}" if hint else "", ai=True)
+            self._sub_epic = self._story = None
+            self.backlog.epics.append(self._epic)
+            emitted.append(self._epic)
+
+
+class SectionParser(LineParser):
+    """
+    One project section's output into ``project_model``. List sections emit
+    their items as they complete (feature strings, ``TeamMemberModel``, goal
+    dicts, ``TimelineWeekModel``). The summary is free text, so it is only
+    buffered and parsed at ``close``.
+    """
+
+    def __init__(self, section: str, project_model: Optional[ProjectModel] = None):
+        super().__init__()
+        self.section = section
+        self.project_model = project_model or ProjectModel()
+        self._handler = getattr(self, f"_{section}_line", None)
+        if self._handler is None:
+            raise ValueError(f"Unknown project section: {section}")
+        self._raw: List[str] = []  # summary chunks
+        self._items: List[Any] = []
+        self._goal: Optional[Dict[str, str]] = None
+        self._timeline_started = False
+        self._week: Optional[TimelineWeekModel] = None
+
+    def feed(self, chunk: str) -> List[Any]:
+        if self.section == "summary":
+            if self._closed:
+                raise ValueError("feed() after close()")
+            self._raw.append(chunk)
+            return []
+        return super().feed(chunk)
+
+    def _line(self, line: str, emitted: List[Any]):
+        self._handler(line, emitted)
+
+    # Sections ----------------------------------------------------------------
+
+    def _summary_line(self, line: str, emitted: List[Any]):
+        pass  # buffered by feed()
+
+    def _features_line(self, line: str, emitted: List[Any]):
+        stripped = line.strip()
+        if stripped.startswith("- ") and len(self._items) < MAX_FEATURES:
+            feature = _OPTIONAL_RE.sub("", stripped[2:])
+            self._items.append(feature)
+            emitted.append(feature)
+
+    def _roles_line(self, line: str, emitted: List[Any]):
+        stripped = line.strip()
+        if stripped.startswith("- "):
+            role = TeamMemberModel(role=stripped[2:].strip())
+            self._items.append(role)
+            emitted.append(role)
+
+    def _goals_line(self, line: str, emitted: List[Any]):
+        stripped = line.strip()
+        if stripped.startswith("- title:"):
+            self._emit_goal(emitted)
+            self._goal = {"title": stripped[len("- title:"):].strip(), "role": ""}
+        elif stripped.startswith("role:") and self._goal is not None:
+            self._goal["role"] = stripped[len("role:"):].strip()
+
+    def _emit_goal(self, emitted: List[Any]):
+        if self._goal is not None:
+            self._items.append(self._goal)
+            emitted.append(self._goal)
+            self._goal = None
+
+    def _timeline_line(self, line: str, emitted: List[Any]):
+        if not self._timeline_started:
+            self._timeline_started = bool(_TIMELINE_RE.search(line))
+            return
+        stripped = line.strip()
+        week = _WEEK_RE.match(stripped)
+        if week:
+            self._emit_week(emitted)
+            self._week = TimelineWeekModel(week_number=int(week.group(1)), goals=[])
+            return
+        item = _ITEM_RE.match(stripped)
+        if item and self._week is not None:
+            self._week.goals.append(TimelineGoalModel(title=item.group(1).strip()))
+
+    def _emit_week(self, emitted: List[Any]):
+        if self._week is not None:
+            self._items.append(self._week)
+            emitted.append(self._week)
+            self._week = None
+
+    # Result ------------------------------------------------------------------
+
+    def _finish(self, emitted: List[Any]):
+        model = self.project_model
+        if self.section == "summary":
+            raw = "".join(self._raw)
+            match = _SUMMARY_RE.search(raw)
+            if match:
+                model.summary = match.group(1).strip()
+                first_sentence = _FIRST_SENTENCE_RE.match(model.summary)
+                model.title = first_sentence.group(1).strip() if first_sentence else DEFAULT_TITLE
+            else:
+                model.summary = raw
+                model.title = DEFAULT_TITLE
+            emitted.append(model.summary)
+        elif self.section == "features":
+            model.features = self._items
+        elif self.section == "roles":
+            model.roles = self._items
+        elif self.section == "goals":
+            self._emit_goal(emitted)
+            model.goals = self._items
+        elif self.section == "timeline" and self._timeline_started:
+            self._emit_week(emitted)
+            model.timeline = self._items
+
+
+def parse_backlog(raw_text: str) -> BacklogModel:
+    parser = BacklogParser()
+    parser.feed(raw_text)
+    parser.close()
+    return parser.backlog
+
+
+def parse_section(section: str, raw_text: str, project_model: Optional[ProjectModel] = None) -> ProjectModel:
+    parser = SectionParser(section, project_model)
+    parser.feed(raw_text)
+    parser.close()
+    return parser.project_model
@@ -0,0 +1,479 @@
+"""
+In-process inference telemetry for the LLM pipelines.
+
+Every ``generate_section`` call records prompt/generated token counts, time to
+first token, decode throughput, retries, validation failures and cache hits.
+Values are aggregated into fixed-bucket histograms per (pipeline, section) so
+the ``llm-metrics`` endpoint can report where a slow generation spends its time.
+Calls made inside ``model_scope(name)`` are also aggregated per model, which
+is what the per-section model A/B comparisons read.
+"""
+import bisect
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+try:
+    from transformers.generation.streamers import BaseStreamer
+except Exception:  # transformers not installed (e.g. fake-model benchmarks)
+    BaseStreamer = object
+
+from llms import token_budget
+
+logger = logging.getLogger('llms')
+
+# Histogram bucket upper bounds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 384, 512, 768, 1024, 2048, 4096)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 200)
+
+
+class Histogram:
+    """Fixed-bucket histogram with count/sum/min/max and bucket-based percentiles."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value: float):
+        if value is None:
+            return
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-th percentile (clamped to max)."""
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= target:
+                bound = self.buckets[i] if i < len(self.buckets) else self.max
+                return round(min(bound, self.max), 4)
+        return round(self.max, 4)
+
+    def snapshot(self) -> Dict:
+        buckets = {f"le_{b}": c for b, c in zip(self.buckets, self.counts)}
+        buckets["le_inf"] = self.counts[-1]
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 4),
+            'mean': round(self.sum / self.count, 4) if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+            'buckets': buckets,
+        }
+
+
+class SectionMetrics:
+    """Counters and histograms for one (pipeline, section) pair."""
+
+    def __init__(self):
+        self.calls = 0
+        self.successes = 0
+        self.first_try_successes = 0
+        self.failures = 0
+        self.attempts = 0
+        self.retries = 0
+        self.validation_failures = 0
+        self.empty_responses = 0
+        self.errors = 0
+        self.cancelled = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.prompt_tokens = Histogram(TOKEN_BUCKETS)
+        self.generated_tokens = Histogram(TOKEN_BUCKETS)
+        self.queue_wait_seconds = Histogram(LATENCY_BUCKETS)
+        self.ttft_seconds = Histogram(LATENCY_BUCKETS)
+        self.decode_tokens_per_second = Histogram(RATE_BUCKETS)
+        self.attempt_seconds = Histogram(LATENCY_BUCKETS)
+        self.call_seconds = Histogram(LATENCY_BUCKETS)
+
+    def snapshot(self) -> Dict:
+        return {
+            'calls': self.calls,
+            'successes': self.successes,
+            'first_try_successes': self.first_try_successes,
+            'failures': self.failures,
+            'attempts': self.attempts,
+            'retries': self.retries,
+            'validation_failures': self.validation_failures,
+            'empty_responses': self.empty_responses,
+            'errors': self.errors,
+            'cancelled': self.cancelled,
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'prompt_tokens': self.prompt_tokens.snapshot(),
+            'generated_tokens': self.generated_tokens.snapshot(),
+            'queue_wait_seconds': self.queue_wait_seconds.snapshot(),
+            'ttft_seconds': self.ttft_seconds.snapshot(),
+            'decode_tokens_per_second': self.decode_tokens_per_second.snapshot(),
+            'attempt_seconds': self.attempt_seconds.snapshot(),
+            'call_seconds': self.call_seconds.snapshot(),
+        }
+
+
+class MetricsRegistry:
+    """Thread-safe registry of per-section metrics and named cache counters."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sections: Dict[Tuple[str, str], SectionMetrics] = {}
+        self._models: Dict[Tuple[str, str, str], SectionMetrics] = {}
+        self._caches: Dict[str, Dict[str, int]] = {}
+        self._started_at = time.time()
+
+    def _section(self, pipeline: str, section: str) -> SectionMetrics:
+        key = (pipeline, section)
+        metrics = self._sections.get(key)
+        if metrics is None:
+            metrics = self._sections[key] = SectionMetrics()
+        return metrics
+
+    def _targets(self, pipeline: str, section: str, model: Optional[str]) -> List[SectionMetrics]:
+        """The section's metrics, plus its per-model metrics when the model is known."""
+        targets = [self._section(pipeline, section)]
+        if model:
+            key = (model, pipeline, section)
+            if key not in self._models:
+                self._models[key] = SectionMetrics()
+            targets.append(self._models[key])
+        return targets
+
+    def record_attempt(self, pipeline: str, section: str, stats: 'CompletionStats', outcome: str,
+                       model: Optional[str] = None):
+        """Record a single model completion. ``outcome`` is ok/invalid/empty/error."""
+        with self._lock:
+            for m in self._targets(pipeline, section, model):
+                self._observe_attempt(m, stats, outcome)
+
+    @staticmethod
+    def _observe_attempt(m: SectionMetrics, stats: 'CompletionStats', outcome: str):
+        m.attempts += 1
+        m.prompt_tokens.observe(stats.prompt_tokens)
+        m.generated_tokens.observe(stats.generated_tokens)
+        m.ttft_seconds.observe(stats.ttft)
+        m.decode_tokens_per_second.observe(stats.decode_tokens_per_second)
+        m.attempt_seconds.observe(stats.duration)
+        if outcome == 'invalid':
+            m.validation_failures += 1
+        elif outcome == 'empty':
+            m.empty_responses += 1
+        elif outcome == 'error':
+            m.errors += 1
+
+    def record_call(self, pipeline: str, section: str, attempts: int, success: bool, duration: float,
+                    cancelled: bool = False, model: Optional[str] = None):
+        """Record the end of a ``generate_section`` call (all attempts included)."""
+        with self._lock:
+            for m in self._targets(pipeline, section, model):
+                m.calls += 1
+                m.retries += max(0, attempts - 1)
+                m.call_seconds.observe(duration)
+                if cancelled:
+                    m.cancelled += 1
+                elif success:
+                    m.successes += 1
+                    if attempts == 1:
+                        m.first_try_successes += 1
+                else:
+                    m.failures += 1
+
+    def record_queue_wait(self, pipeline: str, section: str, seconds: float):
+        with self._lock:
+            self._section(pipeline, section).queue_wait_seconds.observe(seconds)
+
+    def record_cache(self, cache: str, hit: bool, pipeline: str = None, section: str = None):
+        """Count a hit/miss on a named cache, optionally attributed to a section."""
+        with self._lock:
+            counters = self._caches.setdefault(cache, {'hits': 0, 'misses': 0})
+            counters['hits' if hit else 'misses'] += 1
+            if pipeline and section:
+                m = self._section(pipeline, section)
+                if hit:
+                    m.cache_hits += 1
+                else:
+                    m.cache_misses += 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            pipelines: Dict[str, Dict] = {}
+            for (pipeline, section), metrics in sorted(self._sections.items()):
+                pipelines.setdefault(pipeline, {})[section] = metrics.snapshot()
+            models: Dict[str, Dict] = {}
+            for (model, pipeline, section), metrics in sorted(self._models.items()):
+                models.setdefault(model, {}).setdefault(pipeline, {})[section] = metrics.snapshot()
+            return {
+                'since': self._started_at,
+                'uptime_seconds': round(time.time() - self._started_at, 1),
+                'pipelines': pipelines,
+                'models': models,
+                'caches': {name: dict(c) for name, c in self._caches.items()},
+            }
+
+    def reset(self):
+        with self._lock:
+            self._sections.clear()
+            self._models.clear()
+            self._caches.clear()
+            self._started_at = time.time()
+
+
+# Global registry instance
+registry = MetricsRegistry()
+
+# Name of the model serving the current generation, set by model_scope()
+_current_model: contextvars.ContextVar = contextvars.ContextVar('llm_model', default=None)
+
+
+@contextmanager
+def model_scope(model: Optional[str]):
+    """Attribute the section calls made inside the block to ``model``."""
+    token = _current_model.set(model)
+    try:
+        yield
+    finally:
+        _current_model.reset(token)
+
+
+def current_model() -> Optional[str]:
+    return _current_model.get()
+
+
+class CompletionStats:
+    """Timing and token counts for one model completion."""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.first_token_at = None
+        self.finished_at = None
+        self.prompt_tokens = None
+        self.generated_tokens = None
+
+    @property
+    def duration(self) -> Optional[float]:
+        if self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
+
+    @property
+    def ttft(self) -> Optional[float]:
+        if self.first_token_at is None:
+            return None
+        return self.first_token_at - self.started_at
+
+    @property
+    def decode_tokens_per_second(self) -> Optional[float]:
+        # The first token is attributed to prefill, so decode covers the rest
+        if self.first_token_at is None or self.finished_at is None or not self.generated_tokens:
+            return None
+        elapsed = self.finished_at - self.first_token_at
+        if elapsed <= 0 or self.generated_tokens < 2:
+            return None
+        return (self.generated_tokens - 1) / elapsed
+
+
+class TimingStreamer(BaseStreamer):
+    """
+    Minimal ``generate`` streamer that timestamps the first generated token.
+    ``generate`` pushes the prompt ids first, then one tensor per decode step.
+    With ``on_text`` and a ``tokenizer``, the generated text is also decoded
+    as it arrives and passed on a line (or a word) at a time.
+    """
+
+    def __init__(self, stats: CompletionStats, on_text: Optional[Callable[[str], None]] = None, tokenizer=None):
+        self.stats = stats
+        self._prompt_seen = False
+        self.generated = 0
+        self.on_text = on_text if tokenizer is not None else None
+        self.tokenizer = tokenizer
+        self.streamed = False
+        self._ids: List[int] = []
+        self._sent = 0
+
+    def put(self, value):
+        if not self._prompt_seen:
+            self._prompt_seen = True
+            shape = getattr(value, 'shape', None)
+            self.stats.prompt_tokens = int(shape[-1]) if shape is not None else len(value)
+            return
+        if self.stats.first_token_at is None:
+            self.stats.first_token_at = time.perf_counter()
+        self.generated += int(value.numel()) if hasattr(value, 'numel') else len(value)
+        if self.on_text is not None:
+            self._ids += value.reshape(-1).tolist() if hasattr(value, 'reshape') else list(value)
+            self._emit(final=False)
+
+    def end(self):
+        if self.generated:
+            self.stats.generated_tokens = self.generated
+        if self.on_text is not None:
+            self._emit(final=True)
+
+    def _emit(self, final: bool):
+        # Decode the pending ids together: single tokens can be partial characters
+        text = self.tokenizer.decode(self._ids, skip_special_tokens=True)
+        if final or text.endswith("\n"):
+            chunk = text[self._sent:]
+            self._ids, self._sent = [], 0
+        else:
+            chunk = text[self._sent:text.rfind(" ") + 1]
+            self._sent += len(chunk)
+        if chunk:
+            self.streamed = True
+            self.on_text(chunk)
+
+
+def count_tokens(llm, text: str) -> int:
+    """Count tokens with the model tokenizer when available, else approximate."""
+    if not text:
+        return 0
+    tokenizer = getattr(getattr(llm, 'pipeline', None), 'tokenizer', None)
+    if tokenizer is not None:
+        try:
+            return len(tokenizer.encode(text, add_special_tokens=False))
+        except Exception:
+            pass
+    # ~1.3 tokens per whitespace-separated word for Llama/Mistral style vocabularies
+    return int(len(text.split()) * 1.3) + 1
+
+
+def timed_completion(llm, prompt: str, max_tokens: int,
+                     on_text: Optional[Callable[[str], None]] = None) -> Tuple[Optional[str], CompletionStats]:
+    """
+    Run one completion, preferring a direct pipeline call with a per-call
+    ``max_new_tokens`` override and falling back to ``llm.invoke``.
+    ``on_text`` receives the generated text: in pieces while it is decoded
+    when the pipeline has a tokenizer, else all at once at the end. If the
+    pipeline fails after streaming, the fallback's text is not passed on.
+    Returns the raw text and the timing stats for the attempt.
+    """
+    stats = CompletionStats()
+    text = None
+    streamer = TimingStreamer(stats)
+    if hasattr(llm, "pipeline"):
+        streamer = TimingStreamer(stats, on_text, getattr(llm.pipeline, "tokenizer", None))
+        kwargs = {'max_new_tokens': max_tokens, 'streamer': streamer}
+        try:
+            out = llm.pipeline(prompt, **kwargs)
+            if isinstance(out, list) and out and isinstance(out[0], dict) and "generated_text" in out[0]:
+                text = out[0]["generated_text"]
+            elif isinstance(out, str):
+                text = out
+        except Exception:
+            # Fall back to invoke if pipeline call fails
+            pass
+
+    if not text:
+        # Fallback to the wrapper invoke (no streaming, so no TTFT)
+        stats.first_token_at = None
+        stats.generated_tokens = None
+        text = llm.invoke(prompt)
+        if streamer.streamed:
+            # The sink already holds part of a failed generation; it must not get a second copy
+            on_text = None
+
+    stats.finished_at = time.perf_counter()
+    if stats.prompt_tokens is None:
+        stats.prompt_tokens = count_tokens(llm, prompt)
+    if stats.generated_tokens is None:
+        stats.generated_tokens = count_tokens(llm, text or "")
+    if on_text is not None and text and not streamer.streamed:
+        on_text(text)
+    return text, stats
+
+
+def timed_batch_completion(llm, prompts: Sequence[str], max_tokens: int) -> Optional[List[Tuple[Optional[str], CompletionStats]]]:
+    """
+    Run several prompts through one batched pipeline call. Every result shares
+    the batch wall time (no TTFT without a streamer). Returns None when the
+    model cannot batch, so callers fall back to one ``timed_completion`` each.
+    """
+    if len(prompts) == 1:
+        return [timed_completion(llm, prompts[0], max_tokens)]
+    if not hasattr(llm, "pipeline"):
+        return None
+
+    started = time.perf_counter()
+    try:
+        out = llm.pipeline(list(prompts), max_new_tokens=max_tokens, batch_size=len(prompts))
+    except Exception as e:
+        logger.warning(f"[LLM Telemetry] Batched completion failed, falling back to single calls: {e}")
+        return None
+    finished = time.perf_counter()
+    if not isinstance(out, list) or len(out) != len(prompts):
+        return None
+
+    results = []
+    for prompt, item in zip(prompts, out):
+        # HF pipelines return one list of candidates per prompt
+        candidate = item[0] if isinstance(item, list) and item else item
+        text = candidate.get("generated_text") if isinstance(candidate, dict) else None
+        stats = CompletionStats()
+        stats.started_at = started
+        stats.finished_at = finished
+        stats.prompt_tokens = count_tokens(llm, prompt)
+        stats.generated_tokens = count_tokens(llm, text or "")
+        results.append((text, stats))
+    return results
+
+
+class SectionCall:
+    """Tracks the attempts of one ``generate_section`` call."""
+
+    def __init__(self, pipeline: str, section: str, max_tokens: Optional[int] = None):
+        self.pipeline = pipeline
+        self.section = section
+        self.model = current_model()
+        self.max_tokens = max_tokens
+        self.attempts = 0
+        self._started_at = time.perf_counter()
+        self._finished = False
+
+    def attempt(self, stats: CompletionStats, outcome: str):
+        self.attempts += 1
+        registry.record_attempt(self.pipeline, self.section, stats, outcome, self.model)
+        token_budget.budgets.record(
+            self.pipeline, self.section, self.model, stats.generated_tokens, self.max_tokens, outcome,
+        )
+        logger.debug(
+            f"[LLM Telemetry] {self.pipeline}/{self.section} attempt {self.attempts}: {outcome}, "
+            f"prompt={stats.prompt_tokens} gen={stats.generated_tokens} "
+            f"ttft={stats.ttft} dur={stats.duration}"
+        )
+
+    def error(self):
+        self.attempts += 1
+        registry.record_attempt(self.pipeline, self.section, CompletionStats(), 'error', self.model)
+
+    def finish(self, success: bool, cancelled: bool = False):
+        if self._finished:
+            return
+        self._finished = True
+        registry.record_call(
+            self.pipeline, self.section, self.attempts, success,
+            time.perf_counter() - self._started_at, cancelled=cancelled, model=self.model,
+        )
+
+
+def get_metrics() -> Dict:
+    return registry.snapshot()
+
+
+def reset_metrics():
+    registry.reset()
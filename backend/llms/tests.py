@@ -0,0 +1,722 @@
+import random
+from unittest.mock import patch
+
+from django.test import SimpleTestCase
+
+from llms import telemetry, token_budget
+from llms.fake_llm import FakeLLM, RecordingLLM, detect_section, synthetic_proposal, synthetic_recordings
+from llms.llm_cache import get_cached_llm, override_llm
+from llms.project_llm import generate_section as generate_project_section, run_pipeline_from_text
+from llms.backlog_llm import generate_section as generate_backlog_section, run_backlog_pipeline, build_prompt, target_epic_count
+from llms.backlog_llm import salvage_backlog_prefix, parse_backlog
+from llms.fake_llm import synthetic_backlog
+from llms import incremental
+from llms.project_llm import run_incremental_pipeline, run_pipeline_batch
+from llms.backlog_llm import run_backlog_batch
+from llms.model_registry import ModelRegistry, ModelSpec, models
+from llms import adapters
+from llms.adapters import AdapterManager, AdapterSpec
+from llms.project_llm import build_prompt as build_project_prompt
+from llms.fine_tune.packing import pack_examples, padding_stats
+from llms.few_shot_index import FewShotExample, FewShotIndex, get_index
+from llms.project_llm import build_section_prompt, parse_project_outputs
+from llms.stream_parser import BacklogParser, SectionParser
+from llms.models import EpicModel, TaskModel, TimelineWeekModel
+
+
+class _ScriptedLLM:
+    """Returns canned completions in order through the ``invoke`` fallback."""
+
+    def __init__(self, outputs):
+        self.outputs = list(outputs)
+
+    def invoke(self, prompt):
+        return self.outputs.pop(0)
+
+
+class TelemetryTests(SimpleTestCase):
+    def setUp(self):
+        telemetry.reset_metrics()
+
+    def test_histogram_buckets_and_percentiles(self):
+        hist = telemetry.Histogram((1, 2, 5))
+        for value in (0.5, 1.5, 1.8, 4, 9):
+            hist.observe(value)
+        snap = hist.snapshot()
+        self.assertEqual(snap['count'], 5)
+        self.assertEqual(snap['buckets'], {'le_1': 1, 'le_2': 2, 'le_5': 1, 'le_inf': 1})
+        self.assertEqual(snap['p50'], 2)
+        self.assertEqual(snap['p99'], 9)
+
+    def test_generate_section_records_retries_and_validation_failures(self):
+        llm = _ScriptedLLM(["no prefix here", "", "summary: A planning tool."])
+        result = generate_project_section(llm, "summary", "prompt text", max_retries=3)
+        self.assertEqual(result, "summary: A planning tool.")
+
+        section = telemetry.get_metrics()['pipelines']['project']['summary']
+        self.assertEqual(section['calls'], 1)
+        self.assertEqual(section['successes'], 1)
+        self.assertEqual(section['attempts'], 3)
+        self.assertEqual(section['retries'], 2)
+        self.assertEqual(section['validation_failures'], 1)
+        self.assertEqual(section['empty_responses'], 1)
+        self.assertEqual(section['prompt_tokens']['count'], 3)
+        self.assertEqual(section['first_try_successes'], 0)
+
+        generate_project_section(_ScriptedLLM(["summary: Valid at once."]), "summary", "prompt text")
+        section = telemetry.get_metrics()['pipelines']['project']['summary']
+        self.assertEqual(section['first_try_successes'], 1)
+
+    def test_failed_backlog_call_is_counted(self):
+        llm = _ScriptedLLM(["Epic 1: Only one"] * 2)
+        self.assertEqual(generate_backlog_section(llm, "backlog", "prompt", max_retries=2), "")
+
+        section = telemetry.get_metrics()['pipelines']['backlog']['backlog']
+        self.assertEqual(section['failures'], 1)
+        self.assertEqual(section['validation_failures'], 2)
+
+    def test_validation_warning_names_the_validator(self):
+        from llms.backlog_llm import validate_epic_expansion
+        with self.assertLogs('llms', 'WARNING') as logs:
+            generate_backlog_section(_ScriptedLLM(["Epic 1: Only one"]), "backlog_epic", "prompt",
+                                     max_retries=1, validator=validate_epic_expansion)
+        self.assertIn("(validate_epic_expansion) failed for backlog_epic", logs.output[0])
+        self.assertNotIn(">=4", "\n".join(logs.output))
+
+
+    def test_streamer_passes_decoded_text_on(self):
+        class CharTokenizer:
+            def decode(self, ids, skip_special_tokens=True):
+                return "".join(map(chr, ids))
+
+        chunks = []
+        streamer = telemetry.TimingStreamer(telemetry.CompletionStats(), chunks.append, CharTokenizer())
+        streamer.put([0, 0, 0])  # the prompt
+        text = "Epic 1: Crew\n-Task 1"
+        for char in text:
+            streamer.put([ord(char)])
+        streamer.end()
+        self.assertEqual(chunks, ["Epic ", "1: ", "Crew\n", "-Task ", "1"])
+        self.assertEqual(streamer.stats.generated_tokens, len(text))
+
+    def test_fallback_after_streaming_does_not_repeat_text(self):
+        class CharTokenizer:
+            def decode(self, ids, skip_special_tokens=True):
+                return "".join(map(chr, ids))
+
+        class FailingPipeline:
+            tokenizer = CharTokenizer()
+
+            def __call__(self, prompt, streamer=None, **kwargs):
+                streamer.put([0])
+                for char in "Epic 1: Crew\n":
+                    streamer.put([ord(char)])
+                raise RuntimeError("CUDA error")
+
+        class StreamThenInvoke:
+            pipeline = FailingPipeline()
+
+            def invoke(self, prompt):
+                return "Epic 1: Crew\nEpic 2: Rota\n"
+
+        chunks = []
+        text, _ = telemetry.timed_completion(StreamThenInvoke(), "prompt", 64, on_text=chunks.append)
+        self.assertEqual(text, "Epic 1: Crew\nEpic 2: Rota\n")
+        self.assertEqual("".join(chunks), "Epic 1: Crew\n")
+
+
+class TokenBudgetTests(SimpleTestCase):
+    def setUp(self):
+        token_budget.budgets.reset()
+        self.addCleanup(token_budget.budgets.reset)
+
+    def test_static_limit_until_enough_samples(self):
+        budgets = token_budget.TokenBudgets(min_samples=5)
+        for _ in range(4):
+            budgets.record("project", "summary", "qwen", 100, 256, "ok")
+        self.assertEqual(budgets.limit("project", "summary", "qwen", 256), 256)
+
+        budgets.record("project", "summary", "qwen", 100, 256, "ok")
+        # p95 of 100 plus 15% headroom, rounded up to a multiple of 16
+        self.assertEqual(budgets.limit("project", "summary", "qwen", 256), 128)
+        # Other models and sections keep their own history
+        self.assertEqual(budgets.limit("project", "summary", "phi", 256), 256)
+        self.assertEqual(budgets.limit("project", "roles", "qwen", 256), 256)
+
+    def test_budget_follows_high_percentile_and_is_clamped(self):
+        budgets = token_budget.TokenBudgets(min_samples=20)
+        for length in [40] * 19 + [200]:
+            budgets.record("backlog", "backlog", "m", length, 768, "ok")
+        self.assertEqual(budgets.limit("backlog", "backlog", "m", 768), 48)
+
+        for _ in range(20):
+            budgets.record("backlog", "backlog", "m", 1400, 1536, "ok")
+        self.assertEqual(budgets.limit("backlog", "backlog", "m", 768), 1536)
+
+    def test_budget_grows_when_answers_are_cut_off(self):
+        budgets = token_budget.TokenBudgets(min_samples=5)
+        for _ in range(10):
+            budgets.record("project", "goals", "m", 100, 128, "ok")
+        self.assertEqual(budgets.limit("project", "goals", "m", 384), 128)
+
+        # Invalid answers that used up the limit were truncated
+        budgets.record("project", "goals", "m", 128, 128, "invalid")
+        budgets.record("project", "goals", "m", 20, 128, "invalid")
+        self.assertEqual(budgets.limit("project", "goals", "m", 384), 160)
+        self.assertEqual(budgets.rows()[0]['truncations'], 1)
+
+    def test_rows_round_trip_and_report(self):
+        budgets = token_budget.TokenBudgets(min_samples=3)
+        for length in (30, 50, 70):
+            budgets.record("project", "features", "m", length, 256, "ok")
+        budgets.limit("project", "features", "m", 256)
+        rows = budgets.rows()
+        self.assertEqual([d['lengths'] for d in budgets.take_deltas()], [[30, 50, 70]])
+        self.assertEqual(budgets.take_deltas(), [])
+
+        restored = token_budget.TokenBudgets(min_samples=3)
+        restored.load(rows)
+        self.assertEqual(restored.limit("project", "features", "m", 256), budgets.limit("project", "features", "m", 256))
+        report = restored.report(rows)[0]
+        self.assertEqual((report['samples'], report['p50'], report['p95'], report['default_tokens']), (3, 50, 70, 256))
+        self.assertEqual(report['success_rate'], 1.0)
+
+    def test_sections_record_lengths_and_use_learned_limits(self):
+        generate_project_section(_ScriptedLLM(["summary: A planning tool."]), "summary", "prompt", max_tokens=256)
+        row = token_budget.budgets.rows()[0]
+        self.assertEqual((row['section'], row['attempts'], row['max_tokens']), ("summary", 1, 256))
+        self.assertEqual(len(row['lengths']), 1)
+
+        token_budget.budgets.reset()
+        for _ in range(token_budget.budgets.min_samples):
+            token_budget.budgets.record("project", "summary", "qwen-0.5b", 50, 256, "ok")
+        fake = FakeLLM(synthetic_recordings("small"))
+        with override_llm(fake):
+            run_pipeline_from_text(synthetic_proposal("small"))
+        limits = {c["section"]: c["max_new_tokens"] for c in fake.calls}
+        self.assertEqual(limits["summary"], 64)
+        self.assertEqual(limits["timeline"], 384)
+
+
+class FakeLLMTests(SimpleTestCase):
+    def test_override_is_served_by_get_cached_llm(self):
+        fake = FakeLLM({})
+        with override_llm(fake):
+            self.assertIs(get_cached_llm(), fake)
+
+    def test_detects_sections_from_prompt_templates(self):
+        for section in ("summary", "features", "roles", "goals", "timeline", "backlog"):
+            self.assertEqual(detect_section(build_prompt(section, "Some proposal")), section)
+
+    def test_project_pipeline_replays_recordings(self):
+        with override_llm(FakeLLM(synthetic_recordings("small"))):
+            project = run_pipeline_from_text(synthetic_proposal("small"))
+        self.assertTrue(project.summary.startswith("Crew Operations Platform"))
+        self.assertEqual(len(project.features), 5)
+        self.assertEqual(len(project.roles), 6)
+        self.assertEqual(len(project.goals), 8)
+        self.assertEqual([w.week_number for w in project.timeline], [1, 2, 3, 4])
+
+    def test_backlog_pipeline_replays_recordings(self):
+        with override_llm(FakeLLM(synthetic_recordings("small"))):
+            backlog = run_backlog_pipeline(synthetic_proposal("small"), {"project_title": "Crew"})
+        self.assertEqual(len(backlog.epics), 4)
+        self.assertEqual(len(backlog.epics[0].sub_epics[0].user_stories[0].tasks), 2)
+
+    def test_output_is_truncated_at_max_new_tokens(self):
+        fake = FakeLLM({"default": "word " * 100}, tokens_per_word=1.0)
+        out = fake.pipeline("anything", max_new_tokens=10)[0]["generated_text"]
+        self.assertEqual(len(out.split()), 10)
+
+    def test_synthetic_latency_reaches_telemetry(self):
+        slept = []
+        fake = FakeLLM({"summary": "summary: " + "x " * 20}, ttft_seconds=0.5, seconds_per_token=0.01, sleep=slept.append)
+        text, stats = telemetry.timed_completion(fake, build_prompt("summary", "text"), 256)
+        self.assertTrue(text.startswith("summary:"))
+        self.assertEqual(slept[0], 0.5)
+        self.assertIsNotNone(stats.ttft)
+        self.assertGreater(stats.generated_tokens, 1)
+
+    def test_recorded_outputs_round_trip(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as directory:
+            recorder = RecordingLLM(FakeLLM({"summary": ["summary: first", "summary: second"]}), directory)
+            prompt = build_prompt("summary", "text")
+            recorder.pipeline(prompt, max_new_tokens=50)
+            recorder.invoke(prompt)
+            replay = FakeLLM.from_directory(directory)
+        self.assertEqual(replay.invoke(prompt), "summary: first")
+        self.assertEqual(replay.invoke(prompt), "summary: second")
+
+
+class HierarchicalBacklogTests(SimpleTestCase):
+    def setUp(self):
+        telemetry.reset_metrics()
+
+    def test_epics_are_expanded_and_merged(self):
+        fake = FakeLLM(synthetic_recordings("huge"))
+        progress = []
+        with override_llm(fake):
+            backlog = run_backlog_pipeline(
+                synthetic_proposal("huge"), {"project_title": "Crew"},
+                progress_callback=lambda phase, done, total: progress.append((phase, done, total)),
+            )
+        self.assertEqual(len(backlog.epics), 12)
+        # Every expansion is renumbered under its own epic
+        self.assertTrue(backlog.epics[6].sub_epics[0].title.startswith("-Sub-Epic 7.1:"))
+        self.assertTrue(backlog.epics[6].sub_epics[0].user_stories[0].tasks[0].title.startswith("-Task 7.1.1.1:"))
+        self.assertEqual(progress[-1], ("expanding", 12, 12))
+        # One epic-list call plus batched expansions, no single-pass fallback
+        sections = [c["section"] for c in fake.calls]
+        self.assertEqual(sections.count("backlog_epics"), 1)
+        self.assertEqual(sections.count("backlog_epic"), 12)
+        self.assertNotIn("backlog", sections)
+
+    def test_failed_expansion_gets_placeholder_structure(self):
+        recordings = synthetic_recordings("small")
+        recordings["backlog_epic"] = "I cannot help with that."
+        with override_llm(FakeLLM(recordings)):
+            backlog = run_backlog_pipeline(synthetic_proposal("small"), {}, hierarchical=True)
+        self.assertEqual(len(backlog.epics), 4)
+        self.assertEqual(len(backlog.epics[0].sub_epics[0].user_stories[0].tasks), 2)
+        section = telemetry.get_metrics()['pipelines']['backlog']['backlog_epic']
+        self.assertEqual(section['failures'], 4)
+
+    def test_single_pass_reports_epics_as_they_stream(self):
+        progress = []
+        with override_llm(FakeLLM(synthetic_recordings("small"))):
+            run_backlog_pipeline(
+                synthetic_proposal("small"), {}, hierarchical=False,
+                progress_callback=lambda *args: progress.append(args),
+            )
+        self.assertEqual(progress[0], ("streaming", 0, 4))
+        self.assertEqual(progress[-1], ("streaming", 4, 4))
+
+    def test_epic_count_scales_with_proposal(self):
+        self.assertEqual(target_epic_count(synthetic_proposal("small")), 4)
+        self.assertGreater(target_epic_count(synthetic_proposal("huge")), target_epic_count(synthetic_proposal("medium")))
+        self.assertEqual(target_epic_count("word " * 100000), 12)
+
+
+class BacklogSalvageTests(SimpleTestCase):
+    def setUp(self):
+        telemetry.reset_metrics()
+
+    def test_truncated_trailing_epic_is_dropped(self):
+        text = synthetic_backlog(3) + "\nEpic 4: Billing Module\n -Sub-Epic 4.1: Billing Core Flow 1\n  -User Story 4.1.1: As a"
+        prefix = salvage_backlog_prefix(text)
+        self.assertEqual(sum(1 for line in prefix.splitlines() if line.startswith("Epic")), 3)
+        self.assertTrue(prefix.endswith("for story 1"))
+
+    def test_near_miss_is_continued_instead_of_regenerated(self):
+        recordings = {
+            "backlog": synthetic_backlog(3),
+            # Chatter before the first new epic is dropped
+            "backlog_continue": "Continuing the backlog:\n" + synthetic_backlog(1, start=4),
+        }
+        fake = FakeLLM(recordings)
+        with override_llm(fake):
+            backlog = run_backlog_pipeline(synthetic_proposal("small"), {"project_title": "Crew"}, hierarchical=False)
+
+        self.assertEqual(len(backlog.epics), 4)
+        self.assertTrue(backlog.epics[3].title.startswith("Epic 4: Onboarding Module"))
+        self.assertFalse(any("Generic" in e.title or "User Interface" in e.title for e in backlog.epics))
+        self.assertEqual([c["section"] for c in fake.calls], ["backlog", "backlog_continue"])
+        self.assertEqual(fake.calls[1]["max_new_tokens"], 96)
+
+        metrics = telemetry.get_metrics()['pipelines']['backlog']
+        self.assertEqual(metrics['backlog']['successes'], 1)
+        self.assertEqual(metrics['backlog']['attempts'], 1)
+        self.assertEqual(metrics['backlog_continue']['successes'], 1)
+
+    def test_failed_continuation_falls_back_to_regeneration(self):
+        recordings = {
+            "backlog": [synthetic_backlog(3), synthetic_backlog(4)],
+            "backlog_continue": "Sorry, I cannot continue.",
+        }
+        fake = FakeLLM(recordings)
+        with override_llm(fake):
+            backlog = run_backlog_pipeline(synthetic_proposal("small"), {}, hierarchical=False)
+        self.assertEqual(len(backlog.epics), 4)
+        self.assertEqual([c["section"] for c in fake.calls], ["backlog", "backlog_continue", "backlog"])
+
+
+PROPOSAL_PAGES = [
+    "Crew Operations Platform. Overview and purpose of the project.",
+    "Key feature list: the system will track crew rosters and certifications.",
+    "The team includes a backend developer, a designer and a QA engineer.",
+    "Goals and objectives: reduce paperwork and measure success by adoption.",
+    "Delivery plan: week 1 setup, week 2 build, week 3 test, week 4 launch.",
+]
+
+
+class IncrementalIngestionTests(SimpleTestCase):
+    def test_relevant_pages_follow_section_keywords(self):
+        self.assertEqual(incremental.relevant_pages("timeline", PROPOSAL_PAGES), [0, 4])
+        self.assertEqual(incremental.relevant_pages("roles", PROPOSAL_PAGES), [0, 2])
+        # Short proposals are used whole
+        self.assertEqual(incremental.relevant_pages("timeline", PROPOSAL_PAGES[:3]), [0, 1, 2])
+
+    def test_changed_pages_ignores_whitespace(self):
+        old = incremental.page_hashes(PROPOSAL_PAGES)
+        revised = list(PROPOSAL_PAGES)
+        revised[1] = revised[1].replace(" ", "  ")
+        revised[4] = revised[4].replace("week 4 launch", "week 4 launch and handover")
+        self.assertEqual(incremental.changed_pages(old, incremental.page_hashes(revised)), [4])
+        self.assertEqual(incremental.changed_pages(old, incremental.page_hashes(revised + ["Appendix"])), [4, 5])
+
+    def test_only_sections_reading_changed_pages_are_regenerated(self):
+        fake = FakeLLM(synthetic_recordings("small"))
+        with override_llm(fake):
+            first, outputs, report = run_incremental_pipeline(PROPOSAL_PAGES)
+            self.assertEqual(len(report["regenerated_sections"]), 5)
+
+            revised = list(PROPOSAL_PAGES)
+            revised[4] = revised[4].replace("week 4 launch", "week 4 launch and handover")
+            calls = len(fake.calls)
+            second, _, report = run_incremental_pipeline(revised, cached_outputs=outputs)
+
+        self.assertEqual(report["regenerated_sections"], ["timeline"])
+        self.assertEqual(report["reused_sections"], ["summary", "features", "roles", "goals"])
+        self.assertEqual([c["section"] for c in fake.calls[calls:]], ["timeline"])
+        self.assertEqual(second.summary, first.summary)
+        self.assertEqual(len(second.goals), len(first.goals))
+
+
+class BatchIngestionTests(SimpleTestCase):
+    def test_project_sections_are_batched_across_proposals(self):
+        delays = []
+        fake = FakeLLM(synthetic_recordings("small"), ttft_seconds=1.0, sleep=delays.append)
+        with override_llm(fake):
+            results = run_pipeline_batch([PROPOSAL_PAGES, PROPOSAL_PAGES[:3], []], batch_size=4)
+            single, outputs, _ = run_incremental_pipeline(PROPOSAL_PAGES)
+
+        # One batched forward pass per section for the two non-empty proposals
+        self.assertEqual(len(delays), 5 + 5)
+        self.assertEqual(len(results), 3)
+        project_model, section_outputs = results[0]
+        self.assertEqual(project_model.summary, single.summary)
+        self.assertEqual(section_outputs["timeline"]["input_hash"], outputs["timeline"]["input_hash"])
+        self.assertEqual(results[2][1], {})
+
+    def test_backlogs_are_batched_and_keep_input_order(self):
+        delays = []
+        fake = FakeLLM(synthetic_recordings("small"), ttft_seconds=1.0, sleep=delays.append)
+        progress = []
+        items = [(synthetic_proposal("small"), {"project_title": "A"}), ("", {}), (synthetic_proposal("small"), {"project_title": "B"})]
+        with override_llm(fake):
+            backlogs = run_backlog_batch(items, batch_size=4, progress_callback=lambda *args: progress.append(args))
+
+        self.assertEqual(len(delays), 1)
+        self.assertEqual([c["section"] for c in fake.calls], ["backlog", "backlog"])
+        self.assertTrue(backlogs[0].epics)
+        self.assertEqual(backlogs[1].epics, [])
+        self.assertEqual(len(backlogs[2].epics), len(backlogs[0].epics))
+        self.assertEqual(progress[-1], ("backlog", 2, 3))
+
+
+class ModelRegistryTests(SimpleTestCase):
+    SPECS = {
+        "large": ModelSpec("large", "org/large", 5000),
+        "small": ModelSpec("small", "org/small", 1000),
+        "tiny": ModelSpec("tiny", "org/tiny", 500),
+    }
+
+    def registry(self, routes, budget=8000):
+        loaded = []
+
+        def loader(spec):
+            loaded.append(spec.name)
+            return FakeLLM(synthetic_recordings("small"))
+        return ModelRegistry(self.SPECS, routes, budget, loader=loader, default_model="large"), loaded
+
+    def test_sections_route_to_their_model(self):
+        registry, _ = self.registry({"summary": "small", "goals": "large", "roles": "unknown"})
+        self.assertEqual(registry.route("summary"), "small")
+        self.assertEqual(registry.route("goals"), "large")
+        self.assertEqual(registry.route("roles"), "large")
+        self.assertEqual(registry.route("backlog"), "large")
+
+    def test_weighted_split_is_sticky_per_key(self):
+        registry, _ = self.registry({"summary": {"small": 50, "tiny": 50}})
+        arms = [registry.route("summary", f"proposal-{i}") for i in range(200)]
+        self.assertEqual(arms, [registry.route("summary", f"proposal-{i}") for i in range(200)])
+        self.assertGreater(arms.count("small"), 60)
+        self.assertGreater(arms.count("tiny"), 60)
+
+    def test_section_models_count_as_activity(self):
+        from llms import llm_cache
+        registry, _ = self.registry({"summary": "small"})
+        with patch.object(llm_cache, '_last_activity_time', None):
+            registry.get_for_section("summary")
+            self.assertIsNotNone(llm_cache._last_activity_time)
+
+    def test_models_load_lazily_and_evict_least_recently_used(self):
+        registry, loaded = self.registry({}, budget=6200)
+        self.assertEqual(loaded, [])
+        registry.get("large")
+        registry.get("small")
+        self.assertEqual(loaded, ["large", "small"])
+        registry.get("small")
+        self.assertEqual(loaded, ["large", "small"])
+
+        # 5000 + 1000 + 500 exceeds the budget: "large" was used least recently
+        registry.get("tiny")
+        self.assertEqual(registry.snapshot()['loaded'], ["small", "tiny"])
+        self.assertEqual(registry.evictions, 1)
+
+    def test_telemetry_is_tagged_with_the_serving_model(self):
+        telemetry.reset_metrics()
+        with override_llm(FakeLLM(synthetic_recordings("small"))):
+            run_incremental_pipeline(PROPOSAL_PAGES)
+
+        metrics = telemetry.get_metrics()['models']
+        self.assertIn("summary", metrics[models.route("summary")]["project"])
+        self.assertIn("timeline", metrics[models.route("timeline")]["project"])
+        self.assertEqual(
+            sum(m['calls'] for sections in metrics.values() for m in sections['project'].values()), 5,
+        )
+
+
+class _FakeAdapterHost:
+    """Records adapter operations instead of calling peft."""
+
+    def __init__(self, llm):
+        self.log = []
+        self.active = None
+
+    def load(self, spec):
+        self.log.append(("load", spec.name))
+
+    def delete(self, name):
+        self.log.append(("delete", name))
+
+    def activate(self, name):
+        self.active = name
+
+    def generate_mixed(self, prompts, adapter_names, max_new_tokens):
+        return [f"{name}: {prompt}" for prompt, name in zip(prompts, adapter_names)]
+
+
+class AdapterTests(SimpleTestCase):
+    SPECS = {name: AdapterSpec(name, "qwen-0.5b", f"/adapters/{name}") for name in ("summary", "roles", "acme")}
+
+    def manager(self, max_adapters=2):
+        fake = FakeLLM(synthetic_recordings("small"))
+        manager = AdapterManager(fake, max_adapters, host_factory=_FakeAdapterHost, adapters=self.SPECS)
+        return manager, manager._host
+
+    def test_bound_llm_generates_with_its_adapter_active(self):
+        manager, host = self.manager()
+        seen = []
+        fake = manager.llm
+        complete, complete_batch = fake.complete, fake.complete_batch
+        fake.complete = lambda *args, **kwargs: seen.append(host.active) or complete(*args, **kwargs)
+        fake.complete_batch = lambda *args, **kwargs: seen.append(host.active) or complete_batch(*args, **kwargs)
+
+        response = generate_project_section(manager.bind("summary"), "summary", build_project_prompt("summary", "A crew app."))
+        self.assertTrue(response.lower().startswith("summary:"))
+        self.assertEqual(host.log, [("load", "summary")])
+
+        telemetry.timed_batch_completion(manager.bind(None), ["a", "b"], 16)
+        self.assertEqual(seen, ["summary", None])
+
+    def test_least_recently_used_adapter_is_evicted(self):
+        manager, host = self.manager(max_adapters=2)
+        for name in ("summary", "roles", "summary", "acme"):
+            manager.run(name, lambda: None)
+
+        self.assertEqual(manager.resident(), ["summary", "acme"])
+        self.assertEqual(host.log, [("load", "summary"), ("load", "roles"), ("delete", "roles"), ("load", "acme")])
+
+    def test_mixed_batch_uses_one_adapter_per_prompt(self):
+        manager, host = self.manager(max_adapters=2)
+        outputs = manager.generate_mixed(["p1", "p2", "p3"], ["summary", None, "acme"], 16)
+        self.assertEqual(outputs, ["summary: p1", "__base__: p2", "acme: p3"])
+        self.assertEqual(manager.resident(), ["summary", "acme"])
+
+    def test_registry_routes_bind_adapters_to_their_base_model(self):
+        registry = ModelRegistry(
+            {"qwen-0.5b": ModelSpec("qwen-0.5b", "org/qwen", 1000)},
+            {"summary": "qwen-0.5b+qwen-project-manager", "roles": "unknown+adapter"},
+            loader=lambda spec: FakeLLM(synthetic_recordings("small")), default_model="qwen-0.5b",
+        )
+        self.assertEqual(registry.route("roles"), "qwen-0.5b")
+        llm = registry.get(registry.route("summary"))
+        self.assertEqual(llm.adapter, "qwen-project-manager")
+        with self.assertRaises(ValueError):
+            adapters.bind("mistral-7b", llm, "qwen-project-manager")
+
+
+class FineTunePackingTests(SimpleTestCase):
+    def test_examples_are_packed_without_splitting(self):
+        lengths = [300, 200, 150, 100, 40]
+        input_ids = [list(range(n)) for n in lengths]
+        labels = [[-100] * 10 + ids[10:] for ids in input_ids]
+        packed = pack_examples(input_ids, labels, 512)
+
+        self.assertEqual(packed["length"], [500, 290])
+        self.assertTrue(all(length <= 512 for length in packed["length"]))
+        self.assertEqual(sum(packed["length"]), sum(lengths))
+        # Positions restart for every packed example, labels stay aligned
+        self.assertEqual(packed["position_ids"][0], list(range(300)) + list(range(200)))
+        self.assertEqual([len(row) for row in packed["labels"]], packed["length"])
+        # No all-ones mask that would let packed examples attend to each other
+        self.assertNotIn("attention_mask", packed)
+
+    def test_padding_waste_fixed_vs_dynamic(self):
+        lengths = [100, 110, 400, 420]
+        fixed = padding_stats(lengths, batch_size=2, max_length=512)
+        dynamic = padding_stats(sorted(lengths), batch_size=2)
+        self.assertEqual(fixed["padded_tokens"], 2048)
+        self.assertEqual(dynamic["padded_tokens"], 2 * 110 + 2 * 420)
+        self.assertLess(dynamic["padding_waste"], fixed["padding_waste"])
+
+
+class FewShotRetrievalTests(SimpleTestCase):
+    def test_most_similar_project_ranks_first(self):
+        index = get_index()
+        query = "Patients book appointments with doctors online and get SMS reminders before each visit."
+        for section in ("summary", "features", "roles", "goals", "timeline"):
+            best, score = index.search(section, query, k=1)[0]
+            self.assertIn("clinic", best.context)
+            self.assertGreater(score, 0)
+
+    def test_selection_respects_k_and_token_budget(self):
+        index = FewShotIndex([
+            FewShotExample("features", "warehouse stock tracking", "features:\n  - Stock Tracking"),
+            FewShotExample("features", "warehouse picking robots", "features:\n" + "  - Robot Fleet Control\n" * 30),
+            FewShotExample("features", "music streaming", "features:\n  - Playlist Sharing"),
+        ])
+        query = "warehouse robots and stock"
+        self.assertEqual(len(index.select("features", query, k=1, token_budget=1000)), 1)
+        # The long second match does not fit and is skipped for the next one
+        picked = index.select("features", query, k=2, token_budget=60)
+        self.assertEqual([e.context for e in picked], ["warehouse stock tracking", "music streaming"])
+        # Over budget, the most relevant example is still kept
+        self.assertEqual(
+            [e.context for e in index.select("features", query, k=2, token_budget=5)], ["warehouse stock tracking"]
+        )
+        self.assertEqual(index.select("goals", query), [])
+        # Sections without indexed examples get the static format example
+        self.assertTrue(index.render("goals", query).startswith("Example format:\n- title:"))
+
+    def test_budgets_fit_k_examples_for_every_section(self):
+        from llms.few_shot_index import FEW_SHOT_K
+
+        index = get_index()
+        query = "Teams plan sprints, assign tasks and track delivery on a shared board."
+        for section in ("summary", "features", "roles", "goals", "timeline"):
+            self.assertEqual(len(index.select(section, query)), FEW_SHOT_K, section)
+
+    def test_section_prompts_carry_retrieved_examples(self):
+        pages = ["Shelf lets library members reserve books and join waitlists for borrowed titles."]
+        for section in ("summary", "features", "roles", "goals", "timeline"):
+            prompt = build_section_prompt(section, pages, {})
+            self.assertIn("Examples from similar projects:", prompt)
+            self.assertIn("Project: Shelf", prompt)
+            self.assertNotIn("{few_shot_examples}", prompt)
+            self.assertEqual(detect_section(prompt), section)
+
+
+class StreamParserTests(SimpleTestCase):
+    def _chunked(self, parser, text, rng):
+        emitted = []
+        pos = 0
+        while pos < len(text):
+            size = rng.randint(1, 40)
+            emitted += parser.feed(text[pos:pos + size])
+            pos += size
+        return emitted + parser.close()
+
+    def _mangle(self, text, rng):
+        """Truncations, deletions and stray fragments, like a misbehaving model."""
+        for _ in range(rng.randint(1, 5)):
+            pos = rng.randint(0, len(text))
+            roll = rng.random()
+            if roll < 0.2:
+                text = text[:pos]
+            elif roll < 0.6:
+                fragment = rng.choice(["\n", ":", "- ", "Epic", "-Task", "-Sub-Epic 9", "\r\n", "\r", "timeline:\n",
+                                       "week_number: 2\n", "- title: x\n", "role: y\n", "summary: z.", "<|eot|>"])
+                text = text[:pos] + fragment + text[pos:]
+            else:
+                text = text[:pos] + text[pos + rng.randint(1, 30):]
+        return text
+
+    def test_backlog_objects_are_emitted_as_lines_complete(self):
+        parser = BacklogParser()
+        self.assertEqual(parser.feed("Epic 1: Scheduling *(covers: Plan"), [])
+        emitted = parser.feed(" crews)*\n -Sub-Epic 1.1: Rotations\n")
+        self.assertIsInstance(emitted[0], EpicModel)
+        self.assertEqual(emitted[0].title, "Epic 1: Scheduling *(covers: Plan crews)*")
+        self.assertEqual(emitted[0].description, "Derived from task: Plan crews")
+        parser.feed("  -User Story 1.1.1: As a planner, I want rotations\n   -Task 1.1.1.1: Build the roster")
+        self.assertEqual(len(parser.backlog.epics[0].sub_epics[0].user_stories[0].tasks), 0)
+        emitted = parser.close()
+        self.assertIsInstance(emitted[0], TaskModel)
+        self.assertEqual(parser.backlog.epics[0].sub_epics[0].user_stories[0].tasks[0].title, "-Task 1.1.1.1: Build the roster")
+        with self.assertRaises(ValueError):
+            parser.feed("more")
+
+    def test_malformed_backlog_lines_are_skipped(self):
+        text = (
+            "-Task 0: orphan before any epic\n"
+            "Epic without a colon\n"
+            "Epic 1: Billing\n"
+            "  -User Story 1.0.1: story without a sub-epic\n"
+            " -Sub-Epic 1.1: Invoices\n"
+            "   -Task 1.1.0.1: task without a story\n"
+            "  -User Story 1.1.1: As a manager, I want invoices\n"
+            "   -Task 1.1.1.1: Render invoices\n"
+            "Epic 2: Reports\n"
+            "   -Task 2.0.0.1: task of a new epic without a story\n"
+        )
+        backlog = parse_backlog(text)
+        self.assertEqual([e.title for e in backlog.epics], ["Epic 1: Billing", "Epic 2: Reports"])
+        stories = backlog.epics[0].sub_epics[0].user_stories
+        self.assertEqual([s.title for s in stories], ["-User Story 1.1.1: As a manager, I want invoices"])
+        self.assertEqual(len(stories[0].tasks), 1)
+        self.assertEqual(backlog.epics[1].sub_epics, [])
+
+    def test_timeline_weeks_stream_out_before_close(self):
+        parser = SectionParser("timeline")
+        emitted = parser.feed("timeline:\n  - week_number: 1\n    tasks:\n      - Plan\n  - week_number: 2\n")
+        self.assertEqual([w.week_number for w in emitted], [1])
+        self.assertIsInstance(emitted[0], TimelineWeekModel)
+        emitted = parser.feed("    tasks:\n      - Build")
+        self.assertEqual(emitted, [])
+        parser.close()
+        self.assertEqual([[g.title for g in w.goals] for w in parser.project_model.timeline], [["Plan"], ["Build"]])
+
+    def test_fuzzed_output_parses_the_same_in_any_chunking(self):
+        rng = random.Random(20240)
+        recordings = synthetic_recordings("small")
+        for _ in range(300):
+            section = rng.choice(["summary", "features", "roles", "goals", "timeline", "backlog"])
+            text = self._mangle(recordings[section], rng)
+            if section == "backlog":
+                whole = parse_backlog(text)
+                parser = BacklogParser()
+                self._chunked(parser, text, rng)
+                self.assertEqual(parser.backlog, whole)
+            else:
+                whole = parse_project_outputs({section: text})
+                parser = SectionParser(section)
+                self._chunked(parser, text, rng)
+                self.assertEqual(parser.project_model, whole)
+
+    def test_token_by_token_parsing_stays_linear(self):
+        text = synthetic_backlog(12, 3, 3, 4)
+        parser = BacklogParser()
+        parsed_lines = []
+        line = parser._line
+        parser._line = lambda text, emitted: (parsed_lines.append(text), line(text, emitted))
+        for char in text:
+            parser.feed(char)
+        parser.close()
+        self.assertEqual(parser.backlog, parse_backlog(text))
+        self.assertEqual(sum(len(us.tasks) for e in parser.backlog.epics for se in e.sub_epics for us in se.user_stories),
+                         12 * 3 * 3 * 4)
+        # ~37k one-character chunks, yet every line is classified exactly once
+        self.assertEqual(parsed_lines, text.splitlines())
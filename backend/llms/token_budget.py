@@ -0,0 +1,226 @@
+"""
+Per-section generation budgets learned from observed output lengths.
+
+The static limits (``SECTION_TOKEN_LIMITS``, the backlog's 768 tokens) are
+guesses: too small truncates answers and costs a retry, too large lets the
+model pad. Every attempt is recorded here per (pipeline, section, model), and
+once a section has ``LLM_TOKEN_BUDGET_MIN_SAMPLES`` successful answers its
+``max_new_tokens`` becomes a high percentile of their lengths plus headroom.
+When recent attempts keep hitting the limit the budget grows instead.
+
+The history is persisted in ``SectionTokenStats`` (see
+``apps.ai_api.persistence``) and reported by ``manage.py token_budget_report``.
+"""
+import math
+import threading
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+
+ENABLED = getattr(settings, 'LLM_ADAPTIVE_TOKENS', True)
+PERCENTILE = getattr(settings, 'LLM_TOKEN_BUDGET_PERCENTILE', 0.95)
+HEADROOM = getattr(settings, 'LLM_TOKEN_BUDGET_HEADROOM', 1.15)
+MIN_SAMPLES = getattr(settings, 'LLM_TOKEN_BUDGET_MIN_SAMPLES', 20)
+WINDOW = getattr(settings, 'LLM_TOKEN_BUDGET_WINDOW', 200)
+
+MIN_TOKENS = 32
+MAX_FACTOR = 2        # never more than twice the static default
+ROUND_TO = 16
+TRUNCATED_AT = 0.9    # an invalid answer this close to the limit was cut off
+TRUNCATION_RATE = 0.05
+GROWTH = 1.25
+
+Key = Tuple[str, str, str]
+
+
+def percentile(values: List[int], q: float) -> Optional[int]:
+    """Nearest-rank percentile of ``values``."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+
+class SectionHistory:
+    """Recent outcomes of one (pipeline, section, model)."""
+
+    def __init__(self, window: int = WINDOW):
+        self.lengths = deque(maxlen=window)    # generated tokens of valid answers
+        self.truncated = deque(maxlen=window)  # per attempt: was it cut off at the limit
+        self.attempts = 0
+        self.successes = 0
+        self.truncations = 0
+        self.max_tokens = 0      # limit used by the latest attempt
+        self.default_tokens = 0  # static limit the budget replaces
+        self.dirty = False
+        # Recorded since the last save, merged into the stored row by the next one
+        self.new_lengths: List[int] = []
+        self.new_truncated: List[bool] = []
+        self.new_attempts = 0
+        self.new_successes = 0
+        self.new_truncations = 0
+
+
+class TokenBudgets:
+    def __init__(self, enabled: bool = ENABLED, percentile: float = PERCENTILE, headroom: float = HEADROOM,
+                 min_samples: int = MIN_SAMPLES, window: int = WINDOW):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.headroom = headroom
+        self.min_samples = min_samples
+        self.window = window
+        self._histories: Dict[Key, SectionHistory] = {}
+        self._lock = threading.Lock()
+
+    def _history(self, key: Key) -> SectionHistory:
+        history = self._histories.get(key)
+        if history is None:
+            history = self._histories[key] = SectionHistory(self.window)
+        return history
+
+    def record(self, pipeline: str, section: str, model: Optional[str], generated_tokens: Optional[int],
+               max_tokens: Optional[int], outcome: str):
+        """Record one attempt. ``outcome`` is ok/invalid/empty/error, as in telemetry."""
+        if outcome == 'error' or generated_tokens is None:
+            return
+        truncated = outcome != 'ok' and bool(max_tokens) and generated_tokens >= TRUNCATED_AT * max_tokens
+        with self._lock:
+            history = self._history((pipeline, section, model or ""))
+            history.attempts += 1
+            history.new_attempts += 1
+            history.truncated.append(truncated)
+            history.new_truncated.append(truncated)
+            if truncated:
+                history.truncations += 1
+                history.new_truncations += 1
+            if outcome == 'ok':
+                history.successes += 1
+                history.new_successes += 1
+                history.lengths.append(int(generated_tokens))
+                history.new_lengths.append(int(generated_tokens))
+            if max_tokens:
+                history.max_tokens = int(max_tokens)
+            history.dirty = True
+
+    def limit(self, pipeline: str, section: str, model: Optional[str], default: int) -> int:
+        """``max_new_tokens`` for the next generation of ``section`` on ``model``."""
+        if not self.enabled:
+            return default
+        with self._lock:
+            history = self._history((pipeline, section, model or ""))
+            if history.default_tokens != default:
+                history.default_tokens = default
+                history.dirty = True
+            return self._budget(history, default)
+
+    def _budget(self, history: SectionHistory, default: int) -> int:
+        if len(history.lengths) < self.min_samples:
+            return default
+        budget = percentile(list(history.lengths), self.percentile) * self.headroom
+        recent = list(history.truncated)
+        if recent and sum(recent) / len(recent) > TRUNCATION_RATE:
+            budget = max(budget, (history.max_tokens or default) * GROWTH)
+        budget = math.ceil(budget / ROUND_TO) * ROUND_TO
+        return int(min(max(budget, MIN_TOKENS), default * MAX_FACTOR))
+
+    # Persistence ---------------------------------------------------------------
+
+    def rows(self) -> List[Dict]:
+        """Histories as plain dicts (the ``SectionTokenStats`` fields)."""
+        with self._lock:
+            rows = []
+            for (pipeline, section, model), h in sorted(self._histories.items()):
+                rows.append({
+                    'pipeline': pipeline, 'section': section, 'model': model,
+                    'lengths': list(h.lengths), 'truncated': list(h.truncated),
+                    'attempts': h.attempts, 'successes': h.successes, 'truncations': h.truncations,
+                    'max_tokens': h.max_tokens, 'default_tokens': h.default_tokens,
+                })
+            return rows
+
+    def take_deltas(self) -> List[Dict]:
+        """
+        What each changed history recorded since the last call, as
+        ``SectionTokenStats`` fields: new ``lengths``/``truncated`` entries and
+        counter increments, plus the current limits. Clears them and the dirty flags.
+        """
+        with self._lock:
+            deltas = []
+            for (pipeline, section, model), h in sorted(self._histories.items()):
+                if not h.dirty:
+                    continue
+                deltas.append({
+                    'pipeline': pipeline, 'section': section, 'model': model,
+                    'lengths': h.new_lengths, 'truncated': h.new_truncated,
+                    'attempts': h.new_attempts, 'successes': h.new_successes, 'truncations': h.new_truncations,
+                    'max_tokens': h.max_tokens, 'default_tokens': h.default_tokens,
+                })
+                h.new_lengths, h.new_truncated = [], []
+                h.new_attempts = h.new_successes = h.new_truncations = 0
+                h.dirty = False
+            return deltas
+
+    def requeue(self, deltas: Iterable[Dict]):
+        """Put back deltas that could not be saved, ahead of anything recorded since."""
+        with self._lock:
+            for delta in deltas:
+                h = self._history((delta['pipeline'], delta['section'], delta['model']))
+                h.new_lengths = delta['lengths'] + h.new_lengths
+                h.new_truncated = delta['truncated'] + h.new_truncated
+                h.new_attempts += delta['attempts']
+                h.new_successes += delta['successes']
+                h.new_truncations += delta['truncations']
+                h.dirty = True
+
+    def load(self, rows: Iterable[Dict]):
+        """Restore persisted histories; ones already observed in this process are kept."""
+        with self._lock:
+            for row in rows:
+                key = (row['pipeline'], row['section'], row.get('model') or "")
+                if key in self._histories:
+                    continue
+                h = self._history(key)
+                h.lengths.extend(row.get('lengths') or [])
+                h.truncated.extend(bool(t) for t in row.get('truncated') or [])
+                h.attempts = row.get('attempts') or 0
+                h.successes = row.get('successes') or 0
+                h.truncations = row.get('truncations') or 0
+                h.max_tokens = row.get('max_tokens') or 0
+                h.default_tokens = row.get('default_tokens') or 0
+
+    def report(self, rows: Optional[Iterable[Dict]] = None) -> List[Dict]:
+        """Per-section summary: sample counts, rates, percentiles and the learned budget."""
+        report = []
+        for row in (self.rows() if rows is None else rows):
+            h = SectionHistory(self.window)
+            h.lengths.extend(row['lengths'])
+            h.truncated.extend(row['truncated'])
+            h.max_tokens = row['max_tokens']
+            default = row['default_tokens'] or row['max_tokens']
+            attempts = row['attempts']
+            report.append({
+                'pipeline': row['pipeline'], 'section': row['section'], 'model': row['model'],
+                'attempts': attempts,
+                'success_rate': round(row['successes'] / attempts, 4) if attempts else None,
+                'truncation_rate': round(row['truncations'] / attempts, 4) if attempts else None,
+                'samples': len(h.lengths),
+                'p50': percentile(list(h.lengths), 0.5),
+                'p95': percentile(list(h.lengths), self.percentile),
+                'max': max(h.lengths) if h.lengths else None,
+                'default_tokens': default,
+                'budget': self._budget(h, default) if default else None,
+            })
+        return report
+
+    def reset(self):
+        with self._lock:
+            self._histories.clear()
+
+
+# Global instance used by the project and backlog pipelines
+budgets = TokenBudgets()
+
+
+def limit(pipeline: str, section: str, model: Optional[str], default: int) -> int:
+    return budgets.limit(pipeline, section, model, default)